@@ -60,6 +60,7 @@ class FlavorsController(wsgi.Controller):
             req, limited_flavors, include_extra_specs=include_extra_specs)
 
     @wsgi.expected_errors(404)
+    @wsgi.allow_replica_reads
     def show(self, req, id):
         """Return data about the given flavor id."""
         context = req.environ['nova.context']
@@ -95,6 +96,7 @@ class FlavorsController(wsgi.Controller):
                 msg = _('Invalid is_public filter [%s]') % is_public
                 raise webob.exc.HTTPBadRequest(explanation=msg)
 
+    @wsgi.allow_replica_reads
     def _get_flavors(self, req):
         """Helper function that returns a list of flavor dicts."""
         filters = {}
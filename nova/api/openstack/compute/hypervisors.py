@@ -106,6 +106,7 @@ class HypervisorsController(wsgi.Controller):
             raise webob.exc.HTTPNotFound(explanation=msg)
         return compute_nodes
 
+    @wsgi.allow_replica_reads
     def _get_hypervisors(self, req, detail=False, limit=None, marker=None,
                          links=False):
         """Get hypervisors for the given request.
@@ -299,6 +300,7 @@ class HypervisorsController(wsgi.Controller):
     def show(self, req, id):
         return self._show(req, id)
 
+    @wsgi.allow_replica_reads
     def _show(self, req, id, with_servers=False):
         context = req.environ['nova.context']
         context.can(hv_policies.BASE_POLICY_NAME)
@@ -321,6 +323,7 @@ class HypervisorsController(wsgi.Controller):
             hyp, service, True, req, instances))
 
     @wsgi.expected_errors((400, 404, 501))
+    @wsgi.allow_replica_reads
     def uptime(self, req, id):
         context = req.environ['nova.context']
         context.can(hv_policies.BASE_POLICY_NAME)
@@ -354,6 +357,7 @@ class HypervisorsController(wsgi.Controller):
 
     @wsgi.Controller.api_version('2.1', '2.52')
     @wsgi.expected_errors(404)
+    @wsgi.allow_replica_reads
     def search(self, req, id):
         """Prior to microversion 2.53 you could search for hypervisors by a
         hostname pattern on a dedicated route. Starting with 2.53, searching
@@ -377,6 +381,7 @@ class HypervisorsController(wsgi.Controller):
 
     @wsgi.Controller.api_version('2.1', '2.52')
     @wsgi.expected_errors(404)
+    @wsgi.allow_replica_reads
     def servers(self, req, id):
         """Prior to microversion 2.53 you could search for hypervisors by a
         hostname pattern and include servers on those hosts in the response on
@@ -402,6 +407,7 @@ class HypervisorsController(wsgi.Controller):
         return dict(hypervisors=hypervisors)
 
     @wsgi.expected_errors(())
+    @wsgi.allow_replica_reads
     def statistics(self, req):
         context = req.environ['nova.context']
         context.can(hv_policies.BASE_POLICY_NAME)
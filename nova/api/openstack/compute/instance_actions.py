@@ -80,6 +80,7 @@ class InstanceActionsController(wsgi.Controller):
 
     @wsgi.Controller.api_version("2.1", "2.57")
     @wsgi.expected_errors(404)
+    @wsgi.allow_replica_reads
     def index(self, req, server_id):
         """Returns the list of actions recorded for a given instance."""
         context = req.environ["nova.context"]
@@ -94,6 +95,7 @@ class InstanceActionsController(wsgi.Controller):
     @wsgi.expected_errors((400, 404))
     @validation.query_schema(schema_instance_actions.list_query_params_v258,
                              "2.58")
+    @wsgi.allow_replica_reads
     def index(self, req, server_id):
         """Returns the list of actions recorded for a given instance."""
         context = req.environ["nova.context"]
@@ -122,6 +124,7 @@ class InstanceActionsController(wsgi.Controller):
         return actions_dict
 
     @wsgi.expected_errors(404)
+    @wsgi.allow_replica_reads
     def show(self, req, server_id, id):
         """Return data about the given instance action."""
         context = req.environ['nova.context']
@@ -70,6 +70,7 @@ class LimitsController(wsgi.Controller):
     def index(self, req):
         return self._index(req, FILTERED_LIMITS_2_57, max_image_meta=False)
 
+    @wsgi.allow_replica_reads
     def _index(self, req, filtered_limits=None, max_image_meta=True):
         """Return all global limit information."""
         context = req.environ['nova.context']
@@ -121,6 +121,7 @@ class QuotaSetsController(wsgi.Controller):
         return self._show(req, id, FILTERED_QUOTAS_2_57)
 
     @validation.query_schema(quota_sets.query_schema)
+    @wsgi.allow_replica_reads
     def _show(self, req, id, filtered_quotas):
         context = req.environ['nova.context']
         context.can(qs_policies.POLICY_ROOT % 'show', {'project_id': id})
@@ -149,6 +150,7 @@ class QuotaSetsController(wsgi.Controller):
         return self._detail(req, id, FILTERED_QUOTAS_2_57)
 
     @validation.query_schema(quota_sets.query_schema)
+    @wsgi.allow_replica_reads
     def _detail(self, req, id, filtered_quotas):
         context = req.environ['nova.context']
         context.can(qs_policies.POLICY_ROOT % 'detail', {'project_id': id})
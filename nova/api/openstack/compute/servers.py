@@ -103,6 +103,7 @@ class ServersController(wsgi.Controller):
             raise exc.HTTPBadRequest(explanation=err.format_message())
         return servers
 
+    @wsgi.allow_replica_reads
     def _get_servers(self, req, is_detail):
         """Returns a list of servers, based on any search options specified."""
 
@@ -235,6 +236,7 @@ class ServersController(wsgi.Controller):
             schema_servers.SERVER_LIST_IGNORE_SORT_KEY, ('host', 'node'))
 
         expected_attrs = []
+        columns = None
         if is_detail:
             if api_version_request.is_supported(req, '2.16'):
                 expected_attrs.append('services')
@@ -247,12 +249,16 @@ class ServersController(wsgi.Controller):
             # showing details
             expected_attrs = self._view_builder.get_show_expected_attrs(
                                                                 expected_attrs)
+        else:
+            # Don't load whole instances only to show their id and name.
+            columns = self._view_builder.get_index_columns()
 
         try:
             instance_list = self.compute_api.get_all(elevated or context,
                     search_opts=search_opts, limit=limit, marker=marker,
                     expected_attrs=expected_attrs,
-                    sort_keys=sort_keys, sort_dirs=sort_dirs)
+                    sort_keys=sort_keys, sort_dirs=sort_dirs,
+                    columns=columns)
         except exception.MarkerNotFound:
             msg = _('marker [%s] not found') % marker
             raise exc.HTTPBadRequest(explanation=msg)
@@ -380,6 +386,7 @@ class ServersController(wsgi.Controller):
         return objects.NetworkRequestList(objects=networks)
 
     @wsgi.expected_errors(404)
+    @wsgi.allow_replica_reads
     def show(self, req, id):
         """Returns server details by server id."""
         context = req.environ['nova.context']
@@ -658,6 +665,9 @@ class ServersController(wsgi.Controller):
                 exception.MultiattachSupportNotYetAvailable,
                 exception.CertificateValidationNotYetAvailable) as error:
             raise exc.HTTPConflict(explanation=error.format_message())
+        except exception.ValidationTimeout as error:
+            raise exc.HTTPServiceUnavailable(
+                explanation=error.format_message())
 
         # If the caller wanted a reservation_id, return it
         if return_reservation_id:
@@ -290,6 +290,7 @@ class SimpleTenantUsageController(wsgi.Controller):
         """Retrieve tenant_usage for a specified tenant."""
         return self._show(req, id)
 
+    @wsgi.allow_replica_reads
     def _index(self, req, links=False):
         context = req.environ['nova.context']
 
@@ -326,6 +327,7 @@ class SimpleTenantUsageController(wsgi.Controller):
 
         return tenant_usages
 
+    @wsgi.allow_replica_reads
     def _show(self, req, id, links=False):
         tenant_id = id
         context = req.environ['nova.context']
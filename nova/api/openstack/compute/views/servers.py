@@ -109,6 +109,14 @@ class ViewBuilder(common.ViewBuilder):
         # results.
         return sorted(list(set(self._show_expected_attrs + expected_attrs)))
 
+    def get_index_columns(self):
+        """Returns the list of instance columns used by index
+
+        Only these columns need to be loaded from the database when listing
+        instances without details.
+        """
+        return ['uuid', 'display_name']
+
     def show(self, request, instance, extend_address=True,
              show_extra_specs=None):
         """Detailed view of a single instance."""
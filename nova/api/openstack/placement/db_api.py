@@ -13,6 +13,9 @@
 own file so the nova db_api (which has cascading imports) is not imported.
 """
 
+import functools
+import inspect
+
 from oslo_db.sqlalchemy import enginefacade
 from oslo_log import log as logging
 
@@ -39,6 +42,34 @@ def configure(conf):
             **_get_db_conf(conf.placement_database))
 
 
+def replica_reader(primary_mode):
+    """Decorator for read-only DB API functions whose results may be served
+    from the replica database connection, the ``slave_connection`` of the
+    database group placement is configured with.
+
+    The replica is used when the ``read_from_replica`` attribute of the
+    request context passed as the ``context`` argument is True. Otherwise the
+    function runs on the primary in the supplied transaction mode, for example
+    ``placement_context_manager.reader``.
+
+    Any DB API function called from the decorated function must use a
+    ``reader.allow_async`` transaction so that it joins the replica
+    transaction.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            context = inspect.getcallargs(f, *args, **kwargs)['context']
+            if getattr(context, 'read_from_replica', False):
+                mode = placement_context_manager.async_
+            else:
+                mode = primary_mode
+            with mode.using(context):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 def get_placement_engine():
     return placement_context_manager.get_legacy_facade().get_engine()
 
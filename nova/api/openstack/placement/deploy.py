@@ -19,6 +19,7 @@ from nova.api.openstack.placement import auth
 from nova.api.openstack.placement import db_api
 from nova.api.openstack.placement import fault_wrap
 from nova.api.openstack.placement import handler
+from nova.api.openstack.placement import metrics
 from nova.api.openstack.placement import microversion
 from nova.api.openstack.placement.objects import resource_provider
 from nova.api.openstack.placement import requestlog
@@ -56,6 +57,10 @@ def deploy(conf):
     microversion_middleware = mp_middleware.MicroversionMiddleware
     fault_middleware = fault_wrap.FaultWrapper
     request_log = requestlog.RequestLog
+    if conf.placement.enable_metrics:
+        metrics_middleware = metrics.RequestMetrics
+    else:
+        metrics_middleware = None
 
     application = handler.PlacementHandler()
     # configure microversion middleware in the old school way
@@ -73,6 +78,7 @@ def deploy(conf):
     # authentication information.
     for middleware in (fault_middleware,
                        request_log,
+                       metrics_middleware,
                        context_middleware,
                        auth_middleware,
                        cors_middleware,
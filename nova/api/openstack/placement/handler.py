@@ -38,6 +38,7 @@ from nova.api.openstack.placement.handlers import resource_provider
 from nova.api.openstack.placement.handlers import root
 from nova.api.openstack.placement.handlers import trait
 from nova.api.openstack.placement.handlers import usage
+from nova.api.openstack.placement import metrics
 from nova.api.openstack.placement import util
 from nova.i18n import _
 
@@ -136,10 +137,14 @@ def dispatch(environ, start_response, mapper):
     If there is a matching route, but no matching handler
     for the given method, raise a 405.
     """
-    result = mapper.match(environ=environ)
-    if result is None:
+    match = mapper.routematch(environ=environ)
+    if match is None:
         raise webob.exc.HTTPNotFound(
             json_formatter=util.json_error_formatter)
+    result, route = match
+    # Record the matched route template so that per-route metrics are not
+    # keyed by individual resource UUIDs.
+    environ[metrics.ROUTE_ENVIRON] = route.routepath
     # We can't reach this code without action being present.
     handler = result.pop('action')
     environ['wsgiorg.routing_args'] = ((), result)
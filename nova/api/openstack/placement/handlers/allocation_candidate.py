@@ -276,6 +276,7 @@ def list_allocation_candidates(req):
     # We can't be aware of nested architecture with old microversions
     nested_aware = want_version.matches((1, 29))
 
+    context.read_from_replica = util.read_from_replica(req)
     try:
         cands = rp_obj.AllocationCandidates.get_by_requests(
             context, requests, limit=limit, group_policy=group_policy,
@@ -224,6 +224,7 @@ def list_resource_providers(req):
                 value = util.normalize_traits_qs_param(
                     value, allow_forbidden=allow_forbidden)
             filters[attr] = value
+    context.read_from_replica = util.read_from_replica(req)
     try:
         resource_providers = rp_obj.ResourceProviderList.get_all_by_filters(
             context, filters)
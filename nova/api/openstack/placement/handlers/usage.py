@@ -61,6 +61,7 @@ def list_usages(req):
             _("No resource provider with uuid %(uuid)s found: %(error)s") %
              {'uuid': uuid, 'error': exc})
 
+    context.read_from_replica = util.read_from_replica(req)
     usage = rp_obj.UsageList.get_all_by_resource_provider_uuid(
         context, uuid)
 
@@ -101,6 +102,7 @@ def get_total_usages(req):
     project_id = req.GET.get('project_id')
     user_id = req.GET.get('user_id')
 
+    context.read_from_replica = util.read_from_replica(req)
     usages = rp_obj.UsageList.get_all_by_project_user(context, project_id,
                                                       user_id=user_id)
 
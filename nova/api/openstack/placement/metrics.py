@@ -0,0 +1,251 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Middleware and helpers for collecting placement hot-path metrics.
+
+When enabled with ``[placement]/enable_metrics``, the ``RequestMetrics``
+middleware records, per route template and microversion, the number of
+requests, a latency histogram, the number of database queries and the time
+spent in them, and the number of bytes returned. Functions decorated with
+``timed`` additionally record the time spent in them per route. The collected
+metrics are served as text on ``GET /metrics`` to callers allowed by the
+``placement:metrics`` policy.
+"""
+
+import collections
+import functools
+import threading
+import time
+
+from oslo_log import log as logging
+import sqlalchemy as sa
+import webob
+
+from nova.api.openstack.placement import exception
+from nova.api.openstack.placement import microversion
+from nova.api.openstack.placement.policies import metrics as policies
+from nova.api.openstack.placement import util
+from nova.i18n import _
+
+LOG = logging.getLogger(__name__)
+
+# The environ key in which the dispatcher stores the matched route template.
+ROUTE_ENVIRON = 'placement.route'
+METRICS_PATH = '/metrics'
+# Upper bounds, in seconds, of the latency histogram buckets. A final +Inf
+# bucket is implied.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+_REQUEST_STATE = threading.local()
+_DB_LISTENERS_LOCK = threading.Lock()
+_DB_LISTENERS_INSTALLED = False
+
+
+class _RequestStats(object):
+    """Measurements for the request being processed by the current thread."""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.functions = collections.defaultdict(float)
+
+
+class _RouteStats(object):
+    """Accumulated measurements for one (route, method, microversion)."""
+
+    def __init__(self):
+        self.count = 0
+        self.latency_sum = 0.0
+        # One counter per bucket in LATENCY_BUCKETS plus the +Inf bucket.
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.bytes = 0
+        self.functions = collections.defaultdict(float)
+
+    def add(self, latency, size, req_stats):
+        self.count += 1
+        self.latency_sum += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_buckets[i] += 1
+                break
+        else:
+            self.latency_buckets[-1] += 1
+        self.db_queries += req_stats.db_queries
+        self.db_time += req_stats.db_time
+        self.bytes += size
+        for name, elapsed in req_stats.functions.items():
+            self.functions[name] += elapsed
+
+
+class MetricsRegistry(object):
+    """Thread-safe store of the per-route metrics of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = collections.defaultdict(_RouteStats)
+
+    def record(self, key, latency, size, req_stats):
+        with self._lock:
+            self._routes[key].add(latency, size, req_stats)
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self):
+        """Return the collected metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            items = sorted(self._routes.items())
+            for (route, method, version), stats in items:
+                labels = 'route="%s",method="%s",microversion="%s"' % (
+                    route, method, version)
+                lines.append('placement_requests_total{%s} %d' %
+                             (labels, stats.count))
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS,
+                                        stats.latency_buckets):
+                    cumulative += count
+                    lines.append(
+                        'placement_request_duration_seconds_bucket'
+                        '{%s,le="%s"} %d' % (labels, bound, cumulative))
+                lines.append(
+                    'placement_request_duration_seconds_bucket'
+                    '{%s,le="+Inf"} %d' % (labels, stats.count))
+                lines.append('placement_request_duration_seconds_sum{%s} %f'
+                             % (labels, stats.latency_sum))
+                lines.append('placement_request_duration_seconds_count{%s} '
+                             '%d' % (labels, stats.count))
+                lines.append('placement_db_queries_total{%s} %d' %
+                             (labels, stats.db_queries))
+                lines.append('placement_db_seconds_total{%s} %f' %
+                             (labels, stats.db_time))
+                lines.append('placement_response_bytes_total{%s} %d' %
+                             (labels, stats.bytes))
+                for name, elapsed in sorted(stats.functions.items()):
+                    lines.append(
+                        'placement_function_seconds_total{%s,function="%s"} '
+                        '%f' % (labels, name, elapsed))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    stats = getattr(_REQUEST_STATE, 'stats', None)
+    if stats is not None:
+        conn.info.setdefault('placement_query_start', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = getattr(_REQUEST_STATE, 'stats', None)
+    starts = conn.info.get('placement_query_start')
+    if stats is not None and starts:
+        stats.db_queries += 1
+        stats.db_time += time.time() - starts.pop()
+
+
+def _install_db_listeners():
+    """Count queries and time spent in them on every SQLAlchemy engine.
+
+    The listeners only record anything while a request is being measured by
+    the current thread, so they are cheap for everything else.
+    """
+    global _DB_LISTENERS_INSTALLED
+    with _DB_LISTENERS_LOCK:
+        if _DB_LISTENERS_INSTALLED:
+            return
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute',
+                        _before_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute',
+                        _after_cursor_execute)
+        _DB_LISTENERS_INSTALLED = True
+
+
+def timed(func):
+    """Decorator recording the time spent in the decorated function against
+    the request being measured by the current thread, if any.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stats = getattr(_REQUEST_STATE, 'stats', None)
+        if stats is None:
+            return func(*args, **kwargs)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.functions[name] += time.time() - start
+    return wrapper
+
+
+class RequestMetrics(object):
+    """WSGI Middleware recording per-route metrics and serving them on
+    ``GET /metrics``.
+    """
+
+    def __init__(self, application, registry=None):
+        self.application = application
+        self.registry = registry or REGISTRY
+        _install_db_listeners()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == METRICS_PATH:
+            return self._show_metrics(environ, start_response)
+
+        stats = _RequestStats()
+        _REQUEST_STATE.stats = stats
+        start = time.time()
+        sizes = []
+
+        def replacement_start_response(status, headers, exc_info=None):
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    sizes.append(int(value))
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.application(environ, replacement_start_response)
+        finally:
+            _REQUEST_STATE.stats = None
+            key = (environ.get(ROUTE_ENVIRON, 'unmatched'),
+                   environ['REQUEST_METHOD'],
+                   environ.get(microversion.MICROVERSION_ENVIRON, '-'))
+            self.registry.record(key, time.time() - start,
+                                 sum(sizes), stats)
+
+    def _show_metrics(self, environ, start_response):
+        context = environ['placement.context']
+        try:
+            context.can(policies.METRICS)
+        except exception.PolicyNotAuthorized as exc:
+            response = webob.exc.HTTPForbidden(
+                exc.format_message(),
+                json_formatter=util.json_error_formatter)
+            return response(environ, start_response)
+        if environ['REQUEST_METHOD'] != 'GET':
+            response = webob.exc.HTTPMethodNotAllowed(
+                _('The method specified is not allowed for this resource.'),
+                headers={'allow': 'GET'},
+                json_formatter=util.json_error_formatter)
+            return response(environ, start_response)
+        response = webob.Response(
+            body=self.registry.render().encode('utf-8'),
+            content_type='text/plain', charset='utf-8')
+        return response(environ, start_response)
@@ -39,10 +39,12 @@ from sqlalchemy.sql import null
 
 from nova.api.openstack.placement import db_api
 from nova.api.openstack.placement import exception
+from nova.api.openstack.placement import metrics
 from nova.api.openstack.placement.objects import consumer as consumer_obj
 from nova.api.openstack.placement.objects import project as project_obj
 from nova.api.openstack.placement.objects import user as user_obj
 from nova.api.openstack.placement import resource_class_cache as rc_cache
+from nova.api.openstack.placement import sharing_provider_cache
 from nova.db.sqlalchemy import api_models as models
 from nova.i18n import _
 from nova import rc_fields
@@ -60,6 +62,7 @@ _PROJECT_TBL = models.Project.__table__
 _USER_TBL = models.User.__table__
 _CONSUMER_TBL = models.Consumer.__table__
 _RC_CACHE = None
+_SHARING_CACHE = sharing_provider_cache.SharingProviderCache()
 _TRAIT_LOCK = 'trait_sync'
 _TRAITS_SYNCED = False
 
@@ -67,7 +70,7 @@ CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def ensure_rc_cache(ctx):
     """Ensures that a singleton resource class cache has been created in the
     module's scope.
@@ -282,6 +285,46 @@ def _increment_provider_generation(ctx, rp):
     return new_generation
 
 
+def _increment_provider_generations(ctx, rps):
+    """Increments the generation of each of the supplied providers with a
+    single compare-and-swap UPDATE statement, supplying the currently-known
+    generation of every provider.
+
+    On success, the generation field of each supplied provider is set to its
+    new value.
+
+    :param ctx: `nova.context.RequestContext` that contains an oslo_db Session
+    :param rps: List of unique `ResourceProvider` objects whose generations
+                should be updated.
+    :raises nova.exception.ConcurrentUpdateDetected: if another thread updated
+            any of the providers in between the time when the provider was
+            originally read and this call.
+    """
+    if not rps:
+        return
+    # The SQL generated below looks like this:
+    # UPDATE resource_providers
+    # SET generation = generation + 1
+    # WHERE (id = $RP1_ID AND generation = $RP1_GEN)
+    # OR (id = $RP2_ID AND generation = $RP2_GEN)
+    # ...
+    #
+    # If any provider's generation has moved, fewer rows than the number of
+    # providers are updated and the caller's transaction is rolled back.
+    cas_conds = [
+        sa.and_(_RP_TBL.c.id == rp.id, _RP_TBL.c.generation == rp.generation)
+        for rp in rps
+    ]
+    upd_stmt = _RP_TBL.update().where(sa.or_(*cas_conds)).values(
+        generation=_RP_TBL.c.generation + 1)
+
+    res = ctx.session.execute(upd_stmt)
+    if res.rowcount != len(rps):
+        raise exception.ResourceProviderConcurrentUpdateDetected()
+    for rp in rps:
+        rp.generation += 1
+
+
 @db_api.placement_context_manager.writer
 def _add_inventory(context, rp, inventory):
     """Add one Inventory that wasn't already on the provider.
@@ -380,13 +423,10 @@ def _set_inventory(context, rp, inv_list):
     return exceeded
 
 
-@db_api.placement_context_manager.reader
-def _get_provider_by_uuid(context, uuid):
-    """Given a UUID, return a dict of information about the resource provider
-    from the database.
-
-    :raises: NotFound if no such provider was found
-    :param uuid: The UUID to look up
+def _provider_select():
+    """Returns a tuple of (select, rp_table_alias) for a SELECT statement that
+    returns the fields needed to construct `ResourceProvider` objects. Callers
+    add their own WHERE clause using the returned table alias.
     """
     rpt = sa.alias(_RP_TBL, name="rp")
     parent = sa.alias(_RP_TBL, name="parent")
@@ -406,7 +446,19 @@ def _get_provider_by_uuid(context, uuid):
         rpt.c.updated_at,
         rpt.c.created_at,
     ]
-    sel = sa.select(cols).select_from(rp_to_parent).where(rpt.c.uuid == uuid)
+    return sa.select(cols).select_from(rp_to_parent), rpt
+
+
+@db_api.placement_context_manager.reader.allow_async
+def _get_provider_by_uuid(context, uuid):
+    """Given a UUID, return a dict of information about the resource provider
+    from the database.
+
+    :raises: NotFound if no such provider was found
+    :param uuid: The UUID to look up
+    """
+    sel, rpt = _provider_select()
+    sel = sel.where(rpt.c.uuid == uuid)
     res = context.session.execute(sel).fetchone()
     if not res:
         raise exception.NotFound(
@@ -414,7 +466,21 @@ def _get_provider_by_uuid(context, uuid):
     return dict(res)
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
+def _get_providers_by_uuids(context, uuids):
+    """Given a collection of UUIDs, return a list of dicts of information
+    about the resource providers from the database, in a single query.
+
+    Providers that do not exist are not included in the returned list.
+
+    :param uuids: The UUIDs to look up
+    """
+    sel, rpt = _provider_select()
+    sel = sel.where(rpt.c.uuid.in_(uuids))
+    return [dict(r) for r in context.session.execute(sel)]
+
+
+@db_api.placement_context_manager.reader.allow_async
 def _get_aggregates_by_provider_id(context, rp_id):
     join_statement = sa.join(
         _AGG_TBL, _RP_AGG_TBL, sa.and_(
@@ -424,7 +490,8 @@ def _get_aggregates_by_provider_id(context, rp_id):
     return [r[0] for r in context.session.execute(sel).fetchall()]
 
 
-@db_api.placement_context_manager.reader
+@metrics.timed
+@db_api.placement_context_manager.reader.allow_async
 def _anchors_for_sharing_providers(context, rp_ids, get_id=False):
     """Given a list of internal IDs of sharing providers, returns a set of
     tuples of (sharing provider UUID, anchor provider UUID), where each of
@@ -432,15 +499,33 @@ def _anchors_for_sharing_providers(context, rp_ids, get_id=False):
     aggregate as the sharing provider. (These are the providers that can
     "anchor" a single AllocationRequest.)
 
-    The sharing provider may or may not itself be part of a tree; in either
-    case, an entry for this root provider is included in the result.
-
-    If the sharing provider is not part of any aggregate, the empty list is
-    returned.
+    The anchors of the providers having the MISC_SHARES_VIA_AGGREGATE trait
+    come from the sharing providers cache; those of any other provider are
+    looked up in the database.
 
     If get_id is True, it returns a set of tuples of (sharing provider ID,
     anchor provider ID) instead.
     """
+    cached = _SHARING_CACHE.get(context)
+    rp_ids = set(rp_ids)
+    uncached = rp_ids.difference(cached.sharing)
+    anchors = cached.anchors_for(rp_ids - uncached, get_id=get_id)
+    if uncached:
+        anchors |= _anchors_for_providers_from_db(context, uncached,
+                                                  get_id=get_id)
+    return anchors
+
+
+@db_api.placement_context_manager.reader.allow_async
+def _anchors_for_providers_from_db(context, rp_ids, get_id=False):
+    """Looks up in the database the anchors of the providers with the supplied
+    internal IDs, see _anchors_for_sharing_providers().
+
+    The provider may or may not itself be part of a tree; in either case, an
+    entry for this root provider is included in the result.
+
+    If the provider is not part of any aggregate, the empty set is returned.
+    """
     # SELECT sps.uuid, COALESCE(rps.uuid, shr_with_sps.uuid)
     # FROM resource_providers AS sps
     # INNER JOIN resource_provider_aggregates AS shr_aggs
@@ -501,6 +586,9 @@ def _set_aggregates(context, resource_provider, provided_aggregates,
     existing_aggregates = set(_get_aggregates_by_provider_id(context, rp_id))
     to_add = provided_aggregates - existing_aggregates
     target_aggregates = list(provided_aggregates)
+    if provided_aggregates != existing_aggregates:
+        # The anchors of the sharing providers may change.
+        sharing_provider_cache.bump_version(context)
 
     # Create any aggregates that do not yet exist in
     # PlacementAggregates. This is different from
@@ -549,7 +637,7 @@ def _set_aggregates(context, resource_provider, provided_aggregates,
             context, resource_provider)
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_traits_by_provider_id(context, rp_id):
     t = sa.alias(_TRAIT_TBL, name='t')
     rpt = sa.alias(_RP_TRAIT_TBL, name='rpt')
@@ -615,15 +703,21 @@ def _set_traits(context, rp, traits):
     """
     # Get the internal IDs of our existing traits
     existing_traits = _get_traits_by_provider_id(context, rp.id)
-    existing_traits = set(rec['id'] for rec in existing_traits)
+    existing_ids = set(rec['id'] for rec in existing_traits)
     want_traits = set(trait.id for trait in traits)
 
-    to_add = want_traits - existing_traits
-    to_delete = existing_traits - want_traits
+    to_add = want_traits - existing_ids
+    to_delete = existing_ids - want_traits
 
     if not to_add and not to_delete:
         return
 
+    changed = set(trait.name for trait in traits if trait.id in to_add)
+    changed |= set(rec['name'] for rec in existing_traits
+                   if rec['id'] in to_delete)
+    if os_traits.MISC_SHARES_VIA_AGGREGATE in changed:
+        sharing_provider_cache.bump_version(context)
+
     if to_delete:
         _delete_traits_from_provider(context, rp.id, to_delete)
     if to_add:
@@ -631,7 +725,7 @@ def _set_traits(context, rp, traits):
     rp.generation = _increment_provider_generation(context, rp)
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _has_child_providers(context, rp_id):
     """Returns True if the supplied resource provider has any child providers,
     False otherwise
@@ -1037,8 +1131,11 @@ class ResourceProvider(base.VersionedObject, base.TimestampedObject):
         context.session.query(models.Inventory).\
             filter(models.Inventory.resource_provider_id == _id).\
             delete(synchronize_session=False)
-        # Delete any aggregate associations for the resource provider
+        # Delete any aggregate associations for the resource provider and
+        # make sure it isn't used as a sharing provider or as an anchor any
+        # longer.
         # The name substitution on the next line is needed to satisfy pep8
+        sharing_provider_cache.bump_version(context)
         RPA_model = models.ResourceProviderAggregate
         context.session.query(RPA_model).\
                 filter(RPA_model.resource_provider_id == _id).delete()
@@ -1130,15 +1227,16 @@ class ResourceProvider(base.VersionedObject, base.TimestampedObject):
         # originally in the same tree. If re-parenting is supported,
         # this logic should be changed to update only descendents of the
         # re-parented resource providers, not all the providers in the tree.
-        for rp in same_tree:
-            # If the parent is not updated, this clause is skipped since the
-            # `same_tree` has no element.
-            rp.root_provider_uuid = parent_ids.root_uuid
-            db_rp = context.session.query(
-                models.ResourceProvider).filter_by(id=rp.id).first()
-            data = {'root_provider_id': parent_ids.root_id}
-            db_rp.update(data)
-            context.session.add(db_rp)
+        # If the parent is not updated, this is skipped since the `same_tree`
+        # has no element. Otherwise the whole tree is moved under the new root
+        # with a single statement, whatever its size.
+        if same_tree:
+            # The providers of the tree are anchored to a new root.
+            sharing_provider_cache.bump_version(context)
+            upd_stmt = _RP_TBL.update().where(
+                _RP_TBL.c.id.in_([rp.id for rp in same_tree])).values(
+                    root_provider_id=parent_ids.root_id)
+            context.session.execute(upd_stmt)
 
         try:
             context.session.flush()
@@ -1167,7 +1265,8 @@ class ResourceProvider(base.VersionedObject, base.TimestampedObject):
         return resource_provider
 
 
-@db_api.placement_context_manager.reader
+@metrics.timed
+@db_api.placement_context_manager.reader.allow_async
 def _get_providers_with_shared_capacity(ctx, rc_id, amount, member_of=None):
     """Returns a list of resource provider IDs (internal IDs, not UUIDs)
     that have capacity for a requested amount of a resource and indicate that
@@ -1212,15 +1311,16 @@ def _get_providers_with_shared_capacity(ctx, rc_id, amount, member_of=None):
                       resource providers that *directly* belong to the
                       aggregates referenced.
     """
+    # The providers having the MISC_SHARES_VIA_AGGREGATE trait come from the
+    # sharing providers cache, so we don't need to join the traits tables.
+    sharing_ids = list(_SHARING_CACHE.get(ctx).sharing)
+    if not sharing_ids:
+        return []
+
     # The SQL we need to generate here looks like this:
     #
     # SELECT rp.id
     # FROM resource_providers AS rp
-    #   INNER JOIN resource_provider_traits AS rpt
-    #     ON rp.id = rpt.resource_provider_id
-    #   INNER JOIN traits AS t
-    #     ON rpt.trait_id = t.id
-    #     AND t.name = "MISC_SHARES_VIA_AGGREGATE"
     #   INNER JOIN inventories AS inv
     #     ON rp.id = inv.resource_provider_id
     #     AND inv.resource_class_id = $rc_id
@@ -1231,7 +1331,8 @@ def _get_providers_with_shared_capacity(ctx, rc_id, amount, member_of=None):
     #     GROUP BY resource_provider_id
     #   ) AS usage
     #     ON rp.id = usage.resource_provider_id
-    # WHERE COALESCE(usage.used, 0) + $amount <= (
+    # WHERE rp.id IN $(SHARING_IDS) AND
+    #   COALESCE(usage.used, 0) + $amount <= (
     #   inv.total - inv.reserved) * inv.allocation_ratio
     # ) AND
     #   inv.min_unit <= $amount AND
@@ -1241,28 +1342,11 @@ def _get_providers_with_shared_capacity(ctx, rc_id, amount, member_of=None):
 
     rp_tbl = sa.alias(_RP_TBL, name='rp')
     inv_tbl = sa.alias(_INV_TBL, name='inv')
-    t_tbl = sa.alias(_TRAIT_TBL, name='t')
-    rpt_tbl = sa.alias(_RP_TRAIT_TBL, name='rpt')
-
-    rp_to_rpt_join = sa.join(
-        rp_tbl, rpt_tbl,
-        rp_tbl.c.id == rpt_tbl.c.resource_provider_id,
-    )
-
-    rpt_to_t_join = sa.join(
-        rp_to_rpt_join, t_tbl,
-        sa.and_(
-            rpt_tbl.c.trait_id == t_tbl.c.id,
-            # The traits table wants unicode trait names, but os_traits
-            # presents native str, so we need to cast.
-            t_tbl.c.name == six.text_type(os_traits.MISC_SHARES_VIA_AGGREGATE),
-        ),
-    )
 
     rp_to_inv_join = sa.join(
-        rpt_to_t_join, inv_tbl,
+        rp_tbl, inv_tbl,
         sa.and_(
-            rpt_tbl.c.resource_provider_id == inv_tbl.c.resource_provider_id,
+            rp_tbl.c.id == inv_tbl.c.resource_provider_id,
             inv_tbl.c.resource_class_id == rc_id,
         ),
     )
@@ -1279,6 +1363,7 @@ def _get_providers_with_shared_capacity(ctx, rc_id, amount, member_of=None):
     )
 
     where_conds = sa.and_(
+        rp_tbl.c.id.in_(sharing_ids),
         func.coalesce(usage.c.used, 0) + amount <= (
             inv_tbl.c.total - inv_tbl.c.reserved) * inv_tbl.c.allocation_ratio,
         inv_tbl.c.min_unit <= amount,
@@ -1311,7 +1396,7 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
     }
 
     @staticmethod
-    @db_api.placement_context_manager.reader
+    @db_api.replica_reader(db_api.placement_context_manager.reader)
     def _get_all_by_filters_from_db(context, filters):
         # Eg. filters can be:
         #  filters = {
@@ -1377,20 +1462,21 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
         if 'in_tree' in filters:
             # The 'in_tree' parameter is the UUID of a resource provider that
             # the caller wants to limit the returned providers to only those
-            # within its "provider tree". So, we look up the resource provider
-            # having the UUID specified by the 'in_tree' parameter and grab the
-            # root_provider_id value of that record. We can then ask for only
-            # those resource providers having a root_provider_id of that value.
+            # within its "provider tree". So, we look up the root_provider_id
+            # of the resource provider having the UUID specified by the
+            # 'in_tree' parameter and ask for only those resource providers
+            # having a root_provider_id of that value. The lookup is a scalar
+            # subquery so that listing a tree, however deep or wide, costs a
+            # single round trip to the database. If no provider has the
+            # supplied UUID, the subquery is NULL and nothing is returned.
             tree_uuid = filters.pop('in_tree')
-            tree_ids = _provider_ids_from_uuid(context, tree_uuid)
-            if tree_ids is None:
-                # List operations should simply return an empty list when a
-                # non-existing resource provider UUID is given.
-                return []
-            root_id = tree_ids.root_id
-            # TODO(jaypipes): Remove this OR condition when root_provider_id
-            # is not nullable in the database and all resource provider records
-            # have populated the root provider ID.
+            tree_rp = sa.alias(_RP_TBL, name="tree_rp")
+            # TODO(jaypipes): Remove the COALESCE and the OR condition when
+            # root_provider_id is not nullable in the database and all
+            # resource provider records have populated the root provider ID.
+            root_id = sa.select([
+                func.coalesce(tree_rp.c.root_provider_id, tree_rp.c.id)])
+            root_id = root_id.where(tree_rp.c.uuid == tree_uuid).as_scalar()
             where_cond = sa.or_(rp.c.id == root_id,
                 rp.c.root_provider_id == root_id)
             query = query.where(where_cond)
@@ -1558,7 +1644,7 @@ class Inventory(base.VersionedObject, base.TimestampedObject):
         return int((self.total - self.reserved) * self.allocation_ratio)
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_inventory_by_provider_id(ctx, rp_id):
     inv = sa.alias(_INV_TBL, name="i")
     cols = [
@@ -1653,6 +1739,7 @@ def _delete_allocations_by_ids(ctx, alloc_ids):
     ctx.session.execute(del_sql)
 
 
+@metrics.timed
 def _check_capacity_exceeded(ctx, allocs):
     """Checks to see if the supplied allocation records would result in any of
     the inventories involved having their capacity exceeded.
@@ -1819,7 +1906,7 @@ def _check_capacity_exceeded(ctx, allocs):
     return res_providers
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_allocations_by_provider_id(ctx, rp_id):
     allocs = sa.alias(_ALLOC_TBL, name="a")
     consumers = sa.alias(_CONSUMER_TBL, name="c")
@@ -1853,7 +1940,7 @@ def _get_allocations_by_provider_id(ctx, rp_id):
     return [dict(r) for r in ctx.session.execute(sel)]
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_allocations_by_consumer_uuid(ctx, consumer_uuid):
     allocs = sa.alias(_ALLOC_TBL, name="a")
     rp = sa.alias(_RP_TBL, name="rp")
@@ -2057,8 +2144,10 @@ class AllocationList(base.ObjectListBase, base.VersionedObject):
         # ConcurrentUpdateDetected which can be caught by the caller to choose
         # to try again. It will also rollback the transaction so that these
         # changes always happen atomically.
-        for rp in visited_rps.values():
-            rp.generation = _increment_provider_generation(context, rp)
+        # All the providers involved in the write are checked and incremented
+        # in a single compare-and-swap statement rather than one UPDATE per
+        # provider.
+        _increment_provider_generations(context, list(visited_rps.values()))
         for consumer in visited_consumers.values():
             consumer.increment_generation()
         # If any consumers involved in this transaction ended up having no
@@ -2162,23 +2251,32 @@ class AllocationList(base.ObjectListBase, base.VersionedObject):
         # sleeping, we simply want to reset the resource provider objects
         # and try again. For sake of simplicity (and because we don't have
         # easy access to the information) we reload all the resource
-        # providers that may be present.
+        # providers that may be present, using a single query.
         retries = self.RP_CONFLICT_RETRY_COUNT
+        conflicts = 0
         while retries:
             retries -= 1
             try:
                 self._set_allocations(self._context, self.objects)
                 break
             except exception.ResourceProviderConcurrentUpdateDetected:
+                conflicts += 1
                 LOG.debug('Retrying allocations write on resource provider '
-                          'generation conflict')
+                          'generation conflict (attempt %d)', conflicts)
                 # We only want to reload each unique resource provider once.
                 alloc_rp_uuids = set(
                     alloc.resource_provider.uuid for alloc in self.objects)
                 seen_rps = {}
-                for rp_uuid in alloc_rp_uuids:
-                    seen_rps[rp_uuid] = ResourceProvider.get_by_uuid(
-                        self._context, rp_uuid)
+                for rp_rec in _get_providers_by_uuids(self._context,
+                                                      alloc_rp_uuids):
+                    rp = ResourceProvider._from_db_object(
+                        self._context, ResourceProvider(), rp_rec)
+                    seen_rps[rp.uuid] = rp
+                missing = alloc_rp_uuids - set(seen_rps)
+                if missing:
+                    raise exception.NotFound(
+                        'No resource provider with uuid %s found' %
+                        ', '.join(sorted(missing)))
                 for alloc in self.objects:
                     rp_uuid = alloc.resource_provider.uuid
                     alloc.resource_provider = seen_rps[rp_uuid]
@@ -2236,7 +2334,7 @@ class UsageList(base.ObjectListBase, base.VersionedObject):
     }
 
     @staticmethod
-    @db_api.placement_context_manager.reader
+    @db_api.replica_reader(db_api.placement_context_manager.reader)
     def _get_all_by_resource_provider_uuid(context, rp_uuid):
         query = (context.session.query(models.Inventory.resource_class_id,
                  func.coalesce(func.sum(models.Allocation.used), 0))
@@ -2255,7 +2353,7 @@ class UsageList(base.ObjectListBase, base.VersionedObject):
         return result
 
     @staticmethod
-    @db_api.placement_context_manager.reader
+    @db_api.replica_reader(db_api.placement_context_manager.reader)
     def _get_all_by_project_user(context, project_id, user_id=None):
         query = (context.session.query(models.Allocation.resource_class_id,
                  func.coalesce(func.sum(models.Allocation.used), 0))
@@ -2332,7 +2430,7 @@ class ResourceClass(base.VersionedObject, base.TimestampedObject):
         return obj
 
     @staticmethod
-    @db_api.placement_context_manager.reader
+    @db_api.placement_context_manager.reader.allow_async
     def _get_next_id(context):
         """Utility method to grab the next resource class identifier to use for
          user-defined resource classes.
@@ -2461,7 +2559,7 @@ class ResourceClassList(base.ObjectListBase, base.VersionedObject):
     }
 
     @staticmethod
-    @db_api.placement_context_manager.reader
+    @db_api.placement_context_manager.reader.allow_async
     def _get_all(context):
         customs = list(context.session.query(models.ResourceClass).all())
         return _RC_CACHE.STANDARDS + customs
@@ -2681,7 +2779,8 @@ class ProviderSummary(base.VersionedObject):
         return set(res.resource_class for res in self.resources)
 
 
-@db_api.placement_context_manager.reader
+@metrics.timed
+@db_api.placement_context_manager.reader.allow_async
 def _get_usages_by_provider_tree(ctx, root_ids):
     """Returns a row iterator of usage records grouped by provider ID
     for all resource providers in all trees indicated in the ``root_ids``.
@@ -2768,7 +2867,7 @@ def _get_usages_by_provider_tree(ctx, root_ids):
     return ctx.session.execute(query).fetchall()
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_provider_ids_having_any_trait(ctx, traits):
     """Returns a set of resource provider internal IDs that have ANY of the
     supplied traits.
@@ -2789,7 +2888,7 @@ def _get_provider_ids_having_any_trait(ctx, traits):
     return set(r[0] for r in ctx.session.execute(sel))
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_provider_ids_having_all_traits(ctx, required_traits):
     """Returns a set of resource provider internal IDs that have ALL of the
     required traits.
@@ -2818,7 +2917,7 @@ def _get_provider_ids_having_all_traits(ctx, required_traits):
     return set(r[0] for r in ctx.session.execute(sel))
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _has_provider_trees(ctx):
     """Simple method that returns whether provider trees (i.e. nested resource
     providers) are in use in the deployment at all. This information is used to
@@ -2835,7 +2934,8 @@ def _has_provider_trees(ctx):
     return len(res) > 0
 
 
-@db_api.placement_context_manager.reader
+@metrics.timed
+@db_api.placement_context_manager.reader.allow_async
 def _get_provider_ids_matching(ctx, resources, required_traits,
         forbidden_traits, member_of=None):
     """Returns a list of tuples of (internal provider ID, root provider ID)
@@ -2957,7 +3057,7 @@ def _get_provider_ids_matching(ctx, resources, required_traits,
     return [rpids for rpids in provs_with_resource if rpids[0] in filtered_rps]
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _provider_aggregates(ctx, rp_ids):
     """Given a list of resource provider internal IDs, returns a dict,
     keyed by those provider IDs, of sets of aggregate ids associated
@@ -2982,7 +3082,7 @@ def _provider_aggregates(ctx, rp_ids):
     return res
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_providers_with_resource(ctx, rc_id, amount):
     """Returns a set of tuples of (provider ID, root provider ID) of providers
     that satisfy the request for a single resource class.
@@ -3050,7 +3150,7 @@ def _get_providers_with_resource(ctx, rc_id, amount):
     return ret
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_trees_with_traits(ctx, rp_ids, required_traits, forbidden_traits):
     """Given a list of provider IDs, filter them to return a set of tuples of
     (provider ID, root provider ID) of providers which belong to a tree that
@@ -3139,7 +3239,8 @@ def _get_trees_with_traits(ctx, rp_ids, required_traits, forbidden_traits):
     return [(rp_id, root_id) for rp_id, root_id in res]
 
 
-@db_api.placement_context_manager.reader
+@metrics.timed
+@db_api.placement_context_manager.reader.allow_async
 def _get_trees_matching_all(ctx, resources, required_traits, forbidden_traits,
                             sharing, member_of):
     """Returns a list of two-tuples (provider internal ID, root provider
@@ -3270,6 +3371,7 @@ def _get_trees_matching_all(ctx, resources, required_traits, forbidden_traits,
     return ret
 
 
+@metrics.timed
 def _build_provider_summaries(context, usages, prov_traits):
     """Given a list of dicts of usage information and a map of providers to
     their associated string traits, returns a dict, keyed by resource provider
@@ -3476,6 +3578,7 @@ def _check_traits_for_alloc_request(res_requests, summaries, prov_traits,
     return all_prov_ids
 
 
+@metrics.timed
 def _alloc_candidates_single_provider(ctx, requested_resources, rp_tuples):
     """Returns a tuple of (allocation requests, provider summaries) for a
     supplied set of requested resource amounts and resource providers. The
@@ -3539,6 +3642,7 @@ def _alloc_candidates_single_provider(ctx, requested_resources, rp_tuples):
     return alloc_requests, list(summaries.values())
 
 
+@metrics.timed
 def _alloc_candidates_multiple_providers(ctx, requested_resources,
         required_traits, forbidden_traits, rp_tuples):
     """Returns a tuple of (allocation requests, provider summaries) for a
@@ -3649,7 +3753,7 @@ def _alloc_candidates_multiple_providers(ctx, requested_resources,
     return alloc_requests, list(summaries.values())
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _get_traits_by_provider_tree(ctx, root_ids):
     """Returns a dict, keyed by provider IDs for all resource providers
     in all trees indicated in the ``root_ids``, of string trait names
@@ -3677,7 +3781,7 @@ def _get_traits_by_provider_tree(ctx, root_ids):
     return res
 
 
-@db_api.placement_context_manager.reader
+@db_api.placement_context_manager.reader.allow_async
 def _trait_ids_from_names(ctx, names):
     """Given a list of string trait names, returns a dict, keyed by those
     string names, of the corresponding internal integer trait ID.
@@ -3817,6 +3921,7 @@ def _exceeds_capacity(areq, psum_res_by_rp_rc):
     return False
 
 
+@metrics.timed
 def _merge_candidates(candidates, group_policy=None):
     """Given a dict, keyed by RequestGroup suffix, of tuples of
     (allocation_requests, provider_summaries), produce a single tuple of
@@ -4120,7 +4225,7 @@ class AllocationCandidates(base.VersionedObject):
     # resource_providers table via ResourceProvider.get_by_uuid, which does
     # data migration to populate the root_provider_uuid.  Change this back to a
     # reader when that migration is no longer happening.
-    @db_api.placement_context_manager.writer
+    @db_api.replica_reader(db_api.placement_context_manager.writer)
     def _get_by_requests(cls, context, requests, limit=None,
                          group_policy=None, nested_aware=True):
         # TODO(jaypipes): Make a RequestGroupContext object and put these
@@ -17,6 +17,7 @@ from nova.api.openstack.placement.policies import allocation
 from nova.api.openstack.placement.policies import allocation_candidate
 from nova.api.openstack.placement.policies import base
 from nova.api.openstack.placement.policies import inventory
+from nova.api.openstack.placement.policies import metrics
 from nova.api.openstack.placement.policies import resource_class
 from nova.api.openstack.placement.policies import resource_provider
 from nova.api.openstack.placement.policies import trait
@@ -33,5 +34,6 @@ def list_rules():
         usage.list_rules(),
         trait.list_rules(),
         allocation.list_rules(),
-        allocation_candidate.list_rules()
+        allocation_candidate.list_rules(),
+        metrics.list_rules()
     )
@@ -0,0 +1,175 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+import os_traits
+from oslo_utils import uuidutils
+import six
+import sqlalchemy as sa
+from sqlalchemy import func
+
+from nova.api.openstack.placement import db_api
+from nova.db.sqlalchemy import api_models as models
+
+_VERSION_TBL = models.PlacementCacheVersion.__table__
+_RP_TBL = models.ResourceProvider.__table__
+_RP_AGG_TBL = models.ResourceProviderAggregate.__table__
+_RP_TRAIT_TBL = models.ResourceProviderTrait.__table__
+_TRAIT_TBL = models.Trait.__table__
+# The name of the row of the placement_cache_versions table holding the
+# version of the sharing providers data.
+VERSION_NAME = 'sharing_providers'
+
+
+@db_api.placement_context_manager.writer
+def bump_version(ctx):
+    """Invalidates the sharing providers cache of every placement process.
+
+    Must be called in the transaction changing the aggregates of a provider,
+    the providers having the MISC_SHARES_VIA_AGGREGATE trait or the root of a
+    provider.
+    """
+    upd = _VERSION_TBL.update().where(_VERSION_TBL.c.name == VERSION_NAME)
+    upd = upd.values(version=uuidutils.generate_uuid())
+    ctx.session.execute(upd)
+
+
+@db_api.placement_context_manager.reader.allow_async
+def _get_version(ctx):
+    sel = sa.select([_VERSION_TBL.c.version])
+    sel = sel.where(_VERSION_TBL.c.name == VERSION_NAME)
+    return ctx.session.execute(sel).scalar()
+
+
+@db_api.placement_context_manager.reader.allow_async
+def _load_from_db(ctx, version):
+    """Returns a _SharingProviders object with the providers having the
+    MISC_SHARES_VIA_AGGREGATE trait and the roots of the trees associated with
+    the same aggregates as each of them.
+    """
+    # SELECT rp.id, rp.uuid
+    # FROM resource_providers AS rp
+    # INNER JOIN resource_provider_traits AS rpt
+    #   ON rp.id = rpt.resource_provider_id
+    # INNER JOIN traits AS t
+    #   ON rpt.trait_id = t.id
+    #   AND t.name = "MISC_SHARES_VIA_AGGREGATE"
+    rp = sa.alias(_RP_TBL, name='rp')
+    rpt = sa.alias(_RP_TRAIT_TBL, name='rpt')
+    t = sa.alias(_TRAIT_TBL, name='t')
+    join_chain = sa.join(rp, rpt, rp.c.id == rpt.c.resource_provider_id)
+    join_chain = sa.join(
+        join_chain, t, sa.and_(
+            rpt.c.trait_id == t.c.id,
+            # The traits table wants unicode trait names, but os_traits
+            # presents native str, so we need to cast.
+            t.c.name == six.text_type(os_traits.MISC_SHARES_VIA_AGGREGATE)))
+    sel = sa.select([rp.c.id, rp.c.uuid]).select_from(join_chain)
+    sharing = dict(ctx.session.execute(sel).fetchall())
+    anchors = collections.defaultdict(set)
+    if not sharing:
+        return _SharingProviders(version, sharing, anchors)
+
+    # SELECT shr_aggs.resource_provider_id,
+    #   COALESCE(shr_with_sps.root_provider_id, shr_with_sps.id),
+    #   COALESCE(rps.uuid, shr_with_sps.uuid)
+    # FROM resource_provider_aggregates AS shr_aggs
+    # INNER JOIN resource_provider_aggregates AS shr_with_sps_aggs
+    #   ON shr_aggs.aggregate_id = shr_with_sps_aggs.aggregate_id
+    # INNER JOIN resource_providers AS shr_with_sps
+    #   ON shr_with_sps_aggs.resource_provider_id = shr_with_sps.id
+    # LEFT JOIN resource_providers AS rps
+    #   ON shr_with_sps.root_provider_id = rps.id
+    # WHERE shr_aggs.resource_provider_id IN $(SHARING_IDS)
+    rps = sa.alias(_RP_TBL, name='rps')
+    shr_aggs = sa.alias(_RP_AGG_TBL, name='shr_aggs')
+    shr_with_sps_aggs = sa.alias(_RP_AGG_TBL, name='shr_with_sps_aggs')
+    shr_with_sps = sa.alias(_RP_TBL, name='shr_with_sps')
+    join_chain = sa.join(
+        shr_aggs, shr_with_sps_aggs,
+        shr_aggs.c.aggregate_id == shr_with_sps_aggs.c.aggregate_id)
+    join_chain = sa.join(
+        join_chain, shr_with_sps,
+        shr_with_sps_aggs.c.resource_provider_id == shr_with_sps.c.id)
+    # TODO(efried): Change this to an inner join and drop the COALESCEs when
+    # we are sure all root_provider_id values are NOT NULL
+    join_chain = sa.outerjoin(
+        join_chain, rps, shr_with_sps.c.root_provider_id == rps.c.id)
+    sel = sa.select([
+        shr_aggs.c.resource_provider_id,
+        func.coalesce(shr_with_sps.c.root_provider_id, shr_with_sps.c.id),
+        func.coalesce(rps.c.uuid, shr_with_sps.c.uuid)])
+    sel = sel.select_from(join_chain)
+    sel = sel.where(shr_aggs.c.resource_provider_id.in_(list(sharing)))
+    for sp_id, anchor_id, anchor_uuid in ctx.session.execute(sel):
+        anchors[sp_id].add((anchor_id, anchor_uuid))
+    return _SharingProviders(version, sharing, anchors)
+
+
+class _SharingProviders(object):
+    """The sharing providers and their anchors at a given version."""
+
+    def __init__(self, version, sharing, anchors):
+        self.version = version
+        # Dict, keyed by internal ID, of the UUID of the providers having the
+        # MISC_SHARES_VIA_AGGREGATE trait
+        self.sharing = sharing
+        # Dict, keyed by internal ID of sharing provider, of sets of
+        # (internal ID, UUID) of the root providers of the trees associated
+        # with the same aggregates as the sharing provider
+        self.anchors = anchors
+
+    def anchors_for(self, rp_ids, get_id=False):
+        """Returns a set of tuples of (sharing provider UUID, anchor provider
+        UUID) for the supplied internal IDs of sharing providers, or of
+        (sharing provider ID, anchor provider ID) if get_id is True.
+        """
+        if get_id:
+            return set((rp_id, anchor[0])
+                       for rp_id in rp_ids
+                       for anchor in self.anchors.get(rp_id, ()))
+        return set((self.sharing[rp_id], anchor[1])
+                   for rp_id in rp_ids
+                   for anchor in self.anchors.get(rp_id, ()))
+
+
+class SharingProviderCache(object):
+    """A cache of the providers sharing their inventory via aggregates and of
+    the root providers they can anchor allocation requests to.
+
+    The cached data is only reused as long as the version row of the
+    placement_cache_versions table is unchanged, which costs a single primary
+    key lookup per use instead of joining the traits and aggregates tables.
+    Writers change the version with bump_version() in the same transaction as
+    the data, so every placement process sees the change.
+    """
+
+    def __init__(self):
+        self._data = None
+
+    def clear(self):
+        self._data = None
+
+    def get(self, ctx):
+        """Returns the _SharingProviders current for the supplied context's
+        transaction, reloading them from the database if they changed.
+        """
+        version = _get_version(ctx)
+        data = self._data
+        if data is not None and version is not None and (
+                data.version == version):
+            return data
+        data = _load_from_db(ctx, version)
+        if version is not None:
+            self._data = data
+        return data
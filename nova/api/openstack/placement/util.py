@@ -19,6 +19,7 @@ from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_middleware import request_id
 from oslo_serialization import jsonutils
+from oslo_utils import strutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 import webob
@@ -39,6 +40,9 @@ LOG = logging.getLogger(__name__)
 
 # Error code handling constants
 ENV_ERROR_CODE = 'placement.error_code'
+# Request header with which a client that has just written to placement
+# forces a following read to be served from the primary database.
+MUST_BE_CURRENT_HEADER = 'OpenStack-Placement-Must-Be-Current'
 ERROR_CODE_MICROVERSION = (1, 23)
 
 # Querystring-related constants
@@ -193,6 +197,20 @@ def require_content(content_type):
     return decorator
 
 
+def read_from_replica(req):
+    """Return True if the read-only request may be served from the replica
+    database connection.
+
+    This is the case when ``[placement]/enable_replica_reads`` is True and
+    the client has not asked for current data with a true value in the
+    OpenStack-Placement-Must-Be-Current header.
+    """
+    if not CONF.placement.enable_replica_reads:
+        return False
+    must_be_current = req.headers.get(MUST_BE_CURRENT_HEADER, 'false')
+    return not strutils.bool_from_string(must_be_current)
+
+
 def resource_class_url(environ, resource_class):
     """Produce the URL for a resource class.
 
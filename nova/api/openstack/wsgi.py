@@ -14,7 +14,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import functools
+import threading
+import time
 
 import microversion_parse
 from oslo_log import log as logging
@@ -27,11 +30,13 @@ import webob
 from nova.api.openstack import api_version_request as api_version
 from nova.api.openstack import versioned_method
 from nova.api import wsgi
+import nova.conf
 from nova import exception
 from nova import i18n
 from nova.i18n import _
 
 
+CONF = nova.conf.CONF
 LOG = logging.getLogger(__name__)
 
 _SUPPORTED_CONTENT_TYPES = (
@@ -53,6 +58,15 @@ _METHODS_WITH_BODY = [
     'PUT',
 ]
 
+# Request header with which a client forces the reads of a request to be served
+# from the primary databases rather than from their replicas.
+MUST_BE_CURRENT_HEADER = 'OpenStack-Nova-Must-Be-Current'
+
+# The last time each user changed something through this API worker, keyed by
+# user ID and oldest first, see read_from_replica().
+_LAST_WRITES = collections.OrderedDict()
+_LAST_WRITES_LOCK = threading.Lock()
+
 # The default api version request if none is requested in the headers
 # Note(cyeoh): This only applies for the v2.1 API once microversions
 # support is fully merged. It does not affect the V2 API.
@@ -370,6 +384,58 @@ class ResponseObject(object):
         return self._headers.copy()
 
 
+def _record_write(context):
+    """Records that the user of the context changed something, so that their
+    reads go to the primary databases for a while.
+    """
+    now = time.time()
+    window = CONF.api.replica_read_after_write_window
+    with _LAST_WRITES_LOCK:
+        _LAST_WRITES.pop(context.user_id, None)
+        _LAST_WRITES[context.user_id] = now
+        # Forget the writes which do not matter anymore
+        while _LAST_WRITES:
+            user_id, write_time = next(iter(_LAST_WRITES.items()))
+            if now - write_time < window:
+                break
+            del _LAST_WRITES[user_id]
+
+
+def read_from_replica(req):
+    """Return True if the reads of the read-only request may be served from
+    the replica databases.
+
+    This is the case when ``[api]/enable_replica_reads`` is True, unless the
+    client asked for current data with a true value in the
+    OpenStack-Nova-Must-Be-Current header or the user changed something
+    through this API worker in the last
+    ``[api]/replica_read_after_write_window`` seconds.
+    """
+    if not CONF.api.enable_replica_reads:
+        return False
+    must_be_current = req.headers.get(MUST_BE_CURRENT_HEADER, 'false')
+    if strutils.bool_from_string(must_be_current):
+        return False
+    context = req.environ['nova.context']
+    write_time = _LAST_WRITES.get(context.user_id)
+    return (write_time is None or time.time() - write_time >=
+            CONF.api.replica_read_after_write_window)
+
+
+def allow_replica_reads(f):
+    """Decorator for the read-only methods of the controllers, whose reads may
+    be served from the replica databases, see read_from_replica().
+
+    The method must take the request as first argument after self.
+    """
+    @functools.wraps(f)
+    def wrapped(self, req, *args, **kwargs):
+        context = req.environ['nova.context']
+        context.read_from_replica = read_from_replica(req)
+        return f(self, req, *args, **kwargs)
+    return wrapped
+
+
 def action_peek(body):
     """Determine action to invoke.
 
@@ -644,6 +710,10 @@ class Resource(wsgi.Application):
         except Fault as ex:
             response = ex
 
+        if (context and CONF.api.enable_replica_reads and
+                request.method not in ('GET', 'HEAD')):
+            _record_write(context)
+
         if not response:
             # No exceptions; convert action_result into a
             # ResponseObject
@@ -47,6 +47,7 @@ from sqlalchemy.engine import url as sqla_url
 from nova.api.openstack.placement.objects import consumer as consumer_obj
 from nova.cmd import common as cmd_common
 from nova.compute import api as compute_api
+from nova.compute import instance_list
 import nova.conf
 from nova import config
 from nova import context
@@ -504,14 +505,23 @@ Error: %s""") % six.text_type(e))
                 'max_rows as a batch size for each iteration.'))
     @args('--purge', action='store_true', dest='purge', default=False,
           help='Purge all data from shadow tables after archive completes')
+    @args('--max-workers', type=int, metavar='<number>', dest='max_workers',
+          default=4,
+          help='Maximum number of tables to archive at once. Defaults to 4.')
+    @args('--batch-time', type=float, metavar='<seconds>', dest='batch_time',
+          default=1.0,
+          help='Target duration of the transactions archiving the rows of '
+               'a table, which the number of rows archived per transaction '
+               'is adapted to. Defaults to 1 second.')
     def archive_deleted_rows(self, max_rows=1000, verbose=False,
-                             until_complete=False, purge=False):
+                             until_complete=False, purge=False,
+                             max_workers=4, batch_time=1.0):
         """Move deleted rows from production tables to shadow tables.
 
         Returns 0 if nothing was archived, 1 if some number of rows were
-        archived, 2 if max_rows is invalid, 3 if no connection could be
-        established to the API DB. If automating, this should be
-        run continuously while the result is 1, stopping at 0.
+        archived, 2 if max_rows, max_workers or batch_time is invalid, 3 if
+        no connection could be established to the API DB. If automating,
+        this should be run continuously while the result is 1, stopping at 0.
         """
         max_rows = int(max_rows)
         if max_rows < 0:
@@ -521,6 +531,9 @@ Error: %s""") % six.text_type(e))
             print(_('max rows must be <= %(max_value)d') %
                   {'max_value': db.MAX_INT})
             return 2
+        if max_workers < 1 or batch_time <= 0:
+            print(_('max workers and batch time must be positive'))
+            return 2
 
         ctxt = context.get_admin_context()
         try:
@@ -537,11 +550,22 @@ Error: %s""") % six.text_type(e))
 
         table_to_rows_archived = {}
         deleted_instance_uuids = []
+        # The number of rows archived from each table and the time it took,
+        # as reported by the database API.
+        table_to_timings = {}
+
+        def report(table, rows, seconds):
+            timings = table_to_timings.setdefault(table, [0, 0.0])
+            timings[0] += rows
+            timings[1] += seconds
+
         if until_complete and verbose:
             sys.stdout.write(_('Archiving') + '..')  # noqa
         while True:
             try:
-                run, deleted_instance_uuids = db.archive_deleted_rows(max_rows)
+                run, deleted_instance_uuids = db.archive_deleted_rows(
+                    max_rows, max_workers=max_workers, batch_time=batch_time,
+                    report_fn=report)
             except KeyboardInterrupt:
                 run = {}
                 if until_complete and verbose:
@@ -579,11 +603,17 @@ Error: %s""") % six.text_type(e))
                                  dict_value=_('Number of Rows Archived'))
             else:
                 print(_('Nothing was archived.'))
+            for table, (rows, seconds) in sorted(table_to_timings.items()):
+                print(_('Archived %(rows)i rows from %(table)s in '
+                        '%(seconds).2f seconds (%(rate)i rows/s)') %
+                      {'rows': rows, 'table': table, 'seconds': seconds,
+                       'rate': rows / max(seconds, 0.001)})
 
         if table_to_rows_archived and purge:
             if verbose:
                 print(_('Rows were archived, running purge...'))
-            self.purge(purge_all=True, verbose=verbose)
+            self.purge(purge_all=True, verbose=verbose,
+                       max_workers=max_workers, batch_time=batch_time)
 
         # NOTE(danms): Return nonzero if we archived something
         return int(bool(table_to_rows_archived))
@@ -597,11 +627,22 @@ Error: %s""") % six.text_type(e))
           help='Print information about purged records')
     @args('--all-cells', dest='all_cells', action='store_true', default=False,
           help='Run against all cell databases')
+    @args('--max-workers', type=int, metavar='<number>', dest='max_workers',
+          default=4,
+          help='Maximum number of tables to purge at once. Defaults to 4.')
+    @args('--batch-time', type=float, metavar='<seconds>', dest='batch_time',
+          default=1.0,
+          help='Target duration of the transactions purging the rows of a '
+               'table, which the number of rows purged per transaction is '
+               'adapted to. Defaults to 1 second.')
     def purge(self, before=None, purge_all=False, verbose=False,
-              all_cells=False):
+              all_cells=False, max_workers=4, batch_time=1.0):
         if before is None and purge_all is False:
             print(_('Either --before or --all is required'))
             return 1
+        if max_workers < 1 or batch_time <= 0:
+            print(_('max workers and batch time must be positive'))
+            return 2
         if before:
             try:
                 before_date = dateutil_parser.parse(before, fuzzy=True)
@@ -628,18 +669,71 @@ Error: %s""") % six.text_type(e))
             for cell in cells:
                 identity = _('Cell %s') % cell.identity
                 with context.target_cell(admin_ctxt, cell) as cctxt:
-                    deleted += sa_db.purge_shadow_tables(cctxt,
-                                                         before_date,
-                                                         status_fn=status)
+                    deleted += sa_db.purge_shadow_tables(
+                        cctxt, before_date, status_fn=status,
+                        max_workers=max_workers, batch_time=batch_time)
         else:
             identity = _('DB')
-            deleted = sa_db.purge_shadow_tables(admin_ctxt,
-                                                before_date, status_fn=status)
+            deleted = sa_db.purge_shadow_tables(
+                admin_ctxt, before_date, status_fn=status,
+                max_workers=max_workers, batch_time=batch_time)
         if deleted:
             return 0
         else:
             return 3
 
+    @args('--since', dest='since',
+          help='List the instances changed since this time. Fuzzy time '
+               'specs are allowed')
+    @args('--cursor', dest='cursor',
+          help='List the instances changed since a previous run of this '
+               'command, which printed this cursor')
+    @args('--limit', type=int, metavar='<number>', dest='limit', default=1000,
+          help='Maximum number of instances to list. Defaults to 1000.')
+    def instance_changes(self, since=None, cursor=None, limit=1000):
+        """Lists the instances of every cell changed since a point in time,
+        deleted ones included, then the cursor to list the next changes from.
+
+        The instances of each cell are read in the order of their last update
+        from a high-water mark, which the cursor holds for every cell, so a
+        run only reads the instances changed since the previous one.
+        """
+        if (since is None) == (cursor is None):
+            print(_('Either --since or --cursor is required'))
+            return 1
+        if limit < 1:
+            print(_('limit must be positive'))
+            return 2
+        if cursor is not None:
+            try:
+                feed = instance_list.InstanceChangeFeed.from_cursor(cursor)
+            except exception.MarkerNotFound:
+                print(_('Invalid value for --cursor'))
+                return 2
+        else:
+            try:
+                since_date = dateutil_parser.parse(since, fuzzy=True)
+            except ValueError as e:
+                print(_('Invalid value for --since: %s') % e)
+                return 2
+            feed = instance_list.InstanceChangeFeed(since_date)
+
+        ctxt = context.get_admin_context()
+        instances = feed.get_instance_objects(
+            ctxt, limit=limit,
+            columns=['project_id', 'host', 'vm_state', 'task_state',
+                     'deleted', 'updated_at'])
+        t = prettytable.PrettyTable([_('UUID'), _('Project'), _('Host'),
+                                     _('VM State'), _('Task State'),
+                                     _('Deleted'), _('Updated At')])
+        for instance in instances:
+            t.add_row([instance.uuid, instance.project_id, instance.host,
+                       instance.vm_state, instance.task_state,
+                       instance.deleted, instance.updated_at])
+        print(t)
+        print(_('Cursor: %s') % feed.cursor)
+        return 0
+
     @args('--delete', action='store_true', dest='delete',
           help='If specified, automatically delete any records found where '
                'instance_uuid is NULL.')
@@ -24,8 +24,11 @@ import copy
 import functools
 import re
 import string
+import sys
+import time
 
 from castellan import key_manager
+import eventlet.timeout
 from oslo_log import log as logging
 from oslo_messaging import exceptions as oslo_exceptions
 from oslo_serialization import base64 as base64utils
@@ -245,6 +248,63 @@ def load_cells():
         LOG.error('No cells are configured, unable to continue')
 
 
+def _validate_concurrently(validations, untimed=()):
+    """Run independent validations of a request concurrently.
+
+    Each validation is given up to [api]/create_validation_timeout seconds to
+    complete, if set, and the time taken by each of them is logged.
+
+    :param validations: list of tuples of the name of a validation and of the
+        callable running it
+    :param untimed: names of the validations which are not given a timeout,
+        since they cannot be interrupted without leaking what they created
+    :returns: dict, keyed by name, of the results of the validations
+    :raises: the error of the first validation which failed, in the order of
+        validations, once all of them are completed
+    """
+    timeout = CONF.api.create_validation_timeout
+    timings = {}
+
+    def _validate(name, func):
+        start = time.time()
+        # NOTE: The Timeout exception is not an Exception, so that it can't be
+        # swallowed by the validations which convert any failure of another
+        # service into a validation error.
+        timer = eventlet.timeout.Timeout(
+            None if name in untimed else timeout or None)
+        try:
+            return func()
+        except eventlet.timeout.Timeout as exc:
+            if exc is not timer:
+                raise
+            raise exception.ValidationTimeout(validation=name,
+                                              timeout=timeout)
+        finally:
+            timer.cancel()
+            timings[name] = time.time() - start
+
+    start = time.time()
+    threads = [(name, utils.spawn(_validate, name, func))
+               for name, func in validations]
+    results = {}
+    error = None
+    for name, thread in threads:
+        try:
+            results[name] = thread.wait()
+        except Exception:
+            if error is None:
+                error = sys.exc_info()
+    LOG.info('Validated %(names)s in %(total).3f seconds (%(timings)s)',
+             {'names': ', '.join(name for name, func in validations),
+              'total': time.time() - start,
+              'timings': ', '.join('%s: %.3fs' % (name, timings[name])
+                                   for name, func in validations
+                                   if name in timings)})
+    if error is not None:
+        six.reraise(*error)
+    return results
+
+
 @profiler.trace_cls("compute_api")
 class API(base.Base):
     """API for interacting with the compute manager."""
@@ -793,29 +853,49 @@ class API(base.Base):
             except TypeError:
                 raise exception.InstanceUserDataMalformed()
 
-        # When using Neutron, _check_requested_secgroups will translate and
-        # return any requested security group names to uuids.
-        security_groups = (
-            self._check_requested_secgroups(context, security_groups))
-
-        # Note:  max_count is the number of instances requested by the user,
-        # max_network_count is the maximum number of instances taking into
-        # account any network quotas
-        max_network_count = self._check_requested_networks(context,
-                                     requested_networks, max_count)
-
-        kernel_id, ramdisk_id = self._handle_kernel_and_ramdisk(
-                context, kernel_id, ramdisk_id, boot_meta)
-
         config_drive = self._check_config_drive(config_drive)
 
+        # PCI requests come from two sources: instance flavor and
+        # requested_networks. The first call in below returns an
+        # InstancePCIRequests object which is a list of InstancePCIRequest
+        # objects. The second call, among the validations below, creates an
+        # InstancePCIRequest object for each SR-IOV port, and append it to
+        # the list in the InstancePCIRequests object
+        pci_request_info = pci_request.get_pci_requests_from_flavor(
+            instance_type)
+
+        # The validations below call other services or the database and are
+        # independent from each other, so they are run concurrently.
+        validations = [
+            # When using Neutron, _check_requested_secgroups will translate
+            # and return any requested security group names to uuids.
+            ('security_groups', functools.partial(
+                self._check_requested_secgroups, context, security_groups)),
+            # Note:  max_count is the number of instances requested by the
+            # user, max_network_count is the maximum number of instances
+            # taking into account any network quotas
+            ('networks', functools.partial(
+                self._check_requested_networks, context, requested_networks,
+                max_count)),
+            ('kernel_and_ramdisk', functools.partial(
+                self._handle_kernel_and_ramdisk, context, kernel_id,
+                ramdisk_id, boot_meta)),
+        ]
         if key_data is None and key_name is not None:
-            key_pair = objects.KeyPair.get_by_name(context,
-                                                   context.user_id,
-                                                   key_name)
+            validations.append(('key_pair', functools.partial(
+                objects.KeyPair.get_by_name, context, context.user_id,
+                key_name)))
+        validations.append(('resource_requests', functools.partial(
+            self.network_api.create_resource_requests, context,
+            requested_networks, pci_request_info)))
+        results = _validate_concurrently(validations)
+        security_groups = results['security_groups']
+        max_network_count = results['networks']
+        kernel_id, ramdisk_id = results['kernel_and_ramdisk']
+        network_metadata = results['resource_requests']
+        key_pair = results.get('key_pair')
+        if key_pair is not None:
             key_data = key_pair.public_key
-        else:
-            key_pair = None
 
         root_device_name = block_device.prepend_dev(
                 block_device.properties_root_device_name(
@@ -833,17 +913,6 @@ class API(base.Base):
 
         system_metadata = {}
 
-        # PCI requests come from two sources: instance flavor and
-        # requested_networks. The first call in below returns an
-        # InstancePCIRequests object which is a list of InstancePCIRequest
-        # objects. The second call in below creates an InstancePCIRequest
-        # object for each SR-IOV port, and append it to the list in the
-        # InstancePCIRequests object
-        pci_request_info = pci_request.get_pci_requests_from_flavor(
-            instance_type)
-        network_metadata = self.network_api.create_resource_requests(
-            context, requested_networks, pci_request_info)
-
         base_options = {
             'reservation_id': reservation_id,
             'image_ref': image_href,
@@ -904,10 +973,11 @@ class API(base.Base):
             block_device_mapping, shutdown_terminate,
             instance_group, check_server_group_quota, filter_properties,
             key_pair, tags, trusted_certs, supports_multiattach=False,
-            network_metadata=None):
-        # Check quotas
-        num_instances = compute_utils.check_num_instances_quota(
-                context, instance_type, min_count, max_count)
+            network_metadata=None, num_instances=None):
+        # Check quotas, unless the caller already did
+        if num_instances is None:
+            num_instances = compute_utils.check_num_instances_quota(
+                    context, instance_type, min_count, max_count)
         security_groups = self.security_group_api.populate_security_groups(
                 security_groups)
         self.security_group_api.ensure_default(context)
@@ -1180,7 +1250,8 @@ class API(base.Base):
         tags = tags or []
 
         if image_href:
-            image_id, boot_meta = self._get_image(context, image_href)
+            get_image = functools.partial(self._get_image, context,
+                                          image_href)
         else:
             # This is similar to the logic in _retrieve_trusted_certs_object.
             if (trusted_certs or
@@ -1190,9 +1261,21 @@ class API(base.Base):
                 msg = _("Image certificate validation is not supported "
                         "when booting from volume")
                 raise exception.CertificateValidationFailed(message=msg)
-            image_id = None
-            boot_meta = self._get_bdm_image_metadata(
-                context, block_device_mapping, legacy_bdm)
+
+            def get_image():
+                return None, self._get_bdm_image_metadata(
+                    context, block_device_mapping, legacy_bdm)
+
+        # The quota of instances is checked along with getting the image,
+        # while the maximum number of instances it allows is capped below
+        # once the network quotas are known.
+        results = _validate_concurrently([
+            ('image', get_image),
+            ('quota', functools.partial(
+                compute_utils.check_num_instances_quota, context,
+                instance_type, min_count, max_count))])
+        image_id, boot_meta = results['image']
+        num_instances = results['quota']
 
         self._check_auto_disk_config(image=boot_meta,
                                      auto_disk_config=auto_disk_config)
@@ -1217,6 +1300,7 @@ class API(base.Base):
                      {'max_count': max_count,
                       'max_net_count': max_net_count})
             max_count = max_net_count
+            num_instances = min(num_instances, max_count)
 
         block_device_mapping = self._check_and_transform_bdm(context,
             base_options, instance_type, boot_meta, min_count, max_count,
@@ -1238,7 +1322,7 @@ class API(base.Base):
             boot_meta, security_groups, block_device_mapping,
             shutdown_terminate, instance_group, check_server_group_quota,
             filter_properties, key_pair, tags, trusted_certs,
-            supports_multiattach, network_metadata)
+            supports_multiattach, network_metadata, num_instances)
 
         instances = []
         request_specs = []
@@ -1426,79 +1510,31 @@ class API(base.Base):
                       instance=instance)
             raise exception.InvalidBDMBootSequence()
 
-        for bdm in block_device_mappings:
-            # NOTE(vish): For now, just make sure the volumes are accessible.
-            # Additionally, check that the volume can be attached to this
-            # instance.
-            snapshot_id = bdm.snapshot_id
-            volume_id = bdm.volume_id
-            image_id = bdm.image_id
-            if (image_id is not None and
-                    image_id != instance.get('image_ref')):
-                try:
-                    self._get_image(context, image_id)
-                except Exception:
-                    raise exception.InvalidBDMImage(id=image_id)
-                if (bdm.source_type == 'image' and
-                        bdm.destination_type == 'volume' and
-                        not bdm.volume_size):
-                    raise exception.InvalidBDM(message=_("Images with "
-                        "destination_type 'volume' need to have a non-zero "
-                        "size specified"))
-            elif volume_id is not None:
-                # The instance is being created and we don't know which
-                # cell it's going to land in, so check all cells.
-                min_compute_version = \
-                    objects.service.get_minimum_version_all_cells(
-                        context, ['nova-compute'])
-                try:
-                    # NOTE(ildikov): The boot from volume operation did not
-                    # reserve the volume before Pike and as the older computes
-                    # are running 'check_attach' which will fail if the volume
-                    # is in 'attaching' state; if the compute service version
-                    # is not high enough we will just perform the old check as
-                    # opposed to reserving the volume here.
-                    volume = self.volume_api.get(context, volume_id)
-                    if (min_compute_version >=
-                        BFV_RESERVE_MIN_COMPUTE_VERSION):
-                        self._check_attach_and_reserve_volume(
-                            context, volume, instance, bdm,
-                            supports_multiattach)
-                    else:
-                        # NOTE(ildikov): This call is here only for backward
-                        # compatibility can be removed after Ocata EOL.
-                        self._check_attach(context, volume, instance)
-                    bdm.volume_size = volume.get('size')
-
-                    # NOTE(mnaser): If we end up reserving the volume, it will
-                    #               not have an attachment_id which is needed
-                    #               for cleanups.  This can be removed once
-                    #               all calls to reserve_volume are gone.
-                    if 'attachment_id' not in bdm:
-                        bdm.attachment_id = None
-                except (exception.CinderConnectionFailed,
-                        exception.InvalidVolume,
-                        exception.MultiattachNotSupportedOldMicroversion,
-                        exception.MultiattachSupportNotYetAvailable):
-                    raise
-                except exception.InvalidInput as exc:
-                    raise exception.InvalidVolume(reason=exc.format_message())
-                except Exception:
-                    raise exception.InvalidBDMVolume(id=volume_id)
-            elif snapshot_id is not None:
-                try:
-                    snap = self.volume_api.get_snapshot(context, snapshot_id)
-                    bdm.volume_size = bdm.volume_size or snap.get('size')
-                except exception.CinderConnectionFailed:
-                    raise
-                except Exception:
-                    raise exception.InvalidBDMSnapshot(id=snapshot_id)
-            elif (bdm.source_type == 'blank' and
-                    bdm.destination_type == 'volume' and
-                    not bdm.volume_size):
-                raise exception.InvalidBDM(message=_("Blank volumes "
-                    "(source: 'blank', dest: 'volume') need to have non-zero "
-                    "size"))
+        # The sources of the block devices are validated concurrently, since
+        # each of them can call glance or cinder. Since the validations which
+        # succeed are not stopped when another one fails, the volumes they
+        # reserved are released if the request fails. The validations of
+        # volumes are not timed out, since a timeout could interrupt them once
+        # cinder reserved the volume, but before we know about it.
+        reserved_bdms = []
+
+        def _validate_source(bdm):
+            if self._validate_bdm_source(context, instance, bdm,
+                                         supports_multiattach):
+                reserved_bdms.append(bdm)
+
+        validations = [('block_device_mapping_%d' % i,
+                        functools.partial(_validate_source, bdm))
+                       for i, bdm in enumerate(block_device_mappings)]
+        try:
+            _validate_concurrently(
+                validations,
+                untimed=[name for (name, func), bdm in
+                         zip(validations, block_device_mappings)
+                         if bdm.volume_id is not None])
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._release_bdm_volumes(context, instance, reserved_bdms)
 
         ephemeral_size = sum(bdm.volume_size or instance_type['ephemeral_gb']
                 for bdm in block_device_mappings
@@ -1524,6 +1560,108 @@ class API(base.Base):
             if num_local > max_local:
                 raise exception.InvalidBDMLocalsLimit()
 
+    def _validate_bdm_source(self, context, instance, bdm,
+                             supports_multiattach):
+        """Validate the source of a block device mapping.
+
+        :returns: True if the volume of the block device mapping was reserved
+            or attached to the instance, False otherwise
+        """
+        # NOTE(vish): For now, just make sure the volumes are accessible.
+        # Additionally, check that the volume can be attached to this
+        # instance.
+        snapshot_id = bdm.snapshot_id
+        volume_id = bdm.volume_id
+        image_id = bdm.image_id
+        if (image_id is not None and
+                image_id != instance.get('image_ref')):
+            try:
+                self._get_image(context, image_id)
+            except Exception:
+                raise exception.InvalidBDMImage(id=image_id)
+            if (bdm.source_type == 'image' and
+                    bdm.destination_type == 'volume' and
+                    not bdm.volume_size):
+                raise exception.InvalidBDM(message=_("Images with "
+                    "destination_type 'volume' need to have a non-zero "
+                    "size specified"))
+        elif volume_id is not None:
+            # The instance is being created and we don't know which
+            # cell it's going to land in, so check all cells.
+            min_compute_version = \
+                objects.service.get_minimum_version_all_cells(
+                    context, ['nova-compute'])
+            try:
+                # NOTE(ildikov): The boot from volume operation did not
+                # reserve the volume before Pike and as the older computes
+                # are running 'check_attach' which will fail if the volume
+                # is in 'attaching' state; if the compute service version
+                # is not high enough we will just perform the old check as
+                # opposed to reserving the volume here.
+                volume = self.volume_api.get(context, volume_id)
+                reserved = (min_compute_version >=
+                            BFV_RESERVE_MIN_COMPUTE_VERSION)
+                if reserved:
+                    self._check_attach_and_reserve_volume(
+                        context, volume, instance, bdm,
+                        supports_multiattach)
+                else:
+                    # NOTE(ildikov): This call is here only for backward
+                    # compatibility can be removed after Ocata EOL.
+                    self._check_attach(context, volume, instance)
+                bdm.volume_size = volume.get('size')
+
+                # NOTE(mnaser): If we end up reserving the volume, it will
+                #               not have an attachment_id which is needed
+                #               for cleanups.  This can be removed once
+                #               all calls to reserve_volume are gone.
+                if 'attachment_id' not in bdm:
+                    bdm.attachment_id = None
+                return reserved
+            except (exception.CinderConnectionFailed,
+                    exception.InvalidVolume,
+                    exception.MultiattachNotSupportedOldMicroversion,
+                    exception.MultiattachSupportNotYetAvailable):
+                raise
+            except exception.InvalidInput as exc:
+                raise exception.InvalidVolume(reason=exc.format_message())
+            except Exception:
+                raise exception.InvalidBDMVolume(id=volume_id)
+        elif snapshot_id is not None:
+            try:
+                snap = self.volume_api.get_snapshot(context, snapshot_id)
+                bdm.volume_size = bdm.volume_size or snap.get('size')
+            except exception.CinderConnectionFailed:
+                raise
+            except Exception:
+                raise exception.InvalidBDMSnapshot(id=snapshot_id)
+        elif (bdm.source_type == 'blank' and
+                bdm.destination_type == 'volume' and
+                not bdm.volume_size):
+            raise exception.InvalidBDM(message=_("Blank volumes "
+                "(source: 'blank', dest: 'volume') need to have non-zero "
+                "size"))
+        return False
+
+    def _release_bdm_volumes(self, context, instance, bdms):
+        """Release the volumes reserved or attached by _validate_bdm_source.
+
+        Failures are logged and ignored, since the request is failing anyway.
+        """
+        for bdm in bdms:
+            try:
+                if bdm.attachment_id:
+                    self.volume_api.attachment_delete(context,
+                                                      bdm.attachment_id)
+                else:
+                    self.volume_api.unreserve_volume(context, bdm.volume_id)
+            except Exception as exc:
+                LOG.warning('Failed to release volume %(volume_id)s after '
+                            'the block device mappings failed validation: '
+                            '%(exc)s',
+                            {'volume_id': bdm.volume_id, 'exc': exc},
+                            instance=instance)
+
     def _check_attach(self, context, volume, instance):
         # TODO(ildikov): This check_attach code is kept only for backward
         # compatibility and should be removed after Ocata EOL.
@@ -2458,7 +2596,8 @@ class API(base.Base):
         return instance
 
     def get_all(self, context, search_opts=None, limit=None, marker=None,
-                expected_attrs=None, sort_keys=None, sort_dirs=None):
+                expected_attrs=None, sort_keys=None, sort_dirs=None,
+                columns=None):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -2472,6 +2611,10 @@ class API(base.Base):
         secondary sort ket, etc.). For each sort key, the associated sort
         direction is based on the list of sort directions in the 'sort_dirs'
         parameter.
+
+        If a list of 'columns' is given, only these columns and the
+        'expected_attrs' of the instances are loaded from the cell databases,
+        instead of whole instances.
         """
         if search_opts is None:
             search_opts = {}
@@ -2560,6 +2703,10 @@ class API(base.Base):
             elif limit:
                 LOG.debug('Removing limit for DB query due to IP filter')
                 limit = None
+        if filter_ip:
+            # Filtering by IP in memory needs the network info of the whole
+            # instances.
+            columns = None
 
         # Skip get BuildRequest if filtering by IP address, as building
         # instances will not have IP addresses.
@@ -2591,17 +2738,21 @@ class API(base.Base):
         # neutron (which is the default) but if you're using neutron then the
         # security_group_instance_association table should be empty anyway
         # and the DB should optimize out that join, making it insignificant.
-        fields = ['metadata', 'info_cache', 'security_groups']
+        if columns is None:
+            fields = ['metadata', 'info_cache', 'security_groups']
+        else:
+            fields = []
         if expected_attrs:
             fields.extend(expected_attrs)
 
         if CONF.cells.enable:
             insts = self._do_old_style_instance_list_for_poor_cellsv1_users(
                 context, filters, limit, marker, fields, sort_keys,
-                sort_dirs)
+                sort_dirs, columns=columns)
         else:
             insts = instance_list.get_instance_objects_sorted(
-                context, filters, limit, marker, fields, sort_keys, sort_dirs)
+                context, filters, limit, marker, fields, sort_keys, sort_dirs,
+                columns=columns)
 
         def _get_unique_filter_method():
             seen_uuids = set()
@@ -2634,7 +2785,8 @@ class API(base.Base):
                                                            limit, marker,
                                                            fields,
                                                            sort_keys,
-                                                           sort_dirs):
+                                                           sort_dirs,
+                                                           columns=None):
         try:
             cell0_mapping = objects.CellMapping.get_by_uuid(context,
                 objects.CellMapping.CELL0_UUID)
@@ -2646,7 +2798,7 @@ class API(base.Base):
                     cell0_instances = self._get_instances_by_filters(
                         cctxt, filters, limit=limit, marker=marker,
                         fields=fields, sort_keys=sort_keys,
-                        sort_dirs=sort_dirs)
+                        sort_dirs=sort_dirs, columns=columns)
                     # If we found the marker in cell0 we need to set it to None
                     # so we don't expect to find it in the cells below.
                     marker = None
@@ -2667,7 +2819,7 @@ class API(base.Base):
             cell_instances = self._get_instances_by_filters(
                 context, filters, limit=limit, marker=marker,
                 fields=fields, sort_keys=sort_keys,
-                sort_dirs=sort_dirs)
+                sort_dirs=sort_dirs, columns=columns)
         else:
             LOG.debug('Limit excludes any results from real cells')
             cell_instances = objects.InstanceList(objects=[])
@@ -2722,10 +2874,12 @@ class API(base.Base):
 
     def _get_instances_by_filters(self, context, filters,
                                   limit=None, marker=None, fields=None,
-                                  sort_keys=None, sort_dirs=None):
+                                  sort_keys=None, sort_dirs=None,
+                                  columns=None):
         return objects.InstanceList.get_by_filters(
             context, filters=filters, limit=limit, marker=marker,
-            expected_attrs=fields, sort_keys=sort_keys, sort_dirs=sort_dirs)
+            expected_attrs=fields, sort_keys=sort_keys, sort_dirs=sort_dirs,
+            columns=columns)
 
     def update_instance(self, context, instance, updates):
         """Updates a single Instance object with some updates dict.
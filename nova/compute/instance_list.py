@@ -10,7 +10,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 import copy
+import datetime
+
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
 
 from nova.compute import multi_cell_list
 import nova.conf
@@ -22,6 +28,8 @@ from nova.objects import instance as instance_obj
 
 
 CONF = nova.conf.CONF
+LOG = logging.getLogger(__name__)
+_CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
 
 class InstanceSortContext(multi_cell_list.RecordSortContext):
@@ -72,32 +80,201 @@ class InstanceLister(multi_cell_list.CrossCellLister):
                 raise exception.MarkerNotFound(marker=marker)
         return db_inst
 
-    def get_marker_by_values(self, ctx, values):
-        return db.instance_get_by_sort_filters(ctx,
-                                               self.sort_ctx.sort_keys,
-                                               self.sort_ctx.sort_dirs,
-                                               values)
-
-    def get_by_filters(self, ctx, filters, limit, marker, **kwargs):
+    def get_by_filters(self, ctx, filters, limit, marker_values, **kwargs):
+        if kwargs.get('columns') is not None:
+            # NOTE: The records of the cells are merged on the values of their
+            # sort keys, so these have to be loaded too.
+            kwargs['columns'] = (
+                set(kwargs['columns']) | set(self.sort_ctx.sort_keys))
         return db.instance_get_all_by_filters_sort(
-            ctx, filters, limit=limit, marker=marker,
+            ctx, filters, limit=limit, marker_values=marker_values,
             sort_keys=self.sort_ctx.sort_keys,
             sort_dirs=self.sort_ctx.sort_dirs,
             **kwargs)
 
 
+class InstanceChangeFeed(object):
+    """A feed of the instances of every cell changed since a point in time.
+
+    Unlike listing the instances with a changes-since filter, this does not
+    merge sort the instances of the cells. The instances of each cell are
+    returned in (updated_at, id) order after a high-water mark, the
+    (updated_at, id) of the last instance returned from the cell, which the
+    cell database seeks on the index of these columns. The cursor holds the
+    high-water mark of every cell, so that polling the feed with it only
+    reads the instances changed since the previous poll.
+
+    An instance updated several times between two polls is returned once,
+    with its current values, and deleted instances are returned too.
+    """
+
+    # The sort keys of the instances of each cell, whose values are the
+    # high-water mark of the cell.
+    MARK_KEYS = ['updated_at', 'id']
+
+    def __init__(self, changes_since, marks=None, cells=None):
+        """Creates a feed of the instances updated at or after
+        changes_since.
+
+        :param changes_since: The datetime to start the feed from, in every
+                              cell without a high-water mark
+        :param marks: A dict, keyed by cell uuid, of the high-water marks
+        :param cells: The CellMappings to poll, all of them if None
+        """
+        self.changes_since = timeutils.normalize_time(changes_since)
+        self.marks = marks or {}
+        self.cells = cells
+
+    @classmethod
+    def from_cursor(cls, cursor, cells=None):
+        """Returns the feed continuing after the instances already returned
+        when the supplied cursor was made.
+
+        :raises: MarkerNotFound if the cursor is invalid
+        """
+        def decode_time(value):
+            return datetime.datetime.strptime(value, _CURSOR_TIME_FORMAT)
+
+        try:
+            data = jsonutils.loads(base64.urlsafe_b64decode(cursor.encode()))
+            changes_since = decode_time(data['since'])
+            marks = {}
+            for cell_uuid, mark in data['marks'].items():
+                updated_at, inst_id = mark
+                marks[cell_uuid] = [decode_time(updated_at), int(inst_id)]
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise exception.MarkerNotFound(marker=cursor)
+        return cls(changes_since, marks=marks, cells=cells)
+
+    @property
+    def cursor(self):
+        """A cursor holding the high-water marks of the instances returned so
+        far, to be passed to from_cursor() to continue the feed.
+        """
+        def encode_time(value):
+            return timeutils.normalize_time(value).strftime(
+                _CURSOR_TIME_FORMAT)
+
+        data = {'since': encode_time(self.changes_since),
+                'marks': {cell_uuid: [encode_time(updated_at), inst_id]
+                          for cell_uuid, (updated_at, inst_id)
+                          in self.marks.items()}}
+        return base64.urlsafe_b64encode(
+            jsonutils.dump_as_bytes(data)).decode()
+
+    def _cells_by_mark(self):
+        """Returns the cells to poll, the ones whose changes were returned up
+        to the oldest time first, so that a busy cell does not starve the
+        others when a limit is given.
+        """
+        if self.cells:
+            cells = self.cells
+        else:
+            context.load_cells()
+            cells = context.CELLS
+
+        def mark_time(cell):
+            mark = self.marks.get(cell.uuid)
+            return mark[0] if mark else self.changes_since
+        return sorted(cells, key=mark_time)
+
+    def get_changes(self, ctx, limit=None, batch_size=1000, settle_time=5,
+                    columns_to_join=None, columns=None):
+        """Generates the instances changed after the high-water marks, cell
+        by cell, advancing the high-water mark of a cell as its instances
+        are generated.
+
+        The instances are read from each cell database by batches of
+        batch_size. A cell whose database cannot be read is skipped and keeps
+        its high-water mark.
+
+        :param ctx: A RequestContext
+        :param limit: The maximum number of instances to generate, or None
+        :param batch_size: The maximum number of instances read at once from
+                           a cell database
+        :param settle_time: The number of seconds since their last update
+                            after which the instances are returned
+        :param columns_to_join: As for instance_get_all_by_filters_sort()
+        :param columns: The columns of the instances to load, all of them if
+                        None
+        """
+        if columns is not None:
+            columns = set(columns) | set(self.MARK_KEYS)
+        # NOTE: An instance can be updated in the same second as the
+        # high-water mark of its cell, and its update committed after the
+        # instances following it, so the instances updated too recently to
+        # be settled are left to the next poll.
+        changes_before = timeutils.utcnow() - datetime.timedelta(
+            seconds=settle_time)
+        for cell in self._cells_by_mark():
+            while limit is None or limit > 0:
+                count = batch_size if limit is None else min(limit,
+                                                             batch_size)
+                try:
+                    with context.target_cell(ctx, cell) as cctx:
+                        batch = db.instance_get_changes(
+                            cctx, self.changes_since,
+                            changes_before=changes_before, limit=count,
+                            marker_values=self.marks.get(cell.uuid),
+                            columns_to_join=columns_to_join,
+                            columns=columns)
+                except Exception:
+                    LOG.exception('Error getting the changed instances of '
+                                  'cell %s, skipping it.', cell.uuid)
+                    break
+                for db_inst in batch:
+                    self.marks[cell.uuid] = [db_inst[key]
+                                             for key in self.MARK_KEYS]
+                    yield db_inst
+                if limit is not None:
+                    limit -= len(batch)
+                if len(batch) < count:
+                    break
+            if limit is not None and limit <= 0:
+                return
+
+    def get_instance_objects(self, ctx, limit=None, expected_attrs=None,
+                             columns=None):
+        """Same as get_changes(), but return an InstanceList.
+
+        If columns is given, only these columns of the instances are loaded,
+        see InstanceList.get_by_filters().
+        """
+        expected_attrs = expected_attrs or []
+        columns_to_join = instance_obj._expected_cols(expected_attrs)
+        columns = instance_obj._projected_cols(columns)
+        instance_generator = self.get_changes(
+            ctx, limit=limit, columns_to_join=columns_to_join,
+            columns=columns)
+        if 'fault' in expected_attrs:
+            # We join fault above, so we need to make sure we don't ask
+            # make_instance_list to do it again for us
+            expected_attrs = copy.copy(expected_attrs)
+            expected_attrs.remove('fault')
+        return instance_obj._make_instance_list(ctx, objects.InstanceList(),
+                                                instance_generator,
+                                                expected_attrs,
+                                                columns=columns)
+
+
 # NOTE(danms): These methods are here for legacy glue reasons. We should not
 # replicate these for every data type we implement.
 def get_instances_sorted(ctx, filters, limit, marker, columns_to_join,
-                         sort_keys, sort_dirs, cell_mappings=None):
+                         sort_keys, sort_dirs, cell_mappings=None,
+                         columns=None):
     return InstanceLister(sort_keys, sort_dirs,
                           cells=cell_mappings).get_records_sorted(
-        ctx, filters, limit, marker, columns_to_join=columns_to_join)
+        ctx, filters, limit, marker, columns_to_join=columns_to_join,
+        columns=columns)
 
 
 def get_instance_objects_sorted(ctx, filters, limit, marker, expected_attrs,
-                                sort_keys, sort_dirs):
-    """Same as above, but return an InstanceList."""
+                                sort_keys, sort_dirs, columns=None):
+    """Same as above, but return an InstanceList.
+
+    If columns is given, only these columns of the instances are loaded, see
+    InstanceList.get_by_filters().
+    """
     query_cell_subset = CONF.api.instance_list_per_project_cells
     # NOTE(danms): Replicated in part from instance_get_all_by_sort_filters(),
     # where if we're not admin we're restricted to our context's project
@@ -111,10 +288,12 @@ def get_instance_objects_sorted(ctx, filters, limit, marker, expected_attrs,
         # so don't limit the list to a subset.
         cell_mappings = None
     columns_to_join = instance_obj._expected_cols(expected_attrs)
+    columns = instance_obj._projected_cols(columns)
     instance_generator = get_instances_sorted(ctx, filters, limit, marker,
                                               columns_to_join, sort_keys,
                                               sort_dirs,
-                                              cell_mappings=cell_mappings)
+                                              cell_mappings=cell_mappings,
+                                              columns=columns)
 
     if 'fault' in expected_attrs:
         # We join fault above, so we need to make sure we don't ask
@@ -123,4 +302,4 @@ def get_instance_objects_sorted(ctx, filters, limit, marker, expected_attrs,
         expected_attrs.remove('fault')
     return instance_obj._make_instance_list(ctx, objects.InstanceList(),
                                             instance_generator,
-                                            expected_attrs)
+                                            expected_attrs, columns=columns)
@@ -105,6 +105,12 @@ CONF = nova.conf.CONF
 
 LOG = logging.getLogger(__name__)
 
+# The stages of the build pipeline of an instance, named after the instance
+# action events recording their timing.
+BUILD_STAGE_NETWORK = 'allocate_network'
+BUILD_STAGE_BLOCK_DEVICE = 'prep_block_device'
+BUILD_STAGE_IMAGE = 'prefetch_image'
+
 get_notifier = functools.partial(rpc.get_notifier, service='compute')
 wrap_exception = functools.partial(exception_wrapper.wrap_exception,
                                    get_notifier=get_notifier,
@@ -248,6 +254,45 @@ def delete_image_on_error(function):
     return decorated_function
 
 
+# The power states reported by the hypervisor which
+# ComputeManager._sync_instance_power_state accepts for each vm_state, when
+# they match the power state in the database.  None means any power state.
+_POWER_STATES_IN_SYNC = {
+    vm_states.ACTIVE: (power_state.RUNNING,),
+    vm_states.STOPPED: (power_state.NOSTATE,
+                        power_state.SHUTDOWN,
+                        power_state.CRASHED),
+    vm_states.PAUSED: (power_state.PAUSED,),
+    vm_states.SOFT_DELETED: (power_state.NOSTATE,
+                             power_state.SHUTDOWN),
+    vm_states.DELETED: (power_state.NOSTATE,
+                        power_state.SHUTDOWN),
+    vm_states.BUILDING: None,
+    vm_states.RESCUED: None,
+    vm_states.RESIZED: None,
+    vm_states.SUSPENDED: None,
+    vm_states.ERROR: None,
+}
+
+
+def _is_power_state_in_sync(instance, vm_power_state):
+    """Returns whether syncing the power state of the instance would neither
+    change it in the database nor act on the instance.
+
+    :param instance: The Instance object, as in the database.
+    :param vm_power_state: The power state of the instance reported by the
+                           virt driver, or None if it didn't report any.
+    """
+    if vm_power_state is None or instance.task_state is not None:
+        return False
+    if vm_power_state != instance.power_state:
+        return False
+    if instance.vm_state not in _POWER_STATES_IN_SYNC:
+        return False
+    expected = _POWER_STATES_IN_SYNC[instance.vm_state]
+    return expected is None or vm_power_state in expected
+
+
 # TODO(danms): Remove me after Icehouse
 # TODO(alaski): Actually remove this after Newton, assuming a major RPC bump
 # NOTE(mikal): if the method being decorated has more than one decorator, then
@@ -524,6 +569,20 @@ class ComputeManager(manager.Manager):
                 CONF.max_concurrent_builds)
         else:
             self._build_semaphore = compute_utils.UnlimitedSemaphore()
+        # The stages of the build pipeline of an instance, which run
+        # concurrently, each with its own limit of concurrent runs.
+        self._build_stage_semaphores = {}
+        for stage, limit in (
+                (BUILD_STAGE_NETWORK, CONF.max_concurrent_network_allocations),
+                (BUILD_STAGE_BLOCK_DEVICE,
+                 CONF.max_concurrent_block_device_preparations),
+                (BUILD_STAGE_IMAGE, CONF.max_concurrent_image_prefetches)):
+            if limit != 0:
+                self._build_stage_semaphores[stage] = (
+                    eventlet.semaphore.Semaphore(limit))
+            else:
+                self._build_stage_semaphores[stage] = (
+                    compute_utils.UnlimitedSemaphore())
         if max(CONF.max_concurrent_live_migrations, 0) != 0:
             self._live_migration_executor = futures.ThreadPoolExecutor(
                 max_workers=CONF.max_concurrent_live_migrations)
@@ -1242,9 +1301,9 @@ class ComputeManager(manager.Manager):
             evacuated_instances = self._destroy_evacuated_instances(context)
 
             # Initialise instances on the host that are not evacuating
-            for instance in instances:
-                if instance.uuid not in evacuated_instances:
-                    self._init_instance(context, instance)
+            self._init_instances(
+                context, [instance for instance in instances
+                          if instance.uuid not in evacuated_instances])
 
             # NOTE(gibi): collect all the instance uuids that is in some way
             # was already handled above. Either by init_instance or by
@@ -1273,6 +1332,59 @@ class ComputeManager(manager.Manager):
                 # _sync_scheduler_instance_info periodic task will.
                 self._update_scheduler_instance_info(context, instances)
 
+    @staticmethod
+    def _init_instance_in_order(instance):
+        """Returns True if initializing the instance completes its deletion
+        or rolls back its migration, which change the resources used on the
+        host, so that it is initialized in order with the other such
+        instances.
+        """
+        return (instance.vm_state == vm_states.DELETED or
+                instance.task_state in (task_states.DELETING,
+                                        task_states.RESIZE_MIGRATING))
+
+    def _init_instances(self, context, instances):
+        """Initializes the instances, init_instance_pool_size at a time, and
+        returns once all of them are initialized.
+
+        The instances for which _init_instance_in_order is True are
+        initialized one after the other in a single greenthread, while the
+        other instances are initialized concurrently.
+        """
+        semaphore = eventlet.semaphore.Semaphore(CONF.init_instance_pool_size)
+
+        def _init(instance):
+            with semaphore:
+                instance_start = time.time()
+                self._init_instance(context, instance)
+                LOG.debug('Initialized the instance in %.3f seconds',
+                          time.time() - instance_start, instance=instance)
+
+        def _init_in_order(ordered_instances):
+            for instance in ordered_instances:
+                _init(instance)
+
+        start = time.time()
+        ordered_instances = [instance for instance in instances
+                             if self._init_instance_in_order(instance)]
+        threads = [utils.spawn(_init_in_order, ordered_instances)]
+        threads.extend(utils.spawn(_init, instance) for instance in instances
+                       if not self._init_instance_in_order(instance))
+        # Wait for all the instances before re-raising the first error, so
+        # that none is left initializing behind the back of the service.
+        error = None
+        for thread in threads:
+            try:
+                thread.wait()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            six.reraise(*error)
+        if instances:
+            LOG.info('Initialized %(count)d instances in %(time).3f seconds',
+                     {'count': len(instances), 'time': time.time() - start})
+
     def _error_out_instances_whose_build_was_interrupted(
             self, context, already_handled_instances):
         """If there are instances in BUILDING state that are not
@@ -1578,8 +1690,11 @@ class ComputeManager(manager.Manager):
         filters = {'vm_state': vm_states.BUILDING,
                    'host': self.host}
 
+        # NOTE: Only the creation time is needed to find the instances which
+        # timed out, anything else is lazy-loaded when putting them in ERROR.
         building_insts = objects.InstanceList.get_by_filters(context,
-                           filters, expected_attrs=[], use_slave=True)
+                           filters, expected_attrs=[], use_slave=True,
+                           columns=['created_at'])
 
         for instance in building_insts:
             if timeutils.is_older_than(instance.created_at, timeout):
@@ -1683,9 +1798,60 @@ class ComputeManager(manager.Manager):
 
         is_vpn = False
         return network_model.NetworkInfoAsyncWrapper(
-                self._allocate_network_async, context, instance,
+                self._allocate_network_stage, context, instance,
                 requested_networks, macs, security_groups, is_vpn)
 
+    def _allocate_network_stage(self, context, instance, requested_networks,
+                                macs, security_groups, is_vpn):
+        """Runs the network allocation stage of the build of an instance."""
+        with self._build_stage(context, instance, BUILD_STAGE_NETWORK):
+            return self._allocate_network_async(
+                context, instance, requested_networks, macs, security_groups,
+                is_vpn)
+
+    @contextlib.contextmanager
+    def _build_stage(self, context, instance, stage):
+        """Runs a stage of the build pipeline of an instance.
+
+        The number of concurrent runs of the stage is limited by its
+        semaphore, and the time taken by the stage is recorded as the
+        compute_<stage> event of the instance action.
+        """
+        with self._build_stage_semaphores[stage]:
+            with compute_utils.EventReporter(
+                    context, 'compute_%s' % stage, self.host, instance.uuid):
+                yield
+
+    def _prefetch_image(self, context, instance, image_meta):
+        """Runs the image prefetch stage of the build of an instance.
+
+        The image is downloaded by the virt driver while the network and
+        block devices of the instance are prepared. Any failure is only
+        logged, as the driver fetches the image again in spawn.
+        """
+        try:
+            with self._build_stage(context, instance, BUILD_STAGE_IMAGE):
+                self.driver.prefetch_image(context, instance, image_meta)
+        except Exception:
+            LOG.warning('Failed to prefetch image %s, it will be fetched '
+                        'when spawning the instance.', image_meta.id,
+                        instance=instance, exc_info=True)
+
+    def _start_image_prefetch(self, context, instance, image_meta,
+                              block_device_mapping):
+        """Starts prefetching the image of an image-backed instance.
+
+        Returns the green thread prefetching the image, or None if the
+        instance is volume-backed.
+        """
+        if not image_meta.obj_attr_is_set('id'):
+            return
+        if compute_utils.is_volume_backed_instance(context, instance,
+                                                   block_device_mapping):
+            return
+        return utils.spawn(self._prefetch_image, context, instance,
+                           image_meta)
+
     def _default_root_device_name(self, instance, image_meta, root_bdm):
         try:
             return self.driver.default_root_device_name(instance,
@@ -2388,32 +2554,15 @@ class ComputeManager(manager.Manager):
                 self.host, phase=fields.NotificationPhase.END,
                 bdms=block_device_mapping)
 
-    @contextlib.contextmanager
-    def _build_resources(self, context, instance, requested_networks,
-                         security_groups, image_meta, block_device_mapping):
-        resources = {}
-        network_info = None
-        try:
-            LOG.debug('Start building networks asynchronously for instance.',
-                      instance=instance)
-            network_info = self._build_networks_for_instance(context, instance,
-                    requested_networks, security_groups)
-            resources['network_info'] = network_info
-        except (exception.InstanceNotFound,
-                exception.UnexpectedDeletingTaskStateError):
-            raise
-        except exception.UnexpectedTaskStateError as e:
-            raise exception.BuildAbortException(instance_uuid=instance.uuid,
-                    reason=e.format_message())
-        except Exception:
-            # Because this allocation is async any failures are likely to occur
-            # when the driver accesses network_info during spawn().
-            LOG.exception('Failed to allocate network(s)',
-                          instance=instance)
-            msg = _('Failed to allocate the network(s), not rescheduling.')
-            raise exception.BuildAbortException(instance_uuid=instance.uuid,
-                    reason=msg)
+    def _prep_build_resources(self, context, instance, network_info,
+                              image_meta, block_device_mapping, resources):
+        """Prepares the block devices of the instance and gets its placement
+        allocations, adding them to the resources of _build_resources().
 
+        :raises: BuildAbortException, InstanceNotFound or
+                 UnexpectedDeletingTaskStateError once the networks are
+                 cleaned up if the preparation failed
+        """
         try:
             # Perform any driver preparation work for the driver.
             self.driver.prepare_for_spawn(instance)
@@ -2434,8 +2583,10 @@ class ComputeManager(manager.Manager):
             instance.task_state = task_states.BLOCK_DEVICE_MAPPING
             instance.save()
 
-            block_device_info = self._prep_block_device(context, instance,
-                    block_device_mapping)
+            with self._build_stage(context, instance,
+                                   BUILD_STAGE_BLOCK_DEVICE):
+                block_device_info = self._prep_block_device(context, instance,
+                        block_device_mapping)
             resources['block_device_info'] = block_device_info
         except (exception.InstanceNotFound,
                 exception.UnexpectedDeletingTaskStateError):
@@ -2482,6 +2633,52 @@ class ComputeManager(manager.Manager):
             raise exception.BuildAbortException(instance_uuid=instance.uuid,
                                                 reason=msg)
 
+    @contextlib.contextmanager
+    def _build_resources(self, context, instance, requested_networks,
+                         security_groups, image_meta, block_device_mapping):
+        resources = {}
+        network_info = None
+        try:
+            LOG.debug('Start building networks asynchronously for instance.',
+                      instance=instance)
+            network_info = self._build_networks_for_instance(context, instance,
+                    requested_networks, security_groups)
+            resources['network_info'] = network_info
+        except (exception.InstanceNotFound,
+                exception.UnexpectedDeletingTaskStateError):
+            raise
+        except exception.UnexpectedTaskStateError as e:
+            raise exception.BuildAbortException(instance_uuid=instance.uuid,
+                    reason=e.format_message())
+        except Exception:
+            # Because this allocation is async any failures are likely to occur
+            # when the driver accesses network_info during spawn().
+            LOG.exception('Failed to allocate network(s)',
+                          instance=instance)
+            msg = _('Failed to allocate the network(s), not rescheduling.')
+            raise exception.BuildAbortException(instance_uuid=instance.uuid,
+                    reason=msg)
+
+        # The image is prefetched while the block devices are prepared, and
+        # both run while the networks are allocated.
+        image_prefetch = self._start_image_prefetch(
+            context, instance, image_meta, block_device_mapping)
+
+        try:
+            self._prep_build_resources(context, instance, network_info,
+                                       image_meta, block_device_mapping,
+                                       resources)
+            # Make sure the image is in the cache of the driver before
+            # spawning, so that spawn does not fetch it a second time.
+            if image_prefetch is not None:
+                image_prefetch.wait()
+        finally:
+            # If the build failed before spawning, stop downloading the image
+            # rather than letting it run outside of the build semaphores.
+            # This does nothing if the prefetch completed.
+            if image_prefetch is not None:
+                image_prefetch.kill()
+
         try:
             yield resources
         except Exception as exc:
@@ -7461,11 +7658,20 @@ class ComputeManager(manager.Manager):
         list, pull the DB record, and try the call to the network API.
         If anything errors don't fail, as it's possible the instance
         has been deleted, etc.
+
+        If heal_instance_info_cache_batch_size is greater than 1, a batch of
+        instances is healed on each call instead, see
+        _heal_instance_info_cache_batch.
         """
         heal_interval = CONF.heal_instance_info_cache_interval
         if not heal_interval:
             return
 
+        batch_size = CONF.heal_instance_info_cache_batch_size
+        if batch_size > 1:
+            self._heal_instance_info_cache_batch(context, batch_size)
+            return
+
         instance_uuids = getattr(self, '_instance_uuids_to_heal', [])
         instance = None
 
@@ -7526,28 +7732,91 @@ class ComputeManager(manager.Manager):
 
         if instance:
             # We have an instance now to refresh
-            try:
-                # Call to network API to get instance info.. this will
-                # force an update to the instance's info_cache
-                self.network_api.get_instance_nw_info(context, instance)
-                LOG.debug('Updated the network info_cache for instance',
-                          instance=instance)
-            except exception.InstanceNotFound:
-                # Instance is gone.
-                LOG.debug('Instance no longer exists. Unable to refresh',
-                          instance=instance)
-                return
-            except exception.InstanceInfoCacheNotFound:
-                # InstanceInfoCache is gone.
-                LOG.debug('InstanceInfoCache no longer exists. '
-                          'Unable to refresh', instance=instance)
-            except Exception:
-                LOG.error('An error occurred while refreshing the network '
-                          'cache.', instance=instance, exc_info=True)
+            self._heal_instance_nw_info(context, instance)
         else:
             LOG.debug("Didn't find any instances for network info cache "
                       "update.")
 
+    def _heal_instance_nw_info(self, context, instance):
+        try:
+            # Call to network API to get instance info.. this will
+            # force an update to the instance's info_cache
+            self.network_api.get_instance_nw_info(context, instance)
+            LOG.debug('Updated the network info_cache for instance',
+                      instance=instance)
+        except exception.InstanceNotFound:
+            # Instance is gone.
+            LOG.debug('Instance no longer exists. Unable to refresh',
+                      instance=instance)
+        except exception.InstanceInfoCacheNotFound:
+            # InstanceInfoCache is gone.
+            LOG.debug('InstanceInfoCache no longer exists. '
+                      'Unable to refresh', instance=instance)
+        except Exception:
+            LOG.error('An error occurred while refreshing the network '
+                      'cache.', instance=instance, exc_info=True)
+
+    def _heal_instance_info_cache_batch(self, context, batch_size):
+        """Heals the network info cache of the next batch_size instances of
+        the list of instances to heal, with a single call to the network API
+        retrieving their network info in bulk and only writing the caches
+        which changed.
+        """
+        instance_uuids = getattr(self, '_instance_uuids_to_heal', [])
+
+        LOG.debug('Starting heal instance info cache')
+
+        if not instance_uuids:
+            # The list of instances to heal is empty so rebuild it
+            LOG.debug('Rebuilding the list of instances to heal')
+            db_instances = objects.InstanceList.get_by_host(
+                context, self.host, expected_attrs=[], use_slave=True)
+            # We don't want to refresh the cache for instances which are
+            # building or deleting so don't put them in the list. If they
+            # are building they will get added to the list next time we
+            # build it.
+            instance_uuids = [
+                inst.uuid for inst in db_instances
+                if (inst.vm_state != vm_states.BUILDING and
+                    inst.task_state != task_states.DELETING)]
+            self._instance_uuids_to_heal = instance_uuids
+
+        instances = []
+        while instance_uuids and not instances:
+            batch = instance_uuids[:batch_size]
+            del instance_uuids[:batch_size]
+            # Instances which are gone, have been migrated to another host or
+            # are being deleted are skipped.
+            filters = {'uuid': batch, 'host': self.host, 'deleted': False}
+            db_instances = objects.InstanceList.get_by_filters(
+                context, filters,
+                expected_attrs=['system_metadata', 'info_cache', 'flavor'],
+                use_slave=True)
+            instances = [inst for inst in db_instances
+                         if inst.task_state != task_states.DELETING]
+
+        if not instances:
+            LOG.debug("Didn't find any instances for network info cache "
+                      "update.")
+            return
+
+        try:
+            healed = self.network_api.heal_instances_nw_info_cache(
+                context, instances)
+        except NotImplementedError:
+            for instance in instances:
+                self._heal_instance_nw_info(context, instance)
+            return
+        except Exception:
+            LOG.error('An error occurred while refreshing the network cache '
+                      'of instances %s.',
+                      ', '.join(inst.uuid for inst in instances),
+                      exc_info=True)
+            return
+        LOG.debug('Updated the network info_cache of %(healed)d out of '
+                  '%(count)d instances.',
+                  {'healed': len(healed), 'count': len(instances)})
+
     @periodic_task.periodic_task
     def _poll_rebooting_instances(self, context):
         if CONF.reboot_timeout > 0:
@@ -7926,6 +8195,11 @@ class ComputeManager(manager.Manager):
                         {'num_db_instances': num_db_instances,
                          'num_vm_instances': num_vm_instances})
 
+        try:
+            vm_power_states = self.driver.get_power_states()
+        except NotImplementedError:
+            vm_power_states = None
+
         def _sync(db_instance):
             # NOTE(melwitt): This must be synchronized as we query state from
             #                two separate sources, the driver and the database.
@@ -7947,6 +8221,11 @@ class ComputeManager(manager.Manager):
             # process syncs asynchronously - don't want instance locking to
             # block entire periodic task thread
             uuid = db_instance.uuid
+            if vm_power_states is not None and _is_power_state_in_sync(
+                    db_instance, vm_power_states.get(uuid)):
+                # Nothing to sync, so no need to query the driver and the
+                # database again under the instance lock.
+                continue
             if uuid in self._syncs_in_progress:
                 LOG.debug('Sync already in progress for %s', uuid)
             else:
@@ -8173,9 +8452,12 @@ class ComputeManager(manager.Manager):
         filters = {'vm_state': vm_states.SOFT_DELETED,
                    'task_state': None,
                    'host': self.host}
+        # The deletion notifications need the flavor of the instances, load
+        # it with them rather than lazy-loading it for each instance.
         instances = objects.InstanceList.get_by_filters(
             context, filters,
-            expected_attrs=objects.instance.INSTANCE_DEFAULT_FIELDS,
+            expected_attrs=(objects.instance.INSTANCE_DEFAULT_FIELDS +
+                            ['flavor']),
             use_slave=True)
         for instance in instances:
             if self._deleted_old_enough(instance, interval):
@@ -8262,8 +8544,25 @@ class ComputeManager(manager.Manager):
                 self.scheduler_client.reportclient.delete_resource_provider(
                     context, cn, cascade=True)
 
-        for nodename in nodenames:
-            self._update_available_resource_for_node(context, nodename)
+        # The resource tracker locks each node separately, so the nodes can be
+        # updated concurrently.
+        semaphore = eventlet.semaphore.Semaphore(
+            CONF.update_resources_pool_size)
+
+        def _update_node(nodename):
+            with semaphore:
+                node_start = time.time()
+                self._update_available_resource_for_node(context, nodename)
+                LOG.debug('Updated the resources of node %(node)s in '
+                          '%(time).3f seconds',
+                          {'node': nodename, 'time': time.time() - node_start})
+
+        # NOTE: The periodic task wrapper of the manager warns when the
+        # whole task takes longer than its interval.
+        threads = [utils.spawn(_update_node, nodename)
+                   for nodename in nodenames]
+        for thread in threads:
+            thread.wait()
 
     def _get_compute_nodes_in_db(self, context, use_slave=False,
                                  startup=False):
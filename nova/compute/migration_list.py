@@ -65,15 +65,9 @@ class MigrationLister(multi_cell_list.CrossCellLister):
             raise exception.MarkerNotFound(marker=marker)
         return db_migration
 
-    def get_marker_by_values(self, ctx, values):
-        return db.migration_get_by_sort_filters(ctx,
-                                                self.sort_ctx.sort_keys,
-                                                self.sort_ctx.sort_dirs,
-                                                values)
-
-    def get_by_filters(self, ctx, filters, limit, marker, **kwargs):
+    def get_by_filters(self, ctx, filters, limit, marker_values, **kwargs):
         return db.migration_get_all_by_filters(
-            ctx, filters, limit=limit, marker=marker,
+            ctx, filters, limit=limit, marker_values=marker_values,
             sort_keys=self.sort_ctx.sort_keys,
             sort_dirs=self.sort_ctx.sort_dirs)
 
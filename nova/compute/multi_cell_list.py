@@ -11,13 +11,10 @@
 #    under the License.
 
 import abc
-import copy
 import heapq
-import itertools
-
-import six
 
 from oslo_log import log as logging
+import six
 
 from nova import context
 
@@ -108,26 +105,7 @@ class CrossCellLister(object):
         pass
 
     @abc.abstractmethod
-    def get_marker_by_values(self, ctx, values):
-        """Get the identifier of the marker record by value.
-
-        When we need to paginate across cells, the marker record exists
-        in only one of those cells. The rest of the cells must decide on
-        a record to be their equivalent marker with which to return the
-        next page of results. This must be done by value, based on the
-        values of the sort_keys properties on the actual marker, as if
-        the results were sorted appropriately and the actual marker existed
-        in each cell.
-
-        :param ctx: A RequestContext
-        :param values: The values of the sort_keys properties of fhe actual
-                       marker instance
-        :returns: The identifier of the equivalent marker in the local database
-        """
-        pass
-
-    @abc.abstractmethod
-    def get_by_filters(self, ctx, filters, limit, marker, **kwargs):
+    def get_by_filters(self, ctx, filters, limit, marker_values, **kwargs):
         """List records by filters, sorted and paginated.
 
         This is the standard filtered/sorted list method for the data type
@@ -137,7 +115,9 @@ class CrossCellLister(object):
         :param ctx: A RequestContext
         :param filters: A dict of column=filter items
         :param limit: A numeric limit on the number of results, or None
-        :param marker: The marker identifier, or None
+        :param marker_values: The values of the sort_keys properties of the
+                              marker record, after which the records are
+                              returned, or None
         :returns: A list of records
         """
         pass
@@ -164,16 +144,14 @@ class CrossCellLister(object):
 
         """
 
+        marker_values = None
         if marker:
-            # A marker identifier was provided from the API. Call this
-            # the 'global' marker as it determines where we start the
-            # process across all cells. Look up the record in
-            # whatever cell it is in and record the values for the
-            # sort keys so we can find the marker instance in each
-            # cell (called the 'local' marker).
-            global_marker_record = self.get_marker_record(ctx, marker)
-            global_marker_values = [global_marker_record[key]
-                                    for key in self.sort_ctx.sort_keys]
+            # Every cell returns its records sorted after the values of the
+            # sort keys of the marker, as if the marker was in the cell, so
+            # we only look up the marker record in whatever cell it is in.
+            marker_record = self.get_marker_record(ctx, marker)
+            marker_values = [marker_record[key]
+                             for key in self.sort_ctx.sort_keys]
 
         def do_query(ctx):
             """Generate RecordWrapper(record) objects from a cell.
@@ -185,67 +163,13 @@ class CrossCellLister(object):
             scatter_gather routine.
             """
 
-            # The local marker is an identifier of a record in a cell
-            # that is found by the special method
-            # get_marker_by_values(). It should be the next record
-            # in order according to the sort provided, but after the
-            # marker instance which may have been in another cell.
-            local_marker = None
-
-            # Since the regular DB query routines take a marker and assume that
-            # the marked record was the last entry of the previous page, we
-            # may need to prefix it to our result query if we're not the cell
-            # that had the actual marker record.
-            local_marker_prefix = []
-
-            marker_id = self.marker_identifier
-
-            if marker:
-                # FIXME(danms): If we knew which cell we were in here, we could
-                # avoid looking up the marker again. But, we don't currently.
-
-                local_marker = self.get_marker_by_values(ctx,
-                                                         global_marker_values)
-                if local_marker:
-                    if local_marker != marker:
-                        # We did find a marker in our cell, but it wasn't
-                        # the global marker. Thus, we will use it as our
-                        # marker in the main query below, but we also need
-                        # to prefix that result with this marker instance
-                        # since the result below will not return it and it
-                        # has not been returned to the user yet. Note that
-                        # we do _not_ prefix the marker instance if our
-                        # marker was the global one since that has already
-                        # been sent to the user.
-                        local_marker_filters = copy.copy(filters)
-                        if marker_id not in local_marker_filters:
-                            # If an $id filter was provided, it will
-                            # have included our marker already if this
-                            # instance is desired in the output
-                            # set. If it wasn't, we specifically query
-                            # for it. If the other filters would have
-                            # excluded it, then we'll get an empty set
-                            # here and not include it in the output as
-                            # expected.
-                            local_marker_filters[marker_id] = [local_marker]
-                        local_marker_prefix = self.get_by_filters(
-                            ctx, local_marker_filters, limit=1, marker=None,
-                            **kwargs)
-                else:
-                    # There was a global marker but everything in our
-                    # cell is _before_ that marker, so we return
-                    # nothing. If we didn't have this clause, we'd
-                    # pass marker=None to the query below and return a
-                    # full unpaginated set for our cell.
-                    return []
-
             main_query_result = self.get_by_filters(
                 ctx, filters,
-                limit=limit, marker=local_marker,
+                limit=limit, marker_values=marker_values,
                 **kwargs)
 
             return (RecordWrapper(self.sort_ctx, inst) for inst in
-                    itertools.chain(local_marker_prefix, main_query_result))
+                    main_query_result)
 
         # NOTE(tssurya): When the below routine provides sentinels to indicate
         # a timeout on a cell, we ignore that cell to avoid the crash when
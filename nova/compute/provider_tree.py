@@ -20,10 +20,12 @@ no remoteable methods nor is there any interaction with the nova.db modules.
 
 import collections
 import copy
+import hashlib
 
 import os_traits
 from oslo_concurrency import lockutils
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import uuidutils
 import six
 
@@ -119,6 +121,17 @@ class _Provider(object):
         if provider.uuid in self.children:
             del self.children[provider.uuid]
 
+    def digest(self):
+        """Returns a digest of the name, parent, inventory, traits and
+        aggregates of the provider, which is the same for two providers if and
+        only if none of these differ.
+        """
+        content = jsonutils.dumps(
+            [self.name, self.parent_uuid, self.inventory,
+             sorted(self.traits), sorted(self.aggregates)],
+            sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
     def has_inventory(self):
         """Returns whether the provider has any inventory records at all. """
         return self.inventory != {}
@@ -254,6 +267,33 @@ class ProviderTree(object):
                 ret.extend(root.get_provider_uuids())
         return ret
 
+    def get_digests(self, name_or_uuid=None):
+        """Return a dict, keyed by UUID, of the digests of the name, parent,
+        inventory, traits and aggregates of all providers (in a subtree).
+
+        Comparing the digests of two ProviderTrees is a cheap way to tell
+        whether their providers differ in any of these, without copying the
+        provider data.  The generations of the providers are not part of the
+        digests.
+
+        :param name_or_uuid: Provider name or UUID representing the root of a
+                             subtree for which to return digests.  If not
+                             specified, the method returns the digests of all
+                             providers in the ProviderTree.
+        """
+        with self.lock:
+            if name_or_uuid is not None:
+                roots = [self._find_with_lock(name_or_uuid)]
+            else:
+                roots = list(self.roots)
+            ret = {}
+            to_visit = roots
+            while to_visit:
+                provider = to_visit.pop()
+                ret[provider.uuid] = provider.digest()
+                to_visit.extend(provider.children.values())
+            return ret
+
     def populate_from_iterable(self, provider_dicts):
         """Populates this ProviderTree from an iterable of provider dicts.
 
@@ -20,10 +20,13 @@ model.
 """
 import collections
 import copy
+import functools
+import inspect
 import retrying
 
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import timeutils
 
 from nova.compute import claims
 from nova.compute import monitors
@@ -50,6 +53,10 @@ CONF = nova.conf.CONF
 
 LOG = logging.getLogger(__name__)
 COMPUTE_RESOURCE_SEMAPHORE = "compute_resources"
+# ComputeNode fields holding the usage tracked from instances, migrations and
+# orphans, rather than the resources reported by the virt driver
+_TRACKED_USAGE_FIELDS = ('vcpus_used', 'memory_mb_used', 'local_gb_used',
+                         'current_workload', 'running_vms', 'numa_topology')
 
 
 def _instance_in_resize_state(instance):
@@ -71,6 +78,48 @@ def _instance_in_resize_state(instance):
     return False
 
 
+def _synchronized(host_wide=False):
+    """Returns a decorator serializing the calls of the decorated
+    ResourceTracker method per compute node or, if host_wide, for the whole
+    host.
+
+    The node is given by the nodename argument of the method or, failing
+    that, by the hypervisor_hostname of its resources argument. The time spent
+    waiting for the lock is added up per node in
+    ResourceTracker.lock_wait_times.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            call_args = inspect.getcallargs(f, self, *args, **kwargs)
+            if 'nodename' in call_args:
+                nodename = call_args['nodename']
+            else:
+                nodename = call_args['resources']['hypervisor_hostname']
+            lock_name = COMPUTE_RESOURCE_SEMAPHORE
+            if not host_wide:
+                lock_name = '%s-%s' % (lock_name, nodename)
+            start = timeutils.now()
+
+            @utils.synchronized(lock_name)
+            def _locked():
+                self.lock_wait_times[nodename] += timeutils.now() - start
+                return f(self, *args, **kwargs)
+
+            return _locked()
+        return wrapper
+    return decorator
+
+
+# The claims and updates of the different nodes of a compute service, such as
+# an Ironic one, don't wait on each other: each node flushes its own provider
+# tree to placement. Only the state shared by the nodes, which is the PCI
+# device tracker, is changed under the host-wide lock, always taken after the
+# lock of the node.
+_synchronized_per_node = _synchronized()
+_synchronized_per_host = _synchronized(host_wide=True)
+
+
 def _is_trackable_migration(migration):
     # Only look at resize/migrate migration and evacuation records
     # NOTE(danms): RT should probably examine live migration
@@ -144,6 +193,22 @@ class ResourceTracker(object):
         monitor_handler = monitors.MonitorHandler(self)
         self.monitors = monitor_handler.monitors
         self.old_resources = collections.defaultdict(objects.ComputeNode)
+        # Dict, keyed by nodename, of the provider tree digests, from before
+        # and after the virt driver updated the tree, of the last successful
+        # flush to placement
+        self.provider_tree_digests = {}
+        # Counter, keyed by 'compute_node' and 'placement', of the writes
+        # skipped because nothing changed
+        self.skipped_writes = collections.Counter()
+        # Dict, keyed by nodename, of the monotonic time of the last audit of
+        # the usage of the node
+        self.usage_audit_times = {}
+        # Counter, keyed by nodename, of the audits which found that the
+        # tracked usage had drifted
+        self.usage_drifts = collections.Counter()
+        # Counter, keyed by nodename, of the total time in seconds spent
+        # waiting for the lock of the node
+        self.lock_wait_times = collections.Counter()
         self.scheduler_client = scheduler_client.SchedulerClient()
         self.reportclient = self.scheduler_client.reportclient
         self.ram_allocation_ratio = CONF.ram_allocation_ratio
@@ -156,7 +221,7 @@ class ResourceTracker(object):
         except KeyError:
             raise exception.ComputeHostNotFound(host=nodename)
 
-    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+    @_synchronized_per_node
     def instance_claim(self, context, instance, nodename, limits=None):
         """Indicate that some resources are needed for an upcoming compute
         instance build operation.
@@ -217,7 +282,7 @@ class ResourceTracker(object):
 
         # self._set_instance_host_and_node() will save instance to the DB
         # so set instance.numa_topology first.  We need to make sure
-        # that numa_topology is saved while under COMPUTE_RESOURCE_SEMAPHORE
+        # that numa_topology is saved while holding the lock of the node
         # so that the resource audit knows about any cpus we've pinned.
         instance_numa_topology = claim.claimed_numa_topology
         instance.numa_topology = instance_numa_topology
@@ -238,7 +303,7 @@ class ResourceTracker(object):
 
         return claim
 
-    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+    @_synchronized_per_node
     def rebuild_claim(self, context, instance, nodename, limits=None,
                       image_meta=None, migration=None):
         """Create a claim for a rebuild operation."""
@@ -247,7 +312,7 @@ class ResourceTracker(object):
                                 migration, move_type='evacuation',
                                 limits=limits, image_meta=image_meta)
 
-    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+    @_synchronized_per_node
     def resize_claim(self, context, instance, instance_type, nodename,
                      migration, image_meta=None, limits=None):
         """Create a claim for a resize or cold-migration move."""
@@ -416,7 +481,7 @@ class ResourceTracker(object):
         instance.node = None
         instance.save()
 
-    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+    @_synchronized_per_node
     def abort_instance_claim(self, context, instance, nodename):
         """Remove usage from the given instance."""
         self._update_usage_from_instance(context, instance, nodename,
@@ -439,7 +504,7 @@ class ResourceTracker(object):
                 dev_pools_obj = self.pci_tracker.stats.to_device_pools_obj()
                 self.compute_nodes[nodename].pci_device_pools = dev_pools_obj
 
-    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+    @_synchronized_per_node
     def drop_move_claim(self, context, instance, nodename,
                         instance_type=None, prefix='new_'):
         # Remove usage for an incoming/outgoing migration on the destination
@@ -474,7 +539,7 @@ class ResourceTracker(object):
             ctxt = context.elevated()
             self._update(ctxt, self.compute_nodes[nodename])
 
-    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
+    @_synchronized_per_node
     def update_usage(self, context, instance, nodename):
         """Update the resource usage and stats after a change in an
         instance
@@ -592,6 +657,7 @@ class ResourceTracker(object):
 
         self._setup_pci_tracker(context, cn, resources)
 
+    @_synchronized_per_host
     def _setup_pci_tracker(self, context, compute_node, resources):
         if not self.pci_tracker:
             n_id = compute_node.id
@@ -657,6 +723,8 @@ class ResourceTracker(object):
         self.stats.pop(nodename, None)
         self.compute_nodes.pop(nodename, None)
         self.old_resources.pop(nodename, None)
+        self.provider_tree_digests.pop(nodename, None)
+        self.usage_audit_times.pop(nodename, None)
 
     def _get_host_metrics(self, context, nodename):
         """Get the metrics from monitors and
@@ -739,20 +807,124 @@ class ResourceTracker(object):
                               'another host\'s instance!',
                           {'uuid': migration.instance_uuid})
 
-    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
-    def _update_available_resource(self, context, resources):
+    def _is_usage_audit_due(self, nodename):
+        """Returns whether the usage of the node needs to be rebuilt from the
+        instances and migrations in the database, rather than kept as
+        tracked.
+        """
+        last_audit = self.usage_audit_times.get(nodename)
+        if last_audit is None or nodename not in self.compute_nodes:
+            return True
+        interval = CONF.resource_usage_audit_interval
+        return interval <= 0 or timeutils.now() - last_audit >= interval
+
+    def _refresh_compute_node(self, context, resources):
+        """Copy the resources reported by the virt driver to the compute node,
+        keeping the usage tracked since the last audit.
+        """
+        nodename = resources['hypervisor_hostname']
+        cn = self.compute_nodes[nodename]
+        usage = {field: getattr(cn, field) for field in _TRACKED_USAGE_FIELDS
+                 if cn.obj_attr_is_set(field)}
+        old_stats = self.stats[nodename]
+        instance_stats = {key: value for key, value in old_stats.items()
+                          if key.startswith('num_') or key == 'io_workload'}
+        states = dict(old_stats.states)
 
-        # initialize the compute node object, creating it
-        # if it does not already exist.
         self._init_compute_node(context, resources)
 
+        stats = self.stats[nodename]
+        stats.update(instance_stats)
+        stats.states.update(states)
+        cn.stats = stats
+        for field, value in usage.items():
+            setattr(cn, field, value)
+        cn.free_ram_mb = cn.memory_mb - cn.memory_mb_used
+        cn.free_disk_gb = cn.local_gb - cn.local_gb_used
+
+    def _check_usage_drift(self, nodename, old_usage):
+        """Log a warning if the usage of the node rebuilt by an audit differs
+        from the usage tracked since the previous audit.
+        """
+        cn = self.compute_nodes[nodename]
+        drift = {}
+        for field, old_value in old_usage.items():
+            new_value = getattr(cn, field)
+            if new_value != old_value:
+                drift[field] = (old_value, new_value)
+        if drift:
+            self.usage_drifts[nodename] += 1
+            LOG.warning('The resource usage tracked for node %(node)s had '
+                        'drifted from the usage of its instances and '
+                        'migrations, correcting: %(drift)s',
+                        {'node': nodename,
+                         'drift': ', '.join(
+                             '%s %s -> %s' % (field, old, new)
+                             for field, (old, new) in sorted(drift.items()))})
+
+    @_synchronized_per_node
+    def _update_available_resource(self, context, resources):
         nodename = resources['hypervisor_hostname']
+        audit = self._is_usage_audit_due(nodename)
+
+        if audit:
+            # Keep the usage tracked since the previous audit, if any, to
+            # report any drift. The NUMA topology is left out, its usage only
+            # derives from the instances and migrations.
+            old_usage = None
+            if nodename in self.usage_audit_times:
+                cn = self.compute_nodes[nodename]
+                old_usage = {field: getattr(cn, field)
+                             for field in _TRACKED_USAGE_FIELDS
+                             if field != 'numa_topology' and
+                             cn.obj_attr_is_set(field)}
+
+            # initialize the compute node object, creating it
+            # if it does not already exist.
+            self._init_compute_node(context, resources)
+        else:
+            # The usage of the node is kept up to date as instances are
+            # claimed, moved and removed, so it only needs rebuilding on the
+            # next audit.
+            self._refresh_compute_node(context, resources)
 
         # if we could not init the compute node the tracker will be
         # disabled and we should quit now
         if self.disabled(nodename):
             return
 
+        if audit:
+            self._audit_usage(context, nodename, old_usage)
+
+        cn = self.compute_nodes[nodename]
+        dev_pools_obj = self.pci_tracker.stats.to_device_pools_obj()
+        cn.pci_device_pools = dev_pools_obj
+
+        self._report_final_resource_view(nodename)
+
+        metrics = self._get_host_metrics(context, nodename)
+        # TODO(pmurray): metrics should not be a json string in ComputeNode,
+        # but it is. This should be changed in ComputeNode
+        cn.metrics = jsonutils.dumps(metrics)
+
+        # update the compute_node
+        self._update(context, cn)
+        LOG.debug('Compute_service record updated for %(host)s:%(node)s, '
+                  'writes skipped since startup because nothing changed: '
+                  '%(compute_node)d to the compute nodes and %(placement)d '
+                  'to placement',
+                  {'host': self.host, 'node': nodename,
+                   'compute_node': self.skipped_writes['compute_node'],
+                   'placement': self.skipped_writes['placement']})
+
+    def _audit_usage(self, context, nodename, old_usage):
+        """Rebuild the usage of the node from its instances and in-progress
+        migrations in the database and the orphans found by the virt driver.
+
+        :param old_usage: The usage tracked since the previous audit, keyed by
+                          ComputeNode field, or None if this is the first
+                          audit of the node.
+        """
         # Grab all instances assigned to this node:
         instances = objects.InstanceList.get_by_host_and_node(
             context, self.host, nodename,
@@ -780,27 +952,15 @@ class ResourceTracker(object):
         orphans = self._find_orphaned_instances()
         self._update_usage_from_orphans(orphans, nodename)
 
-        cn = self.compute_nodes[nodename]
-
         # NOTE(yjiang5): Because pci device tracker status is not cleared in
         # this periodic task, and also because the resource tracker is not
         # notified when instances are deleted, we need remove all usages
         # from deleted instances.
         self.pci_tracker.clean_usage(instances, migrations, orphans)
-        dev_pools_obj = self.pci_tracker.stats.to_device_pools_obj()
-        cn.pci_device_pools = dev_pools_obj
 
-        self._report_final_resource_view(nodename)
-
-        metrics = self._get_host_metrics(context, nodename)
-        # TODO(pmurray): metrics should not be a json string in ComputeNode,
-        # but it is. This should be changed in ComputeNode
-        cn.metrics = jsonutils.dumps(metrics)
-
-        # update the compute_node
-        self._update(context, cn)
-        LOG.debug('Compute_service record updated for %(host)s:%(node)s',
-                  {'host': self.host, 'node': nodename})
+        if old_usage is not None:
+            self._check_usage_drift(nodename, old_usage)
+        self.usage_audit_times[nodename] = timeutils.now()
 
     def _get_compute_node(self, context, nodename):
         """Returns compute node for the host and nodename."""
@@ -892,6 +1052,7 @@ class ResourceTracker(object):
                 compute_node, old_compute, ['updated_at']):
             self.old_resources[nodename] = copy.deepcopy(compute_node)
             return True
+        self.skipped_writes['compute_node'] += 1
         return False
 
     def _update_to_placement(self, context, compute_node):
@@ -912,7 +1073,13 @@ class ResourceTracker(object):
         # provider corresponding to the compute node.
         reportclient = self.scheduler_client.reportclient
         prov_tree = reportclient.get_provider_tree_and_ensure_root(
-            context, compute_node.uuid, name=compute_node.hypervisor_hostname)
+            context, compute_node.uuid, name=compute_node.hypervisor_hostname,
+            scoped=True)
+        # The provider tree is a copy of the report client's cache of the tree
+        # of the node and of its sharing providers, so this is what placement
+        # has as far as we know. Only the tree of the node is flushed: the
+        # other nodes of the host flush theirs concurrently.
+        cached_digests = prov_tree.get_digests(compute_node.uuid)
         # Let the virt driver rearrange the provider tree and set/update
         # the inventory, traits, and aggregates throughout.
         try:
@@ -928,8 +1095,20 @@ class ResourceTracker(object):
             # amounts.
             _normalize_inventory_from_cn_obj(inv_data, compute_node)
             prov_tree.update_inventory(nodename, inv_data)
+            # If neither the cache nor what the virt driver reported changed
+            # since the last successful flush, there is nothing to flush.
+            digests = (cached_digests,
+                       prov_tree.get_digests(compute_node.uuid))
+            if self.provider_tree_digests.get(nodename) == digests:
+                self.skipped_writes['placement'] += 1
+                LOG.debug('Skipping update of the resource providers of node '
+                          '%s in placement since nothing changed.', nodename)
+                return
             # Flush any changes.
-            reportclient.update_from_provider_tree(context, prov_tree)
+            self.provider_tree_digests.pop(nodename, None)
+            reportclient.update_from_provider_tree(
+                context, prov_tree, rp_uuid=compute_node.uuid)
+            self.provider_tree_digests[nodename] = digests
         except NotImplementedError:
             # update_provider_tree isn't implemented yet - try get_inventory
             try:
@@ -963,7 +1142,11 @@ class ResourceTracker(object):
         self._update_to_placement(context, compute_node)
 
         if self.pci_tracker:
-            self.pci_tracker.save(context)
+            self._save_pci_devices(context, compute_node.hypervisor_hostname)
+
+    @_synchronized_per_host
+    def _save_pci_devices(self, context, nodename):
+        self.pci_tracker.save(context)
 
     def _update_usage(self, usage, nodename, sign=1):
         mem_usage = usage['memory_mb']
@@ -1086,7 +1269,12 @@ class ResourceTracker(object):
     def _update_usage_from_migrations(self, context, migrations, nodename):
         filtered = {}
         instances = {}
-        self.tracked_migrations.clear()
+        # Stop tracking the migrations to or from the node, which are all
+        # about to be tracked again, but not those of the other nodes of this
+        # host.
+        for uuid, migration in list(self.tracked_migrations.items()):
+            if nodename in (migration.source_node, migration.dest_node):
+                del self.tracked_migrations[uuid]
 
         # do some defensive filtering against bad migrations records in the
         # database:
@@ -1202,7 +1390,11 @@ class ResourceTracker(object):
         instances assigned to the local compute host, even if they are not
         currently powered on.
         """
-        self.tracked_instances.clear()
+        # Stop tracking the instances of the node, which are all about to be
+        # tracked again, but not those of the other nodes of this host.
+        for uuid, instance in list(self.tracked_instances.items()):
+            if instance.get('node', nodename) == nodename:
+                del self.tracked_instances[uuid]
 
         cn = self.compute_nodes[nodename]
         # set some initial values, reserve room for host/hypervisor:
@@ -14,11 +14,13 @@
 
 """Handles database requests from other nova services."""
 
+import collections
 import contextlib
 import copy
 import functools
 import sys
 
+import eventlet.semaphore
 from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
@@ -40,6 +42,7 @@ from nova.conductor.tasks import live_migrate
 from nova.conductor.tasks import migrate
 from nova import context as nova_context
 from nova.db import base
+from nova.db.sqlalchemy import api as db_api
 from nova import exception
 from nova.i18n import _
 from nova import image
@@ -219,6 +222,23 @@ def obj_target_cell(obj, cell):
             yield target
 
 
+@contextlib.contextmanager
+def objs_target_cell(context, objs, cell):
+    """Run with the context of all the objects set to a single copy of
+    context targeted to a specific cell, so that the database calls made with
+    any of them can join the same transaction.
+    """
+    with try_target_cell(context, cell) as target:
+        orig_contexts = [obj._context for obj in objs]
+        for obj in objs:
+            obj._context = target
+        try:
+            yield target
+        finally:
+            for obj, orig_context in six.moves.zip(objs, orig_contexts):
+                obj._context = orig_context
+
+
 @profiler.trace_cls("rpc")
 class ComputeTaskManager(base.Base):
     """Namespace for compute methods.
@@ -1159,11 +1179,14 @@ class ComputeTaskManager(base.Base):
         return size
 
     def _create_block_device_mapping(self, cell, instance_type, instance_uuid,
-                                     block_device_mapping):
+                                     block_device_mapping, cell_context=None):
         """Create the BlockDeviceMapping objects in the db.
 
         This method makes a copy of the list in order to avoid using the same
         id field in case this is called for multiple instances.
+
+        If cell_context, a context already targeted to the cell, is provided
+        the objects are created with it, joining its database transaction.
         """
         LOG.debug("block_device_mapping %s", list(block_device_mapping),
                   instance_uuid=instance_uuid)
@@ -1171,6 +1194,10 @@ class ComputeTaskManager(base.Base):
         for bdm in instance_block_device_mapping:
             bdm.volume_size = self._volume_size(instance_type, bdm)
             bdm.instance_uuid = instance_uuid
+            if cell_context is not None:
+                with bdm.obj_alternate_context(cell_context):
+                    bdm.update_or_create()
+                continue
             with obj_target_cell(bdm, cell):
                 bdm.update_or_create()
         return instance_block_device_mapping
@@ -1281,6 +1308,9 @@ class ComputeTaskManager(base.Base):
         cell_mapping_cache = {}
         instances = []
         host_az = {}  # host=az cache to optimize multi-create
+        # The instances to create, grouped by the cell of their selected host,
+        # so that the records of each cell are written in a few transactions
+        instances_by_cell = collections.OrderedDict()
 
         for (build_request, request_spec, host_list) in six.moves.zip(
                 build_requests, request_specs, host_lists):
@@ -1332,10 +1362,14 @@ class ComputeTaskManager(base.Base):
                         availability_zones.get_host_availability_zone(
                             context, host.service_host))
                 instance.availability_zone = host_az[host.service_host]
-                with obj_target_cell(instance, cell):
-                    instance.create()
-                    instances.append(instance)
-                    cell_mapping_cache[instance.uuid] = cell
+                instances.append(instance)
+                cell_mapping_cache[instance.uuid] = cell
+                instances_by_cell.setdefault(cell.uuid, (cell, []))[1].append(
+                    instance)
+
+        for cell, cell_instances in instances_by_cell.values():
+            with objs_target_cell(context, cell_instances, cell) as cctxt:
+                self._create_instances_in_cell(cctxt, cell_instances)
 
         # NOTE(melwitt): We recheck the quota after creating the
         # objects to prevent users from allocating more resources
@@ -1355,66 +1389,164 @@ class ComputeTaskManager(base.Base):
                                                   block_device_mapping, tags,
                                                   cell_mapping_cache)
 
-        zipped = six.moves.zip(build_requests, request_specs, host_lists,
-                              instances)
-        for (build_request, request_spec, host_list, instance) in zipped:
-            if instance is None:
+        instance_bdms = {}
+        instance_tags = {}
+        for cell, cell_instances in instances_by_cell.values():
+            bdms, inst_tags = self._create_build_records_in_cell(
+                context, cell, cell_instances, block_device_mapping, tags)
+            instance_bdms.update(bdms)
+            instance_tags.update(inst_tags)
+
+        # TODO(Kevin Zheng): clean this up once instance.create() handles
+        # tags; we do this so the instance.create notification in
+        # build_and_run_instance in nova-compute doesn't lazy-load tags
+        for instance in instances:
+            if instance is not None:
+                instance.tags = instance_tags[instance.uuid] if \
+                    instance_tags[instance.uuid] else objects.TagList()
+
+        # NOTE(mdbooth): To avoid an incomplete instance record being
+        # returned by the API, the instance mappings are updated after the
+        # instance records are complete in their cell, and before the build
+        # requests are destroyed. Normally the instance mapping update is
+        # guarded by a try/except but if we're here we know that a newer
+        # nova-api handled the build process and would have created the
+        # mappings.
+        created_build_requests = [
+            build_request for build_request, instance in
+            six.moves.zip(build_requests, instances) if instance is not None]
+        created_instances = [instance for instance in instances
+                             if instance is not None]
+        with objs_target_cell(context, created_build_requests, None):
+            deleted_build_requests = (
+                self._map_instances_and_destroy_build_requests(
+                    context, created_build_requests, created_instances,
+                    cell_mapping_cache))
+        for instance in created_instances:
+            if instance.uuid in deleted_build_requests:
+                # The build request was deleted before/during scheduling so
+                # the instance is gone and we don't have anything to build for
+                # this one.
+                self._cleanup_deleted_build_request(
+                    context, instance, cell_mapping_cache[instance.uuid],
+                    instance_bdms[instance.uuid],
+                    instance_tags[instance.uuid])
+
+        # The casts to the compute hosts are independent from each other, so
+        # they are sent concurrently.
+        semaphore = eventlet.semaphore.Semaphore(
+            CONF.conductor.max_concurrent_build_casts)
+        threads = []
+        zipped = six.moves.zip(request_specs, host_lists, instances)
+        for (request_spec, host_list, instance) in zipped:
+            if instance is None or instance.uuid in deleted_build_requests:
                 # Skip placeholders that were buried in cell0 or had their
-                # build requests deleted by the user before instance create.
+                # build requests deleted by the user before or during the
+                # build.
                 continue
-            cell = cell_mapping_cache[instance.uuid]
-            # host_list is a list of one or more Selection objects, the first
-            # of which has been selected and its resources claimed.
-            host = host_list.pop(0)
-            alts = [(alt.service_host, alt.nodename) for alt in host_list]
-            LOG.debug("Selected host: %s; Selected node: %s; Alternates: %s",
-                    host.service_host, host.nodename, alts, instance=instance)
-            filter_props = request_spec.to_legacy_filter_properties_dict()
-            scheduler_utils.populate_retry(filter_props, instance.uuid)
-            scheduler_utils.populate_filter_properties(filter_props,
-                                                       host)
-            # TODO(melwitt): Maybe we should set_target_cell on the contexts
-            # once we map to a cell, and remove these separate with statements.
-            with obj_target_cell(instance, cell) as cctxt:
+            threads.append(utils.spawn(
+                self._cast_build_and_run_instance, semaphore, instance,
+                cell_mapping_cache[instance.uuid], request_spec, host_list,
+                image, admin_password, injected_files, requested_networks,
+                instance_bdms[instance.uuid]))
+        # Wait for all the casts before re-raising the first error, so that
+        # every instance which can be built is.
+        error = None
+        for thread in threads:
+            try:
+                thread.wait()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            six.reraise(*error)
+
+    @staticmethod
+    @db_api.pick_context_manager_writer
+    def _create_instances_in_cell(context, instances):
+        """Create the instances, whose context must be the supplied context
+        targeted to their cell, in a single database transaction.
+        """
+        for instance in instances:
+            instance.create()
+
+    def _create_build_records_in_cell(self, context, cell, instances,
+                                      block_device_mapping, tags):
+        """Create the instance actions, block device mappings and tags of the
+        instances created in a cell in a single database transaction, then
+        send the notifications of their initial create.
+
+        :returns: a tuple of dicts, keyed by instance uuid, of the
+            BlockDeviceMapping objects and of the TagList of the instances
+        """
+        instance_bdms = {}
+        instance_tags = {}
+        with objs_target_cell(context, instances, cell) as cctxt:
+            with db_api.get_context_manager(cctxt).writer.using(cctxt):
+                for instance in instances:
+                    objects.InstanceAction.action_start(
+                        cctxt, instance.uuid, instance_actions.CREATE,
+                        want_result=False)
+                    instance_bdms[instance.uuid] = (
+                        self._create_block_device_mapping(
+                            cell, instance.flavor, instance.uuid,
+                            block_device_mapping, cell_context=cctxt))
+                    instance_tags[instance.uuid] = self._create_tags(
+                        cctxt, instance.uuid, tags)
+            for instance in instances:
                 # send a state update notification for the initial create to
                 # show it going from non-existent to BUILDING
                 # This can lazy-load attributes on instance.
                 notifications.send_update_with_states(cctxt, instance, None,
                         vm_states.BUILDING, None, None, service="conductor")
-                objects.InstanceAction.action_start(
-                    cctxt, instance.uuid, instance_actions.CREATE,
-                    want_result=False)
-                instance_bdms = self._create_block_device_mapping(
-                    cell, instance.flavor, instance.uuid, block_device_mapping)
-                instance_tags = self._create_tags(cctxt, instance.uuid, tags)
-
-            # TODO(Kevin Zheng): clean this up once instance.create() handles
-            # tags; we do this so the instance.create notification in
-            # build_and_run_instance in nova-compute doesn't lazy-load tags
-            instance.tags = instance_tags if instance_tags \
-                else objects.TagList()
-
-            # Update mapping for instance. Normally this check is guarded by
-            # a try/except but if we're here we know that a newer nova-api
-            # handled the build process and would have created the mapping
-            inst_mapping = objects.InstanceMapping.get_by_instance_uuid(
-                context, instance.uuid)
-            inst_mapping.cell_mapping = cell
-            inst_mapping.save()
+        return instance_bdms, instance_tags
 
-            if not self._delete_build_request(
-                    context, build_request, instance, cell, instance_bdms,
-                    instance_tags):
-                # The build request was deleted before/during scheduling so
-                # the instance is gone and we don't have anything to build for
-                # this one.
-                continue
+    @staticmethod
+    @db_api.api_context_manager.writer
+    def _map_instances_and_destroy_build_requests(context, build_requests,
+                                                  instances,
+                                                  cell_mapping_cache):
+        """Map the instances to their cell and destroy their build requests,
+        whose context must be the supplied context, in a single API database
+        transaction.
+
+        :returns: the set of the instance uuids whose build request was
+            already deleted
+        """
+        inst_mappings = objects.InstanceMappingList.get_by_instance_uuids(
+            context, [instance.uuid for instance in instances])
+        for inst_mapping in inst_mappings:
+            inst_mapping.cell_mapping = cell_mapping_cache[
+                inst_mapping.instance_uuid]
+            inst_mapping.save()
+        deleted = set()
+        for build_request in build_requests:
+            try:
+                build_request.destroy()
+            except exception.BuildRequestNotFound:
+                deleted.add(build_request.instance_uuid)
+        return deleted
 
-            # NOTE(danms): Compute RPC expects security group names or ids
-            # not objects, so convert this to a list of names until we can
-            # pass the objects.
-            legacy_secgroups = [s.identifier
-                                for s in request_spec.security_groups]
+    def _cast_build_and_run_instance(self, semaphore, instance, cell,
+                                     request_spec, host_list, image,
+                                     admin_password, injected_files,
+                                     requested_networks, instance_bdms):
+        # host_list is a list of one or more Selection objects, the first
+        # of which has been selected and its resources claimed.
+        host = host_list.pop(0)
+        alts = [(alt.service_host, alt.nodename) for alt in host_list]
+        LOG.debug("Selected host: %s; Selected node: %s; Alternates: %s",
+                host.service_host, host.nodename, alts, instance=instance)
+        filter_props = request_spec.to_legacy_filter_properties_dict()
+        scheduler_utils.populate_retry(filter_props, instance.uuid)
+        scheduler_utils.populate_filter_properties(filter_props,
+                                                   host)
+        # NOTE(danms): Compute RPC expects security group names or ids
+        # not objects, so convert this to a list of names until we can
+        # pass the objects.
+        legacy_secgroups = [s.identifier
+                            for s in request_spec.security_groups]
+        with semaphore:
             with obj_target_cell(instance, cell) as cctxt:
                 self.compute_rpcapi.build_and_run_instance(
                     cctxt, instance=instance, image=image,
@@ -1481,17 +1613,14 @@ class ComputeTaskManager(base.Base):
             except exception.RequestSpecNotFound:
                 pass
 
-    def _delete_build_request(self, context, build_request, instance, cell,
-                              instance_bdms, instance_tags):
-        """Delete a build request after creating the instance in the cell.
-
-        This method handles cleaning up the instance in case the build request
-        is already deleted by the time we try to delete it.
+    def _cleanup_deleted_build_request(self, context, instance, cell,
+                                       instance_bdms, instance_tags):
+        """Clean up the bdm, tags and instance record of an instance whose
+        build request was deleted, indicating that an instance deletion
+        request has been processed and the build should halt.
 
         :param context: the context of the request being handled
         :type context: nova.context.RequestContext
-        :param build_request: the build request to delete
-        :type build_request: nova.objects.BuildRequest
         :param instance: the instance created from the build_request
         :type instance: nova.objects.Instance
         :param cell: the cell in which the instance was created
@@ -1500,41 +1629,31 @@ class ComputeTaskManager(base.Base):
         :type instance_bdms: nova.objects.BlockDeviceMappingList
         :param instance_tags: list of tags for the instance
         :type instance_tags: nova.objects.TagList
-        :returns: True if the build request was successfully deleted, False if
-            the build request was already deleted and the instance is now gone.
         """
-        try:
-            build_request.destroy()
-        except exception.BuildRequestNotFound:
-            # This indicates an instance deletion request has been
-            # processed, and the build should halt here. Clean up the
-            # bdm, tags and instance record.
-            with obj_target_cell(instance, cell) as cctxt:
-                with compute_utils.notify_about_instance_delete(
-                        self.notifier, cctxt, instance):
+        with obj_target_cell(instance, cell) as cctxt:
+            with compute_utils.notify_about_instance_delete(
+                    self.notifier, cctxt, instance):
+                try:
+                    instance.destroy()
+                except exception.InstanceNotFound:
+                    pass
+                except exception.ObjectActionError:
+                    # NOTE(melwitt): Instance became scheduled during
+                    # the destroy, "host changed". Refresh and re-destroy.
                     try:
+                        instance.refresh()
                         instance.destroy()
                     except exception.InstanceNotFound:
                         pass
-                    except exception.ObjectActionError:
-                        # NOTE(melwitt): Instance became scheduled during
-                        # the destroy, "host changed". Refresh and re-destroy.
-                        try:
-                            instance.refresh()
-                            instance.destroy()
-                        except exception.InstanceNotFound:
-                            pass
-            for bdm in instance_bdms:
-                with obj_target_cell(bdm, cell):
-                    try:
-                        bdm.destroy()
-                    except exception.ObjectActionError:
-                        pass
-            if instance_tags:
-                with try_target_cell(context, cell) as target_ctxt:
-                    try:
-                        objects.TagList.destroy(target_ctxt, instance.uuid)
-                    except exception.InstanceNotFound:
-                        pass
-            return False
-        return True
+        for bdm in instance_bdms:
+            with obj_target_cell(bdm, cell):
+                try:
+                    bdm.destroy()
+                except exception.ObjectActionError:
+                    pass
+        if instance_tags:
+            with try_target_cell(context, cell) as target_ctxt:
+                try:
+                    objects.TagList.destroy(target_ctxt, instance.uuid)
+                except exception.InstanceNotFound:
+                    pass
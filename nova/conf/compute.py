@@ -573,6 +573,59 @@ Possible Values:
 
 * 0 : treated as unlimited.
 * Any positive integer representing maximum concurrent builds.
+"""),
+    cfg.IntOpt('max_concurrent_network_allocations',
+        default=0,
+        min=0,
+        help="""
+Limits the maximum number of network allocations that the instance builds of
+nova-compute run concurrently. Network allocation runs at the same time as
+the image prefetch and the block device preparation of the build.
+
+Possible Values:
+
+* 0 : only limited by ``max_concurrent_builds``.
+* Any positive integer representing maximum concurrent network allocations.
+
+Related options:
+
+* ``max_concurrent_builds``
+"""),
+    cfg.IntOpt('max_concurrent_block_device_preparations',
+        default=0,
+        min=0,
+        help="""
+Limits the maximum number of block device preparations, including the
+creation, attachment and connection of volumes, that the instance builds of
+nova-compute run concurrently.
+
+Possible Values:
+
+* 0 : only limited by ``max_concurrent_builds``.
+* Any positive integer representing maximum concurrent block device
+  preparations.
+
+Related options:
+
+* ``max_concurrent_builds``
+"""),
+    cfg.IntOpt('max_concurrent_image_prefetches',
+        default=0,
+        min=0,
+        help="""
+Limits the maximum number of images that the instance builds of nova-compute
+download into the image cache of the virt driver concurrently, before the
+instances are spawned. Image-backed builds prefetch their image while their
+network and block devices are prepared.
+
+Possible Values:
+
+* 0 : only limited by ``max_concurrent_builds``.
+* Any positive integer representing maximum concurrent image prefetches.
+
+Related options:
+
+* ``max_concurrent_builds``
 """),
     # TODO(sfinucan): Add min parameter
     cfg.IntOpt('max_concurrent_live_migrations',
@@ -617,6 +670,49 @@ for performance reasons, for example, with Ironic.
 Possible values:
 
 * Any positive integer representing greenthreads count.
+"""),
+    cfg.IntOpt('update_resources_pool_size',
+        default=1,
+        min=1,
+        help="""
+Number of compute nodes whose resources are updated concurrently.
+
+The update_available_resources periodic task updates the resources of each
+compute node managed by the service. This option sets how many nodes are
+updated at the same time, which lets virt drivers managing many nodes, such as
+Ironic, complete the task within its interval. The changes of the nodes are
+sent to the placement service concurrently too.
+
+Possible values:
+
+* 1 to update the nodes one at a time.
+* Any other positive integer representing greenthreads count.
+
+Related options:
+
+* ``update_resources_interval``
+"""),
+    cfg.IntOpt('init_instance_pool_size',
+        default=10,
+        min=1,
+        help="""
+Number of instances initialized concurrently when nova-compute starts.
+
+On startup, nova-compute checks the power state of each instance on the host,
+plugs its virtual interfaces, resumes its guest and recovers it from an
+interrupted task. This option sets how many instances are initialized at the
+same time. The service only reports that it is up once all of them are
+initialized. Instances whose pending deletion is completed or whose migration
+is rolled back are always initialized one at a time, in order.
+
+Possible values:
+
+* 1 to initialize the instances one at a time.
+* Any other positive integer representing greenthreads count.
+
+Related options:
+
+* ``resume_guests_state_on_host_boot``
 """)
 ]
 
@@ -665,11 +761,32 @@ provider's aggregates and traits info.
 
 This option specifies the number of seconds between attempts to update a
 provider's aggregates and traits information in the local cache of the compute
-node.
+node. The aggregates and traits of the providers in the compute node's tree
+are refreshed whenever their generation moves; for those, this option only
+controls how often the providers sharing resources with them via aggregate are
+looked up again.
 
 Possible values:
 
 * Any positive integer in seconds.
+"""),
+    cfg.IntOpt('resource_provider_update_concurrency',
+        default=10,
+        min=1,
+        help="""
+Maximum number of concurrent requests to the placement service when flushing
+changes to the compute node's resource providers.
+
+When the virt driver reports several resource providers, for example the
+nodes of an Ironic compute service or the NUMA nodes and devices of a host,
+the providers which don't depend on each other are created, deleted and
+updated concurrently, up to this number of requests at a time. The same number
+of connections to the placement service are kept alive.
+
+Possible values:
+
+* 1 to update the providers one at a time.
+* Any other positive integer.
 """),
    cfg.StrOpt('cpu_shared_set',
         help="""
@@ -802,6 +919,22 @@ Possible values:
 
 * Any positive integer in seconds.
 * Any value <=0 will disable the sync. This is not recommended.
+"""),
+    cfg.IntOpt('heal_instance_info_cache_batch_size',
+        default=50,
+        min=1,
+        help="""
+Number of instances whose network information cache is healed on each run
+of the heal task.
+
+The networking information of the instances of a batch is retrieved from
+Neutron with a few bulk queries, and only the caches which changed are
+written. A value of 1 heals one instance per run, querying the networking
+information of each of its ports separately.
+
+Related options:
+
+* ``heal_instance_info_cache_interval``
 """),
     cfg.IntOpt('reclaim_instance_interval',
         default=0,
@@ -969,6 +1102,35 @@ Possible values:
 * 0: Will run at the default periodic interval.
 * Any value < 0: Disables the option.
 * Any positive integer in seconds.
+"""),
+    cfg.IntOpt('resource_usage_audit_interval',
+        default=0,
+        help="""
+Interval for auditing the resource usage of compute nodes.
+
+The resource tracker keeps the resource usage of each compute node up to date
+as instances are claimed, moved and removed. Every this number of seconds,
+the update_available_resources periodic task also audits that usage by
+reloading all instances and in-progress migrations of the node from the
+database and replaying their usage, and logs a warning if it differs from the
+tracked usage. In between audits, the periodic task only refreshes the
+resources reported by the virt driver, which saves a lot of work on compute
+services managing many nodes, such as Ironic ones.
+
+The statistics derived from the instances of the node, such as the number of
+instances in each VM state and task state and the ``io_workload``, are only
+recomputed by the audits, so the ones reported to the scheduler can be up to
+this number of seconds old.
+
+Possible values:
+
+* 0 or any value < 0: Audit the usage every time the periodic task runs. This
+  is the default.
+* Any positive integer in seconds.
+
+Related options:
+
+* ``update_resources_interval``
 """)
 ]
 
@@ -31,6 +31,19 @@ ALL_OPTS = [
         help="""
 Number of workers for OpenStack Conductor service. The default will be the
 number of CPUs available.
+"""),
+    cfg.IntOpt(
+        'max_concurrent_build_casts',
+        default=10,
+        min=1,
+        help="""
+Maximum number of concurrent build requests sent to compute hosts.
+
+When building several instances at once, for example with the ``min_count``
+of the servers API, the conductor writes the records of the instances to the
+database in a few transactions per cell, then sends the build requests to the
+compute hosts selected for them concurrently. This sets how many of them are
+sent at the same time.
 """),
 ]
 
@@ -35,6 +35,32 @@ are returned in a deterministic but undefined order. That is, all things
 being equal, two requests for allocation candidates will return the same
 results in the same order; but no guarantees are made as to how that order
 is determined.
+"""),
+    cfg.BoolOpt(
+        'enable_metrics',
+        default=False,
+        help="""
+If True, the placement API service records per route and microversion request
+counts, latency histograms, database query counts and times, and response
+sizes, and exposes them in text form on ``GET /metrics``. Access to the
+metrics is controlled by the ``placement:metrics`` policy, which is admin-only
+by default. Metrics are kept in memory and are per API worker process.
+"""),
+    cfg.BoolOpt(
+        'enable_replica_reads',
+        default=False,
+        help="""
+If True, the placement API service serves the read-only requests that list
+resource providers, usages and allocation candidates from the replica
+database connection, the ``slave_connection`` of the ``[placement_database]``
+group, or of the ``[api_database]`` group if placement uses the API database.
+A client can force such a request to read from the primary database, for
+example right after a write, by sending the
+``OpenStack-Placement-Must-Be-Current: true`` header.
+
+Related options:
+
+* ``[placement_database]/slave_connection``
 """),
     # TODO(mriedem): When placement is split out of nova, this should be
     # deprecated since then [oslo_policy]/policy_file can be used.
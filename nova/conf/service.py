@@ -80,6 +80,47 @@ Possible Values:
 
 * Any positive integer (in seconds)
 * 0 : disable the random delay
+"""),
+    cfg.FloatOpt('periodic_task_jitter',
+               default=0,
+               min=0,
+               max=1,
+               help="""
+Maximum random advance of the first run of each periodic task, as a
+fraction of the interval of the task.
+
+Unlike periodic_fuzzy_delay, which delays all the periodic tasks of a service
+by the same amount, this option offsets each task separately, so that the
+tasks of services started together, and the different tasks of a service,
+don't run in lockstep against the conductor and the database. Tasks
+configured to run immediately at startup are not offset.
+
+Possible Values:
+
+* 0 : disable the per-task offset. This is the default.
+* Any value up to 1, for an offset up to the whole interval of the task
+
+Related options:
+
+* periodic_fuzzy_delay
+"""),
+    cfg.ListOpt('periodic_task_dedicated_workers',
+                default=[],
+                help="""
+Names of the periodic tasks running in their own worker.
+
+Periodic tasks run one after the other, so a slow task delays all the
+others. The tasks listed here are instead started in their own greenthread
+and don't delay the others. A run of a dedicated task is skipped if the
+previous one hasn't completed yet.
+
+The runtime of every periodic task is logged at debug level, and a warning
+is logged when a task takes longer than its interval.
+
+Possible Values:
+
+* A list of periodic task names, for example
+  ``_sync_power_states,update_available_resource``
 """),
     cfg.ListOpt('enabled_apis',
                 item_type=cfg.types.String(choices=['osapi_compute',
@@ -31,12 +31,14 @@ from oslo_log import log as logging
 from oslo_utils import timeutils
 import six
 
+import nova.conf
 from nova import exception
 from nova.i18n import _
 from nova import objects
 from nova import policy
 from nova import utils
 
+CONF = nova.conf.CONF
 LOG = logging.getLogger(__name__)
 CELL_CACHE = {}
 # NOTE(melwitt): Used for the scatter-gather utility to indicate we timed out
@@ -142,6 +144,10 @@ class RequestContext(context.RequestContext):
         # provided by this module
         self.db_connection = None
         self.mq_connection = None
+        # Whether the reads of the request may be served from the replica
+        # databases, see nova.api.openstack.wsgi.read_from_replica(). This is
+        # not sent to the other services.
+        self.read_from_replica = False
 
         self.user_auth_plugin = user_auth_plugin
         if self.is_admin is None:
@@ -364,7 +370,9 @@ def set_target_cell(context, cell_mapping):
             except KeyError:
                 db_connection_string = cell_mapping.database_connection
                 context.db_connection = db.create_context_manager(
-                    db_connection_string)
+                    db_connection_string,
+                    slave_connection=CONF.api.cell_replica_connections.get(
+                        cell_mapping.uuid))
                 if not cell_mapping.transport_url.startswith('none'):
                     context.mq_connection = rpc.create_transport(
                         cell_mapping.transport_url)
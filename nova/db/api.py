@@ -75,9 +75,12 @@ def not_equal(*values):
     return IMPL.not_equal(*values)
 
 
-def create_context_manager(connection):
-    """Return a context manager for a cell database connection."""
-    return IMPL.create_context_manager(connection=connection)
+def create_context_manager(connection, slave_connection=None):
+    """Return a context manager for a cell database connection, and the
+    connection of its replica if any.
+    """
+    return IMPL.create_context_manager(connection=connection,
+                                       slave_connection=slave_connection)
 
 
 ###################
@@ -563,12 +566,18 @@ def migration_get_in_progress_by_host_and_node(context, host, node):
 
 
 def migration_get_all_by_filters(context, filters, sort_keys=None,
-                                 sort_dirs=None, limit=None, marker=None):
-    """Finds all migrations using the provided filters."""
+                                 sort_dirs=None, limit=None, marker=None,
+                                 marker_values=None):
+    """Finds all migrations using the provided filters.
+
+    The migrations after the one whose sort keys have the values of
+    marker_values are returned when it is given instead of the marker uuid.
+    """
     return IMPL.migration_get_all_by_filters(context, filters,
                                              sort_keys=sort_keys,
                                              sort_dirs=sort_dirs,
-                                             limit=limit, marker=marker)
+                                             limit=limit, marker=marker,
+                                             marker_values=marker_values)
 
 
 def migration_get_in_progress_by_instance(context, instance_uuid,
@@ -578,17 +587,6 @@ def migration_get_in_progress_by_instance(context, instance_uuid,
                                                       migration_type)
 
 
-def migration_get_by_sort_filters(context, sort_keys, sort_dirs, values):
-    """Get the uuid of the first migration in a sort order.
-
-    Return the first migration (uuid) of the set where each column value
-    is greater than or equal to the matching one in @values, for each key
-    in @sort_keys.
-    """
-    return IMPL.migration_get_by_sort_filters(context, sort_keys, sort_dirs,
-                                              values)
-
-
 ####################
 
 
@@ -776,7 +774,7 @@ def instance_get_all_uuids_by_host(context, host):
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
                                 sort_dir='desc', limit=None, marker=None,
-                                columns_to_join=None):
+                                columns_to_join=None, columns=None):
     """Get all instances that match all filters."""
     # Note: This function exists for backwards compatibility since calls to
     # the instance layer coming in over RPC may specify the single sort
@@ -785,31 +783,40 @@ def instance_get_all_by_filters(context, filters, sort_key='created_at',
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
                                             sort_dir, limit=limit,
                                             marker=marker,
-                                            columns_to_join=columns_to_join)
+                                            columns_to_join=columns_to_join,
+                                            columns=columns)
 
 
 def instance_get_all_by_filters_sort(context, filters, limit=None,
                                      marker=None, columns_to_join=None,
-                                     sort_keys=None, sort_dirs=None):
+                                     sort_keys=None, sort_dirs=None,
+                                     columns=None, marker_values=None):
     """Get all instances that match all filters sorted by multiple keys.
 
-    sort_keys and sort_dirs must be a list of strings.
+    sort_keys and sort_dirs must be a list of strings. If columns is given,
+    only these columns of the instances are loaded. The instances after the
+    one whose sort keys have the values of marker_values are returned when
+    it is given instead of the marker uuid.
     """
     return IMPL.instance_get_all_by_filters_sort(
         context, filters, limit=limit, marker=marker,
         columns_to_join=columns_to_join, sort_keys=sort_keys,
-        sort_dirs=sort_dirs)
+        sort_dirs=sort_dirs, columns=columns, marker_values=marker_values)
 
 
-def instance_get_by_sort_filters(context, sort_keys, sort_dirs, values):
-    """Get the uuid of the first instance in a sort order.
+def instance_get_changes(context, changes_since, changes_before=None,
+                         limit=None, marker_values=None, columns_to_join=None,
+                         columns=None):
+    """Get the instances updated at or after changes_since, and before
+    changes_before if given, sorted by (updated_at, id).
 
-    Return the first instance (uuid) of the set where each column value
-    is greater than or equal to the matching one in @values, for each key
-    in @sort_keys.
+    The instances after the (updated_at, id) values of marker_values are
+    returned when it is given.
     """
-    return IMPL.instance_get_by_sort_filters(context, sort_keys, sort_dirs,
-                                             values)
+    return IMPL.instance_get_changes(
+        context, changes_since, changes_before=changes_before, limit=limit,
+        marker_values=marker_values, columns_to_join=columns_to_join,
+        columns=columns)
 
 
 def instance_get_active_by_window_joined(context, begin, end=None,
@@ -1783,10 +1790,16 @@ def task_log_get(context, task_name, period_beginning,
 ####################
 
 
-def archive_deleted_rows(max_rows=None):
+def archive_deleted_rows(max_rows=None, max_workers=1, batch_time=None,
+                         report_fn=None):
     """Move up to max_rows rows from production tables to corresponding shadow
     tables.
 
+    The tables which do not depend on each other are archived by up to
+    max_workers at once, in batches taking about batch_time seconds each.
+    report_fn is called with each table name, the number of rows archived
+    from it and the time it took.
+
     :returns: dict that maps table name to number of rows archived from that
               table, for example:
 
@@ -1799,7 +1812,10 @@ def archive_deleted_rows(max_rows=None):
         }
 
     """
-    return IMPL.archive_deleted_rows(max_rows=max_rows)
+    return IMPL.archive_deleted_rows(max_rows=max_rows,
+                                     max_workers=max_workers,
+                                     batch_time=batch_time,
+                                     report_fn=report_fn)
 
 
 def pcidevice_online_data_migration(context, max_count):
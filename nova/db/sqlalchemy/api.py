@@ -23,7 +23,9 @@ import datetime
 import functools
 import inspect
 import sys
+import time
 
+import eventlet.semaphore
 from oslo_db import api as oslo_db_api
 from oslo_db import exception as db_exc
 from oslo_db.sqlalchemy import enginefacade
@@ -35,25 +37,23 @@ from oslo_utils import importutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 import six
-from six.moves import range
 import sqlalchemy as sa
 from sqlalchemy import and_
 from sqlalchemy import Boolean
 from sqlalchemy.exc import NoSuchTableError
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy import Integer
 from sqlalchemy import MetaData
 from sqlalchemy import or_
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
+from sqlalchemy.orm import load_only
 from sqlalchemy.orm import noload
 from sqlalchemy.orm import undefer
 from sqlalchemy.schema import Table
 from sqlalchemy import sql
 from sqlalchemy.sql.expression import asc
-from sqlalchemy.sql.expression import cast
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import UpdateBase
 from sqlalchemy.sql import false
@@ -70,6 +70,7 @@ from nova.db.sqlalchemy import models
 from nova import exception
 from nova.i18n import _
 from nova import safe_utils
+from nova import utils
 
 profiler_sqlalchemy = importutils.try_import('osprofiler.sqlalchemy')
 
@@ -110,13 +111,21 @@ def configure(conf):
             lambda eng: profiler_sqlalchemy.add_tracing(sa, eng, "db"))
 
 
-def create_context_manager(connection=None):
+def create_context_manager(connection=None, slave_connection=None):
     """Create a database context manager object.
 
     : param connection: The database connection string
+    : param slave_connection: The connection string of the replica of the
+                              database
     """
     ctxt_mgr = enginefacade.transaction_context()
-    ctxt_mgr.configure(**_get_db_conf(CONF.database, connection=connection))
+    db_conf = _get_db_conf(CONF.database, connection=connection)
+    # NOTE: The [database]/slave_connection is a replica of the database of
+    # the [database] group, not of the other cell databases.
+    if (slave_connection is not None or
+            db_conf['connection'] != CONF.database.connection):
+        db_conf['slave_connection'] = slave_connection
+    ctxt_mgr.configure(**db_conf)
     return ctxt_mgr
 
 
@@ -186,11 +195,19 @@ def require_instance_exists_using_uuid(f):
     return wrapper
 
 
+def _read_from_replica(context):
+    """Returns True if the reads of the context may be served from the replica
+    database connection, see nova.api.openstack.wsgi.read_from_replica().
+    """
+    return getattr(context, 'read_from_replica', False)
+
+
 def select_db_reader_mode(f):
     """Decorator to select synchronous or asynchronous reader mode.
 
     The kwarg argument 'use_slave' defines reader mode. Asynchronous reader
-    will be used if 'use_slave' is True and synchronous reader otherwise.
+    will be used if 'use_slave' is True or the reads of the context may be
+    served from the replica, and synchronous reader otherwise.
     If 'use_slave' is not specified default value 'False' will be used.
 
     Wrapped function must have a context in the arguments.
@@ -204,7 +221,7 @@ def select_db_reader_mode(f):
         context = keyed_args['context']
         use_slave = keyed_args.get('use_slave', False)
 
-        if use_slave:
+        if use_slave or _read_from_replica(context):
             reader_mode = get_context_manager(context).async
         else:
             reader_mode = get_context_manager(context).reader
@@ -230,7 +247,8 @@ def pick_context_manager_writer(f):
 
 
 def pick_context_manager_reader(f):
-    """Decorator to use a reader db context manager.
+    """Decorator to use a reader db context manager, or an async one if the
+    reads of the RequestContext may be served from the replica.
 
     The db context manager will be picked from the RequestContext.
 
@@ -239,13 +257,18 @@ def pick_context_manager_reader(f):
     @functools.wraps(f)
     def wrapped(context, *args, **kwargs):
         ctxt_mgr = get_context_manager(context)
-        with ctxt_mgr.reader.using(context):
+        if _read_from_replica(context):
+            reader_mode = ctxt_mgr.async_
+        else:
+            reader_mode = ctxt_mgr.reader
+        with reader_mode.using(context):
             return f(context, *args, **kwargs)
     return wrapped
 
 
 def pick_context_manager_reader_allow_async(f):
-    """Decorator to use a reader.allow_async db context manager.
+    """Decorator to use a reader.allow_async db context manager, or an async
+    one if the reads of the RequestContext may be served from the replica.
 
     The db context manager will be picked from the RequestContext.
 
@@ -254,7 +277,29 @@ def pick_context_manager_reader_allow_async(f):
     @functools.wraps(f)
     def wrapped(context, *args, **kwargs):
         ctxt_mgr = get_context_manager(context)
-        with ctxt_mgr.reader.allow_async.using(context):
+        if _read_from_replica(context):
+            reader_mode = ctxt_mgr.async_
+        else:
+            reader_mode = ctxt_mgr.reader.allow_async
+        with reader_mode.using(context):
+            return f(context, *args, **kwargs)
+    return wrapped
+
+
+def select_api_db_reader_mode(f):
+    """Decorator to use an API db reader context manager, or an async one
+    reading from [api_database]/slave_connection if the reads of the
+    RequestContext may be served from the replica.
+
+    Wrapped function must have a RequestContext as first argument.
+    """
+    @functools.wraps(f)
+    def wrapped(context, *args, **kwargs):
+        if _read_from_replica(context):
+            reader_mode = api_context_manager.async_
+        else:
+            reader_mode = api_context_manager.reader
+        with reader_mode.using(context):
             return f(context, *args, **kwargs)
     return wrapped
 
@@ -1939,7 +1984,8 @@ def _build_instance_get(context, columns_to_join=None):
     return query
 
 
-def _instances_fill_metadata(context, instances, manual_joins=None):
+def _instances_fill_metadata(context, instances, manual_joins=None,
+                             columns=None):
     """Selectively fill instances with manually-joined metadata. Note that
     instance will be converted to a dict.
 
@@ -1948,6 +1994,8 @@ def _instances_fill_metadata(context, instances, manual_joins=None):
     :param manual_joins: list of tables to manually join (can be any
                          combination of 'metadata' and 'system_metadata' or
                          None to take the default of both)
+    :param columns: list of the keys to copy from the instances to the dicts,
+                    or None to copy whole rows
     """
     uuids = [inst['uuid'] for inst in instances]
 
@@ -1977,7 +2025,10 @@ def _instances_fill_metadata(context, instances, manual_joins=None):
 
     filled_instances = []
     for inst in instances:
-        inst = dict(inst)
+        if columns is None:
+            inst = dict(inst)
+        else:
+            inst = {column: inst[column] for column in columns}
         inst['system_metadata'] = sys_meta[inst['uuid']]
         inst['metadata'] = meta[inst['uuid']]
         if 'pci_devices' in manual_joins:
@@ -2037,7 +2088,8 @@ def instance_get_all(context, columns_to_join=None):
 @require_context
 @pick_context_manager_reader_allow_async
 def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
-                                limit=None, marker=None, columns_to_join=None):
+                                limit=None, marker=None, columns_to_join=None,
+                                columns=None):
     """Return instances matching all filters sorted by the primary key.
 
     See instance_get_all_by_filters_sort for more information.
@@ -2048,14 +2100,85 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                                             marker=marker,
                                             columns_to_join=columns_to_join,
                                             sort_keys=[sort_key],
-                                            sort_dirs=[sort_dir])
+                                            sort_dirs=[sort_dir],
+                                            columns=columns)
+
+
+def _instance_list_query(context, columns_to_join, columns):
+    """Returns a tuple of (query, manual_joins, columns) for listing the
+    instances with the supplied columns_to_join, loading only the supplied
+    columns if not None.
+
+    manual_joins and columns are to be passed to _instances_fill_metadata().
+    """
+    if columns is not None and columns_to_join is None:
+        columns_to_join = []
+    if columns_to_join is None:
+        columns_to_join_new = ['info_cache', 'security_groups']
+        manual_joins = ['metadata', 'system_metadata']
+    else:
+        manual_joins, columns_to_join_new = (
+            _manual_join_columns(columns_to_join))
+
+    query = context.session.query(models.Instance)
+    if columns is not None:
+        columns = set(columns) | set(['id', 'uuid'])
+        query = query.options(load_only(*columns))
+    for column in columns_to_join_new:
+        if 'extra.' in column:
+            query = query.options(undefer(column))
+        else:
+            query = query.options(joinedload(column))
+        if columns is not None:
+            columns.add(column.partition('.')[0])
+    return query, manual_joins, columns
+
+
+@require_context
+@pick_context_manager_reader_allow_async
+def instance_get_changes(context, changes_since, changes_before=None,
+                         limit=None, marker_values=None, columns_to_join=None,
+                         columns=None):
+    """Return the instances updated at or after changes_since, and before
+    changes_before if given, deleted ones included, sorted by
+    (updated_at, id).
+
+    If marker_values is given, only the instances after the (updated_at, id)
+    values it holds are returned. The query seeks the index on the
+    (updated_at, id) columns, so it only reads the changed instances.
+    """
+    if limit == 0:
+        return []
+
+    query_prefix, manual_joins, columns = _instance_list_query(
+        context, columns_to_join, columns)
+    changes_since = timeutils.normalize_time(changes_since)
+    query_prefix = query_prefix.filter(
+        models.Instance.updated_at >= changes_since)
+    if changes_before is not None:
+        changes_before = timeutils.normalize_time(changes_before)
+        query_prefix = query_prefix.filter(
+            models.Instance.updated_at < changes_before)
+    if not context.is_admin:
+        # If we're not admin context, add appropriate filter..
+        if context.project_id:
+            query_prefix = query_prefix.filter_by(
+                project_id=context.project_id)
+        else:
+            query_prefix = query_prefix.filter_by(user_id=context.user_id)
+    query_prefix = _paginate_query(query_prefix, models.Instance, limit,
+                                   ['updated_at', 'id'], ['asc', 'asc'],
+                                   marker_values=marker_values)
+    return _instances_fill_metadata(context, query_prefix.all(), manual_joins,
+                                    columns=columns)
 
 
 @require_context
 @pick_context_manager_reader_allow_async
 def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
                                      columns_to_join=None, sort_keys=None,
-                                     sort_dirs=None):
+                                     sort_dirs=None, columns=None,
+                                     marker_values=None):
     """Return instances that match all filters sorted by the given keys.
     Deleted instances will be returned by default, unless there's a filter that
     says otherwise.
@@ -2114,6 +2237,14 @@ def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
     |        'not-tags-any: [some-not-any-tag, some-another-not-any-tag]
     |    }
 
+    When a list of columns of the instances table is given, only those
+    columns are loaded, along with the id and uuid of the instances, and
+    nothing is joined unless columns_to_join asks for it. The returned dicts
+    then only have these keys, plus the manually joined ones.
+
+    Instead of the uuid of the marker instance, marker_values can give the
+    values of its sort keys, see _paginate_query().
+
     """
     # NOTE(mriedem): If the limit is 0 there is no point in even going
     # to the database since nothing is going to be returned anyway.
@@ -2124,19 +2255,8 @@ def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
                                                sort_dirs,
                                                default_dir='desc')
 
-    if columns_to_join is None:
-        columns_to_join_new = ['info_cache', 'security_groups']
-        manual_joins = ['metadata', 'system_metadata']
-    else:
-        manual_joins, columns_to_join_new = (
-            _manual_join_columns(columns_to_join))
-
-    query_prefix = context.session.query(models.Instance)
-    for column in columns_to_join_new:
-        if 'extra.' in column:
-            query_prefix = query_prefix.options(undefer(column))
-        else:
-            query_prefix = query_prefix.options(joinedload(column))
+    query_prefix, manual_joins, columns = _instance_list_query(
+        context, columns_to_join, columns)
 
     # Note: order_by is done in the sqlalchemy.utils.py paginate_query(),
     # no need to do it here as well
@@ -2243,118 +2363,63 @@ def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
     query_prefix = _regex_instance_filter(query_prefix, filters)
 
     # paginate query
-    if marker is not None:
+    if marker is not None and marker_values is None:
         try:
             marker = _instance_get_by_uuid(
                     context.elevated(read_deleted='yes'), marker)
         except exception.InstanceNotFound:
             raise exception.MarkerNotFound(marker=marker)
     try:
-        query_prefix = sqlalchemyutils.paginate_query(query_prefix,
-                               models.Instance, limit,
-                               sort_keys,
-                               marker=marker,
-                               sort_dirs=sort_dirs)
+        query_prefix = _paginate_query(query_prefix, models.Instance, limit,
+                                       sort_keys, sort_dirs, marker=marker,
+                                       marker_values=marker_values)
     except db_exc.InvalidSortKey:
         raise exception.InvalidSortKey()
 
-    return _instances_fill_metadata(context, query_prefix.all(), manual_joins)
+    return _instances_fill_metadata(context, query_prefix.all(), manual_joins,
+                                    columns=columns)
 
 
-@require_context
-@pick_context_manager_reader_allow_async
-def instance_get_by_sort_filters(context, sort_keys, sort_dirs, values):
-    """Attempt to get a single instance based on a combination of sort
-    keys, directions and filter values. This is used to try to find a
-    marker instance when we don't have a marker uuid.
-
-    This returns just a uuid of the instance that matched.
+class _SortValues(object):
+    """Stands for the marker record of paginate_query() when only the values
+    of its first sort keys are known, which must already order the records
+    uniquely.
     """
 
-    model = models.Instance
-    return _model_get_uuid_by_sort_filters(context, model, sort_keys,
-                                           sort_dirs, values)
-
-
-def _model_get_uuid_by_sort_filters(context, model, sort_keys, sort_dirs,
-                                    values):
-    query = context.session.query(model.uuid)
-
-    # NOTE(danms): Below is a re-implementation of our
-    # oslo_db.sqlalchemy.utils.paginate_query() utility. We can't use that
-    # directly because it does not return the marker and we need it to.
-    # The below is basically the same algorithm, stripped down to just what
-    # we need, and augmented with the filter criteria required for us to
-    # get back the instance that would correspond to our query.
-
-    # This is our position in sort_keys,sort_dirs,values for the loop below
-    key_index = 0
-
-    # We build a list of criteria to apply to the query, which looks
-    # approximately like this (assuming all ascending):
-    #
-    #  OR(row.key1 > val1,
-    #     AND(row.key1 == val1, row.key2 > val2),
-    #     AND(row.key1 == val1, row.key2 == val2, row.key3 >= val3),
-    #  )
-    #
-    # The final key is compared with the "or equal" variant so that
-    # a complete match instance is still returned.
-    criteria = []
-
-    for skey, sdir, val in zip(sort_keys, sort_dirs, values):
-        # Apply ordering to our query for the key, direction we're processing
-        if sdir == 'desc':
-            query = query.order_by(desc(getattr(model, skey)))
-        else:
-            query = query.order_by(asc(getattr(model, skey)))
-
-        # Build a list of equivalence requirements on keys we've already
-        # processed through the loop. In other words, if we're adding
-        # key2 > val2, make sure that key1 == val1
-        crit_attrs = []
-        for equal_attr in range(0, key_index):
-            crit_attrs.append(
-                (getattr(model, sort_keys[equal_attr]) == values[equal_attr]))
-
-        model_attr = getattr(model, skey)
-        if isinstance(model_attr.type, Boolean):
-            model_attr = cast(model_attr, Integer)
-            val = int(val)
-
-        if skey == sort_keys[-1]:
-            # If we are the last key, then we should use or-equal to
-            # allow a complete match to be returned
-            if sdir == 'asc':
-                crit = (model_attr >= val)
-            else:
-                crit = (model_attr <= val)
-        else:
-            # If we're not the last key, then strict greater or less than
-            # so we order strictly.
-            if sdir == 'asc':
-                crit = (model_attr > val)
-            else:
-                crit = (model_attr < val)
+    def __init__(self, sort_keys, values):
+        for key in sort_keys:
+            setattr(self, key, None)
+        for key, value in zip(sort_keys, values):
+            setattr(self, key, value)
 
-        # AND together all the above
-        crit_attrs.append(crit)
-        criteria.append(and_(*crit_attrs))
-        key_index += 1
 
-    # OR together all the ANDs
-    query = query.filter(or_(*criteria))
+def _paginate_query(query, model, limit, sort_keys, sort_dirs, marker=None,
+                    marker_values=None):
+    """Returns the query sorted and paginated as by paginate_query(), which
+    selects the records after the marker record, or after the list of
+    marker_values of the sort keys of a record if given.
 
-    # We can't raise InstanceNotFound because we don't have a uuid to
-    # be looking for, so just return nothing if no match.
-    result = query.limit(1).first()
-    if result:
-        # We're querying for a single column, which means we get back a
-        # tuple of one thing. Strip that out and just return the uuid
-        # for our caller.
-        return result[0]
-    else:
-        return result
+    paginate_query() ORs a condition per sort key, which the database can
+    only resolve by scanning the records of all the previous pages. This also
+    bounds the first sort key by the marker value so that the database can
+    seek an index starting with the first sort key to the page.
+    """
+    if marker_values is not None:
+        marker = _SortValues(sort_keys, marker_values)
+    if marker is not None and sort_keys:
+        attr = getattr(model, sort_keys[0], None)
+        value = getattr(marker, sort_keys[0], None)
+        sort_dir = sort_dirs[0] if sort_dirs else 'asc'
+        # NOTE: paginate_query() also returns the records having a NULL first
+        # sort key when they are sorted after the others.
+        if (attr is not None and value is not None and
+                not isinstance(attr.type, Boolean) and '-' not in sort_dir):
+            if sort_dir == 'desc':
+                query = query.filter(attr <= value)
+            else:
+                query = query.filter(attr >= value)
+    return sqlalchemyutils.paginate_query(query, model, limit, sort_keys,
+                                          marker=marker, sort_dirs=sort_dirs)
 
 
 def _db_connection_type(db_connection):
@@ -4414,7 +4479,7 @@ def migration_get_in_progress_by_instance(context, instance_uuid,
 @pick_context_manager_reader
 def migration_get_all_by_filters(context, filters,
                                  sort_keys=None, sort_dirs=None,
-                                 limit=None, marker=None):
+                                 limit=None, marker=None, marker_values=None):
     if limit == 0:
         return []
 
@@ -4449,39 +4514,23 @@ def migration_get_all_by_filters(context, filters,
     if "instance_uuid" in filters:
         instance_uuid = filters["instance_uuid"]
         query = query.filter(models.Migration.instance_uuid == instance_uuid)
-    if marker:
+    if marker and marker_values is None:
         try:
             marker = migration_get_by_uuid(context, marker)
         except exception.MigrationNotFound:
             raise exception.MarkerNotFound(marker=marker)
-    if limit or marker or sort_keys or sort_dirs:
+    if (limit or marker or marker_values is not None or sort_keys or
+            sort_dirs):
         # Default sort by desc(['created_at', 'id'])
         sort_keys, sort_dirs = process_sort_params(sort_keys, sort_dirs,
                                                    default_dir='desc')
-        return sqlalchemyutils.paginate_query(query,
-                                              models.Migration,
-                                              limit=limit,
-                                              sort_keys=sort_keys,
-                                              marker=marker,
-                                              sort_dirs=sort_dirs).all()
+        return _paginate_query(query, models.Migration, limit, sort_keys,
+                               sort_dirs, marker=marker or None,
+                               marker_values=marker_values).all()
     else:
         return query.all()
 
 
-@require_context
-@pick_context_manager_reader_allow_async
-def migration_get_by_sort_filters(context, sort_keys, sort_dirs, values):
-    """Attempt to get a single migration based on a combination of sort
-    keys, directions and filter values. This is used to try to find a
-    marker migration when we don't have a marker uuid.
-
-    This returns just a uuid of the migration that matched.
-    """
-    model = models.Migration
-    return _model_get_uuid_by_sort_filters(context, model, sort_keys,
-                                           sort_dirs, values)
-
-
 @pick_context_manager_writer
 def migration_migrate_to_uuid(context, count):
     # Avoid circular import
@@ -5488,42 +5537,7 @@ def _archive_if_instance_deleted(table, shadow_table, instances, conn,
         return 0
 
 
-def _archive_deleted_rows_for_table(tablename, max_rows):
-    """Move up to max_rows rows from one tables to the corresponding
-    shadow table.
-
-    :returns: number of rows archived
-    """
-    engine = get_engine()
-    conn = engine.connect()
-    metadata = MetaData()
-    metadata.bind = engine
-    # NOTE(tdurakov): table metadata should be received
-    # from models, not db tables. Default value specified by SoftDeleteMixin
-    # is known only by models, not DB layer.
-    # IMPORTANT: please do not change source of metadata information for table.
-    table = models.BASE.metadata.tables[tablename]
-
-    shadow_tablename = _SHADOW_TABLE_PREFIX + tablename
-    rows_archived = 0
-    deleted_instance_uuids = []
-    try:
-        shadow_table = Table(shadow_tablename, metadata, autoload=True)
-    except NoSuchTableError:
-        # No corresponding shadow table; skip it.
-        return rows_archived, deleted_instance_uuids
-
-    if tablename == "dns_domains":
-        # We have one table (dns_domains) where the key is called
-        # "domain" rather than "id"
-        column = table.c.domain
-    else:
-        column = table.c.id
-    # NOTE(guochbo): Use DeleteFromSelect to avoid
-    # database's limit of maximum parameter in one SQL statement.
-    deleted_column = table.c.deleted
-    columns = [c.name for c in table.c]
-
+def _soft_delete_rows_of_deleted_instances(conn, tablename, table):
     # NOTE(clecomte): Tables instance_actions and instances_actions_events
     # have to be manage differently so we soft-delete them here to let
     # the archive work the same for all tables
@@ -5555,11 +5569,61 @@ def _archive_deleted_rows_for_table(tablename, max_rows):
 
         conn.execute(update_statement)
 
+
+def _archive_deleted_rows_for_table(tablename, max_rows, after=None,
+                                    until=None, soft_delete=True):
+    """Move up to max_rows rows from one tables to the corresponding
+    shadow table.
+
+    :param after: only archive the rows with a greater key than this
+    :param until: only archive the rows with a key up to this one
+    :param soft_delete: whether to first soft-delete the rows of the tables
+                        which are not soft-deleted along with their instance
+    :returns: tuple of the number of rows archived, the uuids of the archived
+              instances and the key of the last selected row if max_rows
+              rows were selected, which means that there may be more rows to
+              archive after it, otherwise None
+    """
+    engine = get_engine()
+    conn = engine.connect()
+    metadata = MetaData()
+    metadata.bind = engine
+    # NOTE(tdurakov): table metadata should be received
+    # from models, not db tables. Default value specified by SoftDeleteMixin
+    # is known only by models, not DB layer.
+    # IMPORTANT: please do not change source of metadata information for table.
+    table = models.BASE.metadata.tables[tablename]
+
+    shadow_tablename = _SHADOW_TABLE_PREFIX + tablename
+    rows_archived = 0
+    deleted_instance_uuids = []
+    try:
+        shadow_table = Table(shadow_tablename, metadata, autoload=True)
+    except NoSuchTableError:
+        # No corresponding shadow table; skip it.
+        return rows_archived, deleted_instance_uuids, None
+
+    column = _archive_key_column(table)
+    # NOTE(guochbo): Use DeleteFromSelect to avoid
+    # database's limit of maximum parameter in one SQL statement.
+    deleted_column = table.c.deleted
+    columns = [c.name for c in table.c]
+
+    if soft_delete:
+        _soft_delete_rows_of_deleted_instances(conn, tablename, table)
+
     select = sql.select([column],
-                        deleted_column != deleted_column.default.arg).\
-                        order_by(column).limit(max_rows)
+                        deleted_column != deleted_column.default.arg)
+    if after is not None:
+        select = select.where(column > after)
+    if until is not None:
+        select = select.where(column <= until)
+    select = select.order_by(column).limit(max_rows)
     rows = conn.execute(select).fetchall()
     records = [r[0] for r in rows]
+    last = None
+    if max_rows is not None and len(records) == max_rows:
+        last = records[-1]
 
     if records:
         insert = shadow_table.insert(inline=True).\
@@ -5588,22 +5652,135 @@ def _archive_deleted_rows_for_table(tablename, max_rows):
             LOG.warning("IntegrityError detected when archiving table "
                         "%(tablename)s: %(error)s",
                         {'tablename': tablename, 'error': six.text_type(ex)})
+            deleted_instance_uuids = []
 
     if ((max_rows is None or rows_archived < max_rows)
-            and 'instance_uuid' in columns):
+            and 'instance_uuid' in columns and last is None):
         instances = models.BASE.metadata.tables['instances']
         limit = max_rows - rows_archived if max_rows is not None else None
         extra = _archive_if_instance_deleted(table, shadow_table, instances,
                                              conn, limit)
         rows_archived += extra
 
-    return rows_archived, deleted_instance_uuids
+    return rows_archived, deleted_instance_uuids, last
+
+
+def _archive_key_column(table):
+    if table.name == "dns_domains":
+        # We have one table (dns_domains) where the key is called
+        # "domain" rather than "id"
+        return table.c.domain
+    return table.c.id
+
+
+def _archive_watermark(tablename):
+    """Returns the greatest key archived from a table so far, which is where
+    archiving the table restarts from, or None.
+    """
+    engine = get_engine()
+    metadata = MetaData()
+    metadata.bind = engine
+    try:
+        shadow_table = Table(_SHADOW_TABLE_PREFIX + tablename, metadata,
+                             autoload=True)
+    except NoSuchTableError:
+        return None
+    if 'id' not in shadow_table.c:
+        return None
+    return engine.execute(sql.select([func.max(shadow_table.c.id)])).scalar()
+
+
+class _BatchSizer(object):
+    """Adapts the number of rows handled per transaction so that each
+    transaction takes about target seconds, or keeps it fixed if target is
+    None.
+    """
+
+    # The number of rows of the first batch when adapting the batch size.
+    START = 100
+    # The batch size can at most halve or double from a batch to the next.
+    MAX_FACTOR = 2
+
+    def __init__(self, target=None, size=None):
+        self.target = target
+        self.size = size
+        if target is not None:
+            self.size = min(size or self.START, self.START)
+
+    def adapt(self, rows, seconds):
+        if self.target is None or rows < self.size:
+            return
+        if seconds <= 0:
+            factor = self.MAX_FACTOR
+        else:
+            factor = min(max(self.target / seconds, 1.0 / self.MAX_FACTOR),
+                         self.MAX_FACTOR)
+        self.size = max(1, int(self.size * factor))
+
+
+def _run_concurrently(func, args_list, max_workers):
+    """Calls func with each of the tuples of args_list, at most max_workers
+    at once, and returns the results in the same order. The first error, in
+    order, is raised once all calls are done.
+    """
+    semaphore = eventlet.semaphore.Semaphore(max(max_workers, 1))
+
+    def _call(args):
+        with semaphore:
+            return func(*args)
+
+    threads = [utils.spawn(_call, args) for args in args_list]
+    results = []
+    exc_info = None
+    for thread in threads:
+        try:
+            results.append(thread.wait())
+        except Exception:
+            results.append(None)
+            if exc_info is None:
+                exc_info = sys.exc_info()
+    if exc_info is not None:
+        six.reraise(*exc_info)
+    return results
 
 
-def archive_deleted_rows(max_rows=None):
+def _archive_levels(tables):
+    """Groups the tables so that the tables of a group do not reference each
+    other and are only referenced by the tables of the previous groups, so
+    that the tables of a group can be archived together once the previous
+    groups are archived.
+    """
+    referencing = collections.defaultdict(set)
+    for table in tables:
+        for fk in table.foreign_keys:
+            if fk.column.table is not table:
+                referencing[fk.column.table.name].add(table.name)
+    levels = {}
+    # Reverse sort the tables so we get the leaf nodes first for processing.
+    for table in reversed(tables):
+        levels[table.name] = max([levels[name] + 1
+                                  for name in referencing[table.name]
+                                  if name in levels] or [0])
+    groups = collections.defaultdict(list)
+    for table in reversed(tables):
+        groups[levels[table.name]].append(table.name)
+    return [groups[level] for level in sorted(groups)]
+
+
+def archive_deleted_rows(max_rows=None, max_workers=1, batch_time=None,
+                         report_fn=None):
     """Move up to max_rows rows from production tables to the corresponding
     shadow tables.
 
+    The tables which do not reference each other are archived concurrently,
+    by up to max_workers at once. Each table is archived from where its last
+    archival stopped, then from its start, in batches whose size is adapted
+    so that each transaction takes about batch_time seconds. If batch_time
+    is None, up to max_rows rows are archived from each table at once.
+
+    :param report_fn: function called with the name of each table rows were
+                      archived from, the number of rows and the time it took
+                      in seconds
     :returns: dict that maps table name to number of rows archived from that
               table, for example:
 
@@ -5618,28 +5795,72 @@ def archive_deleted_rows(max_rows=None):
     """
     table_to_rows_archived = {}
     deleted_instance_uuids = []
-    total_rows_archived = 0
+    # NOTE: The archiving threads of a group of tables share the number of
+    # rows left to archive. They are green threads so they can update it
+    # without locking as long as they do not yield in between.
+    budget = {'left': max_rows}
     meta = MetaData(get_engine(use_slave=True))
     meta.reflect()
-    # Reverse sort the tables so we get the leaf nodes first for processing.
-    for table in reversed(meta.sorted_tables):
-        tablename = table.name
+    # skip the special sqlalchemy-migrate migrate_version table and any
+    # shadow tables
+    tables = [table for table in meta.sorted_tables
+              if (table.name != 'migrate_version' and
+                  not table.name.startswith(_SHADOW_TABLE_PREFIX))]
+
+    def _archive_table(tablename):
+        start = time.time()
         rows_archived = 0
-        # skip the special sqlalchemy-migrate migrate_version table and any
-        # shadow tables
-        if (tablename == 'migrate_version' or
-                tablename.startswith(_SHADOW_TABLE_PREFIX)):
-            continue
-        rows_archived,\
-        deleted_instance_uuid = _archive_deleted_rows_for_table(
-                tablename, max_rows=max_rows - total_rows_archived)
-        total_rows_archived += rows_archived
-        if tablename == 'instances':
-            deleted_instance_uuids = deleted_instance_uuid
-        # Only report results for tables that had updates.
+        instance_uuids = []
+        sizer = _BatchSizer(batch_time, max_rows)
+        watermark = _archive_watermark(tablename)
+        after, until = watermark, None
+        soft_delete = True
+        while budget['left'] is None or budget['left'] > 0:
+            batch = sizer.size
+            if budget['left'] is not None:
+                batch = min(batch or budget['left'], budget['left'])
+                budget['left'] -= batch
+            batch_start = time.time()
+            rows, uuids, last = _archive_deleted_rows_for_table(
+                tablename, max_rows=batch, after=after, until=until,
+                soft_delete=soft_delete)
+            if budget['left'] is not None:
+                budget['left'] += batch - rows
+            sizer.adapt(rows, time.time() - batch_start)
+            soft_delete = False
+            rows_archived += rows
+            instance_uuids.extend(uuids)
+            if last is not None and rows:
+                after = last
+            elif watermark is not None:
+                # Archive the rows deleted since the previous archival with
+                # a key lower than where it stopped.
+                after, until, watermark = None, watermark, None
+            else:
+                break
+        seconds = time.time() - start
         if rows_archived:
-            table_to_rows_archived[tablename] = rows_archived
-        if total_rows_archived >= max_rows:
+            LOG.info('Archived %(rows)i rows from %(table)s in '
+                     '%(seconds).2f seconds (%(rate)i rows/s)',
+                     {'rows': rows_archived, 'table': tablename,
+                      'seconds': seconds,
+                      'rate': rows_archived / max(seconds, 0.001)})
+            if report_fn is not None:
+                report_fn(tablename, rows_archived, seconds)
+        return rows_archived, instance_uuids
+
+    for level in _archive_levels(tables):
+        results = _run_concurrently(_archive_table,
+                                    [(name,) for name in level],
+                                    max_workers)
+        for tablename, (rows_archived, instance_uuids) in zip(level,
+                                                             results):
+            if tablename == 'instances':
+                deleted_instance_uuids = instance_uuids
+            # Only report results for tables that had updates.
+            if rows_archived:
+                table_to_rows_archived[tablename] = rows_archived
+        if budget['left'] is not None and budget['left'] <= 0:
             break
     return table_to_rows_archived, deleted_instance_uuids
 
@@ -5650,9 +5871,59 @@ def _purgeable_tables(metadata):
                 t.name.endswith('migrate_version'))]
 
 
-def purge_shadow_tables(context, before_date, status_fn=None):
-    engine = get_engine(context=context)
+def _purge_shadow_table(engine, table, col, before_date, batch_time):
+    """Deletes the rows of a shadow table older than before_date in batches,
+    or all of them if before_date is None, and returns the number of rows
+    deleted.
+    """
     conn = engine.connect()
+    pk = list(table.primary_key.columns)
+    if batch_time is None or len(pk) != 1:
+        if col is not None:
+            delete = table.delete().where(col < before_date)
+        else:
+            delete = table.delete()
+        return conn.execute(delete).rowcount
+
+    pk = pk[0]
+    sizer = _BatchSizer(batch_time)
+    deleted = 0
+    # Each batch starts after the last key of the previous one, so that the
+    # rows which are not old enough yet are not scanned again by every batch.
+    last_key = None
+    while True:
+        start = time.time()
+        size = sizer.size
+        select = sql.select([pk])
+        if col is not None:
+            select = select.where(col < before_date)
+        if last_key is not None:
+            select = select.where(pk > last_key)
+        select = select.order_by(pk).limit(size)
+        keys = [r[0] for r in conn.execute(select).fetchall()]
+        if not keys:
+            break
+        with conn.begin():
+            rows = conn.execute(table.delete().where(pk.in_(keys))).rowcount
+        deleted += rows
+        last_key = keys[-1]
+        sizer.adapt(len(keys), time.time() - start)
+        if len(keys) < size:
+            break
+    return deleted
+
+
+def purge_shadow_tables(context, before_date, status_fn=None, max_workers=1,
+                        batch_time=None):
+    """Deletes the rows of the shadow tables older than before_date, or all
+    of them if before_date is None.
+
+    The shadow tables are purged concurrently, by up to max_workers at once.
+    If batch_time is given, the rows of each table are deleted in batches
+    whose size is adapted so that each transaction takes about batch_time
+    seconds.
+    """
+    engine = get_engine(context=context)
     metadata = MetaData()
     metadata.bind = engine
     metadata.reflect()
@@ -5669,7 +5940,7 @@ def purge_shadow_tables(context, before_date, status_fn=None):
         'shadow_instance_actions_events': 'created_at',
     }
 
-    for table in _purgeable_tables(metadata):
+    def _purge_table(table):
         if before_date is None:
             col = None
         elif table.name in overrides:
@@ -5684,21 +5955,30 @@ def purge_shadow_tables(context, before_date, status_fn=None):
             status_fn(_('Unable to purge table %(table)s because it '
                         'has no timestamp column') % {
                             'table': table.name})
-            continue
-
-        if col is not None:
-            delete = table.delete().where(col < before_date)
-        else:
-            delete = table.delete()
+            return 0
 
-        deleted = conn.execute(delete)
-        if deleted.rowcount > 0:
+        start = time.time()
+        deleted = _purge_shadow_table(engine, table, col, before_date,
+                                      batch_time)
+        seconds = time.time() - start
+        if deleted > 0:
             status_fn(_('Deleted %(rows)i rows from %(table)s based on '
-                        'timestamp column %(col)s') % {
-                            'rows': deleted.rowcount,
+                        'timestamp column %(col)s in %(seconds).2f seconds '
+                        '(%(rate)i rows/s)') % {
+                            'rows': deleted,
                             'table': table.name,
-                            'col': col is None and '(n/a)' or col.name})
-        total_deleted += deleted.rowcount
+                            'col': col is None and '(n/a)' or col.name,
+                            'seconds': seconds,
+                            'rate': deleted / max(seconds, 0.001)})
+        return deleted
+
+    # NOTE: The shadow tables do not have foreign keys, so they can be
+    # purged in any order.
+    tables = _purgeable_tables(metadata)
+    for deleted in _run_concurrently(_purge_table,
+                                     [(table,) for table in tables],
+                                     max_workers):
+        total_deleted += deleted
 
     return total_deleted
 
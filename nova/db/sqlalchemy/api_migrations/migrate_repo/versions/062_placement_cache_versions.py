@@ -0,0 +1,46 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from migrate import UniqueConstraint
+from oslo_utils import uuidutils
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    cache_versions = Table('placement_cache_versions', meta,
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('id', Integer, primary_key=True, nullable=False,
+               autoincrement=True),
+        Column('name', String(length=255), nullable=False),
+        Column('version', String(length=36), nullable=False),
+        UniqueConstraint('name', name='uniq_placement_cache_versions0name'),
+        mysql_engine='InnoDB',
+        mysql_charset='latin1'
+    )
+
+    cache_versions.create(checkfirst=True)
+
+    # Seed the version row of the sharing providers cache so that writers
+    # only ever have to update it.
+    if not cache_versions.select().where(
+            cache_versions.c.name == 'sharing_providers').execute().first():
+        cache_versions.insert().execute(
+            name='sharing_providers', version=uuidutils.generate_uuid())
@@ -399,6 +399,21 @@ class PlacementAggregate(API_BASE):
     uuid = Column(String(36), index=True)
 
 
+class PlacementCacheVersion(API_BASE):
+    """The version of a placement cache, changed whenever the data it caches
+    is changed.
+    """
+    __tablename__ = 'placement_cache_versions'
+    __table_args__ = (
+        schema.UniqueConstraint("name",
+            name="uniq_placement_cache_versions0name"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False)
+    version = Column(String(36), nullable=False)
+
+
 class InstanceGroupMember(API_BASE):
     """Represents the members for an instance group."""
     __tablename__ = 'instance_group_member'
@@ -221,6 +221,8 @@ class Instance(BASE, NovaBase, models.SoftDeleteMixin):
               'deleted', 'created_at'),
         Index('instances_updated_at_project_id_idx',
               'updated_at', 'project_id'),
+        Index('instances_updated_at_id_idx',
+              'updated_at', 'id'),
         schema.UniqueConstraint('uuid', name='uniq_instances0uuid'),
     )
     injected_files = []
@@ -764,6 +766,7 @@ class Migration(BASE, NovaBase, models.SoftDeleteMixin):
               'status'),
         Index('migrations_uuid', 'uuid', unique=True),
         Index('migrations_updated_at_idx', 'updated_at'),
+        Index('migrations_deleted_created_at_idx', 'deleted', 'created_at'),
     )
     id = Column(Integer, primary_key=True, nullable=False)
     # NOTE(tr3buchet): the ____compute variables are instance['host']
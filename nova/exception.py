@@ -496,6 +496,11 @@ class ServiceUnavailable(Invalid):
     msg_fmt = _("Service is unavailable at this time.")
 
 
+class ValidationTimeout(NovaException):
+    msg_fmt = _("Timed out after %(timeout)d seconds validating the "
+                "%(validation)s of the request.")
+
+
 class ServiceNotUnique(Invalid):
     msg_fmt = _("More than one possible service found.")
 
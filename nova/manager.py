@@ -51,21 +51,140 @@ This module provides Manager, a base class for managers.
 
 """
 
+import functools
+import random
+
+from oslo_log import log as logging
 from oslo_service import periodic_task
+from oslo_utils import timeutils
 import six
 
 import nova.conf
 from nova.db import base
 from nova import profiler
 from nova import rpc
+from nova import utils
 
 
 CONF = nova.conf.CONF
+LOG = logging.getLogger(__name__)
+
+
+class PeriodicTaskStats(object):
+    """Runtime metrics of a periodic task."""
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        # Runs longer than the interval of the task
+        self.overruns = 0
+        # Runs of a dedicated task skipped because the previous one was still
+        # running
+        self.skipped = 0
+        self.last_runtime = 0.0
+        self.max_runtime = 0.0
+        self.total_runtime = 0.0
+        # How late the task started compared to its interval
+        self.max_delay = 0.0
+        self.last_start = None
+
+    def to_dict(self):
+        return {'runs': self.runs,
+                'failures': self.failures,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'last_runtime': self.last_runtime,
+                'max_runtime': self.max_runtime,
+                'total_runtime': self.total_runtime,
+                'max_delay': self.max_delay}
 
 
 class PeriodicTasks(periodic_task.PeriodicTasks):
+    """Periodic tasks of a manager.
+
+    On top of the oslo.service scheduling, the first run of each task is
+    advanced by a random fraction of its interval, see periodic_task_jitter,
+    the runtime of each task is recorded and the tasks listed in
+    periodic_task_dedicated_workers run in their own greenthread.
+    """
+
     def __init__(self):
         super(PeriodicTasks, self).__init__(CONF)
+        self._periodic_task_stats = {}
+        self._periodic_tasks_running = set()
+        tasks = []
+        for name, task in self._periodic_tasks:
+            spacing = self._periodic_spacing[name]
+            last_run = self._periodic_last_run[name]
+            if last_run is not None and CONF.periodic_task_jitter:
+                self._periodic_last_run[name] = last_run - random.uniform(
+                    0, spacing * CONF.periodic_task_jitter)
+            self._periodic_task_stats[name] = PeriodicTaskStats()
+            tasks.append((name, self._wrap_periodic_task(name, task)))
+        # NOTE: This shadows the list of tasks of the class with the wrapped
+        # tasks for this instance.
+        self._periodic_tasks = tasks
+
+    def _wrap_periodic_task(self, name, task):
+        dedicated = name in CONF.periodic_task_dedicated_workers
+
+        def _timed_task(self, context):
+            spacing = self._periodic_spacing[name]
+            stats = self._periodic_task_stats[name]
+            start = timeutils.now()
+            if stats.last_start is not None:
+                stats.max_delay = max(
+                    stats.max_delay, start - stats.last_start - spacing)
+            stats.last_start = start
+            try:
+                task(self, context)
+            except BaseException:
+                stats.failures += 1
+                raise
+            finally:
+                runtime = timeutils.now() - start
+                stats.runs += 1
+                stats.last_runtime = runtime
+                stats.max_runtime = max(stats.max_runtime, runtime)
+                stats.total_runtime += runtime
+                LOG.debug('Periodic task %(task)s ran in %(time).3f seconds',
+                          {'task': name, 'time': runtime})
+                if runtime > spacing:
+                    stats.overruns += 1
+                    LOG.warning('Periodic task %(task)s took %(time).3f '
+                                'seconds, longer than its %(spacing)d seconds '
+                                'interval.',
+                                {'task': name, 'time': runtime,
+                                 'spacing': spacing})
+
+        def _run_in_worker(self, context):
+            try:
+                _timed_task(self, context)
+            except Exception:
+                LOG.exception('Error during %s', name)
+            finally:
+                self._periodic_tasks_running.discard(name)
+
+        @functools.wraps(task)
+        def _run(self, context):
+            if not dedicated:
+                return _timed_task(self, context)
+            if name in self._periodic_tasks_running:
+                self._periodic_task_stats[name].skipped += 1
+                LOG.warning('Skipping periodic task %s because its previous '
+                            'run is still in progress.', name)
+                return
+            self._periodic_tasks_running.add(name)
+            utils.spawn(_run_in_worker, self, context)
+
+        return _run
+
+    def get_periodic_task_stats(self):
+        """Returns a dict, keyed by periodic task name, of dicts of the
+        runtime metrics of the task.
+        """
+        return {name: stats.to_dict()
+                for name, stats in self._periodic_task_stats.items()}
 
 
 class ManagerMeta(profiler.get_traced_meta(), type(PeriodicTasks)):
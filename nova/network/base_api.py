@@ -261,6 +261,14 @@ class NetworkAPI(base.Base):
         """Template method, so a subclass can implement for neutron/network."""
         raise NotImplementedError()
 
+    def heal_instances_nw_info_cache(self, context, instances):
+        """Refresh the network info cache of several instances at once,
+        only writing the caches which changed.
+
+        :returns: The list of the instances whose cache was updated.
+        """
+        raise NotImplementedError()
+
     def validate_networks(self, context, requested_networks, num_instances):
         """validate the networks passed at the time of creating
         the server.
@@ -15,13 +15,16 @@
 #    under the License.
 #
 
+import collections
 import copy
 import time
 
 from keystoneauth1 import loading as ks_loading
 from neutronclient.common import exceptions as neutron_client_exc
 from neutronclient.v2_0 import client as clientv20
+from oslo_concurrency import lockutils
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import excutils
 from oslo_utils import strutils
 from oslo_utils import uuidutils
@@ -303,6 +306,73 @@ def _filter_hypervisor_macs(instance, requested_ports_dict, hypervisor_macs):
     return available_macs
 
 
+def _get_segments_physnet(net_id, segments):
+    """Returns the physnet name of the first segment of a multi-segment
+    network defining one, or None if the network has no segments.
+    """
+    for net in segments:
+        # NOTE(vladikr): In general, "multi-segments" network is a
+        # combination of L2 segments. The current implementation
+        # contains a vxlan and vlan(s) segments, where only a vlan
+        # network will have a physical_network specified, but may
+        # change in the future. The purpose of this method
+        # is to find a first segment that provides a physical network.
+        # TODO(vladikr): Additional work will be required to handle the
+        # case of multiple vlan segments associated with different
+        # physical networks.
+        physnet_name = net.get('provider:physical_network')
+        if physnet_name:
+            return physnet_name
+
+    # Raising here as at least one segment should
+    # have a physical network provided.
+    if segments:
+        msg = (_("None of the segments of network %s provides a "
+                 "physical_network") % net_id)
+        raise exception.NovaException(message=msg)
+
+
+def _nw_info_equal(nw_info, other_nw_info):
+    """Compares all the fields of two NetworkInfo, including the ones the
+    model classes leave out of their equality checks.
+    """
+    return (jsonutils.loads(nw_info.json()) ==
+            jsonutils.loads(other_nw_info.json()))
+
+
+class _PrefetchedResources(object):
+    """The neutron resources needed to build the network info of the ports
+    of several instances, retrieved in bulk and indexed for the lookups done
+    while building the VIF models of each port.
+    """
+
+    def __init__(self, networks, subnets, dhcp_ports, floating_ips,
+                 multi_provider):
+        self.networks = {net['id']: net for net in networks}
+        self.subnets = {subnet['id']: subnet for subnet in subnets}
+        self.dhcp_ports = collections.defaultdict(list)
+        for port in dhcp_ports:
+            self.dhcp_ports[port['network_id']].append(port)
+        self.floating_ips = collections.defaultdict(list)
+        for fip in floating_ips:
+            key = (fip['port_id'], fip['fixed_ip_address'])
+            self.floating_ips[key].append(fip)
+        self.multi_provider = multi_provider
+
+    def get_physnet_tunneled_info(self, net_id):
+        """Same as API._get_physnet_tunneled_info, from the prefetched
+        network.
+        """
+        net = self.networks[net_id]
+        if self.multi_provider:
+            physnet_name = _get_segments_physnet(net_id,
+                                                 net.get('segments', {}))
+            if physnet_name:
+                return physnet_name, False
+        return (net.get('provider:physical_network'),
+                net.get('provider:network_type') in L3_NETWORK_TYPES)
+
+
 class API(base_api.NetworkAPI):
     """API for interacting with the neutron 2.x API."""
 
@@ -1708,6 +1778,126 @@ class API(base_api.NetworkAPI):
                                                  refresh_vif_id)
         return network_model.NetworkInfo.hydrate(nw_info)
 
+    def heal_instances_nw_info_cache(self, context, instances):
+        """Refresh the network info cache of several instances at once.
+
+        The network info of all the instances is built from neutron
+        resources retrieved in bulk, without holding the refresh_cache lock
+        of the instances. Only the caches which changed are then written, one
+        by one with the lock held, unless they were updated in the meantime
+        by another operation, in which case they are left to the next heal.
+
+        :param context: The request context.
+        :param instances: List of Instance objects, with their info_cache
+            loaded.
+        :returns: The list of the instances whose cache was updated.
+        """
+        nw_infos = self._get_instances_nw_info(context, instances)
+        healed = []
+        for instance in instances:
+            cached_nw_info = instance.get_network_info()
+            nw_info = nw_infos[instance.uuid]
+            if _nw_info_equal(nw_info, cached_nw_info):
+                continue
+            with lockutils.lock('refresh_cache-%s' % instance.uuid):
+                compute_utils.refresh_info_cache_for_instance(context,
+                                                              instance)
+                if not _nw_info_equal(instance.get_network_info(),
+                                      cached_nw_info):
+                    LOG.debug('The network info cache of the instance was '
+                              'updated while being healed, it will be '
+                              'healed later.', instance=instance)
+                    continue
+                try:
+                    base_api.update_instance_cache_with_nw_info(
+                        self, context, instance, nw_info=nw_info,
+                        update_cells=False)
+                except (exception.InstanceNotFound,
+                        exception.InstanceInfoCacheNotFound):
+                    LOG.debug('Instance no longer exists. Unable to refresh',
+                              instance=instance)
+                    continue
+            healed.append(instance)
+        return healed
+
+    def _get_instances_nw_info(self, context, instances):
+        """Builds the network info of several instances from the ports,
+        networks, subnets, DHCP ports and floating IPs retrieved with a few
+        filtered list calls, instead of several calls per port.
+
+        As when refreshing the network info of a single instance, only the
+        ports in the network info cache of the instance are kept, in the
+        same order.
+
+        :returns: dict, keyed by instance UUID, of NetworkInfo
+        """
+        client = get_client(context, admin=True)
+        cached_nw_infos = {instance.uuid: instance.get_network_info()
+                           for instance in instances}
+
+        data = client.list_ports(device_id=list(cached_nw_infos))
+        ports = data.get('ports', [])
+
+        net_ids = set(port['network_id'] for port in ports)
+        net_ids.update(vif['network']['id']
+                       for nw_info in cached_nw_infos.values()
+                       for vif in nw_info)
+        networks = []
+        if net_ids:
+            data = client.list_networks(id=list(net_ids))
+            networks = data.get('networks', [])
+
+        subnet_ids = set(ip['subnet_id']
+                         for port in ports for ip in port['fixed_ips'])
+        subnets = []
+        dhcp_ports = []
+        if subnet_ids:
+            data = client.list_subnets(id=list(subnet_ids))
+            subnets = data.get('subnets', [])
+        if subnets:
+            data = client.list_ports(
+                network_id=list(set(subnet['network_id']
+                                    for subnet in subnets)),
+                device_owner='network:dhcp')
+            dhcp_ports = data.get('ports', [])
+
+        floating_ips = []
+        if ports:
+            floating_ips = self._safe_get_floating_ips(
+                client, port_id=[port['id'] for port in ports])
+
+        prefetched = _PrefetchedResources(
+            networks, subnets, dhcp_ports, floating_ips,
+            self._has_multi_provider_extension(context, neutron=client))
+
+        ports_by_instance = collections.defaultdict(dict)
+        for port in ports:
+            ports_by_instance[port['device_id']][port['id']] = port
+
+        nw_infos = {}
+        for instance in instances:
+            cached_nw_info = cached_nw_infos[instance.uuid]
+            instance_ports = ports_by_instance[instance.uuid]
+            instance_net_ids = set(vif['network']['id']
+                                   for vif in cached_nw_info)
+            instance_networks = [net for net in networks
+                                 if net['id'] in instance_net_ids]
+            preexisting_port_ids = self._get_preexisting_port_ids(instance)
+            nw_info = network_model.NetworkInfo()
+            for vif in cached_nw_info:
+                port = instance_ports.get(vif['id'])
+                if port and port['tenant_id'] == instance.project_id:
+                    nw_info.append(self._build_vif_model(
+                        context, client, port, instance_networks,
+                        preexisting_port_ids, prefetched=prefetched))
+                else:
+                    LOG.info('Port %s from network info_cache is no '
+                             'longer associated with instance in Neutron. '
+                             'Removing from network info_cache.', vif['id'],
+                             instance=instance)
+            nw_infos[instance.uuid] = nw_info
+        return nw_infos
+
     def _gather_port_ids_and_networks(self, context, instance, networks=None,
                                       port_ids=None, neutron=None):
         """Return an instance's complete list of port_ids and networks."""
@@ -1839,27 +2029,10 @@ class API(base_api.NetworkAPI):
         if self._has_multi_provider_extension(context, neutron=neutron):
             network = neutron.show_network(net_id,
                                            fields='segments').get('network')
-            segments = network.get('segments', {})
-            for net in segments:
-                # NOTE(vladikr): In general, "multi-segments" network is a
-                # combination of L2 segments. The current implementation
-                # contains a vxlan and vlan(s) segments, where only a vlan
-                # network will have a physical_network specified, but may
-                # change in the future. The purpose of this method
-                # is to find a first segment that provides a physical network.
-                # TODO(vladikr): Additional work will be required to handle the
-                # case of multiple vlan segments associated with different
-                # physical networks.
-                physnet_name = net.get('provider:physical_network')
-                if physnet_name:
-                    return physnet_name, False
-
-            # Raising here as at least one segment should
-            # have a physical network provided.
-            if segments:
-                msg = (_("None of the segments of network %s provides a "
-                         "physical_network") % net_id)
-                raise exception.NovaException(message=msg)
+            physnet_name = _get_segments_physnet(
+                net_id, network.get('segments', {}))
+            if physnet_name:
+                return physnet_name, False
 
         net = neutron.show_network(
             net_id, fields=['provider:physical_network',
@@ -2650,12 +2823,16 @@ class API(base_api.NetworkAPI):
         """Force add a network to the project."""
         raise NotImplementedError()
 
-    def _nw_info_get_ips(self, client, port):
+    def _nw_info_get_ips(self, client, port, prefetched=None):
         network_IPs = []
         for fixed_ip in port['fixed_ips']:
             fixed = network_model.FixedIP(address=fixed_ip['ip_address'])
-            floats = self._get_floating_ips_by_fixed_and_port(
-                client, fixed_ip['ip_address'], port['id'])
+            if prefetched is not None:
+                floats = prefetched.floating_ips.get(
+                    (port['id'], fixed_ip['ip_address']), [])
+            else:
+                floats = self._get_floating_ips_by_fixed_and_port(
+                    client, fixed_ip['ip_address'], port['id'])
             for ip in floats:
                 fip = network_model.IP(address=ip['floating_ip_address'],
                                        type='floating')
@@ -2663,16 +2840,17 @@ class API(base_api.NetworkAPI):
             network_IPs.append(fixed)
         return network_IPs
 
-    def _nw_info_get_subnets(self, context, port, network_IPs, client=None):
-        subnets = self._get_subnets_from_port(context, port, client)
+    def _nw_info_get_subnets(self, context, port, network_IPs, client=None,
+                             prefetched=None):
+        subnets = self._get_subnets_from_port(context, port, client,
+                                              prefetched=prefetched)
         for subnet in subnets:
             subnet['ips'] = [fixed_ip for fixed_ip in network_IPs
                              if fixed_ip.is_in_subnet(subnet)]
         return subnets
 
-    def _nw_info_build_network(self, context, port, networks, subnets):
-        # TODO(stephenfin): Pass in an existing admin client if available.
-        neutron = get_client(context, admin=True)
+    def _nw_info_build_network(self, context, port, networks, subnets,
+                               prefetched=None):
         network_name = None
         network_mtu = None
         for net in networks:
@@ -2724,8 +2902,15 @@ class API(base_api.NetworkAPI):
         if bridge is not None and vif_type != network_model.VIF_TYPE_DVS:
             bridge = bridge[:network_model.NIC_NAME_LEN]
 
-        physnet, tunneled = self._get_physnet_tunneled_info(
-            context, neutron, port['network_id'])
+        if (prefetched is not None and
+                port['network_id'] in prefetched.networks):
+            physnet, tunneled = prefetched.get_physnet_tunneled_info(
+                port['network_id'])
+        else:
+            # TODO(stephenfin): Pass in an existing admin client if available.
+            neutron = get_client(context, admin=True)
+            physnet, tunneled = self._get_physnet_tunneled_info(
+                context, neutron, port['network_id'])
         network = network_model.Network(
             id=port['network_id'],
             bridge=bridge,
@@ -2755,7 +2940,7 @@ class API(base_api.NetworkAPI):
                 if vif.get('preserve_on_delete')]
 
     def _build_vif_model(self, context, client, current_neutron_port,
-                         networks, preexisting_port_ids):
+                         networks, preexisting_port_ids, prefetched=None):
         """Builds a ``nova.network.model.VIF`` object based on the parameters
         and current state of the port in Neutron.
 
@@ -2769,6 +2954,9 @@ class API(base_api.NetworkAPI):
         :param preexisting_port_ids: List of IDs of ports attached to a
             given server instance which Nova did not create and therefore
             should not delete when the port is detached from the server.
+        :param prefetched: Optional _PrefetchedResources holding the
+            networks, subnets, DHCP ports and floating IPs of the port, in
+            which case neutron isn't queried for them.
         :return: nova.network.model.VIF object which represents a port in the
             instance network info cache.
         """
@@ -2778,17 +2966,20 @@ class API(base_api.NetworkAPI):
             vif_active = True
 
         network_IPs = self._nw_info_get_ips(client,
-                                            current_neutron_port)
+                                            current_neutron_port,
+                                            prefetched=prefetched)
         subnets = self._nw_info_get_subnets(context,
                                             current_neutron_port,
-                                            network_IPs, client)
+                                            network_IPs, client,
+                                            prefetched=prefetched)
 
         devname = "tap" + current_neutron_port['id']
         devname = devname[:network_model.NIC_NAME_LEN]
 
         network, ovs_interfaceid = (
             self._nw_info_build_network(context, current_neutron_port,
-                                        networks, subnets))
+                                        networks, subnets,
+                                        prefetched=prefetched))
         preserve_on_delete = (current_neutron_port['id'] in
                               preexisting_port_ids)
 
@@ -2922,7 +3113,8 @@ class API(base_api.NetworkAPI):
 
         return nw_info
 
-    def _get_subnets_from_port(self, context, port, client=None):
+    def _get_subnets_from_port(self, context, port, client=None,
+                               prefetched=None):
         """Return the subnets for a given port."""
 
         fixed_ips = port['fixed_ips']
@@ -2933,11 +3125,17 @@ class API(base_api.NetworkAPI):
         # related to the port. To avoid this, the method returns here.
         if not fixed_ips:
             return []
-        if not client:
-            client = get_client(context)
-        search_opts = {'id': list(set(ip['subnet_id'] for ip in fixed_ips))}
-        data = client.list_subnets(**search_opts)
-        ipam_subnets = data.get('subnets', [])
+        subnet_ids = list(set(ip['subnet_id'] for ip in fixed_ips))
+        if prefetched is not None:
+            ipam_subnets = [prefetched.subnets[subnet_id]
+                            for subnet_id in subnet_ids
+                            if subnet_id in prefetched.subnets]
+        else:
+            if not client:
+                client = get_client(context)
+            search_opts = {'id': subnet_ids}
+            data = client.list_subnets(**search_opts)
+            ipam_subnets = data.get('subnets', [])
         subnets = []
 
         for subnet in ipam_subnets:
@@ -2950,10 +3148,14 @@ class API(base_api.NetworkAPI):
                 subnet_dict['ipv6_address_mode'] = subnet['ipv6_address_mode']
 
             # attempt to populate DHCP server field
-            search_opts = {'network_id': subnet['network_id'],
-                           'device_owner': 'network:dhcp'}
-            data = client.list_ports(**search_opts)
-            dhcp_ports = data.get('ports', [])
+            if prefetched is not None:
+                dhcp_ports = prefetched.dhcp_ports.get(subnet['network_id'],
+                                                       [])
+            else:
+                search_opts = {'network_id': subnet['network_id'],
+                               'device_owner': 'network:dhcp'}
+                data = client.list_ports(**search_opts)
+                dhcp_ports = data.get('ports', [])
             for p in dhcp_ports:
                 for ip_pair in p['fixed_ips']:
                     if ip_pair['subnet_id'] == subnet['id']:
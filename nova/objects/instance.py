@@ -12,7 +12,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import contextlib
+import os
+import sys
 
 from oslo_config import cfg
 from oslo_db import exception as db_exc
@@ -20,6 +23,7 @@ from oslo_log import log as logging
 from oslo_serialization import jsonutils
 from oslo_utils import timeutils
 from oslo_utils import versionutils
+from oslo_versionedobjects import base as ovo_base
 from sqlalchemy import or_
 from sqlalchemy.sql import func
 from sqlalchemy.sql import null
@@ -74,6 +78,61 @@ INSTANCE_DEFAULT_FIELDS = ['metadata', 'system_metadata',
 # Maximum count of tags to one instance
 MAX_TAG_COUNT = 50
 
+# A warning is logged each time a call site lazy-loads an attribute of
+# Instance objects this many more times, since each lazy-load costs a database
+# or conductor round trip.
+LAZY_LOAD_STORM_THRESHOLD = 100
+
+# Counter, keyed by (call site, attribute name), of the lazy-loads of the
+# attributes of Instance objects by this process
+_LAZY_LOADS = collections.Counter()
+
+# The modules whose frames are skipped to find the call site of a lazy-load
+_LAZY_LOAD_INTERNAL_FILES = frozenset(
+    os.path.splitext(module.__file__)[0]
+    for module in (sys.modules[__name__], base, ovo_base))
+
+
+def _get_lazy_load_call_site():
+    """Returns the module, line and function of the code which triggered the
+    lazy-load of an attribute of an Instance object.
+    """
+    frame = sys._getframe(1)
+    while (frame.f_back is not None and
+           os.path.splitext(frame.f_code.co_filename)[0] in
+           _LAZY_LOAD_INTERNAL_FILES):
+        frame = frame.f_back
+    return '%s:%d(%s)' % (frame.f_globals.get('__name__'), frame.f_lineno,
+                          frame.f_code.co_name)
+
+
+def _record_lazy_load(attrname, uuid):
+    call_site = _get_lazy_load_call_site()
+    key = (call_site, attrname)
+    _LAZY_LOADS[key] += 1
+    count = _LAZY_LOADS[key]
+    if count % LAZY_LOAD_STORM_THRESHOLD == 0:
+        LOG.warning("'%(attr)s' was lazy-loaded on %(count)d Instance objects "
+                    "by %(call_site)s, consider loading it with the "
+                    "instances or with InstanceList.fill_attrs().",
+                    {'attr': attrname, 'count': count,
+                     'call_site': call_site})
+    else:
+        LOG.debug("Lazy-loading '%(attr)s' on Instance uuid %(uuid)s from "
+                  "%(call_site)s",
+                  {'attr': attrname, 'uuid': uuid, 'call_site': call_site})
+
+
+def get_lazy_load_stats():
+    """Returns a dict, keyed by (call site, attribute name), of the number of
+    lazy-loads of the attributes of Instance objects by this process.
+    """
+    return dict(_LAZY_LOADS)
+
+
+def reset_lazy_load_stats():
+    _LAZY_LOADS.clear()
+
 
 def _expected_cols(expected_attrs):
     """Return expected_attrs that are columns needing joining.
@@ -102,6 +161,26 @@ def _expected_cols(expected_attrs):
     return sorted(list(set(expected_cols)), key=expected_cols.index)
 
 
+def _projected_cols(columns):
+    """Return the columns to load for a projection of the instances, or None
+    to load whole instances.
+
+    The id and uuid are always loaded since the instances can not be saved or
+    lazy-load anything without them.
+    """
+    if columns is None:
+        return None
+    unknown = [column for column in columns
+               if column not in Instance.fields or
+               column in INSTANCE_OPTIONAL_ATTRS]
+    if unknown:
+        raise exception.ObjectActionError(
+            action='project',
+            reason=_('%s are not columns of instances') %
+                   ', '.join(sorted(unknown)))
+    return sorted(set(columns) | set(['id', 'uuid']))
+
+
 _NO_DATA_SENTINEL = object()
 
 
@@ -357,10 +436,12 @@ class Instance(base.NovaPersistentObject, base.NovaObject,
         self.obj_reset_changes(['flavor', 'old_flavor', 'new_flavor'])
 
     @staticmethod
-    def _from_db_object(context, instance, db_inst, expected_attrs=None):
+    def _from_db_object(context, instance, db_inst, expected_attrs=None,
+                        columns=None):
         """Method to help with migration to objects.
 
-        Converts a database entity to a formal object.
+        Converts a database entity to a formal object. If columns is given,
+        only those columns were loaded and are set on the object.
         """
         instance._context = context
         if expected_attrs is None:
@@ -369,6 +450,8 @@ class Instance(base.NovaPersistentObject, base.NovaObject,
         for field in instance.fields:
             if field in INSTANCE_OPTIONAL_ATTRS:
                 continue
+            elif columns is not None and field not in columns:
+                continue
             elif field == 'deleted':
                 instance.deleted = db_inst['deleted'] == db_inst['id']
             elif field == 'cleaned':
@@ -1106,11 +1189,7 @@ class Instance(base.NovaPersistentObject, base.NovaObject,
                 action='obj_load_attr',
                 reason=_('attribute %s not lazy-loadable') % attrname)
 
-        LOG.debug("Lazy-loading '%(attr)s' on %(name)s uuid %(uuid)s",
-                  {'attr': attrname,
-                   'name': self.obj_name(),
-                   'uuid': self.uuid,
-                   })
+        _record_lazy_load(attrname, self.uuid)
 
         # NOTE(danms): We handle some fields differently here so that we
         # can be more efficient
@@ -1252,7 +1331,8 @@ class Instance(base.NovaPersistentObject, base.NovaObject,
             self._context, self.uuid)
 
 
-def _make_instance_list(context, inst_list, db_inst_list, expected_attrs):
+def _make_instance_list(context, inst_list, db_inst_list, expected_attrs,
+                        columns=None):
     get_fault = expected_attrs and 'fault' in expected_attrs
     inst_faults = {}
     if get_fault:
@@ -1271,7 +1351,7 @@ def _make_instance_list(context, inst_list, db_inst_list, expected_attrs):
     for db_inst in db_inst_list:
         inst_obj = inst_cls._from_db_object(
                 context, inst_cls(context), db_inst,
-                expected_attrs=expected_attrs)
+                expected_attrs=expected_attrs, columns=columns)
         if get_fault:
             inst_obj.fault = inst_faults.get(inst_obj.uuid, None)
         inst_list.objects.append(inst_obj)
@@ -1303,7 +1383,8 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
     # Version 2.2: Pagination for get_active_by_window_joined()
     # Version 2.3: Add get_count_by_vm_state()
     # Version 2.4: Add get_counts()
-    VERSION = '2.4'
+    # Version 2.5: Add columns to get_by_filters()
+    VERSION = '2.5'
 
     fields = {
         'objects': fields.ListOfObjectsField('Instance'),
@@ -1314,34 +1395,44 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
     def _get_by_filters_impl(cls, context, filters,
                        sort_key='created_at', sort_dir='desc', limit=None,
                        marker=None, expected_attrs=None, use_slave=False,
-                       sort_keys=None, sort_dirs=None):
+                       sort_keys=None, sort_dirs=None, columns=None):
         if sort_keys or sort_dirs:
             db_inst_list = db.instance_get_all_by_filters_sort(
                 context, filters, limit=limit, marker=marker,
                 columns_to_join=_expected_cols(expected_attrs),
-                sort_keys=sort_keys, sort_dirs=sort_dirs)
+                sort_keys=sort_keys, sort_dirs=sort_dirs, columns=columns)
         else:
             db_inst_list = db.instance_get_all_by_filters(
                 context, filters, sort_key, sort_dir, limit=limit,
-                marker=marker, columns_to_join=_expected_cols(expected_attrs))
+                marker=marker, columns_to_join=_expected_cols(expected_attrs),
+                columns=columns)
         return db_inst_list
 
     @base.remotable_classmethod
     def get_by_filters(cls, context, filters,
                        sort_key='created_at', sort_dir='desc', limit=None,
                        marker=None, expected_attrs=None, use_slave=False,
-                       sort_keys=None, sort_dirs=None):
+                       sort_keys=None, sort_dirs=None, columns=None):
+        """Get the instances matching the filters.
+
+        :param columns: List of the column fields to load, for when the caller
+                        does not need whole instances. Only these fields, the
+                        id, the uuid and expected_attrs are set on the
+                        returned instances, anything else is lazy-loaded.
+        """
+        columns = _projected_cols(columns)
         db_inst_list = cls._get_by_filters_impl(
             context, filters, sort_key=sort_key, sort_dir=sort_dir,
             limit=limit, marker=marker, expected_attrs=expected_attrs,
-            use_slave=use_slave, sort_keys=sort_keys, sort_dirs=sort_dirs)
+            use_slave=use_slave, sort_keys=sort_keys, sort_dirs=sort_dirs,
+            columns=columns)
         # NOTE(melwitt): _make_instance_list could result in joined objects'
         # (from expected_attrs) _from_db_object methods being called during
         # Instance._from_db_object, each of which might choose to perform
         # database writes. So, we call this outside of _get_by_filters_impl to
         # avoid being nested inside a 'reader' database transaction context.
         return _make_instance_list(context, cls(), db_inst_list,
-                                   expected_attrs)
+                                   expected_attrs, columns=columns)
 
     @staticmethod
     @db.select_db_reader_mode
@@ -1487,6 +1578,59 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
 
         return faults_by_uuid.keys()
 
+    def fill_attrs(self, attrs):
+        """Batch query the database for the attributes missing on our
+        instances, instead of lazy-loading them one instance at a time.
+
+        :param attrs: A list of attributes which can be passed as
+                      expected_attrs to get_by_filters(), or 'fault'.
+        :returns: A list of instance uuids which could not be found in the
+                  database, and for which the attributes are still missing.
+        """
+        attrs = set(attrs)
+        if 'fault' in attrs:
+            attrs.remove('fault')
+            if any('fault' not in instance for instance in self):
+                self.fill_faults()
+        for attr in attrs:
+            if attr not in INSTANCE_OPTIONAL_ATTRS or attr == 'ec2_ids':
+                raise exception.ObjectActionError(
+                    action='fill_attrs',
+                    reason=_('attribute %s can not be filled') % attr)
+
+        missing = [instance for instance in self
+                   if any(attr not in instance for attr in attrs)]
+        if not missing:
+            return []
+        # NOTE: The flavors of an instance are loaded together.
+        expected_attrs = set('flavor' if 'flavor' in attr else attr
+                             for attr in attrs)
+        with utils.temporary_mutation(self._context, read_deleted='yes'):
+            db_instances = self.get_by_filters(
+                self._context,
+                {'uuid': [instance.uuid for instance in missing]},
+                expected_attrs=sorted(expected_attrs))
+        db_instances_by_uuid = {db_instance.uuid: db_instance
+                                for db_instance in db_instances}
+
+        not_found = []
+        for instance in missing:
+            db_instance = db_instances_by_uuid.get(instance.uuid)
+            if db_instance is None:
+                not_found.append(instance.uuid)
+                continue
+            filled = set()
+            for attr in attrs:
+                fields_to_fill = (('flavor', 'old_flavor', 'new_flavor')
+                                  if 'flavor' in attr else (attr,))
+                for field in fields_to_fill:
+                    if field not in instance and field in db_instance:
+                        setattr(instance, field, getattr(db_instance, field))
+                        filled.add(field)
+            if filled:
+                instance.obj_reset_changes(filled, recursive=True)
+        return not_found
+
     @base.remotable_classmethod
     def get_uuids_by_host(cls, context, host):
         return db.instance_get_all_uuids_by_host(context, host)
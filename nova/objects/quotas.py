@@ -78,7 +78,7 @@ class Quotas(base.NovaObject):
         self.obj_reset_changes()
 
     @staticmethod
-    @db_api.api_context_manager.reader
+    @db_api.select_api_db_reader_mode
     def _get_from_db(context, project_id, resource, user_id=None):
         model = api_models.ProjectUserQuota if user_id else api_models.Quota
         query = context.session.query(model).\
@@ -96,14 +96,14 @@ class Quotas(base.NovaObject):
         return result
 
     @staticmethod
-    @db_api.api_context_manager.reader
+    @db_api.select_api_db_reader_mode
     def _get_all_from_db(context, project_id):
         return context.session.query(api_models.ProjectUserQuota).\
                         filter_by(project_id=project_id).\
                         all()
 
     @staticmethod
-    @db_api.api_context_manager.reader
+    @db_api.select_api_db_reader_mode
     def _get_all_from_db_by_project(context, project_id):
         # by_project refers to the returned dict that has a 'project_id' key
         rows = context.session.query(api_models.Quota).\
@@ -115,7 +115,7 @@ class Quotas(base.NovaObject):
         return result
 
     @staticmethod
-    @db_api.api_context_manager.reader
+    @db_api.select_api_db_reader_mode
     def _get_all_from_db_by_project_and_user(context, project_id, user_id):
         # by_project_and_user refers to the returned dict that has
         # 'project_id' and 'user_id' keys
@@ -154,7 +154,7 @@ class Quotas(base.NovaObject):
                                                      user_id=user_id)
 
     @staticmethod
-    @db_api.api_context_manager.reader
+    @db_api.select_api_db_reader_mode
     def _get_class_from_db(context, class_name, resource):
         result = context.session.query(api_models.QuotaClass).\
                         filter_by(class_name=class_name).\
@@ -165,7 +165,7 @@ class Quotas(base.NovaObject):
         return result
 
     @staticmethod
-    @db_api.api_context_manager.reader
+    @db_api.select_api_db_reader_mode
     def _get_all_class_from_db_by_name(context, class_name):
         # by_name refers to the returned dict that has a 'class_name' key
         rows = context.session.query(api_models.QuotaClass).\
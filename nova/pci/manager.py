@@ -346,7 +346,7 @@ class PciDevTracker(object):
     def clean_usage(self, instances, migrations, orphans):
         """Remove all usages for instances not passed in the parameter.
 
-        The caller should hold the COMPUTE_RESOURCE_SEMAPHORE lock
+        The caller should hold the resource tracker lock of the compute node
         """
         existed = set(inst['uuid'] for inst in instances)
         existed |= set(mig['instance_uuid'] for mig in migrations)
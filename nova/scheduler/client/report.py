@@ -22,7 +22,9 @@ import re
 import retrying
 import time
 
+import eventlet
 from keystoneauth1 import exceptions as ks_exc
+from keystoneauth1 import session as ks_session
 import os_traits
 from oslo_log import log as logging
 from oslo_middleware import request_id
@@ -54,6 +56,12 @@ POST_RPS_RETURNS_PAYLOAD_API_VERSION = '1.20'
 AGGREGATE_GENERATION_VERSION = '1.19'
 NESTED_PROVIDER_API_VERSION = '1.14'
 POST_ALLOCATIONS_API_VERSION = '1.13'
+# Placement may serve some read-only requests from a database replica. Reads
+# made within MUST_BE_CURRENT_WINDOW seconds of a write by this client send
+# MUST_BE_CURRENT_HEADER so that they are served from the primary database and
+# see the client's own writes.
+MUST_BE_CURRENT_HEADER = 'OpenStack-Placement-Must-Be-Current'
+MUST_BE_CURRENT_WINDOW = 10
 
 AggInfo = collections.namedtuple('AggInfo', ['aggregates', 'generation'])
 TraitInfo = collections.namedtuple('TraitInfo', ['traits', 'generation'])
@@ -249,6 +257,60 @@ def get_placement_request_id(response):
         return response.headers.get(request_id.HTTP_RESP_HEADER_REQUEST_ID)
 
 
+def _uuids_by_depth(tree, uuids):
+    """Group the UUIDs of the providers of a ProviderTree by their depth.
+
+    :param tree: The ProviderTree holding the providers.
+    :param uuids: The UUIDs of the providers, in top-down traversable order,
+                  as returned by ProviderTree.get_provider_uuids().
+    :return: A list, indexed by depth, of lists of provider UUIDs, in the order
+             of uuids. The roots are at index 0.
+    """
+    depths = {}
+    levels = []
+    for uuid in uuids:
+        parent_uuid = tree.data(uuid).parent_uuid
+        depth = depths[parent_uuid] + 1 if parent_uuid in depths else 0
+        depths[uuid] = depth
+        if depth == len(levels):
+            levels.append([])
+        levels[depth].append(uuid)
+    return levels
+
+
+def _get_root_uuid(tree, uuid):
+    """Returns the UUID of the root of the tree of a provider of a
+    ProviderTree.
+    """
+    parent_uuid = tree.data(uuid).parent_uuid
+    while parent_uuid is not None:
+        uuid = parent_uuid
+        parent_uuid = tree.data(uuid).parent_uuid
+    return uuid
+
+
+def _copy_provider_trees(tree, root_uuids):
+    """Returns a new ProviderTree holding a copy of some trees of a
+    ProviderTree.
+
+    :param tree: The ProviderTree to copy from.
+    :param root_uuids: The UUIDs of the roots of the trees to copy.
+    """
+    new_tree = provider_tree.ProviderTree()
+    for root_uuid in root_uuids:
+        for uuid in tree.get_provider_uuids(root_uuid):
+            pd = tree.data(uuid)
+            if pd.parent_uuid is None:
+                new_tree.new_root(pd.name, uuid, generation=pd.generation)
+            else:
+                new_tree.new_child(pd.name, pd.parent_uuid, uuid=uuid,
+                                   generation=pd.generation)
+            new_tree.update_inventory(uuid, pd.inventory)
+            new_tree.update_traits(uuid, pd.traits)
+            new_tree.update_aggregates(uuid, pd.aggregates)
+    return new_tree
+
+
 class SchedulerReportClient(object):
     """Client class for updating the scheduler."""
 
@@ -268,6 +330,8 @@ class SchedulerReportClient(object):
         self._client = self._create_client()
         # NOTE(danms): Keep track of how naggy we've been
         self._warn_count = 0
+        # The last time we wrote anything to placement
+        self._last_write_time = None
 
     @utils.synchronized(PLACEMENT_CLIENT_SEMAPHORE)
     def _create_client(self):
@@ -275,20 +339,44 @@ class SchedulerReportClient(object):
         # Flush provider tree and associations so we start from a clean slate.
         self._provider_tree = provider_tree.ProviderTree()
         self._association_refresh_time = {}
-        client = self._adapter or utils.get_ksa_adapter('placement')
+        if self._adapter:
+            client = self._adapter
+        else:
+            client = utils.get_ksa_adapter('placement')
+            # Keep as many connections alive as the concurrent requests of
+            # update_from_provider_tree.
+            pool_adapter = ks_session.TCPKeepAliveAdapter(
+                pool_maxsize=CONF.compute.resource_provider_update_concurrency)
+            for scheme in ('https://', 'http://'):
+                client.session.session.mount(scheme, pool_adapter)
         # Set accept header on every request to ensure we notify placement
         # service of our response body media type preferences.
         client.additional_headers = {'accept': 'application/json'}
         return client
 
-    def get(self, url, version=None, global_request_id=None):
+    def _wrote_recently(self):
+        return (self._last_write_time is not None and
+                time.time() - self._last_write_time < MUST_BE_CURRENT_WINDOW)
+
+    def get(self, url, version=None, global_request_id=None,
+            allow_stale=False):
+        """Send a GET request to placement.
+
+        :param allow_stale: If False and this client wrote to placement in
+                            the last MUST_BE_CURRENT_WINDOW seconds, ask
+                            placement to serve the request from its primary
+                            database rather than from a replica.
+        """
         headers = ({request_id.INBOUND_HEADER: global_request_id}
                    if global_request_id else {})
+        if not allow_stale and self._wrote_recently():
+            headers[MUST_BE_CURRENT_HEADER] = 'true'
         return self._client.get(url, microversion=version, headers=headers)
 
     def post(self, url, data, version=None, global_request_id=None):
         headers = ({request_id.INBOUND_HEADER: global_request_id}
                    if global_request_id else {})
+        self._last_write_time = time.time()
         # NOTE(sdague): using json= instead of data= sets the
         # media type to application/json for us. Placement API is
         # more sensitive to this than other APIs in the OpenStack
@@ -306,11 +394,13 @@ class SchedulerReportClient(object):
                               global_request_id} if global_request_id else {}}
         if data is not None:
             kwargs['json'] = data
+        self._last_write_time = time.time()
         return self._client.put(url, **kwargs)
 
     def delete(self, url, version=None, global_request_id=None):
         headers = ({request_id.INBOUND_HEADER: global_request_id}
                    if global_request_id else {})
+        self._last_write_time = time.time()
         return self._client.delete(url, microversion=version, headers=headers)
 
     @safe_connect
@@ -349,8 +439,11 @@ class SchedulerReportClient(object):
         version = GRANULAR_AC_VERSION
         qparams = resources.to_querystring()
         url = "/allocation_candidates?%s" % qparams
+        # Allocation candidates may be stale: claims are checked against the
+        # current provider generations when the allocations are written.
         resp = self.get(url, version=version,
-                        global_request_id=context.global_id)
+                        global_request_id=context.global_id,
+                        allow_stale=True)
         if resp.status_code == 200:
             data = resp.json()
             return (data['allocation_requests'], data['provider_summaries'],
@@ -632,6 +725,13 @@ class SchedulerReportClient(object):
         reduces to just the specified provider as a root, with no aggregates or
         traits.
 
+        The providers of the tree which are already in the local cache are
+        revalidated by comparing their generations with the ones returned by
+        placement: the inventory, aggregates and traits are only fetched again
+        for the providers whose generation moved. The providers associated via
+        aggregate are refreshed when their own generation moved, at most every
+        CONF.compute.resource_provider_association_refresh seconds.
+
         :param context: The security context
         :param uuid: UUID identifier for the resource provider to ensure exists
         :param name: Optional name for the resource provider if the record
@@ -643,30 +743,8 @@ class SchedulerReportClient(object):
         # NOTE(efried): We currently have no code path where we need to set the
         # parent_provider_uuid on a previously-parent-less provider - so we do
         # NOT handle that scenario here.
-        # TODO(efried): Reinstate this optimization if possible.
-        # For now, this is removed due to the following:
-        # - update_provider_tree adds a child with some bogus inventory (bad
-        #   resource class) or trait (invalid trait name).
-        # - update_from_provider_tree creates the child in placement and adds
-        #   it to the cache, then attempts to add the bogus inventory/trait.
-        #   The latter fails, so update_from_provider_tree invalidates the
-        #   cache entry by removing the child from the cache.
-        # - Ordinarily, we would rely on the code below (_get_providers_in_tree
-        #   and _provider_tree.populate_from_iterable) to restore the child to
-        #   the cache on the next iteration.  BUT since the root is still
-        #   present in the cache, the commented-out block will cause that part
-        #   of this method to be skipped.
-        # if self._provider_tree.exists(uuid):
-        #     # If we had the requested provider locally, refresh it and its
-        #     # descendants, but only if stale.
-        #     for u in self._provider_tree.get_provider_uuids(uuid):
-        #         self._refresh_associations(context, u, force=False)
-        #     return uuid
-
-        # We don't have it locally; check placement or create it.
-        created_rp = None
-        rps_to_refresh = self._get_providers_in_tree(context, uuid)
-        if not rps_to_refresh:
+        rps_in_tree = self._get_providers_in_tree(context, uuid)
+        if not rps_in_tree:
             created_rp = self._create_resource_provider(
                 context, uuid, name or uuid,
                 parent_provider_uuid=parent_provider_uuid)
@@ -678,23 +756,88 @@ class SchedulerReportClient(object):
             if created_rp is None:
                 raise exception.ResourceProviderCreationFailed(
                     name=name or uuid)
-            # Don't add the created_rp to rps_to_refresh.  Since we just
-            # created it, it has no aggregates or traits.
+            # Since we just created it, it has no aggregates or traits.
+            self._provider_tree.populate_from_iterable([created_rp])
+            return uuid
 
-        self._provider_tree.populate_from_iterable(
-            rps_to_refresh or [created_rp])
+        rps_to_refresh = self._revalidate_tree(rps_in_tree)
 
         # At this point, the whole tree exists in the local cache.
 
+        refreshed = set()
         for rp_to_refresh in rps_to_refresh:
             # NOTE(efried): _refresh_associations doesn't refresh inventory
             # (yet) - see that method's docstring for the why.
             self._refresh_and_get_inventory(context, rp_to_refresh['uuid'])
             self._refresh_associations(context, rp_to_refresh['uuid'],
                                        force=True)
+            refreshed.add(rp_to_refresh['uuid'])
+
+        # The inventory, aggregates and traits of the other providers are
+        # current, but the sharing providers associated with them via
+        # aggregate may have changed.
+        for rp in rps_in_tree:
+            if rp['uuid'] in refreshed or not self._associations_stale(
+                    rp['uuid']):
+                continue
+            aggs = self._provider_tree.data(rp['uuid']).aggregates
+            self._refresh_sharing_providers(context, aggs)
+            self._association_refresh_time[rp['uuid']] = time.time()
 
         return uuid
 
+    def _revalidate_tree(self, rps_in_tree):
+        """Reconciles the local cache with the providers of a tree as returned
+        by placement.
+
+        Providers which are no longer in the tree, or which changed parent, are
+        removed from the cache, and providers missing from the cache are added
+        to it.
+
+        :param rps_in_tree: A list of dicts of resource provider information of
+                            all the providers in a tree.
+        :return: The list of the dicts of the providers whose inventory,
+                 aggregates and traits must be refreshed: the providers added
+                 to the cache and the ones whose generation moved.
+        """
+        by_uuid = {rp['uuid']: rp for rp in rps_in_tree}
+        cached_uuids = []
+        for rp in rps_in_tree:
+            if (rp.get('parent_provider_uuid') is None and
+                    self._provider_tree.exists(rp['uuid'])):
+                cached_uuids.extend(
+                    self._provider_tree.get_provider_uuids(rp['uuid']))
+        for cached_uuid in cached_uuids:
+            rp = by_uuid.get(cached_uuid)
+            if rp is not None:
+                try:
+                    parent_uuid = self._provider_tree.data(
+                        cached_uuid).parent_uuid
+                except ValueError:
+                    # Already removed along with its parent.
+                    continue
+                if parent_uuid == rp.get('parent_provider_uuid'):
+                    continue
+            try:
+                self._provider_tree.remove(cached_uuid)
+            except ValueError:
+                # Already removed along with its parent.
+                pass
+            self._association_refresh_time.pop(cached_uuid, None)
+
+        new_rps = [pd for pd in rps_in_tree
+                   if not self._provider_tree.exists(pd['uuid'])]
+        new_uuids = set(pd['uuid'] for pd in new_rps)
+        self._provider_tree.populate_from_iterable(new_rps)
+        moved_rps = [pd for pd in rps_in_tree
+                     if pd['uuid'] not in new_uuids and
+                     self._provider_tree.data(pd['uuid']).generation !=
+                     pd['generation']]
+        if moved_rps:
+            LOG.debug("Generation of resource providers %s moved, refreshing",
+                      ','.join(pd['uuid'] for pd in moved_rps))
+        return new_rps + moved_rps
+
     @safe_connect
     def _delete_provider(self, rp_uuid, global_request_id=None):
         resp = self.delete('/resource_providers/%s' % rp_uuid,
@@ -810,26 +953,36 @@ class SchedulerReportClient(object):
                 rp_uuid, traits, generation=generation)
 
             if refresh_sharing:
-                # Refresh providers associated by aggregate
-                for rp in self._get_sharing_providers(context, aggs):
-                    if not self._provider_tree.exists(rp['uuid']):
-                        # NOTE(efried): Right now sharing providers are always
-                        # treated as roots. This is deliberate. From the
-                        # context of this compute's RP, it doesn't matter if a
-                        # sharing RP is part of a tree.
-                        self._provider_tree.new_root(
-                            rp['name'], rp['uuid'],
-                            generation=rp['generation'])
-                    # Now we have to (populate or) refresh that guy's traits
-                    # and aggregates (but not *his* aggregate-associated
-                    # providers).  No need to override force=True for newly-
-                    # added providers - the missing timestamp will always
-                    # trigger them to refresh.
-                    self._refresh_associations(context, rp['uuid'],
-                                               force=force,
-                                               refresh_sharing=False)
+                self._refresh_sharing_providers(context, aggs)
             self._association_refresh_time[rp_uuid] = time.time()
 
+    def _refresh_sharing_providers(self, context, aggs):
+        """Refresh the providers associated by aggregate with a provider, and
+        the aggregates and traits of those whose generation moved (but not
+        *their* aggregate-associated providers).
+
+        :param context: The security context
+        :param aggs: The aggregate UUIDs of the provider.
+        :raise: On various placement API errors, one of:
+                - ResourceProviderAggregateRetrievalFailed
+                - ResourceProviderTraitRetrievalFailed
+                - ResourceProviderRetrievalFailed
+        """
+        for rp in self._get_sharing_providers(context, aggs):
+            if not self._provider_tree.exists(rp['uuid']):
+                # NOTE(efried): Right now sharing providers are always
+                # treated as roots. This is deliberate. From the context of
+                # this compute's RP, it doesn't matter if a sharing RP is
+                # part of a tree.
+                self._provider_tree.new_root(rp['name'], rp['uuid'])
+            elif (self._provider_tree.data(rp['uuid']).generation ==
+                    rp['generation']):
+                continue
+            # Now we have to (populate or) refresh that guy's traits and
+            # aggregates, which also sets his generation.
+            self._refresh_associations(context, rp['uuid'], force=True,
+                                       refresh_sharing=False)
+
     def _associations_stale(self, uuid):
         """Respond True if aggregates and traits have not been refreshed
         "recently".
@@ -977,7 +1130,8 @@ class SchedulerReportClient(object):
         return False
 
     def get_provider_tree_and_ensure_root(self, context, rp_uuid, name=None,
-                                          parent_provider_uuid=None):
+                                          parent_provider_uuid=None,
+                                          scoped=False):
         """Returns a fresh ProviderTree representing all providers which are in
         the same tree or in the same aggregate as the specified provider,
         including their aggregates, traits, and inventories.
@@ -993,6 +1147,13 @@ class SchedulerReportClient(object):
                      value
         :param parent_provider_uuid: Optional UUID of the immediate parent,
                                      which must have been previously _ensured.
+        :param scoped: If True, the returned tree only holds the tree of the
+                       specified provider and the trees of the providers
+                       sharing their aggregates with it, rather than every
+                       provider of the local cache, and only the inventories
+                       of these are refreshed. The local cache of a compute
+                       service managing several nodes holds the trees of all
+                       of them.
         :return: A new ProviderTree object.
         """
         # TODO(efried): We would like to have the caller handle create-and/or-
@@ -1004,11 +1165,34 @@ class SchedulerReportClient(object):
         self._ensure_resource_provider(
             context, rp_uuid, name=name,
             parent_provider_uuid=parent_provider_uuid)
-        # Ensure inventories are up to date (for *all* cached RPs)
+        # The inventories of the providers in the tree of rp_uuid were
+        # revalidated above, ensure the others are up to date too.
+        root_uuid = _get_root_uuid(self._provider_tree, rp_uuid)
+        in_tree = set(self._provider_tree.get_provider_uuids(root_uuid))
+        if not scoped:
+            for uuid in self._provider_tree.get_provider_uuids():
+                if uuid not in in_tree:
+                    self._refresh_and_get_inventory(context, uuid)
+            # Return a *copy* of the tree.
+            return copy.deepcopy(self._provider_tree)
+
+        aggs = set()
+        for uuid in in_tree:
+            aggs |= self._provider_tree.data(uuid).aggregates
+        root_uuids = [root_uuid]
         for uuid in self._provider_tree.get_provider_uuids():
-            self._refresh_and_get_inventory(context, uuid)
-        # Return a *copy* of the tree.
-        return copy.deepcopy(self._provider_tree)
+            if (uuid not in in_tree and
+                    self._provider_tree.has_traits(
+                        uuid, [os_traits.MISC_SHARES_VIA_AGGREGATE]) and
+                    self._provider_tree.data(uuid).aggregates & aggs):
+                sharing_root_uuid = _get_root_uuid(self._provider_tree, uuid)
+                if sharing_root_uuid not in root_uuids:
+                    root_uuids.append(sharing_root_uuid)
+        for sharing_root_uuid in root_uuids[1:]:
+            for uuid in self._provider_tree.get_provider_uuids(
+                    sharing_root_uuid):
+                self._refresh_and_get_inventory(context, uuid)
+        return _copy_provider_trees(self._provider_tree, root_uuids)
 
     def set_inventory_for_provider(self, context, rp_uuid, rp_name, inv_data,
                                    parent_provider_uuid=None):
@@ -1418,7 +1602,26 @@ class SchedulerReportClient(object):
         # when we invoke the DELETE.  See bug #1746374.
         self._update_inventory(context, compute_node.uuid, inv_data)
 
-    def update_from_provider_tree(self, context, new_tree):
+    @staticmethod
+    def _run_concurrently(func, args_list):
+        """Call func with each of the argument tuples of args_list, running up
+        to [compute]resource_provider_update_concurrency calls at a time, and
+        wait for all of them to complete.
+
+        :return: The list of the results of the calls, in the order of
+                 args_list.
+        """
+        semaphore = eventlet.semaphore.Semaphore(
+            CONF.compute.resource_provider_update_concurrency)
+
+        def _call(args):
+            with semaphore:
+                return func(*args)
+
+        threads = [utils.spawn(_call, args) for args in args_list]
+        return [thread.wait() for thread in threads]
+
+    def update_from_provider_tree(self, context, new_tree, rp_uuid=None):
         """Flush changes from a specified ProviderTree back to placement.
 
         The specified ProviderTree is compared against the local cache.  Any
@@ -1433,9 +1636,39 @@ class SchedulerReportClient(object):
         :param context: The security context
         :param new_tree: A ProviderTree instance representing the desired state
                          of providers in placement.
+        :param rp_uuid: If specified, only the subtree of new_tree rooted at
+                        this provider is compared against the same subtree of
+                        the local cache and flushed. The other providers, of
+                        new_tree or of the cache, are left alone, and the
+                        flushes of the same subtree are serialized. This lets
+                        the nodes of a compute service flush their own trees
+                        concurrently.
         :raises: ResourceProviderSyncFailed if any errors were encountered
                  attempting to perform the necessary API operations.
         """
+        if rp_uuid is None:
+            self._update_from_provider_tree(
+                context, new_tree, self._provider_tree.get_provider_uuids(),
+                new_tree.get_provider_uuids())
+            return
+
+        @utils.synchronized('%s-%s' % (PLACEMENT_CLIENT_SEMAPHORE, rp_uuid))
+        def _update_subtree():
+            old_uuids = []
+            if self._provider_tree.exists(rp_uuid):
+                old_uuids = self._provider_tree.get_provider_uuids(rp_uuid)
+            self._update_from_provider_tree(
+                context, new_tree, old_uuids,
+                new_tree.get_provider_uuids(rp_uuid))
+
+        _update_subtree()
+
+    def _update_from_provider_tree(self, context, new_tree, old_uuids,
+                                   new_uuids):
+        """Flush the providers new_uuids of new_tree back to placement,
+        deleting the providers old_uuids of the local cache missing from
+        new_uuids. See update_from_provider_tree.
+        """
         # NOTE(efried): We currently do not handle the "rename" case.  This is
         # where new_tree contains a provider named Y whose UUID already exists
         # but is named X.  Today the only way the consumer could accomplish
@@ -1476,52 +1709,68 @@ class SchedulerReportClient(object):
                     pass
                 self._association_refresh_time.pop(rp_uuid, None)
 
-        # Overall indicator of success.  Will be set to False on any exception.
-        success = True
-
         # Helper methods herein will be updating the local cache (this is
         # intentional) so we need to grab up front any data we need to operate
         # on in its "original" form.
         old_tree = self._provider_tree
-        old_uuids = old_tree.get_provider_uuids()
-        new_uuids = new_tree.get_provider_uuids()
+        old_levels = _uuids_by_depth(old_tree, old_uuids)
+        new_levels = _uuids_by_depth(new_tree, new_uuids)
+        results = []
 
         # Do provider deletion first, since it has the best chance of failing
         # for non-generation-conflict reasons (i.e. allocations).
         uuids_to_remove = set(old_uuids) - set(new_uuids)
-        # We have to do deletions in bottom-up order, so we don't error
-        # attempting to delete a parent who still has children.
-        for uuid in reversed(old_uuids):
-            if uuid not in uuids_to_remove:
-                continue
+
+        def delete_provider(uuid):
             with catch_all(uuid) as status:
                 self._delete_provider(uuid)
-            success = success and status.success
+            return status.success
+
+        # We have to do deletions in bottom-up order, so we don't error
+        # attempting to delete a parent who still has children.  Providers at
+        # the same depth don't depend on each other and are deleted
+        # concurrently.
+        for level in reversed(old_levels):
+            results += self._run_concurrently(
+                delete_provider,
+                [(uuid,) for uuid in level if uuid in uuids_to_remove])
 
         # Now create (or load) any "new" providers
         uuids_to_add = set(new_uuids) - set(old_uuids)
+
+        def ensure_providers(uuids):
+            success = True
+            for uuid in uuids:
+                provider = new_tree.data(uuid)
+                with catch_all(uuid) as status:
+                    self._ensure_resource_provider(
+                        context, uuid, name=provider.name,
+                        parent_provider_uuid=provider.parent_uuid)
+                success = success and status.success
+            return success
+
         # We have to do additions in top-down order, so we don't error
-        # attempting to create a child before its parent exists.
+        # attempting to create a child before its parent exists.  The
+        # providers of a tree are created one after the other, since
+        # _ensure_resource_provider reconciles the cache with the whole tree
+        # in placement, but separate trees are created concurrently.
+        root_uuids = {}
+        uuids_by_root = collections.OrderedDict()
         for uuid in new_uuids:
-            if uuid not in uuids_to_add:
-                continue
-            provider = new_tree.data(uuid)
-            with catch_all(uuid) as status:
-                self._ensure_resource_provider(
-                    context, uuid, name=provider.name,
-                    parent_provider_uuid=provider.parent_uuid)
-            success = success and status.success
+            parent_uuid = new_tree.data(uuid).parent_uuid
+            root_uuid = root_uuids.setdefault(
+                uuid, root_uuids.get(parent_uuid, uuid))
+            if uuid in uuids_to_add:
+                uuids_by_root.setdefault(root_uuid, []).append(uuid)
+        results += self._run_concurrently(
+            ensure_providers, [(uuids,) for uuids in uuids_by_root.values()])
 
         # At this point the local cache should have all the same providers as
         # new_tree.  Whether we added them or not, walk through and diff/flush
         # inventories, traits, and aggregates as necessary (the helper methods
         # are set up to check and short out when the relevant property does not
         # differ from what's in the cache).
-        # If we encounter any error and remove a provider from the cache, all
-        # its descendants are also removed, and set_*_for_provider methods on
-        # it wouldn't be able to get started. Walking the tree in bottom-up
-        # order ensures we at least try to process all of the providers.
-        for uuid in reversed(new_uuids):
+        def set_provider(uuid):
             pd = new_tree.data(uuid)
             with catch_all(pd.uuid) as status:
                 self._set_inventory_for_provider(
@@ -1529,8 +1778,19 @@ class SchedulerReportClient(object):
                 self.set_aggregates_for_provider(
                     context, pd.uuid, pd.aggregates)
                 self.set_traits_for_provider(context, pd.uuid, pd.traits)
-            success = success and status.success
+            return status.success
+
+        # If we encounter any error and remove a provider from the cache, all
+        # its descendants are also removed, and set_*_for_provider methods on
+        # it wouldn't be able to get started. Walking the tree in bottom-up
+        # order ensures we at least try to process all of the providers.
+        # Providers at the same depth are processed concurrently.
+        for level in reversed(new_levels):
+            results += self._run_concurrently(
+                set_provider, [(uuid,) for uuid in level])
 
+        # Overall indicator of success.  False on any exception.
+        success = all(results)
         if not success:
             raise exception.ResourceProviderSyncFailed()
 
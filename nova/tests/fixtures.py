@@ -460,7 +460,8 @@ class CellDatabases(fixtures.Fixture):
                 # subsequent calls
                 self._last_ctxt_mgr = self._default_ctxt_mgr
 
-    def _wrap_create_context_manager(self, connection=None):
+    def _wrap_create_context_manager(self, connection=None,
+                                     slave_connection=None):
         ctxt_mgr = self._ctxt_mgrs[connection]
         return ctxt_mgr
 
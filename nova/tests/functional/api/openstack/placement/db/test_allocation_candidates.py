@@ -2764,3 +2764,37 @@ class AllocationCandidatesTestCase(tb.PlacementDbBaseTestCase):
         provider_names = ['cn1']
         expect_root_ids = self._get_rp_ids_matching_names(provider_names)
         self.assertEqual(expect_root_ids, tree_root_ids)
+
+    def test_nested_and_shared_from_replica(self):
+        """Tests that allocation candidates can be read on the replica
+        connection, which is the primary when no slave_connection is set, and
+        that the results match those read on the primary.
+        """
+        cn = self._create_provider('cn', uuids.agg1)
+        tb.add_inventory(cn, fields.ResourceClass.VCPU, 8)
+        numa = self._create_provider('numa', parent=cn.uuid)
+        tb.add_inventory(numa, fields.ResourceClass.MEMORY_MB, 2048)
+        ss = self._create_provider('ss', uuids.agg1)
+        tb.add_inventory(ss, fields.ResourceClass.DISK_GB, 2000)
+        tb.set_traits(ss, "MISC_SHARES_VIA_AGGREGATE")
+        tb.set_traits(numa, os_traits.HW_CPU_X86_AVX2)
+
+        requests = {'': placement_lib.RequestGroup(
+            use_same_provider=False,
+            resources={
+                fields.ResourceClass.VCPU: 1,
+                fields.ResourceClass.MEMORY_MB: 64,
+                fields.ResourceClass.DISK_GB: 100,
+            },
+            required_traits=set([os_traits.HW_CPU_X86_AVX2]))}
+        primary = self._get_allocation_candidates(requests)
+        self.ctx.read_from_replica = True
+        replica = self._get_allocation_candidates(requests)
+
+        expected = [
+            [('cn', fields.ResourceClass.VCPU, 1),
+             ('numa', fields.ResourceClass.MEMORY_MB, 64),
+             ('ss', fields.ResourceClass.DISK_GB, 100)],
+        ]
+        self._validate_allocation_requests(expected, primary)
+        self._validate_allocation_requests(expected, replica)
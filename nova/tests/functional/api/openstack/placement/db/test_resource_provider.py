@@ -21,6 +21,7 @@ import nova
 from nova.api.openstack.placement import exception
 from nova.api.openstack.placement.objects import consumer as consumer_obj
 from nova.api.openstack.placement.objects import resource_provider as rp_obj
+from nova.api.openstack.placement import sharing_provider_cache
 from nova.db.sqlalchemy import api_models as models
 from nova import rc_fields as fields
 from nova.tests.functional.api.openstack.placement.db import test_base as tb
@@ -168,6 +169,28 @@ class ResourceProviderTestCase(tb.PlacementDbBaseTestCase):
 
         self.assertEqual(uuidsentinel.parent, rp1.root_provider_uuid)
 
+    def test_inherit_root_from_parent_deep_tree(self):
+        """Tests that when a root provider with a deep tree beneath it gets a
+        parent, every provider of that tree gets the new root provider.
+        """
+        names = ['rp%d' % x for x in range(5)]
+        parent = None
+        for name in names:
+            self._create_provider(name, parent=parent)
+            parent = getattr(uuidsentinel, name)
+        new_root = self._create_provider('new_root')
+
+        rp0 = rp_obj.ResourceProvider.get_by_uuid(self.ctx, uuidsentinel.rp0)
+        rp0.parent_provider_uuid = new_root.uuid
+        rp0.save()
+
+        rps = rp_obj.ResourceProviderList.get_all_by_filters(
+            self.ctx, filters={'in_tree': uuidsentinel.rp4})
+        self.assertEqual(set(['new_root'] + names),
+                         set(rp.name for rp in rps))
+        for rp in rps:
+            self.assertEqual(uuidsentinel.new_root, rp.root_provider_uuid)
+
     def test_save_root_provider_failed(self):
         """Test that if we provide a root_provider_uuid value that points to
         a resource provider that doesn't exist, we get an ObjectActionError if
@@ -741,6 +764,44 @@ class ResourceProviderTestCase(tb.PlacementDbBaseTestCase):
                                   DISK_ALLOCATION['used'])
         self.assertEqual(expected_gen, rp.generation)
 
+    def test_add_allocation_multiple_providers_generation_conflict(self):
+        rp1 = self._create_provider('rp1')
+        rp2 = self._create_provider('rp2')
+        for rp in (rp1, rp2):
+            tb.add_inventory(rp, DISK_INVENTORY['resource_class'],
+                             DISK_INVENTORY['total'])
+        rp1_gen = rp1.generation
+        # Move the generation of rp2 out from under the rp2 object
+        rp2_copy = rp_obj.ResourceProvider.get_by_uuid(self.ctx, rp2.uuid)
+        tb.add_inventory(rp2_copy, fields.ResourceClass.VCPU, 8)
+
+        consumer = tb.ensure_consumer(self.ctx, self.user_obj,
+                                      self.project_obj)
+        alloc_list = rp_obj.AllocationList(self.ctx, objects=[
+            rp_obj.Allocation(
+                self.ctx, consumer=consumer, resource_provider=rp,
+                resource_class=DISK_INVENTORY['resource_class'], used=2)
+            for rp in (rp1, rp2)
+        ])
+        self.assertRaises(
+            exception.ResourceProviderConcurrentUpdateDetected,
+            alloc_list._set_allocations, self.ctx, alloc_list.objects)
+
+        # The whole write was rolled back, including the generation of the
+        # provider that was not in conflict.
+        rp1_db = rp_obj.ResourceProvider.get_by_uuid(self.ctx, rp1.uuid)
+        self.assertEqual(rp1_gen, rp1_db.generation)
+        self.assertEqual(
+            0, len(rp_obj.AllocationList.get_all_by_resource_provider(
+                self.ctx, rp1)))
+
+        # The server side retry reloads the providers and succeeds
+        alloc_list.replace_all()
+        self.assertEqual(rp1_gen + 1,
+                         alloc_list[0].resource_provider.generation)
+        self.assertEqual(rp2_copy.generation + 1,
+                         alloc_list[1].resource_provider.generation)
+
     def test_get_all_by_resource_provider_multiple_providers(self):
         rp1 = self._create_provider('cn1')
         rp2 = self._create_provider(name='cn2')
@@ -886,6 +947,26 @@ class ResourceProviderListTestCase(tb.PlacementDbBaseTestCase):
                                    [[uuidsentinel.agg_1, uuidsentinel.agg_2]]})
         self.assertEqual(0, len(resource_providers))
 
+    def test_get_all_by_filters_from_replica(self):
+        cn = self._create_provider('cn', uuidsentinel.agg_a)
+        self._create_provider('numa', parent=cn.uuid)
+        self._create_provider('other')
+        tb.set_traits(cn, 'CUSTOM_TRAIT_A')
+        tb.add_inventory(cn, fields.ResourceClass.VCPU, 8)
+
+        # No slave_connection is configured, so the replica is the primary.
+        self.ctx.read_from_replica = True
+        resource_providers = rp_obj.ResourceProviderList.get_all_by_filters(
+            self.ctx, filters={'in_tree': cn.uuid})
+        self.assertEqual(set(['cn', 'numa']),
+                         set(rp.name for rp in resource_providers))
+
+        resource_providers = rp_obj.ResourceProviderList.get_all_by_filters(
+            self.ctx, filters={'member_of': [[uuidsentinel.agg_a]],
+                               'required': ['CUSTOM_TRAIT_A'],
+                               'resources': {fields.ResourceClass.VCPU: 1}})
+        self.assertEqual(['cn'], [rp.name for rp in resource_providers])
+
     def test_get_all_by_required(self):
         # Create some resource providers and give them each 0 or more traits.
         # rp_name_0: no traits
@@ -1086,6 +1167,57 @@ class TestResourceProviderAggregates(tb.PlacementDbBaseTestCase):
             expected, rp_obj._anchors_for_sharing_providers(self.ctx,
                 [s1.id, s2.id, s3.id, s4.id, s5.id], get_id=True))
 
+    def test_anchors_for_sharing_providers_cache(self):
+        """Test that the sharing providers cache is reused until aggregates,
+        sharing traits or trees change.
+        """
+        agg1 = uuidsentinel.agg1
+        shr_trait = rp_obj.Trait.get_by_name(
+            self.ctx, "MISC_SHARES_VIA_AGGREGATE")
+        s1 = self._create_provider('s1', agg1)
+        s1.set_traits(rp_obj.TraitList(objects=[shr_trait]))
+        r1 = self._create_provider('r1', agg1)
+
+        def anchors():
+            return set(p[1] for p in rp_obj._anchors_for_sharing_providers(
+                self.ctx, [s1.id]))
+
+        load = mock.patch.object(sharing_provider_cache, '_load_from_db',
+                                 wraps=sharing_provider_cache._load_from_db)
+        with load as mock_load:
+            self.assertEqual(set([s1.uuid, r1.uuid]), anchors())
+            self.assertEqual(set([s1.uuid, r1.uuid]), anchors())
+            self.assertEqual(1, mock_load.call_count)
+
+            # Changing the aggregates of a provider invalidates the cache
+            r2 = self._create_provider('r2', agg1)
+            self.assertEqual(set([s1.uuid, r1.uuid, r2.uuid]), anchors())
+            self.assertEqual(2, mock_load.call_count)
+
+            # Changing other traits does not
+            r2.set_traits(rp_obj.TraitList(objects=[
+                rp_obj.Trait.get_by_name(self.ctx, 'HW_CPU_X86_AVX2')]))
+            self.assertEqual(set([s1.uuid, r1.uuid, r2.uuid]), anchors())
+            self.assertEqual(2, mock_load.call_count)
+
+            # Anchors are roots, so giving r2 a parent changes them
+            r3 = self._create_provider('r3')
+            r2.parent_provider_uuid = r3.uuid
+            r2.save()
+            self.assertEqual(set([s1.uuid, r1.uuid, r3.uuid]), anchors())
+            self.assertEqual(3, mock_load.call_count)
+
+            # Deleting a provider invalidates the cache
+            r1.destroy()
+            self.assertEqual(set([s1.uuid, r3.uuid]), anchors())
+            self.assertEqual(4, mock_load.call_count)
+
+            # So does removing the sharing trait
+            s1.set_traits(rp_obj.TraitList(objects=[]))
+            self.assertEqual(
+                {}, rp_obj._SHARING_CACHE.get(self.ctx).sharing)
+            self.assertEqual(5, mock_load.call_count)
+
 
 class TestAllocation(tb.PlacementDbBaseTestCase):
 
@@ -1840,6 +1972,17 @@ class UsageListTestCase(tb.PlacementDbBaseTestCase):
             self.ctx, db_rp.uuid)
         self.assertEqual(2, len(usage_list))
 
+    def test_get_all_from_replica(self):
+        db_rp, _ = self._make_allocation(DISK_INVENTORY, DISK_ALLOCATION)
+        self.ctx.read_from_replica = True
+        usage_list = rp_obj.UsageList.get_all_by_resource_provider_uuid(
+            self.ctx, db_rp.uuid)
+        self.assertEqual(1, len(usage_list))
+        self.assertEqual(2, usage_list[0].usage)
+        usage_list = rp_obj.UsageList.get_all_by_project_user(
+            self.ctx, self.project_obj.external_id)
+        self.assertEqual(1, len(usage_list))
+
 
 class ResourceClassListTestCase(tb.PlacementDbBaseTestCase):
 
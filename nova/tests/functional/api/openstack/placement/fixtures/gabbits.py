@@ -118,6 +118,7 @@ class APIFixture(fixture.GabbiFixture):
     def _reset_db_flags():
         rp_obj._TRAITS_SYNCED = False
         rp_obj._RC_CACHE = None
+        rp_obj._SHARING_CACHE.clear()
 
 
 class AllocationFixture(APIFixture):
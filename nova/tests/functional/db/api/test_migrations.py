@@ -720,6 +720,15 @@ class NovaAPIMigrationsWalk(test_migrations.WalkVersionsMixin):
         self.assertColumnExists(engine, 'instance_mappings',
             'queued_for_delete')
 
+    def _check_062(self, engine, data):
+        self.assertColumnExists(engine, 'placement_cache_versions', 'version')
+        self.assertUniqueConstraintExists(engine, 'placement_cache_versions',
+            ['name'])
+        cache_versions = db_utils.get_table(engine,
+                                            'placement_cache_versions')
+        rows = cache_versions.select().execute().fetchall()
+        self.assertEqual(['sharing_providers'], [r['name'] for r in rows])
+
 
 class TestNovaAPIMigrationsWalkSQLite(NovaAPIMigrationsWalk,
                                       test_base.DbTestCase,
@@ -514,7 +514,8 @@ class ServersControllerTest(ControllerTest):
         self.mock_get_all.assert_called_once_with(
             req.environ['nova.context'], expected_attrs=[], limit=1000,
             marker=None, search_opts={'deleted': False, 'project_id': 'fake'},
-            sort_dirs=['desc'], sort_keys=['created_at'])
+            sort_dirs=['desc'], sort_keys=['created_at'],
+            columns=['uuid', 'display_name'])
 
     def test_get_server_list_with_reservation_id(self):
         req = self.req('/fake/servers?reservation_id=foo')
@@ -765,7 +766,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_with_bad_option(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             db_list = [fakes.stub_instance(100, uuid=uuids.fake)]
             return instance_obj._make_instance_list(
                 context, objects.InstanceList(), db_list, FIELDS)
@@ -781,12 +783,14 @@ class ServersControllerTest(ControllerTest):
             req.environ['nova.context'], expected_attrs=[],
             limit=1000, marker=None,
             search_opts={'deleted': False, 'project_id': 'fake'},
-            sort_dirs=['desc'], sort_keys=['created_at'])
+            sort_dirs=['desc'], sort_keys=['created_at'],
+            columns=['uuid', 'display_name'])
 
     def test_get_servers_allows_image(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('image', search_opts)
             self.assertEqual(search_opts['image'], '12345')
@@ -939,7 +943,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_allows_flavor(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('flavor', search_opts)
             # flavor is an integer ID
@@ -974,7 +979,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_allows_status(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('vm_state', search_opts)
             self.assertEqual(search_opts['vm_state'], [vm_states.ACTIVE])
@@ -992,7 +998,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_allows_task_status(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('task_state', search_opts)
             self.assertEqual([task_states.REBOOT_PENDING,
@@ -1015,7 +1022,8 @@ class ServersControllerTest(ControllerTest):
         # Test when resize status, it maps list of vm states.
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIn('vm_state', search_opts)
             self.assertEqual(search_opts['vm_state'],
                              [vm_states.ACTIVE, vm_states.STOPPED])
@@ -1047,7 +1055,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_deleted_status_as_admin(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIn('vm_state', search_opts)
             self.assertEqual(search_opts['vm_state'], ['deleted'])
 
@@ -1105,7 +1114,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_allows_name(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('name', search_opts)
             self.assertEqual(search_opts['name'], 'whee.*')
@@ -1132,7 +1142,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_allows_changes_since(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('changes-since', search_opts)
             changes_since = datetime.datetime(2011, 1, 24, 17, 8, 1,
@@ -1171,7 +1182,8 @@ class ServersControllerTest(ControllerTest):
         """
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             # Allowed by user
             self.assertIn('name', search_opts)
@@ -1199,7 +1211,8 @@ class ServersControllerTest(ControllerTest):
         """
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             # Allowed by user
             self.assertIn('name', search_opts)
@@ -1227,7 +1240,8 @@ class ServersControllerTest(ControllerTest):
         """Test getting servers by ip."""
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('ip', search_opts)
             self.assertEqual(search_opts['ip'], '10\..*')
@@ -1248,7 +1262,8 @@ class ServersControllerTest(ControllerTest):
         """
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('ip6', search_opts)
             self.assertEqual(search_opts['ip6'], 'ffff.*')
@@ -1270,7 +1285,8 @@ class ServersControllerTest(ControllerTest):
         """
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('ip6', search_opts)
             self.assertEqual(search_opts['ip6'], 'ffff.*')
@@ -1292,7 +1308,8 @@ class ServersControllerTest(ControllerTest):
         """
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('access_ip_v4', search_opts)
             self.assertEqual(search_opts['access_ip_v4'], 'ffff.*')
@@ -1314,7 +1331,8 @@ class ServersControllerTest(ControllerTest):
         """
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             self.assertIsNotNone(search_opts)
             self.assertIn('access_ip_v6', search_opts)
             self.assertEqual(search_opts['access_ip_v6'], 'ffff.*')
@@ -1396,7 +1414,8 @@ class ServersControllerTest(ControllerTest):
     def test_get_servers_joins_services(self):
         def fake_get_all(context, search_opts=None,
                          limit=None, marker=None,
-                         expected_attrs=None, sort_keys=None, sort_dirs=None):
+                         expected_attrs=None, sort_keys=None, sort_dirs=None,
+                         columns=None):
             cur = api_version_request.APIVersionRequest(self.wsgi_api_version)
             v216 = api_version_request.APIVersionRequest('2.16')
             if cur >= v216:
@@ -4940,6 +4959,13 @@ class ServersControllerCreateTest(test.TestCase):
         self.assertRaises(webob.exc.HTTPConflict,
                           self._test_create_extra, {})
 
+    @mock.patch.object(compute_api.API, 'create',
+                       side_effect=exception.ValidationTimeout(
+                           validation='networks', timeout=10))
+    def test_create_instance_with_validation_timeout(self, mock_create):
+        self.assertRaises(webob.exc.HTTPServiceUnavailable,
+                          self._test_create_extra, {})
+
     @mock.patch.object(compute_api.API, 'create',
                        side_effect=exception.UnableToAutoAllocateNetwork(
                            project_id=FAKE_UUID))
@@ -21,6 +21,7 @@ import webob
 
 from nova.api.openstack.placement import handler
 from nova.api.openstack.placement.handlers import root
+from nova.api.openstack.placement import metrics
 from nova.api.openstack.placement import microversion
 from nova.tests import uuidsentinel
 
@@ -69,6 +70,7 @@ class DispatchTest(testtools.TestCase):
         environ = _environ(path='/foobar')
         handler.dispatch(environ, start_response, self.mapper)
         self.route_handler.assert_called_with(environ, start_response)
+        self.assertEqual('/foobar', environ[metrics.ROUTE_ENVIRON])
 
     def test_simple_match_routing_args(self):
         self.mapper.connect('/foobar/{id}', action=self.route_handler,
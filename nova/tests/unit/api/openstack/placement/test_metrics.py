@@ -0,0 +1,93 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the placement request metrics middleware."""
+
+import mock
+import testtools
+import webob
+
+from nova.api.openstack.placement import exception
+from nova.api.openstack.placement import metrics
+
+
+@metrics.timed
+def _hot_function():
+    return 'hot'
+
+
+class TestRequestMetrics(testtools.TestCase):
+
+    @staticmethod
+    @webob.dec.wsgify
+    def application(req):
+        req.environ[metrics.ROUTE_ENVIRON] = '/resource_providers/{uuid}'
+        metrics._REQUEST_STATE.stats.db_queries += 2
+        _hot_function()
+        req.response.status = 200
+        req.response.body = b'four'
+        return req.response
+
+    def setUp(self):
+        super(TestRequestMetrics, self).setUp()
+        self.registry = metrics.MetricsRegistry()
+        self.app = metrics.RequestMetrics(self.application,
+                                          registry=self.registry)
+        self.context = mock.Mock()
+
+    def _request(self, path, method='GET'):
+        req = webob.Request.blank(path, method=method)
+        req.environ['placement.microversion'] = '1.29'
+        req.environ['placement.context'] = self.context
+        return req.get_response(self.app)
+
+    def test_records_per_route(self):
+        self._request('/resource_providers/abc')
+        self._request('/resource_providers/def')
+        key = ('/resource_providers/{uuid}', 'GET', '1.29')
+        stats = self.registry._routes[key]
+        self.assertEqual(2, stats.count)
+        self.assertEqual(4, stats.db_queries)
+        self.assertEqual(8, stats.bytes)
+        self.assertEqual(2, sum(stats.latency_buckets))
+        self.assertIn('_hot_function', stats.functions)
+        self.assertIsNone(metrics._REQUEST_STATE.stats)
+
+    def test_show_metrics(self):
+        self._request('/resource_providers/abc')
+        resp = self._request('/metrics')
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual('text/plain', resp.content_type)
+        labels = ('route="/resource_providers/{uuid}",method="GET",'
+                  'microversion="1.29"')
+        body = resp.text
+        self.assertIn('placement_requests_total{%s} 1' % labels, body)
+        self.assertIn('placement_db_queries_total{%s} 2' % labels, body)
+        self.assertIn('placement_response_bytes_total{%s} 4' % labels, body)
+        self.assertIn('placement_request_duration_seconds_bucket'
+                      '{%s,le="+Inf"} 1' % labels, body)
+        self.assertIn('function="_hot_function"', body)
+        self.context.can.assert_called_once_with('placement:metrics')
+
+    def test_show_metrics_forbidden(self):
+        self.context.can.side_effect = exception.PolicyNotAuthorized(
+            action='placement:metrics')
+        resp = self._request('/metrics')
+        self.assertEqual(403, resp.status_int)
+
+    def test_show_metrics_bad_method(self):
+        resp = self._request('/metrics', method='POST')
+        self.assertEqual(405, resp.status_int)
+        self.assertEqual('GET', resp.headers['allow'])
+
+    def test_timed_outside_request(self):
+        self.assertEqual('hot', _hot_function())
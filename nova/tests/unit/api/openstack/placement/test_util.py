@@ -288,6 +288,36 @@ class TestRequireContent(testtools.TestCase):
         self.assertTrue(self.handler(req))
 
 
+class TestReadFromReplica(testtools.TestCase):
+
+    def setUp(self):
+        super(TestReadFromReplica, self).setUp()
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.api.openstack.placement.util.CONF', mock.Mock()))
+        util.CONF.placement.enable_replica_reads = True
+
+    def test_disabled(self):
+        util.CONF.placement.enable_replica_reads = False
+        req = webob.Request.blank('/resource_providers')
+        self.assertFalse(util.read_from_replica(req))
+
+    def test_enabled(self):
+        req = webob.Request.blank('/resource_providers')
+        self.assertTrue(util.read_from_replica(req))
+
+    def test_must_be_current(self):
+        req = webob.Request.blank(
+            '/resource_providers',
+            headers={'openstack-placement-must-be-current': 'true'})
+        self.assertFalse(util.read_from_replica(req))
+
+    def test_must_not_be_current(self):
+        req = webob.Request.blank(
+            '/resource_providers',
+            headers={util.MUST_BE_CURRENT_HEADER: 'false'})
+        self.assertTrue(util.read_from_replica(req))
+
+
 class TestPlacementURLs(testtools.TestCase):
 
     def setUp(self):
@@ -10,6 +10,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
+import fixtures
 import mock
 from oslo_serialization import jsonutils
 import six
@@ -1055,3 +1058,77 @@ class ExpectedErrorTestCase(test.NoDBTestCase):
             raise exception.PolicyNotAuthorized(action="foo")
 
         self.assertRaises(exception.PolicyNotAuthorized, fake_func)
+
+
+class ReplicaReadsTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ReplicaReadsTestCase, self).setUp()
+        self.flags(enable_replica_reads=True, group='api')
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.api.openstack.wsgi._LAST_WRITES',
+            collections.OrderedDict()))
+
+    def _get_request(self, method='GET', headers=None):
+        req = fakes.HTTPRequest.blank('/tests', method=method)
+        req.headers.update(headers or {})
+        return req
+
+    def test_read_from_replica(self):
+        self.assertTrue(wsgi.read_from_replica(self._get_request()))
+
+    def test_read_from_replica_disabled(self):
+        self.flags(enable_replica_reads=False, group='api')
+        self.assertFalse(wsgi.read_from_replica(self._get_request()))
+
+    def test_read_from_replica_must_be_current(self):
+        req = self._get_request(
+            headers={wsgi.MUST_BE_CURRENT_HEADER: 'true'})
+        self.assertFalse(wsgi.read_from_replica(req))
+        req = self._get_request(
+            headers={wsgi.MUST_BE_CURRENT_HEADER: 'false'})
+        self.assertTrue(wsgi.read_from_replica(req))
+
+    def test_allow_replica_reads(self):
+        class Controller(object):
+            @wsgi.allow_replica_reads
+            def index(self, req):
+                return req.environ['nova.context'].read_from_replica
+
+        req = self._get_request()
+        self.assertTrue(Controller().index(req))
+        req = self._get_request(
+            headers={wsgi.MUST_BE_CURRENT_HEADER: 'true'})
+        self.assertFalse(Controller().index(req))
+
+    @mock.patch('time.time')
+    def test_read_from_replica_after_write(self, mock_time):
+        class Controller(object):
+            def create(self, req, body):
+                return 'success'
+
+        app = fakes.TestRouter(Controller())
+        mock_time.return_value = 100
+        req = self._get_request(method='POST')
+        self.assertEqual(200, req.get_response(app).status_int)
+        self.assertEqual({'fake_user': 100}, dict(wsgi._LAST_WRITES))
+
+        # The user reads from the primary right after the write, the others
+        # still read from the replica.
+        mock_time.return_value = 109
+        self.assertFalse(wsgi.read_from_replica(self._get_request()))
+        req = self._get_request()
+        req.environ['nova.context'].user_id = 'other_user'
+        self.assertTrue(wsgi.read_from_replica(req))
+
+        mock_time.return_value = 110
+        self.assertTrue(wsgi.read_from_replica(self._get_request()))
+
+    @mock.patch('time.time')
+    def test_record_write_forgets_old_writes(self, mock_time):
+        for user_id, now in (('user1', 100), ('user2', 105), ('user1', 108),
+                             ('user3', 116)):
+            mock_time.return_value = now
+            wsgi._record_write(mock.Mock(user_id=user_id))
+        self.assertEqual([('user1', 108), ('user3', 116)],
+                         list(wsgi._LAST_WRITES.items()))
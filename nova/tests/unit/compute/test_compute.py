@@ -7283,7 +7283,8 @@ class ComputeTestCase(BaseTestCase,
                                   _get_instance_nw_info_raise=False,
                                   _get_instance_nw_info_raise_cache=False):
         # Update on every call for the test
-        self.flags(heal_instance_info_cache_interval=-1)
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=1)
         ctxt = context.get_admin_context()
 
         instance_map = {}
@@ -7622,7 +7623,9 @@ class ComputeTestCase(BaseTestCase,
                                             sort_dir,
                                             marker=None,
                                             columns_to_join=[],
-                                            limit=None)
+                                            limit=None,
+                                            columns=['created_at', 'id',
+                                                     'uuid'])
             self.assertThat(conductor_instance_update.mock_calls,
                             testtools_matchers.HasLength(len(old_instances)))
             for inst in old_instances:
@@ -8033,7 +8036,8 @@ class ComputeTestCase(BaseTestCase,
         self.compute._reclaim_queued_deletes(ctxt)
 
         mock_get_filter.assert_called_once_with(ctxt, mock.ANY,
-                expected_attrs=instance_obj.INSTANCE_DEFAULT_FIELDS,
+                expected_attrs=(instance_obj.INSTANCE_DEFAULT_FIELDS +
+                                ['flavor']),
                 use_slave=True)
         mock_delete_old.assert_has_calls([mock.call(instance1, 3600),
                                           mock.call(instance2, 3600)])
@@ -17,6 +17,7 @@ import contextlib
 import datetime
 
 import ddt
+import eventlet
 import fixtures
 import iso8601
 import mock
@@ -289,6 +290,8 @@ class _ComputeAPIUnitTestMixIn(object):
         with test.nested(
             mock.patch.object(self.compute_api, '_get_image',
                               return_value=(None, {})),
+            mock.patch('nova.compute.utils.check_num_instances_quota',
+                       return_value=max_count),
             mock.patch.object(self.compute_api, '_check_auto_disk_config'),
             mock.patch.object(self.compute_api,
                               '_validate_and_build_base_options',
@@ -296,6 +299,7 @@ class _ComputeAPIUnitTestMixIn(object):
                                             ['default'], None))
         ) as (
             get_image,
+            check_num_instances_quota,
             check_auto_disk_config,
             validate_and_build_base_options
         ):
@@ -3729,7 +3733,9 @@ class _ComputeAPIUnitTestMixIn(object):
                           self.context, fake_inst,
                           auto_disk_config=True)
 
-    def test_create_with_disabled_auto_disk_config_fails(self):
+    @mock.patch('nova.compute.utils.check_num_instances_quota',
+                return_value=1)
+    def test_create_with_disabled_auto_disk_config_fails(self, mock_quota):
         image_id = self._setup_fake_image_with_disabled_disk_config()
 
         self.assertRaises(exception.AutoDiskConfigDisabledByImage,
@@ -4524,6 +4530,65 @@ class _ComputeAPIUnitTestMixIn(object):
         mock_attach_create.assert_called_once_with(
             self.context, volume_id, instance.uuid)
 
+    def _test_validate_bdm_failure_releases_volumes(self, min_version):
+        instance = self._create_instance_obj()
+        instance_type = self._create_flavor()
+
+        def _get(context, volume_id):
+            if volume_id == uuids.bad_volume:
+                raise exception.CinderConnectionFailed(reason='error')
+            return {'status': 'available', 'attach_status': 'detached',
+                    'id': volume_id, 'multiattach': False}
+
+        bdms = [objects.BlockDeviceMapping(
+                **fake_block_device.AnonFakeDbBlockDeviceDict(
+                {
+                 'boot_index': boot_index,
+                 'volume_id': volume_id,
+                 'source_type': 'volume',
+                 'destination_type': 'volume',
+                 'device_name': device_name,
+                }))
+                for boot_index, volume_id, device_name in (
+                    (0, uuids.volume, 'vda'), (1, uuids.bad_volume, 'vdb'))]
+        with test.nested(
+            mock.patch.object(objects.service,
+                              'get_minimum_version_all_cells',
+                              return_value=min_version),
+            mock.patch.object(objects.Service, 'get_minimum_version',
+                              return_value=min_version),
+            mock.patch.object(cinder.API, 'get', side_effect=_get),
+            mock.patch.object(cinder.API, 'check_availability_zone'),
+            mock.patch.object(cinder.API, 'attachment_create',
+                              return_value={'id': uuids.attachment}),
+            mock.patch.object(cinder.API, 'attachment_delete'),
+            mock.patch.object(cinder.API, 'reserve_volume'),
+            mock.patch.object(cinder.API, 'unreserve_volume'),
+        ) as (mock_min_ver_all, mock_min_ver, mock_get, mock_check_az,
+              mock_attach_create, mock_attach_delete, mock_reserve,
+              mock_unreserve):
+            self.assertRaises(exception.CinderConnectionFailed,
+                              self.compute_api._validate_bdm,
+                              self.context, instance, instance_type, bdms)
+        return mock_attach_delete, mock_unreserve
+
+    def test_validate_bdm_failure_deletes_attachments(self):
+        mock_attach_delete, mock_unreserve = (
+            self._test_validate_bdm_failure_releases_volumes(
+                COMPUTE_VERSION_NEW_ATTACH_FLOW))
+        # The volume attached by the validation which succeeded is detached.
+        mock_attach_delete.assert_called_once_with(self.context,
+                                                   uuids.attachment)
+        mock_unreserve.assert_not_called()
+
+    def test_validate_bdm_failure_unreserves_volumes(self):
+        mock_attach_delete, mock_unreserve = (
+            self._test_validate_bdm_failure_releases_volumes(17))
+        # The volume reserved by the validation which succeeded is
+        # unreserved.
+        mock_unreserve.assert_called_once_with(self.context, uuids.volume)
+        mock_attach_delete.assert_not_called()
+
     def test_validate_bdm_missing_boot_index(self):
         """Tests that _validate_bdm will fail if there is no boot_index=0 entry
         """
@@ -5832,7 +5897,7 @@ class _ComputeAPIUnitTestMixIn(object):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'foo': 'bar'}, None, None,
-                fields, ['baz'], ['desc'])
+                fields, ['baz'], ['desc'], columns=None)
             for i, instance in enumerate(build_req_instances + cell_instances):
                 self.assertEqual(instance, instances[i])
 
@@ -5867,7 +5932,7 @@ class _ComputeAPIUnitTestMixIn(object):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'foo': 'bar'}, None, None,
-                fields, ['baz'], ['desc'])
+                fields, ['baz'], ['desc'], columns=None)
             for i, instance in enumerate(build_req_instances + cell_instances):
                 self.assertEqual(instance, instances[i])
 
@@ -5902,7 +5967,7 @@ class _ComputeAPIUnitTestMixIn(object):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'foo': 'bar'}, 8, None,
-                fields, ['baz'], ['desc'])
+                fields, ['baz'], ['desc'], columns=None)
             for i, instance in enumerate(build_req_instances + cell_instances):
                 self.assertEqual(instance, instances[i])
 
@@ -5940,7 +6005,7 @@ class _ComputeAPIUnitTestMixIn(object):
             mock_inst_get.assert_called_once_with(
                 mock.ANY, {'foo': 'bar'},
                 8, None,
-                fields, ['baz'], ['desc'])
+                fields, ['baz'], ['desc'], columns=None)
             for i, instance in enumerate(build_req_instances +
                                          cell_instances):
                 self.assertEqual(instance, instances[i])
@@ -6460,7 +6525,7 @@ class ComputeAPIUnitTestCase(_ComputeAPIUnitTestMixIn, test.NoDBTestCase):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'ip': 'fake', 'uuid': ['fake_device_id']},
-                None, None, fields, ['baz'], ['desc'])
+                None, None, fields, ['baz'], ['desc'], columns=None)
 
     @mock.patch.object(neutron_api.API, 'has_substr_port_filtering_extension')
     @mock.patch.object(neutron_api.API, 'list_ports')
@@ -6488,7 +6553,7 @@ class ComputeAPIUnitTestCase(_ComputeAPIUnitTestMixIn, test.NoDBTestCase):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'ip6': 'fake', 'uuid': ['fake_device_id']},
-                None, None, fields, ['baz'], ['desc'])
+                None, None, fields, ['baz'], ['desc'], columns=None)
 
     @mock.patch.object(neutron_api.API, 'has_substr_port_filtering_extension')
     @mock.patch.object(neutron_api.API, 'list_ports')
@@ -6523,7 +6588,7 @@ class ComputeAPIUnitTestCase(_ComputeAPIUnitTestMixIn, test.NoDBTestCase):
             mock_inst_get.assert_called_once_with(
                 self.context, {'ip': 'fake1', 'ip6': 'fake2',
                                'uuid': ['fake_device_id', 'fake_device_id']},
-                None, None, fields, ['baz'], ['desc'])
+                None, None, fields, ['baz'], ['desc'], columns=None)
 
     @mock.patch.object(neutron_api.API, 'has_substr_port_filtering_extension')
     @mock.patch.object(neutron_api.API, 'list_ports')
@@ -6541,6 +6606,33 @@ class ComputeAPIUnitTestCase(_ComputeAPIUnitTestMixIn, test.NoDBTestCase):
             fields=['device_id'])
         self.assertEqual([], instances.objects)
 
+    @mock.patch.object(objects.BuildRequestList, 'get_by_filters')
+    @mock.patch('nova.compute.instance_list.get_instance_objects_sorted')
+    def test_get_all_columns(self, mock_get, mock_buildreq_get):
+        mock_get.return_value = objects.InstanceList(objects=[])
+        self.compute_api.get_all(self.context, search_opts={'foo': 'bar'},
+                                 expected_attrs=['tags'],
+                                 columns=['display_name'])
+        # Nothing but the expected attrs is joined when loading columns.
+        mock_get.assert_called_once_with(
+            self.context, {'foo': 'bar'}, None, None, ['tags'], None, None,
+            columns=['display_name'])
+
+    @mock.patch.object(neutron_api.API, 'has_substr_port_filtering_extension',
+                       return_value=False)
+    @mock.patch.object(objects.BuildRequestList, 'get_by_filters')
+    @mock.patch('nova.compute.instance_list.get_instance_objects_sorted')
+    def test_get_all_columns_ip_filter(self, mock_get, mock_buildreq_get,
+                                       mock_check_ext):
+        mock_get.return_value = objects.InstanceList(objects=[])
+        self.compute_api.get_all(self.context, search_opts={'ip': 'fake'},
+                                 columns=['display_name'])
+        # Whole instances are needed to filter them by IP in memory.
+        fields = ['metadata', 'info_cache', 'security_groups']
+        mock_get.assert_called_once_with(
+            self.context, {'ip': 'fake'}, None, None, fields, None, None,
+            columns=None)
+
     @mock.patch('nova.compute.api.API._delete_while_booting',
                 return_value=False)
     @mock.patch('nova.compute.api.API._lookup_instance')
@@ -6628,7 +6720,8 @@ class Cellsv1DeprecatedTestMixIn(object):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'foo': 'bar'}, limit=None, marker=None,
-                fields=fields, sort_keys=['baz'], sort_dirs=['desc'])
+                fields=fields, sort_keys=['baz'], sort_dirs=['desc'],
+                columns=None)
             for i, instance in enumerate(build_req_instances + cell_instances):
                 self.assertEqual(instance, instances[i])
 
@@ -6663,7 +6756,8 @@ class Cellsv1DeprecatedTestMixIn(object):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'foo': 'bar'}, limit=None, marker=None,
-                fields=fields, sort_keys=['baz'], sort_dirs=['desc'])
+                fields=fields, sort_keys=['baz'], sort_dirs=['desc'],
+                columns=None)
             for i, instance in enumerate(build_req_instances + cell_instances):
                 self.assertEqual(instance, instances[i])
 
@@ -6698,7 +6792,8 @@ class Cellsv1DeprecatedTestMixIn(object):
             fields = ['metadata', 'info_cache', 'security_groups']
             mock_inst_get.assert_called_once_with(
                 self.context, {'foo': 'bar'}, limit=8, marker=None,
-                fields=fields, sort_keys=['baz'], sort_dirs=['desc'])
+                fields=fields, sort_keys=['baz'], sort_dirs=['desc'],
+                columns=None)
             for i, instance in enumerate(build_req_instances + cell_instances):
                 self.assertEqual(instance, instances[i])
 
@@ -6749,11 +6844,11 @@ class Cellsv1DeprecatedTestMixIn(object):
             inst_get_calls = [mock.call(cctxt, {'foo': 'bar'},
                                         limit=8, marker=None,
                                         fields=fields, sort_keys=['baz'],
-                                        sort_dirs=['desc']),
+                                        sort_dirs=['desc'], columns=None),
                               mock.call(mock.ANY, {'foo': 'bar'},
                                         limit=6, marker=None,
                                         fields=fields, sort_keys=['baz'],
-                                        sort_dirs=['desc'])
+                                        sort_dirs=['desc'], columns=None)
                               ]
             self.assertEqual(2, mock_inst_get.call_count)
             mock_inst_get.assert_has_calls(inst_get_calls)
@@ -6822,11 +6917,11 @@ class Cellsv1DeprecatedTestMixIn(object):
             inst_get_calls = [mock.call(cctxt, {'foo': 'bar'},
                                         limit=10, marker=marker,
                                         fields=fields, sort_keys=['baz'],
-                                        sort_dirs=['desc']),
+                                        sort_dirs=['desc'], columns=None),
                               mock.call(mock.ANY, {'foo': 'bar'},
                                         limit=10, marker=marker,
                                         fields=fields, sort_keys=['baz'],
-                                        sort_dirs=['desc'])
+                                        sort_dirs=['desc'], columns=None)
                               ]
             self.assertEqual(2, mock_inst_get.call_count)
             mock_inst_get.assert_has_calls(inst_get_calls)
@@ -7024,6 +7119,64 @@ class DiffDictTestCase(test.NoDBTestCase):
         self.assertEqual(diff, dict(b=['-']))
 
 
+class ValidateConcurrentlyTestCase(test.NoDBTestCase):
+
+    @mock.patch('nova.utils.spawn', eventlet.spawn)
+    @mock.patch.object(compute_api, 'LOG')
+    def test_validate_concurrently(self, mock_log):
+        results = compute_api._validate_concurrently([
+            ('foo', lambda: 'foo_result'),
+            ('bar', lambda: 'bar_result')])
+
+        self.assertEqual({'foo': 'foo_result', 'bar': 'bar_result'}, results)
+        self.assertEqual(1, mock_log.info.call_count)
+        log_args = mock_log.info.call_args[0][1]
+        self.assertEqual('foo, bar', log_args['names'])
+        self.assertRegex(log_args['timings'],
+                         r'^foo: \d+\.\d{3}s, bar: \d+\.\d{3}s$')
+
+    @mock.patch('nova.utils.spawn', eventlet.spawn)
+    def test_validate_concurrently_error(self):
+        def _fail(exc):
+            eventlet.sleep(0)
+            raise exc
+
+        bar = mock.Mock(return_value='bar_result')
+        self.assertRaises(
+            exception.InvalidRequest, compute_api._validate_concurrently,
+            [('foo', lambda: _fail(exception.InvalidRequest)),
+             ('bar', bar),
+             ('baz', lambda: _fail(exception.FlavorNotFound(flavor_id=1)))])
+        # The other validations are completed.
+        bar.assert_called_once_with()
+
+    @mock.patch('nova.utils.spawn', eventlet.spawn)
+    def test_validate_concurrently_timeout(self):
+        self.flags(create_validation_timeout=1, group='api')
+
+        def _get_volume():
+            try:
+                eventlet.sleep(10)
+            except Exception:
+                raise exception.InvalidBDMVolume(id=uuids.volume)
+
+        ex = self.assertRaises(exception.ValidationTimeout,
+                               compute_api._validate_concurrently,
+                               [('volume', _get_volume)])
+        self.assertIn('volume', ex.format_message())
+
+    @mock.patch('eventlet.timeout.Timeout')
+    def test_validate_concurrently_untimed(self, mock_timeout):
+        self.flags(create_validation_timeout=1, group='api')
+        results = compute_api._validate_concurrently(
+            [('volume', lambda: 'volume_result'),
+             ('image', lambda: 'image_result')], untimed=['volume'])
+        self.assertEqual({'volume': 'volume_result',
+                          'image': 'image_result'}, results)
+        mock_timeout.assert_has_calls([mock.call(None), mock.call(1)],
+                                      any_order=True)
+
+
 class SecurityGroupAPITest(test.NoDBTestCase):
     def setUp(self):
         super(SecurityGroupAPITest, self).setUp()
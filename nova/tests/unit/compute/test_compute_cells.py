@@ -628,7 +628,10 @@ class CellsConductorAPIRPCRedirect(test.NoDBTestCase):
     @mock.patch.object(compute_api.API, '_get_image')
     @mock.patch.object(compute_api.API, '_validate_and_build_base_options')
     @mock.patch.object(compute_api.API, '_checks_for_create_and_rebuild')
-    def test_build_instances(self, _checks_for_create_and_rebuild,
+    @mock.patch.object(compute_utils, 'check_num_instances_quota',
+                       return_value=1)
+    def test_build_instances(self, _check_quota,
+                             _checks_for_create_and_rebuild,
                              _validate, _get_image, _check_bdm,
                              _provision, _record_action_start):
         _get_image.return_value = (None, 'fake-image')
@@ -19,6 +19,7 @@ import time
 from cinderclient import exceptions as cinder_exception
 from cursive import exception as cursive_exception
 import ddt
+import eventlet
 from eventlet import event as eventlet_event
 from eventlet import timeout as eventlet_timeout
 from keystoneauth1 import exceptions as keystone_exception
@@ -318,6 +319,32 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
             else:
                 self.assertFalse(db_node.destroy.called)
 
+    @mock.patch('nova.utils.spawn', side_effect=eventlet.spawn)
+    @mock.patch.object(manager.ComputeManager,
+                       '_update_available_resource_for_node')
+    @mock.patch.object(fake_driver.FakeDriver, 'get_available_nodes')
+    @mock.patch.object(manager.ComputeManager, '_get_compute_nodes_in_db',
+                       return_value=[])
+    def test_update_available_resource_concurrency(self, get_db_nodes,
+                                                   get_avail_nodes,
+                                                   update_mock, spawn_mock):
+        self.flags(update_resources_pool_size=2)
+        get_avail_nodes.return_value = set(['node%s' % i for i in range(5)])
+        running = set()
+        max_running = []
+
+        def fake_update(context, nodename):
+            running.add(nodename)
+            max_running.append(len(running))
+            eventlet.sleep(0)
+            running.remove(nodename)
+
+        update_mock.side_effect = fake_update
+        self.compute.update_available_resource(self.context)
+
+        self.assertEqual(5, update_mock.call_count)
+        self.assertEqual(2, max(max_running))
+
     @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
                 'delete_resource_provider')
     @mock.patch.object(manager.ComputeManager,
@@ -530,6 +557,55 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
                               'fake_device', 'fake_volume_id', 'fake_disk_bus',
                               'fake_device_type', tag=None, multiattach=True)
 
+    def test_build_stage_semaphores(self):
+        self.flags(max_concurrent_image_prefetches=2)
+        compute = manager.ComputeManager()
+        self.assertIsInstance(
+            compute._build_stage_semaphores[manager.BUILD_STAGE_IMAGE],
+            eventlet.semaphore.Semaphore)
+        self.assertEqual(
+            2, compute._build_stage_semaphores[
+                manager.BUILD_STAGE_IMAGE].balance)
+        for stage in (manager.BUILD_STAGE_NETWORK,
+                      manager.BUILD_STAGE_BLOCK_DEVICE):
+            self.assertIsInstance(compute._build_stage_semaphores[stage],
+                                  compute_utils.UnlimitedSemaphore)
+
+    @mock.patch.object(compute_utils, 'EventReporter')
+    def test_build_stage(self, mock_event):
+        instance = fake_instance.fake_instance_obj(self.context)
+        semaphore = mock.MagicMock()
+        self.compute._build_stage_semaphores[
+            manager.BUILD_STAGE_BLOCK_DEVICE] = semaphore
+
+        with self.compute._build_stage(self.context, instance,
+                                       manager.BUILD_STAGE_BLOCK_DEVICE):
+            semaphore.__enter__.assert_called_once_with()
+            mock_event.assert_called_once_with(
+                self.context, 'compute_prep_block_device', self.compute.host,
+                instance.uuid)
+            mock_event.return_value.__enter__.assert_called_once_with()
+
+        semaphore.__exit__.assert_called_once_with(None, None, None)
+        mock_event.return_value.__exit__.assert_called_once_with(
+            None, None, None)
+
+    @mock.patch.object(manager.ComputeManager, '_allocate_network_async',
+                       return_value='fake-nwinfo')
+    @mock.patch.object(manager.ComputeManager, '_build_stage')
+    def test_allocate_network_stage(self, mock_stage, mock_allocate):
+        instance = fake_instance.fake_instance_obj(self.context)
+
+        self.assertEqual('fake-nwinfo', self.compute._allocate_network_stage(
+            self.context, instance, 'fake-networks', 'fake-macs',
+            'fake-sec-groups', False))
+
+        mock_stage.assert_called_once_with(self.context, instance,
+                                           manager.BUILD_STAGE_NETWORK)
+        mock_allocate.assert_called_once_with(
+            self.context, instance, 'fake-networks', 'fake-macs',
+            'fake-sec-groups', False)
+
     @mock.patch.object(objects.Instance, 'save')
     @mock.patch.object(time, 'sleep')
     def test_allocate_network_succeeds_after_retries(
@@ -754,6 +830,56 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
 
         mock_error_interrupted.assert_called_once_with(mock.ANY, set())
 
+    @mock.patch.object(manager.ComputeManager, '_init_instance')
+    def test_init_instances(self, mock_init_instance):
+        self.flags(init_instance_pool_size=2)
+        instances = [
+            fake_instance.fake_instance_obj(
+                self.context, uuid=uuids.active, vm_state=vm_states.ACTIVE,
+                task_state=None),
+            fake_instance.fake_instance_obj(
+                self.context, uuid=uuids.deleting, vm_state=vm_states.ACTIVE,
+                task_state=task_states.DELETING),
+            fake_instance.fake_instance_obj(
+                self.context, uuid=uuids.stopped, vm_state=vm_states.STOPPED,
+                task_state=None),
+            fake_instance.fake_instance_obj(
+                self.context, uuid=uuids.migrating, vm_state=vm_states.ACTIVE,
+                task_state=task_states.RESIZE_MIGRATING),
+        ]
+
+        self.compute._init_instances(self.context, instances)
+
+        self.assertEqual(4, mock_init_instance.call_count)
+        mock_init_instance.assert_has_calls([
+            mock.call(self.context, instances[1]),
+            mock.call(self.context, instances[3])])
+        mock_init_instance.assert_has_calls([
+            mock.call(self.context, instances[0]),
+            mock.call(self.context, instances[2])], any_order=True)
+
+    # Actually run the instances in greenthreads, whose errors are only
+    # raised when waiting for them.
+    @mock.patch('nova.utils.spawn', eventlet.spawn)
+    @mock.patch.object(manager.ComputeManager, '_init_instance')
+    def test_init_instances_error(self, mock_init_instance):
+        instances = [
+            fake_instance.fake_instance_obj(
+                self.context, uuid=uuids.failing, vm_state=vm_states.ACTIVE,
+                task_state=None),
+            fake_instance.fake_instance_obj(
+                self.context, uuid=uuids.active, vm_state=vm_states.ACTIVE,
+                task_state=None),
+        ]
+        mock_init_instance.side_effect = [test.TestingException, None]
+
+        self.assertRaises(test.TestingException,
+                          self.compute._init_instances, self.context,
+                          instances)
+
+        # The remaining instances are still initialized.
+        self.assertEqual(2, mock_init_instance.call_count)
+
     @mock.patch('nova.objects.InstanceList')
     @mock.patch('nova.objects.MigrationList.get_by_filters')
     def test_cleanup_host(self, mock_miglist_get, mock_instance_list):
@@ -1988,6 +2114,117 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
                                         use_slave=True)
             mock_spawn.assert_called_once_with(mock.ANY, instance)
 
+    @mock.patch.object(fake_driver.FakeDriver, 'get_power_states')
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    def test_sync_power_states_bulk(self, mock_get, mock_get_power_states):
+        """Only the instances whose power state doesn't match the one reported
+        in bulk by the driver are synced one by one.
+        """
+        def _instance(uuid, vm_state, db_power_state, task_state=None):
+            return objects.Instance(uuid=uuid, vm_state=vm_state,
+                                    power_state=db_power_state,
+                                    task_state=task_state)
+
+        in_sync = [
+            _instance(uuids.active, vm_states.ACTIVE, power_state.RUNNING),
+            _instance(uuids.stopped, vm_states.STOPPED, power_state.SHUTDOWN),
+            _instance(uuids.error, vm_states.ERROR, power_state.NOSTATE),
+        ]
+        out_of_sync = [
+            # The power state changed
+            _instance(uuids.changed, vm_states.ACTIVE, power_state.RUNNING),
+            # The power state is the same but doesn't fit the vm_state
+            _instance(uuids.crashed, vm_states.ACTIVE, power_state.CRASHED),
+            # A task is in progress
+            _instance(uuids.task, vm_states.ACTIVE, power_state.RUNNING,
+                      task_state=task_states.REBOOTING),
+            # The driver doesn't know of the instance
+            _instance(uuids.unknown, vm_states.ACTIVE, power_state.RUNNING),
+        ]
+        mock_get.return_value = in_sync + out_of_sync
+        mock_get_power_states.return_value = {
+            uuids.active: power_state.RUNNING,
+            uuids.stopped: power_state.SHUTDOWN,
+            uuids.error: power_state.NOSTATE,
+            uuids.changed: power_state.SHUTDOWN,
+            uuids.crashed: power_state.CRASHED,
+            uuids.task: power_state.RUNNING,
+        }
+        with mock.patch.object(self.compute._sync_power_pool,
+                               'spawn_n') as mock_spawn:
+            self.compute._sync_power_states(mock.sentinel.context)
+
+        mock_get_power_states.assert_called_once_with()
+        self.assertEqual(
+            [mock.call(mock.ANY, instance) for instance in out_of_sync],
+            mock_spawn.call_args_list)
+
+    @mock.patch.object(objects.InstanceList, 'get_by_filters')
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    def test_heal_instance_info_cache_batch(self, mock_get_by_host,
+                                            mock_get_by_filters):
+        self.flags(heal_instance_info_cache_batch_size=2)
+        instances = [objects.Instance(uuid=getattr(uuids, 'inst%d' % i),
+                                      vm_state=vm_states.ACTIVE,
+                                      task_state=None)
+                     for i in range(5)]
+        # The building and deleting instances aren't healed
+        instances[0].vm_state = vm_states.BUILDING
+        instances[4].task_state = task_states.DELETING
+        mock_get_by_host.return_value = instances
+        # The second instance is being deleted when fetched
+        deleting = objects.Instance(uuid=uuids.inst1,
+                                    vm_state=vm_states.ACTIVE,
+                                    task_state=task_states.DELETING)
+        mock_get_by_filters.side_effect = [
+            [deleting, instances[2]], [instances[3]]]
+
+        with mock.patch.object(self.compute.network_api,
+                               'heal_instances_nw_info_cache') as mock_heal:
+            self.compute._heal_instance_info_cache(self.context)
+            mock_get_by_host.assert_called_once_with(
+                self.context, self.compute.host, expected_attrs=[],
+                use_slave=True)
+            mock_get_by_filters.assert_called_once_with(
+                self.context, {'uuid': [uuids.inst1, uuids.inst2],
+                               'host': self.compute.host, 'deleted': False},
+                expected_attrs=['system_metadata', 'info_cache', 'flavor'],
+                use_slave=True)
+            mock_heal.assert_called_once_with(self.context, [instances[2]])
+            self.assertEqual([uuids.inst3],
+                             self.compute._instance_uuids_to_heal)
+
+            mock_heal.reset_mock()
+            self.compute._heal_instance_info_cache(self.context)
+            mock_heal.assert_called_once_with(self.context, [instances[3]])
+            self.assertEqual([], self.compute._instance_uuids_to_heal)
+            self.assertEqual(1, mock_get_by_host.call_count)
+
+    @mock.patch.object(objects.InstanceList, 'get_by_filters')
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    def test_heal_instance_info_cache_batch_not_implemented(
+            self, mock_get_by_host, mock_get_by_filters):
+        self.flags(heal_instance_info_cache_batch_size=2)
+        instances = [objects.Instance(uuid=getattr(uuids, 'inst%d' % i),
+                                      vm_state=vm_states.ACTIVE,
+                                      task_state=None)
+                     for i in range(2)]
+        mock_get_by_host.return_value = instances
+        mock_get_by_filters.return_value = instances
+
+        with test.nested(
+            mock.patch.object(self.compute.network_api,
+                              'heal_instances_nw_info_cache',
+                              side_effect=NotImplementedError),
+            mock.patch.object(self.compute.network_api,
+                              'get_instance_nw_info'),
+        ) as (mock_heal, mock_get_nw_info):
+            self.compute._heal_instance_info_cache(self.context)
+
+        mock_heal.assert_called_once_with(self.context, instances)
+        mock_get_nw_info.assert_has_calls(
+            [mock.call(self.context, instance) for instance in instances])
+
     @mock.patch('nova.objects.InstanceList.get_by_host', new=mock.Mock())
     @mock.patch('nova.compute.manager.ComputeManager.'
                 '_query_driver_power_state_and_sync',
@@ -5365,6 +5602,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         self.admin_pass = 'pass'
         self.injected_files = []
         self.image = {}
+        self.image_meta = objects.ImageMeta.from_dict(self.image)
         self.node = 'fake-node'
         self.limits = {}
         self.requested_networks = []
@@ -5375,6 +5613,10 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
                                                        'fake-node']]}}
 
         self.useFixture(fixtures.SpawnIsSynchronousFixture())
+        # The stages of _build_resources record instance action events.
+        self.mock_build_stage = self.useFixture(
+            fixtures.fixtures.MockPatchObject(
+                manager.ComputeManager, '_build_stage')).mock
 
         def fake_network_info():
             return network_model.NetworkInfo([{'address': '1.2.3.4'}])
@@ -6402,7 +6644,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         try:
             with self.compute._build_resources(self.context, self.instance,
                     self.requested_networks, self.security_groups,
-                    self.image, self.block_device_mapping):
+                    self.image_meta, self.block_device_mapping):
                 pass
         except Exception as e:
             self.assertIsInstance(e, exception.BuildAbortException)
@@ -6519,7 +6761,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
             try:
                 with self.compute._build_resources(self.context, self.instance,
                         self.requested_networks, self.security_groups,
-                        self.image, self.block_device_mapping):
+                        self.image_meta, self.block_device_mapping):
                     pass
             except Exception as e:
                 self.assertIsInstance(e,
@@ -6545,7 +6787,8 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
 
         try:
             with self.compute._build_resources(self.context, self.instance,
-                    self.requested_networks, self.security_groups, self.image,
+                    self.requested_networks, self.security_groups,
+                    self.image_meta,
                     self.block_device_mapping):
                 pass
         except Exception as e:
@@ -6575,7 +6818,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
             try:
                 with self.compute._build_resources(self.context, self.instance,
                         self.requested_networks, self.security_groups,
-                        self.image, self.block_device_mapping):
+                        self.image_meta, self.block_device_mapping):
                     pass
             except Exception as e:
                 self.assertIsInstance(e, exc)
@@ -6601,7 +6844,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         try:
             with self.compute._build_resources(
                     self.context, self.instance, self.requested_networks,
-                    self.security_groups, self.image,
+                    self.security_groups, self.image_meta,
                     self.block_device_mapping):
                 pass
         except Exception as e:
@@ -6631,7 +6874,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         try:
             with self.compute._build_resources(self.context, self.instance,
                     self.requested_networks, self.security_groups,
-                    self.image, self.block_device_mapping):
+                    self.image_meta, self.block_device_mapping):
                 fake_spawn()
         except Exception as e:
             self.assertEqual(test_exception, e)
@@ -6663,7 +6906,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         try:
             with self.compute._build_resources(self.context, self.instance,
                     self.requested_networks, self.security_groups,
-                    self.image, self.block_device_mapping):
+                    self.image_meta, self.block_device_mapping):
                 raise test.TestingException()
         except Exception as e:
             self.assertEqual(expected_exc, e)
@@ -6692,7 +6935,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         try:
             with self.compute._build_resources(self.context, self.instance,
                     self.requested_networks, self.security_groups,
-                    self.image, self.block_device_mapping):
+                    self.image_meta, self.block_device_mapping):
                 raise test.TestingException()
         except exception.BuildAbortException:
             pass
@@ -6718,7 +6961,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         try:
             with self.compute._build_resources(self.context, self.instance,
                     self.requested_networks, self.security_groups,
-                    self.image, self.block_device_mapping):
+                    self.image_meta, self.block_device_mapping):
                 raise test.TestingException()
         except exception.BuildAbortException:
             pass
@@ -6748,7 +6991,7 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
                                     'Failed to spawn'):
             with self.compute._build_resources(self.context, self.instance,
                     self.requested_networks, self.security_groups,
-                    self.image, self.block_device_mapping):
+                    self.image_meta, self.block_device_mapping):
                 fake_spawn()
 
         self.assertTrue(mock_log.warning.called)
@@ -6765,6 +7008,114 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
         # so calling after the fact is not necessary.
         mock_failedspawn.assert_not_called()
 
+    @mock.patch.object(virt_driver.ComputeDriver, 'prefetch_image')
+    @mock.patch.object(manager.ComputeManager, '_build_networks_for_instance')
+    @mock.patch.object(objects.Instance, 'save')
+    def test_build_resources_stages(self, mock_save, mock_build,
+                                    mock_prefetch):
+        mock_save.return_value = self.instance
+        mock_build.return_value = self.network_info
+        self.instance.image_ref = uuids.image
+        image_meta = objects.ImageMeta.from_dict({'id': uuids.image})
+        bdms = objects.BlockDeviceMappingList()
+
+        with self.compute._build_resources(self.context, self.instance,
+                self.requested_networks, self.security_groups,
+                image_meta, bdms) as resources:
+            mock_prefetch.assert_called_once_with(self.context,
+                                                  self.instance, image_meta)
+            self.assertIn('block_device_info', resources)
+
+        self.mock_build_stage.assert_has_calls([
+            mock.call(self.context, self.instance, manager.BUILD_STAGE_IMAGE),
+            mock.call(self.context, self.instance,
+                      manager.BUILD_STAGE_BLOCK_DEVICE)],
+            any_order=True)
+
+    @mock.patch.object(virt_driver.ComputeDriver, 'prefetch_image')
+    @mock.patch.object(manager.ComputeManager, '_build_networks_for_instance')
+    @mock.patch.object(objects.Instance, 'save')
+    def test_build_resources_volume_backed_no_prefetch(self, mock_save,
+                                                      mock_build,
+                                                      mock_prefetch):
+        mock_save.return_value = self.instance
+        mock_build.return_value = self.network_info
+        self.instance.image_ref = ''
+        image_meta = objects.ImageMeta.from_dict({'id': uuids.image})
+        bdms = objects.BlockDeviceMappingList()
+
+        with self.compute._build_resources(self.context, self.instance,
+                self.requested_networks, self.security_groups,
+                image_meta, bdms):
+            pass
+
+        mock_prefetch.assert_not_called()
+        self.mock_build_stage.assert_called_once_with(
+            self.context, self.instance, manager.BUILD_STAGE_BLOCK_DEVICE)
+
+    @mock.patch.object(virt_driver.ComputeDriver, 'prefetch_image',
+                       side_effect=test.TestingException)
+    @mock.patch.object(manager.ComputeManager, '_build_networks_for_instance')
+    @mock.patch.object(objects.Instance, 'save')
+    def test_build_resources_prefetch_failure_ignored(self, mock_save,
+                                                      mock_build,
+                                                      mock_prefetch):
+        mock_save.return_value = self.instance
+        mock_build.return_value = self.network_info
+        self.instance.image_ref = uuids.image
+        image_meta = objects.ImageMeta.from_dict({'id': uuids.image})
+        bdms = objects.BlockDeviceMappingList()
+
+        with mock.patch.object(manager, 'LOG') as mock_log:
+            with self.compute._build_resources(self.context, self.instance,
+                    self.requested_networks, self.security_groups,
+                    image_meta, bdms) as resources:
+                self.assertIn('block_device_info', resources)
+
+        mock_prefetch.assert_called_once_with(self.context, self.instance,
+                                              image_meta)
+        self.assertEqual(1, mock_log.warning.call_count)
+
+    @mock.patch.object(manager.ComputeManager, '_start_image_prefetch')
+    @mock.patch.object(manager.ComputeManager, '_build_networks_for_instance')
+    @mock.patch.object(objects.Instance, 'save')
+    def _test_build_resources_failure_kills_prefetch(self, mock_save,
+                                                     mock_build,
+                                                     mock_start_prefetch):
+        mock_save.return_value = self.instance
+        mock_build.return_value = self.network_info
+        image_prefetch = mock_start_prefetch.return_value
+
+        self.assertRaises(
+            exception.BuildAbortException, self._do_build_resources)
+
+        # The image is not downloaded any further once the build failed.
+        image_prefetch.kill.assert_called_once_with()
+        image_prefetch.wait.assert_not_called()
+
+    def _do_build_resources(self):
+        with self.compute._build_resources(self.context, self.instance,
+                self.requested_networks, self.security_groups,
+                self.image_meta, self.block_device_mapping):
+            pass
+
+    @mock.patch.object(manager.ComputeManager, '_prep_block_device',
+                       side_effect=test.TestingException)
+    def test_build_resources_failed_bdm_prep_kills_prefetch(self, mock_prep):
+        self._test_build_resources_failure_kills_prefetch()
+
+    @mock.patch.object(virt_driver.ComputeDriver, 'prepare_for_spawn',
+                       side_effect=exception.InvalidBDM)
+    def test_build_resources_failed_prepare_for_spawn_kills_prefetch(
+            self, mock_prepspawn):
+        self._test_build_resources_failure_kills_prefetch()
+
+    @mock.patch.object(manager.ComputeManager, '_prep_block_device')
+    def test_build_resources_failed_allocations_kills_prefetch(self,
+                                                              mock_prep):
+        self.mock_get_allocs.side_effect = test.TestingException
+        self._test_build_resources_failure_kills_prefetch()
+
     @mock.patch.object(manager.ComputeManager, '_allocate_network')
     @mock.patch.object(network_api.API, 'get_instance_nw_info')
     def test_build_networks_if_not_allocated(self, mock_get, mock_allocate):
@@ -10,11 +10,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
 import mock
+from oslo_utils import fixture as utils_fixture
 
 from nova.compute import instance_list
 from nova.compute import multi_cell_list
 from nova import context as nova_context
+from nova import exception
 from nova import objects
 from nova import test
 from nova.tests import fixtures
@@ -80,6 +84,30 @@ class TestInstanceList(test.NoDBTestCase):
 
         self.assertEqual(insts_one, insts_two)
 
+    @mock.patch('nova.db.api.instance_get_all_by_filters_sort')
+    @mock.patch('nova.compute.instance_list.InstanceLister.get_marker_record')
+    @mock.patch('nova.objects.CellMappingList.get_all')
+    def test_get_instances_sorted_marker(self, mock_cells, mock_marker,
+                                         mock_inst):
+        mock_cells.return_value = self.cells
+        mock_marker.return_value = dict(hostname='cell0-inst1',
+                                        uuid=uuids.marker)
+        mock_inst.return_value = []
+
+        insts = instance_list.get_instances_sorted(self.context, {},
+                                                   None, uuids.marker,
+                                                   [], ['hostname'], ['asc'])
+        self.assertEqual([], list(insts))
+
+        # The marker is only looked up once, and every cell is queried for
+        # the instances after the values of its sort keys.
+        mock_marker.assert_called_once_with(self.context, uuids.marker)
+        mock_inst.assert_has_calls([mock.call(
+            mock.ANY, {}, limit=None,
+            marker_values=['cell0-inst1', uuids.marker], columns_to_join=[],
+            sort_keys=['hostname', 'uuid'], sort_dirs=['asc', 'asc'],
+            columns=None)] * 3)
+
     @mock.patch('nova.objects.BuildRequestList.get_by_filters')
     @mock.patch('nova.compute.instance_list.get_instances_sorted')
     @mock.patch('nova.objects.CellMappingList.get_by_project_id')
@@ -92,7 +120,8 @@ class TestInstanceList(test.NoDBTestCase):
             user_context, {}, None, None, [], None, None)
         mock_gi.assert_called_once_with(user_context, {}, None, None, [],
                                         None, None,
-                                        cell_mappings=mock_cm.return_value)
+                                        cell_mappings=mock_cm.return_value,
+                                        columns=None)
 
     @mock.patch('nova.objects.BuildRequestList.get_by_filters')
     @mock.patch('nova.compute.instance_list.get_instances_sorted')
@@ -106,7 +135,7 @@ class TestInstanceList(test.NoDBTestCase):
             admin_context, {}, None, None, [], None, None)
         mock_gi.assert_called_once_with(admin_context, {}, None, None, [],
                                         None, None,
-                                        cell_mappings=None)
+                                        cell_mappings=None, columns=None)
         mock_cm.assert_not_called()
 
     @mock.patch('nova.objects.BuildRequestList.get_by_filters')
@@ -121,7 +150,7 @@ class TestInstanceList(test.NoDBTestCase):
             user_context, {}, None, None, [], None, None)
         mock_gi.assert_called_once_with(user_context, {}, None, None, [],
                                         None, None,
-                                        cell_mappings=None)
+                                        cell_mappings=None, columns=None)
 
     @mock.patch('nova.objects.BuildRequestList.get_by_filters')
     @mock.patch('nova.compute.instance_list.get_instances_sorted')
@@ -136,9 +165,33 @@ class TestInstanceList(test.NoDBTestCase):
             admin_context, {}, None, None, [], None, None)
         mock_gi.assert_called_once_with(admin_context, {}, None, None, [],
                                         None, None,
-                                        cell_mappings=None)
+                                        cell_mappings=None, columns=None)
         mock_cm.assert_not_called()
 
+    @mock.patch('nova.db.api.instance_get_all_by_filters_sort')
+    @mock.patch('nova.objects.CellMappingList.get_all')
+    def test_get_instance_objects_sorted_columns(self, mock_cells,
+                                                 mock_inst):
+        mock_cells.return_value = self.cells[:1]
+        mock_inst.return_value = [dict(id=1, uuid=uuids.inst,
+                                       display_name='inst', hostname='inst')]
+        ctx = nova_context.RequestContext('fake', 'fake', is_admin=True)
+
+        insts = instance_list.get_instance_objects_sorted(
+            ctx, {}, None, None, [], ['hostname'], ['asc'],
+            columns=['display_name'])
+
+        # The sort keys are loaded too, so that the records of the cells can
+        # be merged.
+        mock_inst.assert_called_once_with(
+            mock.ANY, {}, limit=None, marker_values=None, columns_to_join=[],
+            sort_keys=['hostname', 'uuid'], sort_dirs=['asc', 'asc'],
+            columns=set(['id', 'uuid', 'display_name', 'hostname']))
+        self.assertEqual(1, len(insts))
+        self.assertEqual(uuids.inst, insts[0].uuid)
+        self.assertEqual('inst', insts[0].display_name)
+        self.assertNotIn('hostname', insts[0])
+
     @mock.patch('nova.context.scatter_gather_cells')
     def test_get_instances_with_down_cells(self, mock_sg):
         inst_cell0 = self.insts[uuids.cell0]
@@ -162,3 +215,120 @@ class TestInstanceList(test.NoDBTestCase):
 
         # return the results from the up cell, ignoring the down cell.
         self.assertEqual(uuid_initial, uuid_final)
+
+
+class TestInstanceChangeFeed(test.NoDBTestCase):
+    def setUp(self):
+        super(TestInstanceChangeFeed, self).setUp()
+        self.cells = [objects.CellMapping(uuid=getattr(uuids, 'cell%i' % i),
+                                          name='cell%i' % i,
+                                          transport_url='fake:///',
+                                          database_connection='fake://')
+                      for i in range(0, 2)]
+        self.since = datetime.datetime(2018, 1, 1)
+        self.now = datetime.datetime(2018, 1, 2)
+        self.useFixture(utils_fixture.TimeFixture(self.now))
+        self.context = mock.sentinel.context
+        self.cell_contexts = {cell.uuid: mock.Mock(cell_uuid=cell.uuid)
+                              for cell in self.cells}
+        self.stub_out('nova.context.target_cell',
+                      lambda ctx, cell: mock.MagicMock(__enter__=mock.Mock(
+                          return_value=self.cell_contexts[cell.uuid])))
+
+    def _insts(self, cell, count, start=1):
+        return [dict(id=i, uuid='%s-inst%i' % (cell.name, i),
+                     updated_at=self.since + datetime.timedelta(seconds=i))
+                for i in range(start, start + count)]
+
+    @mock.patch('nova.db.api.instance_get_changes')
+    def test_get_changes(self, mock_changes):
+        insts = {self.cells[0].uuid: self._insts(self.cells[0], 3),
+                 self.cells[1].uuid: self._insts(self.cells[1], 1)}
+
+        def get_changes(cctx, since, changes_before, limit, marker_values,
+                        columns_to_join, columns):
+            cell_insts = insts[cctx.cell_uuid]
+            if marker_values:
+                cell_insts = [inst for inst in cell_insts
+                              if inst['id'] > marker_values[1]]
+            return cell_insts[:limit]
+        mock_changes.side_effect = get_changes
+
+        feed = instance_list.InstanceChangeFeed(self.since, cells=self.cells)
+        changes = list(feed.get_changes(self.context, limit=3, batch_size=2,
+                                        columns=['display_name']))
+        self.assertEqual(['cell0-inst1', 'cell0-inst2', 'cell0-inst3'],
+                         [inst['uuid'] for inst in changes])
+        # The cells are read by batches from their high-water mark, and only
+        # the instances updated more than settle_time seconds ago are
+        # returned.
+        changes_before = self.now - datetime.timedelta(seconds=5)
+        columns = set(['display_name', 'updated_at', 'id'])
+        mock_changes.assert_has_calls([
+            mock.call(self.cell_contexts[uuids.cell0], self.since,
+                      changes_before=changes_before, limit=2,
+                      marker_values=None, columns_to_join=None,
+                      columns=columns),
+            mock.call(self.cell_contexts[uuids.cell0], self.since,
+                      changes_before=changes_before, limit=1,
+                      marker_values=[insts[uuids.cell0][1]['updated_at'], 2],
+                      columns_to_join=None, columns=columns)])
+        self.assertEqual(2, mock_changes.call_count)
+
+        # The feed continues from the cursor, with the cell whose changes
+        # were returned up to the oldest time first.
+        insts[uuids.cell0].extend(self._insts(self.cells[0], 1, start=4))
+        feed = instance_list.InstanceChangeFeed.from_cursor(
+            feed.cursor, cells=list(reversed(self.cells)))
+        self.assertEqual(self.since, feed.changes_since)
+        self.assertEqual(
+            {uuids.cell0: [insts[uuids.cell0][2]['updated_at'], 3]},
+            feed.marks)
+        changes = list(feed.get_changes(self.context))
+        self.assertEqual(['cell1-inst1', 'cell0-inst4'],
+                         [inst['uuid'] for inst in changes])
+        self.assertEqual(
+            {uuids.cell0: [insts[uuids.cell0][3]['updated_at'], 4],
+             uuids.cell1: [insts[uuids.cell1][0]['updated_at'], 1]},
+            feed.marks)
+
+    @mock.patch('nova.db.api.instance_get_changes')
+    def test_get_changes_with_down_cell(self, mock_changes):
+        insts = self._insts(self.cells[1], 2)
+        mock_changes.side_effect = [exception.DBNotAllowed('nova-compute'),
+                                    insts]
+        feed = instance_list.InstanceChangeFeed(self.since, cells=self.cells)
+
+        changes = list(feed.get_changes(self.context))
+
+        # The down cell is skipped and keeps its high-water mark.
+        self.assertEqual(insts, changes)
+        self.assertEqual({uuids.cell1: [insts[1]['updated_at'], 2]},
+                         feed.marks)
+
+    def test_from_cursor_invalid(self):
+        for cursor in ('~', 'foo', 'WzFd', 'eyJzaW5jZSI6IDF9'):
+            self.assertRaises(exception.MarkerNotFound,
+                              instance_list.InstanceChangeFeed.from_cursor,
+                              cursor)
+
+    @mock.patch('nova.db.api.instance_get_changes')
+    def test_get_instance_objects(self, mock_changes):
+        mock_changes.return_value = [dict(
+            id=1, uuid=uuids.inst, display_name='inst',
+            updated_at=self.since)]
+        ctx = nova_context.RequestContext('fake', 'fake', is_admin=True)
+        feed = instance_list.InstanceChangeFeed(self.since,
+                                                cells=self.cells[:1])
+
+        insts = feed.get_instance_objects(ctx, limit=1,
+                                          columns=['display_name'])
+
+        mock_changes.assert_called_once_with(
+            mock.ANY, self.since, changes_before=mock.ANY, limit=1,
+            marker_values=None, columns_to_join=[],
+            columns=set(['id', 'uuid', 'display_name', 'updated_at']))
+        self.assertEqual(1, len(insts))
+        self.assertEqual(uuids.inst, insts[0].uuid)
+        self.assertEqual('inst', insts[0].display_name)
+        self.assertEqual({uuids.cell0: [self.since, 1]}, feed.marks)
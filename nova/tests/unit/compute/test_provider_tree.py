@@ -414,6 +414,34 @@ class TestProviderTree(test.NoDBTestCase):
         self.assertEqual([uuids.root, uuids.child], pt.get_provider_uuids())
         self.assertFalse(pt.exists(uuids.grandchild))
 
+    def test_get_digests(self):
+        cns = self.compute_nodes
+        pt = self._pt_with_cns()
+        pt.new_child('numa_cell0_1', uuids.cn1, uuid=uuids.numa_cell0_1)
+        digests = pt.get_digests()
+        self.assertEqual(
+            set([cns[0].uuid, cns[1].uuid, uuids.numa_cell0_1]), set(digests))
+        self.assertEqual(3, len(set(digests.values())))
+        self.assertEqual({uuids.numa_cell0_1: digests[uuids.numa_cell0_1]},
+                         pt.get_digests(uuids.numa_cell0_1))
+
+        # The generation doesn't count
+        pt.update_inventory(cns[0].uuid, {}, generation=3)
+        self.assertEqual(digests, pt.get_digests())
+
+        # The inventory, traits and aggregates do
+        for update in (
+                lambda: pt.update_inventory(uuids.numa_cell0_1,
+                                            {'VCPU': {'total': 1}}),
+                lambda: pt.update_traits(uuids.numa_cell0_1, ['CUSTOM_FOO']),
+                lambda: pt.update_aggregates(uuids.numa_cell0_1, [uuids.agg])):
+            update()
+            new_digests = pt.get_digests()
+            self.assertNotEqual(digests[uuids.numa_cell0_1],
+                                new_digests[uuids.numa_cell0_1])
+            self.assertEqual(digests[cns[0].uuid], new_digests[cns[0].uuid])
+            digests = new_digests
+
     def test_has_inventory_changed_no_existing_rp(self):
         pt = self._pt_with_cns()
         self.assertRaises(
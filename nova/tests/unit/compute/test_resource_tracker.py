@@ -13,7 +13,9 @@
 import copy
 import datetime
 
+import eventlet
 import mock
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_utils import timeutils
 from oslo_utils import units
@@ -575,6 +577,91 @@ class TestUpdateAvailableResources(BaseTestCase):
                                                  actual_resources))
         update_mock.assert_called_once()
 
+    @mock.patch('nova.objects.InstancePCIRequests.get_by_instance',
+                return_value=objects.InstancePCIRequests(requests=[]))
+    @mock.patch('nova.objects.PciDeviceList.get_by_compute_node',
+                return_value=objects.PciDeviceList())
+    @mock.patch('nova.objects.ComputeNode.get_by_host_and_nodename')
+    @mock.patch('nova.objects.MigrationList.get_in_progress_by_host_and_node')
+    @mock.patch('nova.objects.InstanceList.get_by_host_and_node')
+    def test_skipped_writes_logged(self, get_mock, migr_mock, get_cn_mock,
+                                   pci_mock, instance_pci_mock):
+        self._setup_rt()
+        get_mock.return_value = []
+        migr_mock.return_value = []
+        get_cn_mock.return_value = _COMPUTE_NODE_FIXTURES[0]
+        self.rt.skipped_writes.update({'compute_node': 3, 'placement': 2})
+
+        with mock.patch.object(resource_tracker.LOG, 'debug') as mock_debug:
+            self._update_available_resources()
+        mock_debug.assert_any_call(
+            mock.ANY, {'host': _HOSTNAME, 'node': _NODENAME,
+                       'compute_node': 3, 'placement': 2})
+
+    def test_usage_audit_due_by_default(self):
+        """The usage of the node, and the stats derived from its instances,
+        are rebuilt every time the periodic task runs by default.
+        """
+        self._setup_rt()
+        self.rt.compute_nodes[_NODENAME] = _COMPUTE_NODE_FIXTURES[0]
+        self.rt.usage_audit_times[_NODENAME] = timeutils.now()
+        self.assertTrue(self.rt._is_usage_audit_due(_NODENAME))
+
+    @mock.patch('oslo_utils.timeutils.now')
+    @mock.patch('nova.objects.InstancePCIRequests.get_by_instance',
+                return_value=objects.InstancePCIRequests(requests=[]))
+    @mock.patch('nova.objects.PciDeviceList.get_by_compute_node',
+                return_value=objects.PciDeviceList())
+    @mock.patch('nova.objects.ComputeNode.get_by_host_and_nodename')
+    @mock.patch('nova.objects.MigrationList.get_in_progress_by_host_and_node')
+    @mock.patch('nova.objects.InstanceList.get_by_host_and_node')
+    def test_usage_audit_interval(self, get_mock, migr_mock, get_cn_mock,
+                                  pci_mock, instance_pci_mock, now_mock):
+        """The usage of the node is only rebuilt from its instances and
+        migrations every resource_usage_audit_interval seconds, and kept as
+        tracked in between.
+        """
+        self.flags(resource_usage_audit_interval=600)
+        self._setup_rt()
+        get_mock.return_value = []
+        migr_mock.return_value = []
+        get_cn_mock.return_value = _COMPUTE_NODE_FIXTURES[0]
+
+        now_mock.return_value = 1000
+        self._update_available_resources()
+        self.assertEqual(1, get_mock.call_count)
+        self.assertEqual(1, migr_mock.call_count)
+        cn = self.rt.compute_nodes[_NODENAME]
+        self.assertEqual(0, cn.memory_mb_used)
+
+        # Emulate a claim which was leaked
+        self.rt._update_usage({'memory_mb': 128}, _NODENAME)
+        self.rt.stats[_NODENAME]['num_instances'] = 1
+
+        now_mock.return_value = 1599
+        update_mock = self._update_available_resources()
+        self.assertEqual(1, get_mock.call_count)
+        self.assertEqual(1, migr_mock.call_count)
+        self.assertEqual(2, self.driver_mock.get_available_resource.call_count)
+        actual_resources = update_mock.call_args[0][1]
+        self.assertEqual(128, actual_resources.memory_mb_used)
+        self.assertEqual(384, actual_resources.free_ram_mb)
+        self.assertEqual('1', actual_resources.stats['num_instances'])
+        self.assertEqual(0, self.rt.usage_drifts[_NODENAME])
+
+        now_mock.return_value = 1600
+        with mock.patch.object(resource_tracker.LOG, 'warning') as mock_warn:
+            update_mock = self._update_available_resources()
+        self.assertEqual(2, get_mock.call_count)
+        self.assertEqual(2, migr_mock.call_count)
+        actual_resources = update_mock.call_args[0][1]
+        self.assertEqual(0, actual_resources.memory_mb_used)
+        self.assertEqual(512, actual_resources.free_ram_mb)
+        self.assertEqual(1, self.rt.usage_drifts[_NODENAME])
+        mock_warn.assert_called_once()
+        self.assertIn('memory_mb_used 128 -> 0',
+                      mock_warn.call_args[0][1]['drift'])
+
     @mock.patch('nova.objects.InstancePCIRequests.get_by_instance',
                 return_value=objects.InstancePCIRequests(requests=[]))
     @mock.patch('nova.objects.PciDeviceList.get_by_compute_node',
@@ -1414,11 +1501,11 @@ class TestUpdateComputeNode(BaseTestCase):
         save_mock.assert_called_once_with()
         gptaer_mock.assert_called_once_with(
             mock.sentinel.ctx, new_compute.uuid,
-            name=new_compute.hypervisor_hostname)
+            name=new_compute.hypervisor_hostname, scoped=True)
         self.driver_mock.update_provider_tree.assert_called_once_with(
             ptree, new_compute.hypervisor_hostname)
         rc_mock.update_from_provider_tree.assert_called_once_with(
-            mock.sentinel.ctx, ptree)
+            mock.sentinel.ctx, ptree, rp_uuid=new_compute.uuid)
         self.sched_client_mock.update_compute_node.assert_not_called()
         self.sched_client_mock.set_inventory_for_provider.assert_not_called()
         # _normalize_inventory_from_cn_obj should have set allocation ratios
@@ -1435,6 +1522,67 @@ class TestUpdateComputeNode(BaseTestCase):
         exp_inv[rc_fields.ResourceClass.DISK_GB]['reserved'] = 1
         self.assertEqual(exp_inv, ptree.data(new_compute.uuid).inventory)
 
+    @mock.patch('nova.objects.ComputeNode.save')
+    def test_update_provider_tree_unchanged_skipped(self, save_mock):
+        """Nothing is written to placement or the database when neither the
+        report client cache nor the provider tree reported by the virt driver
+        changed since the last successful flush.
+        """
+        inv = {
+            rc_fields.ResourceClass.VCPU: {
+                'total': 2,
+                'min_unit': 1,
+                'max_unit': 2,
+                'step_size': 1,
+            },
+        }
+
+        def fake_upt(ptree, nodename):
+            ptree.update_inventory(nodename, inv)
+            ptree.update_traits(nodename, ['CUSTOM_FOO'])
+
+        self._setup_rt()
+        self.driver_mock.update_provider_tree.side_effect = fake_upt
+
+        orig_compute = _COMPUTE_NODE_FIXTURES[0].obj_clone()
+        self.rt.compute_nodes[_NODENAME] = orig_compute
+        self.rt.old_resources[_NODENAME] = orig_compute
+
+        def fake_gptaer(ctx, rp_uuid, name=None, scoped=False):
+            # The report client cache, which update_from_provider_tree is
+            # mocked not to change.
+            ptree = provider_tree.ProviderTree()
+            ptree.new_root(name, rp_uuid)
+            return ptree
+
+        rc_mock = self.rt.reportclient
+        rc_mock.get_provider_tree_and_ensure_root.side_effect = fake_gptaer
+        ufpt_mock = rc_mock.update_from_provider_tree
+
+        self.rt._update(mock.sentinel.ctx, orig_compute.obj_clone())
+        self.assertEqual(1, ufpt_mock.call_count)
+        self.rt._update(mock.sentinel.ctx, orig_compute.obj_clone())
+        self.assertEqual(1, ufpt_mock.call_count)
+        save_mock.assert_not_called()
+        self.assertEqual({'compute_node': 2, 'placement': 1},
+                         dict(self.rt.skipped_writes))
+
+        # A change reported by the virt driver is flushed
+        inv[rc_fields.ResourceClass.VCPU]['total'] = 4
+        self.rt._update(mock.sentinel.ctx, orig_compute.obj_clone())
+        self.assertEqual(2, ufpt_mock.call_count)
+
+        # So is a failed flush, on the next update
+        ufpt_mock.side_effect = exc.ResourceProviderSyncFailed()
+        inv[rc_fields.ResourceClass.VCPU]['total'] = 8
+        self.assertRaises(exc.ResourceProviderSyncFailed,
+                          self.rt._update, mock.sentinel.ctx,
+                          orig_compute.obj_clone())
+        ufpt_mock.side_effect = None
+        self.rt._update(mock.sentinel.ctx, orig_compute.obj_clone())
+        self.assertEqual(4, ufpt_mock.call_count)
+        self.assertEqual(1, self.rt.skipped_writes['placement'])
+
     @mock.patch('nova.objects.ComputeNode.save', new=mock.Mock())
     def test_update_retry_success(self):
         self._setup_rt()
@@ -2806,6 +2954,23 @@ class TestUpdateUsageFromInstance(BaseTestCase):
         self.assertEqual(0, result['root_gb'])
         mock_check_bfv.assert_not_called()
 
+    @mock.patch('nova.compute.utils.is_volume_backed_instance',
+                new=mock.Mock(return_value=False))
+    def test_update_usage_from_instances_other_node(self):
+        """Rebuilding the usage of a node keeps tracking the instances of the
+        other nodes of the host.
+        """
+        self.rt.tracked_instances[uuids.other] = {'uuid': uuids.other,
+                                                  'node': 'other-node'}
+        self.rt.tracked_instances[uuids.gone] = {'uuid': uuids.gone,
+                                                 'node': _NODENAME}
+
+        self.rt._update_usage_from_instances(
+            mock.sentinel.ctx, [self.instance], _NODENAME)
+
+        self.assertEqual(set([uuids.other, self.instance.uuid]),
+                         set(self.rt.tracked_instances))
+
     @mock.patch('nova.compute.utils.is_volume_backed_instance')
     def test_get_usage_dict_include_swap(
             self, mock_check_bfv):
@@ -3313,3 +3478,137 @@ class OverCommitTestCase(BaseTestCase):
     def test_disk_allocation_ratio_none_negative(self):
         self.assertRaises(ValueError,
                           CONF.set_default, 'disk_allocation_ratio', -1.0)
+
+
+class TestSynchronizedPerNode(BaseTestCase):
+
+    def setUp(self):
+        super(TestSynchronizedPerNode, self).setUp()
+        self._setup_rt()
+
+    def test_nodes_locked_separately(self):
+        lock_name = '%s-node-a' % resource_tracker.COMPUTE_RESOURCE_SEMAPHORE
+        with lockutils.lock(lock_name):
+            # The lock of node-a doesn't block node-b
+            self.rt.update_usage(mock.sentinel.ctx, mock.sentinel.instance,
+                                 'node-b')
+            # but blocks node-a
+            thread = eventlet.spawn(self.rt.update_usage, mock.sentinel.ctx,
+                                    mock.sentinel.instance, 'node-a')
+            eventlet.sleep(0)
+            self.assertFalse(thread.dead)
+        thread.wait()
+
+    @mock.patch.object(resource_tracker, 'timeutils')
+    def test_lock_wait_times(self, timeutils_mock):
+        timeutils_mock.now.side_effect = [100.0, 102.5, 200.0, 200.5]
+        resources = {'hypervisor_hostname': 'node-a'}
+        with mock.patch.object(self.rt, '_is_usage_audit_due',
+                               return_value=True), \
+                mock.patch.object(self.rt, '_init_compute_node'):
+            self.rt._update_available_resource(mock.sentinel.ctx, resources)
+        self.rt.update_usage(mock.sentinel.ctx, mock.sentinel.instance,
+                             nodename='node-a')
+        self.assertEqual({'node-a': 3.0}, dict(self.rt.lock_wait_times))
+
+    @mock.patch.object(resource_tracker, 'timeutils')
+    def test_host_lock_wait_times(self, timeutils_mock):
+        timeutils_mock.now.side_effect = [10.0, 11.5]
+        self.rt.pci_tracker = mock.Mock()
+        self.rt._save_pci_devices(mock.sentinel.ctx, 'node-a')
+        self.rt.pci_tracker.save.assert_called_once_with(mock.sentinel.ctx)
+        self.assertEqual({'node-a': 1.5}, dict(self.rt.lock_wait_times))
+
+    def test_flush_doesnt_block_other_nodes(self):
+        """A slow flush of the provider tree of a node to placement doesn't
+        block the updates of the other nodes.
+        """
+        flushing = eventlet.event.Event()
+
+        def fake_gptaer(context, rp_uuid, name=None, scoped=False):
+            ptree = provider_tree.ProviderTree()
+            ptree.new_root(name, rp_uuid)
+            return ptree
+
+        def fake_ufpt(context, new_tree, rp_uuid=None):
+            if rp_uuid == uuids.node_a:
+                flushing.wait()
+
+        reportclient = self.rt.scheduler_client.reportclient
+        reportclient.get_provider_tree_and_ensure_root.side_effect = (
+            fake_gptaer)
+        reportclient.update_from_provider_tree.side_effect = fake_ufpt
+        self.driver_mock.update_provider_tree.side_effect = lambda *a: None
+        self.rt.pci_tracker = mock.Mock()
+        node_a = objects.ComputeNode(uuid=uuids.node_a,
+                                     hypervisor_hostname='node-a')
+        node_b = objects.ComputeNode(uuid=uuids.node_b,
+                                     hypervisor_hostname='node-b')
+
+        with mock.patch.object(self.rt, '_resource_change',
+                               return_value=False):
+            thread = eventlet.spawn(self.rt._update, mock.sentinel.ctx,
+                                    node_a)
+            eventlet.sleep(0)
+            self.rt._update(mock.sentinel.ctx, node_b)
+            self.assertFalse(thread.dead)
+            flushing.send()
+            thread.wait()
+
+        reportclient.update_from_provider_tree.assert_has_calls([
+            mock.call(mock.sentinel.ctx, mock.ANY, rp_uuid=uuids.node_b),
+            mock.call(mock.sentinel.ctx, mock.ANY, rp_uuid=uuids.node_a)],
+            any_order=True)
+
+    def test_concurrent_node_updates_keep_providers(self):
+        """The updates of two nodes flushing their provider trees to
+        placement concurrently don't remove each other's providers.
+        """
+        class FakeReportClient(object):
+            # Like SchedulerReportClient, caches the providers of every node
+            # of the host and yields on each placement request.
+            def __init__(self):
+                self.cache = provider_tree.ProviderTree()
+                self.deleted = []
+
+            def get_provider_tree_and_ensure_root(self, context, rp_uuid,
+                                                  name=None, scoped=False):
+                if not self.cache.exists(rp_uuid):
+                    eventlet.sleep(0)
+                    self.cache.new_root(name, rp_uuid)
+                if scoped:
+                    tree = provider_tree.ProviderTree()
+                    tree.new_root(name, rp_uuid)
+                    return tree
+                return copy.deepcopy(self.cache)
+
+            def update_from_provider_tree(self, context, new_tree,
+                                          rp_uuid=None):
+                old_uuids = self.cache.get_provider_uuids(rp_uuid)
+                new_uuids = new_tree.get_provider_uuids(rp_uuid)
+                eventlet.sleep(0)
+                for uuid in set(old_uuids) - set(new_uuids):
+                    self.deleted.append(uuid)
+                    self.cache.remove(uuid)
+
+        reportclient = FakeReportClient()
+        self.rt.scheduler_client.reportclient = reportclient
+        # The virt driver yields too, like the Ironic driver querying the
+        # nodes.
+        self.driver_mock.update_provider_tree.side_effect = (
+            lambda prov_tree, nodename: eventlet.sleep(0))
+        nodes = [objects.ComputeNode(uuid=uuids.node_a,
+                                     hypervisor_hostname='node-a'),
+                 objects.ComputeNode(uuid=uuids.node_b,
+                                     hypervisor_hostname='node-b')]
+
+        with mock.patch.object(self.rt, '_resource_change',
+                               return_value=False):
+            threads = [eventlet.spawn(self.rt._update, mock.sentinel.ctx, cn)
+                       for cn in nodes]
+            for thread in threads:
+                thread.wait()
+
+        self.assertEqual([], reportclient.deleted)
+        self.assertEqual(set([uuids.node_a, uuids.node_b]),
+                         set(reportclient.cache.get_provider_uuids()))
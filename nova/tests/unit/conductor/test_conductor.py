@@ -17,6 +17,7 @@
 
 import copy
 
+import eventlet
 import mock
 from oslo_db import exception as db_exc
 import oslo_messaging as messaging
@@ -1827,6 +1828,85 @@ class ConductorTaskTestCase(_BaseTaskTestCase, test_compute.BaseTestCase):
         self.assertEqual(2, build_and_run_instance.call_count)
         self.assertEqual(2, len(instance_cells))
 
+    def _add_build_request(self, params):
+        build_request = fake_build_request.fake_req_obj(self.ctxt)
+        del build_request.instance.id
+        build_request.create()
+        params['build_requests'].objects.append(build_request)
+        im = objects.InstanceMapping(
+            self.ctxt, instance_uuid=build_request.instance.uuid,
+            cell_mapping=None, project_id=self.ctxt.project_id)
+        im.create()
+        params['request_specs'].append(objects.RequestSpec(
+            instance_uuid=build_request.instance_uuid,
+            instance_group=None))
+
+    @mock.patch('nova.compute.rpcapi.ComputeAPI.build_and_run_instance')
+    @mock.patch('nova.scheduler.rpcapi.SchedulerAPI.select_destinations')
+    @mock.patch('nova.objects.HostMapping.get_by_host')
+    def test_schedule_and_build_multiple_cells_batched(
+            self, get_hostmapping, select_destinations,
+            build_and_run_instance):
+        """Test that the records of the instances are written in a few
+        transactions per cell.
+        """
+        select_destinations.return_value = [[fake_selection1],
+                [fake_selection2], [fake_selection1], [fake_selection2]]
+        params = self.params
+        self.start_service('compute', host='host1', cell='cell1')
+        self.start_service('compute', host='host2', cell='cell2')
+        get_hostmapping.side_effect = self.host_mappings.values()
+        for x in range(3):
+            self._add_build_request(params)
+
+        with test.nested(
+            mock.patch.object(
+                self.conductor, '_create_instances_in_cell',
+                side_effect=self.conductor._create_instances_in_cell),
+            mock.patch.object(
+                self.conductor, '_create_build_records_in_cell',
+                side_effect=self.conductor._create_build_records_in_cell),
+            mock.patch.object(
+                self.conductor, '_map_instances_and_destroy_build_requests',
+                side_effect=(
+                    self.conductor._map_instances_and_destroy_build_requests))
+        ) as (create_instances, create_records, map_instances):
+            self.conductor.schedule_and_build_instances(**params)
+
+        self.assertEqual(4, build_and_run_instance.call_count)
+        self.assertEqual(2, create_instances.call_count)
+        for call in create_instances.call_args_list:
+            cctxt, instances = call[0]
+            self.assertIsNotNone(cctxt.db_connection)
+            self.assertEqual(2, len(instances))
+        self.assertEqual(2, create_records.call_count)
+        map_instances.assert_called_once_with(
+            self.ctxt, params['build_requests'].objects, mock.ANY, mock.ANY)
+        self.assertEqual(0, len(objects.BuildRequestList.get_all(self.ctxt)))
+        for build_request in params['build_requests']:
+            inst_mapping = objects.InstanceMapping.get_by_instance_uuid(
+                self.ctxt, build_request.instance_uuid)
+            self.assertIsNotNone(inst_mapping.cell_mapping)
+
+    @mock.patch('nova.utils.spawn', eventlet.spawn)
+    @mock.patch('nova.compute.rpcapi.ComputeAPI.build_and_run_instance')
+    @mock.patch('nova.scheduler.rpcapi.SchedulerAPI.select_destinations')
+    def test_schedule_and_build_cast_error(self, select_destinations,
+                                           build_and_run_instance):
+        """Test that a failure to cast the build of an instance does not
+        prevent the other instances from being built.
+        """
+        select_destinations.return_value = [[fake_selection1],
+                                            [fake_selection1]]
+        self.start_service('compute', host='host1')
+        self._add_build_request(self.params)
+        build_and_run_instance.side_effect = [test.TestingException, None]
+
+        self.assertRaises(test.TestingException,
+                          self.conductor.schedule_and_build_instances,
+                          **self.params)
+        self.assertEqual(2, build_and_run_instance.call_count)
+
     @mock.patch('nova.scheduler.rpcapi.SchedulerAPI.select_destinations')
     def test_schedule_and_build_scheduler_failure(self, select_destinations):
         select_destinations.side_effect = Exception
@@ -37,7 +37,10 @@ from oslo_utils import uuidutils
 import six
 from six.moves import range
 from sqlalchemy import Column
+from sqlalchemy import create_engine
+from sqlalchemy import DateTime
 from sqlalchemy.dialects import sqlite
+from sqlalchemy import event
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import inspect
@@ -241,6 +244,61 @@ class DecoratorTestCase(test.TestCase):
         mock_clone.assert_called_once_with(mode=enginefacade._READER)
         mock_using.assert_called_once_with(ctxt)
 
+    @mock.patch.object(enginefacade._TransactionContextManager, 'using')
+    @mock.patch.object(enginefacade._TransactionContextManager, '_clone')
+    def test_select_db_reader_mode_read_from_replica(self, mock_clone,
+                                                     mock_using):
+
+        @db.select_db_reader_mode
+        def func(self, context, value):
+            pass
+
+        mock_clone.return_value = enginefacade._TransactionContextManager(
+            mode=enginefacade._ASYNC_READER)
+        ctxt = context.get_admin_context()
+        ctxt.read_from_replica = True
+        value = 'some_value'
+        func(self, ctxt, value)
+
+        mock_clone.assert_called_once_with(mode=enginefacade._ASYNC_READER)
+        mock_using.assert_called_once_with(ctxt)
+
+    def _test_pick_reader_read_from_replica(self, decorator, mode,
+                                            read_from_replica):
+        @decorator
+        def func(context):
+            return 'result'
+
+        ctxt = context.get_admin_context()
+        ctxt.read_from_replica = read_from_replica
+        with mock.patch.object(enginefacade._TransactionContextManager,
+                               '_clone') as mock_clone:
+            mock_clone.return_value = mock.MagicMock()
+            self.assertEqual('result', func(ctxt))
+        mock_clone.assert_called_once_with(mode=mode)
+        mock_clone.return_value.using.assert_called_once_with(ctxt)
+
+    def test_pick_context_manager_reader_read_from_replica(self):
+        self._test_pick_reader_read_from_replica(
+            sqlalchemy_api.pick_context_manager_reader,
+            enginefacade._READER, False)
+        self._test_pick_reader_read_from_replica(
+            sqlalchemy_api.pick_context_manager_reader,
+            enginefacade._ASYNC_READER, True)
+
+    def test_pick_context_manager_reader_allow_async_read_from_replica(self):
+        self._test_pick_reader_read_from_replica(
+            sqlalchemy_api.pick_context_manager_reader_allow_async,
+            enginefacade._ASYNC_READER, True)
+
+    def test_select_api_db_reader_mode(self):
+        self._test_pick_reader_read_from_replica(
+            sqlalchemy_api.select_api_db_reader_mode,
+            enginefacade._READER, False)
+        self._test_pick_reader_read_from_replica(
+            sqlalchemy_api.select_api_db_reader_mode,
+            enginefacade._ASYNC_READER, True)
+
 
 def _get_fake_aggr_values():
     return {'name': 'fake_aggregate'}
@@ -692,6 +750,24 @@ class SqlAlchemyDbApiNoDbTestCase(test.NoDBTestCase):
         sqlalchemy_api.get_engine(use_slave=True)
         mock_ctxt_mgr.reader.get_engine.assert_called_once_with()
 
+    @mock.patch.object(sqlalchemy_api.enginefacade, 'transaction_context')
+    def test_create_context_manager(self, mock_tc):
+        self.flags(connection='main://', slave_connection='replica://',
+                   group='database')
+        sqlalchemy_api.create_context_manager()
+        sqlalchemy_api.create_context_manager('main://')
+        # The replica of the main database is not the replica of the others
+        sqlalchemy_api.create_context_manager('cell://')
+        sqlalchemy_api.create_context_manager(
+            'cell://', slave_connection='cell-replica://')
+        configured = [(kw['connection'], kw['slave_connection'])
+                      for _args, kw in
+                      mock_tc.return_value.configure.call_args_list]
+        self.assertEqual([('main://', 'replica://'),
+                          ('main://', 'replica://'),
+                          ('cell://', None),
+                          ('cell://', 'cell-replica://')], configured)
+
     def test_get_db_conf_with_connection(self):
         mock_conf_group = mock.MagicMock()
         mock_conf_group.connection = 'fakemain://'
@@ -731,6 +807,116 @@ class SqlAlchemyDbApiNoDbTestCase(test.NoDBTestCase):
         ret = sqlalchemy_api._safe_regex_mysql('||a')
         self.assertEqual('\\|\\|a', ret)
 
+    def test_batch_sizer_fixed(self):
+        sizer = sqlalchemy_api._BatchSizer(size=50)
+        sizer.adapt(50, 10)
+        self.assertEqual(50, sizer.size)
+
+    def test_batch_sizer_adapt(self):
+        sizer = sqlalchemy_api._BatchSizer(target=1.0, size=1000)
+        self.assertEqual(100, sizer.size)
+        # Fast batches grow at most twice as large
+        sizer.adapt(100, 0.1)
+        self.assertEqual(200, sizer.size)
+        sizer.adapt(200, 0.8)
+        self.assertEqual(250, sizer.size)
+        # Slow batches shrink at most by half
+        sizer.adapt(250, 5)
+        self.assertEqual(125, sizer.size)
+        # Partial batches do not say how long a full one would take
+        sizer.adapt(10, 0.001)
+        self.assertEqual(125, sizer.size)
+
+    @mock.patch.object(sqlalchemy_api._BatchSizer, 'START', 2)
+    def test_purge_shadow_table_batches(self):
+        engine = create_engine('sqlite://')
+        table = Table('shadow_foo', MetaData(),
+                      Column('id', Integer, primary_key=True),
+                      Column('deleted_at', DateTime))
+        table.create(engine)
+        old = datetime.datetime(2000, 1, 1)
+        new = datetime.datetime(2020, 1, 1)
+        # The rows with the lowest ids are not old enough to be purged.
+        engine.execute(table.insert(), [
+            {'id': i, 'deleted_at': new if i <= 3 else old}
+            for i in range(1, 10)])
+        selects = []
+
+        def _record_select(conn, cursor, statement, params, context, many):
+            if statement.startswith('SELECT'):
+                selects.append(params)
+        event.listen(engine, 'before_cursor_execute', _record_select)
+
+        deleted = sqlalchemy_api._purge_shadow_table(
+            engine, table, table.c.deleted_at,
+            datetime.datetime(2010, 1, 1), batch_time=3600)
+        event.remove(engine, 'before_cursor_execute', _record_select)
+
+        self.assertEqual(6, deleted)
+        self.assertEqual([1, 2, 3], [r[0] for r in engine.execute(
+            sql.select([table.c.id]).order_by(table.c.id))])
+        # Each batch starts after the last row deleted by the previous one.
+        self.assertEqual(3, len(selects))
+        self.assertIn(5, selects[1])
+        self.assertIn(9, selects[2])
+
+    def test_run_concurrently(self):
+        def fake_func(a, b):
+            if a is None:
+                raise test.TestingException()
+            return a + b
+
+        self.assertEqual([3, 7], sqlalchemy_api._run_concurrently(
+            fake_func, [(1, 2), (3, 4)], 2))
+        self.assertRaises(test.TestingException,
+                          sqlalchemy_api._run_concurrently,
+                          fake_func, [(1, 2), (None, 4)], 1)
+
+    def _get_paginated_sql(self, sort_keys, sort_dirs, marker_values):
+        q = query.Query(models.Instance)
+        q = sqlalchemy_api._paginate_query(q, models.Instance, 10, sort_keys,
+                                           sort_dirs,
+                                           marker_values=marker_values)
+        return str(q.statement.compile(
+            dialect=sqlite.dialect(),
+            compile_kwargs={'literal_binds': True}))
+
+    def test_paginate_query_marker_values(self):
+        dt = datetime.datetime(2018, 1, 1)
+        stmt = self._get_paginated_sql(['created_at', 'id'], ['desc', 'desc'],
+                                      [dt, 42])
+        # The first sort key is bounded so an index on it can be used
+        self.assertIn("instances.created_at <= '2018-01-01 00:00:00.000000' "
+                      "AND (instances.created_at < '2018-01-01 "
+                      "00:00:00.000000' OR instances.created_at = "
+                      "'2018-01-01 00:00:00.000000' AND instances.id < 42)",
+                      stmt)
+        self.assertIn('ORDER BY instances.created_at DESC, instances.id DESC',
+                      stmt)
+
+    def test_paginate_query_marker_values_first_null(self):
+        stmt = self._get_paginated_sql(['display_name', 'uuid'],
+                                      ['asc', 'asc'], [None, 'foo'])
+        self.assertNotIn('instances.display_name >=', stmt)
+        self.assertIn("WHERE instances.uuid > 'foo'", stmt)
+
+    def test_paginate_query_marker_values_missing(self):
+        # The sort keys without a value are not needed to order the records
+        stmt = self._get_paginated_sql(['uuid', 'created_at'], ['asc', 'asc'],
+                                      ['foo'])
+        self.assertIn("WHERE instances.uuid >= 'foo' AND "
+                      "instances.uuid > 'foo'", stmt)
+
+    def test_archive_levels(self):
+        tables = [models.BASE.metadata.tables[name]
+                  for name in ('instances', 'instance_extra',
+                               'instance_faults', 'security_groups',
+                               'security_group_instance_association')]
+        levels = sqlalchemy_api._archive_levels(tables)
+        self.assertEqual([['security_group_instance_association',
+                           'instance_faults', 'instance_extra'],
+                          ['security_groups', 'instances']], levels)
+
 
 class SqlAlchemyDbApiTestCase(DbTestCase):
     def test_instance_get_all_by_host(self):
@@ -901,7 +1087,7 @@ class SqlAlchemyDbApiTestCase(DbTestCase):
             columns_to_join='columns')
         mock_get_all_filters_sort.assert_called_once_with(ctxt, {'foo': 'bar'},
             limit=100, marker='uuid', columns_to_join='columns',
-            sort_keys=['sort_key'], sort_dirs=['sort_dir'])
+            sort_keys=['sort_key'], sort_dirs=['sort_dir'], columns=None)
 
     def test_instance_get_all_by_filters_sort_key_invalid(self):
         '''InvalidSortKey raised if an invalid key is given.'''
@@ -2044,6 +2230,31 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
             sys_meta = utils.metadata_to_dict(inst['system_metadata'])
             self.assertEqual(sys_meta, {})
 
+    def test_instance_get_all_by_filters_columns(self):
+        inst = self.create_instance_with_args(display_name='inst')
+        result = db.instance_get_all_by_filters_sort(
+            self.ctxt, {}, columns=['display_name'])
+        self.assertEqual(1, len(result))
+        self.assertEqual(
+            set(['id', 'uuid', 'display_name', 'metadata',
+                 'system_metadata', 'fault']),
+            set(result[0]))
+        self.assertEqual(inst['uuid'], result[0]['uuid'])
+        self.assertEqual('inst', result[0]['display_name'])
+        self.assertEqual([], result[0]['metadata'])
+
+    def test_instance_get_all_by_filters_columns_joined(self):
+        self.create_instance_with_args()
+        result = db.instance_get_all_by_filters_sort(
+            self.ctxt, {}, columns=['host'],
+            columns_to_join=['metadata', 'info_cache', 'extra.flavor'])
+        self.assertEqual(
+            set(['id', 'uuid', 'host', 'info_cache', 'extra', 'metadata',
+                 'system_metadata', 'fault']),
+            set(result[0]))
+        meta = utils.metadata_to_dict(result[0]['metadata'])
+        self.assertEqual(self.sample_data['metadata'], meta)
+
     def test_instance_get_all_by_filters_with_fault(self):
         inst = self.create_instance_with_args()
         result = db.instance_get_all_by_filters(self.ctxt, {},
@@ -2139,6 +2350,30 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
                                                 filters)
         self._assertEqualListsOfInstances([i2], result)
 
+    def test_instance_get_changes(self):
+        i1 = self.create_instance_with_args(updated_at=
+                                            '2013-12-05T15:03:26.000000')
+        i2 = self.create_instance_with_args(updated_at=
+                                            '2013-12-05T15:03:25.000000')
+        i3 = self.create_instance_with_args(updated_at=
+                                            '2013-12-05T15:03:26.000000')
+        self.create_instance_with_args(updated_at=
+                                       '2013-12-05T15:03:24.000000')
+        changes_since = iso8601.parse_date('2013-12-05T15:03:25.000000')
+        result = db.instance_get_changes(self.ctxt, changes_since)
+        self.assertEqual([i2['uuid'], i1['uuid'], i3['uuid']],
+                         [inst['uuid'] for inst in result])
+
+        result = db.instance_get_changes(
+            self.ctxt, changes_since, limit=1,
+            marker_values=[i1['updated_at'], i1['id']])
+        self.assertEqual([i3['uuid']], [inst['uuid'] for inst in result])
+
+        changes_before = iso8601.parse_date('2013-12-05T15:03:26.000000')
+        result = db.instance_get_changes(self.ctxt, changes_since,
+                                         changes_before=changes_before)
+        self.assertEqual([i2['uuid']], [inst['uuid'] for inst in result])
+
     def test_instance_get_all_by_filters_exact_match(self):
         instance = self.create_instance_with_args(host='host1')
         self.create_instance_with_args(host='host12')
@@ -9570,135 +9805,3 @@ class ConsoleAuthTokenTestCase(test.TestCase):
         db_obj2 = db.console_auth_token_get_valid(self.context, hash2)
         self.assertIsNone(db_obj1, "the token should have expired")
         self.assertIsNotNone(db_obj2, "a valid token should be found here")
-
-
-class SortMarkerHelper(test.TestCase):
-    def setUp(self):
-        super(SortMarkerHelper, self).setUp()
-
-        self.context = context.RequestContext('fake', 'fake')
-        self.instances = []
-
-        launched = datetime.datetime(2005, 4, 30, 13, 00, 00)
-        td = datetime.timedelta
-
-        values = {
-            'key_name': ['dan', 'dan', 'taylor', 'jax'],
-            'memory_mb': [512, 1024, 512, 256],
-            'launched_at': [launched + td(1), launched - td(256),
-                            launched + td(32), launched - td(5000)],
-        }
-
-        for i in range(0, 4):
-            inst = {'user_id': self.context.user_id,
-                    'project_id': self.context.project_id,
-                    'auto_disk_config': bool(i % 2),
-                    'vcpus': 1}
-            for key in values:
-                inst[key] = values[key].pop(0)
-            db_instance = db.instance_create(self.context, inst)
-            self.instances.append(db_instance)
-
-    def test_with_one_key(self):
-        """Test instance_get_by_sort_filters() with one sort key."""
-        # If we sort ascending by key_name and our marker was something
-        # just after jax, taylor would be the next one.
-        marker = db.instance_get_by_sort_filters(
-            self.context,
-            ['key_name'], ['asc'], ['jaxz'])
-        self.assertEqual(self.instances[2]['uuid'], marker)
-
-    def _test_with_multiple_keys(self, sort_keys, sort_dirs, value_fn):
-        """Test instance_get_by_sort_filters() with multiple sort keys.
-
-        Since this returns the marker it's looking for, it's actually really
-        hard to test this like we normally would with pagination, i.e. marching
-        through the instances in order. Attempting to do so covered up a bug
-        in this previously.
-
-        So, for a list of marker values, query and assert we get the instance
-        we expect.
-        """
-
-        # For the query below, ordering memory_mb asc, key_name desc,
-        # The following is the expected ordering of the instances we
-        # have to test:
-        #
-        #   256-jax
-        #   512-taylor
-        #   512-dan
-        #   1024-dan
-
-        steps = [
-            (200, 'foo', 3),  # all less than 256-jax
-            (256, 'xyz', 3),  # name comes before jax
-            (256, 'jax', 3),  # all equal to 256-jax
-            (256, 'abc', 2),  # name after jax
-            (500, 'foo', 2),  # all greater than 256-jax
-            (512, 'xyz', 2),  # name before taylor and dan
-            (512, 'mno', 0),  # name after taylor, before dan-512
-            (512, 'abc', 1),  # name after dan-512
-            (999, 'foo', 1),  # all greater than 512-taylor
-            (1024, 'xyz', 1),  # name before dan
-            (1024, 'abc', None),  # name after dan
-            (2048, 'foo', None),  # all greater than 1024-dan
-        ]
-
-        for mem, name, expected in steps:
-            marker = db.instance_get_by_sort_filters(
-                self.context,
-                sort_keys,
-                sort_dirs,
-                value_fn(mem, name))
-            if expected is None:
-                self.assertIsNone(marker)
-            else:
-                expected_inst = self.instances[expected]
-                got_inst = [inst for inst in self.instances
-                            if inst['uuid'] == marker][0]
-                self.assertEqual(
-                    expected_inst['uuid'],
-                    marker,
-                    'marker %s-%s expected %s-%s got %s-%s' % (
-                        mem, name,
-                        expected_inst['memory_mb'], expected_inst['key_name'],
-                        got_inst['memory_mb'], got_inst['key_name']))
-
-    def test_with_two_keys(self):
-        """Test instance_get_by_sort_filters() with two sort_keys."""
-        self._test_with_multiple_keys(
-            ['memory_mb', 'key_name'],
-            ['asc', 'desc'],
-            lambda mem, name: [mem, name])
-
-    def test_with_three_keys(self):
-        """Test instance_get_by_sort_filters() with three sort_keys.
-
-        This inserts another key in the middle of memory_mb,key_name
-        which is always equal in all the test instances. We do this
-        to make sure that we are only including the equivalence fallback
-        on the final sort_key, otherwise we might stall out in the
-        middle of a series of instances with equivalent values for
-        a key in the middle of sort_keys.
-        """
-        self._test_with_multiple_keys(
-            ['memory_mb', 'vcpus', 'key_name'],
-            ['asc', 'asc', 'desc'],
-            lambda mem, name: [mem, 1, name])
-
-    def test_no_match(self):
-        marker = db.instance_get_by_sort_filters(self.context,
-                                                 ['memory_mb'], ['asc'],
-                                                 [4096])
-        # None of our instances have >= 4096mb, so nothing matches
-        self.assertIsNone(marker)
-
-    def test_by_bool(self):
-        """Verify that we can use booleans in sort_keys."""
-        # If we sort ascending by auto_disk_config, the first one
-        # with True for that value would be the second instance we
-        # create, because bool(1 % 2) == True.
-        marker = db.instance_get_by_sort_filters(
-            self.context,
-            ['auto_disk_config', 'id'], ['asc', 'asc'], [True, 2])
-        self.assertEqual(self.instances[1]['uuid'], marker)
@@ -1009,6 +1009,16 @@ class NovaMigrationsCheckers(test_migrations.ModelsMigrationsSync,
         self.assertColumnExists(engine, 'shadow_instance_extra',
                                 'trusted_certs')
 
+    def _check_392(self, engine, data):
+        self.assertIndexMembers(engine, 'migrations',
+                                'migrations_deleted_created_at_idx',
+                                ['deleted', 'created_at'])
+
+    def _check_393(self, engine, data):
+        self.assertIndexMembers(engine, 'instances',
+                                'instances_updated_at_id_idx',
+                                ['updated_at', 'id'])
+
 
 class TestNovaMigrationsSQLite(NovaMigrationsCheckers,
                                test_base.DbTestCase,
@@ -2443,7 +2443,7 @@ class TestNeutronv2(TestNeutronv2Base):
         api = neutronapi.API()
         self.mox.StubOutWithMock(api, '_get_subnets_from_port')
         api._get_subnets_from_port(
-            self.context, fake_port, None).AndReturn(
+            self.context, fake_port, None, prefetched=None).AndReturn(
             [fake_subnet])
         self.mox.ReplayAll()
         subnets = api._nw_info_get_subnets(self.context, fake_port, fake_ips)
@@ -2751,7 +2751,8 @@ class TestNeutronv2(TestNeutronv2Base):
                     [{'floating_ip_address': '10.0.0.1'}])
         for requested_port in requested_ports:
             api._get_subnets_from_port(self.context, requested_port,
-                                       self.moxed_client).AndReturn(
+                                       self.moxed_client,
+                                       prefetched=None).AndReturn(
                 fake_subnets)
 
         self.mox.StubOutWithMock(api, '_get_preexisting_port_ids')
@@ -6990,3 +6991,157 @@ class TestGetInstanceNetworkInfo(test.NoDBTestCase):
         self.assertIsNotNone(old_vif)
         removed_vif = self._get_vif_in_cache(nwinfo, uuids.removed_port)
         self.assertIsNone(removed_vif)
+
+
+class _FakeNeutronClient(object):
+    """Answers the list and show calls done to build network info models
+    from fixed sets of resources, applying the filters of the calls.
+    """
+
+    def __init__(self, ports, networks, subnets, floating_ips):
+        self.ports = ports
+        self.networks = networks
+        self.subnets = subnets
+        self.floating_ips = floating_ips
+        self.calls = collections.Counter()
+
+    @staticmethod
+    def _filter(resources, **filters):
+        def _matches(resource):
+            for key, value in filters.items():
+                values = value if isinstance(value, list) else [value]
+                if resource.get(key) not in values:
+                    return False
+            return True
+        return [resource for resource in resources if _matches(resource)]
+
+    def list_extensions(self):
+        return {'extensions': []}
+
+    def list_ports(self, **filters):
+        self.calls['list_ports'] += 1
+        return {'ports': self._filter(self.ports, **filters)}
+
+    def list_networks(self, **filters):
+        self.calls['list_networks'] += 1
+        return {'networks': self._filter(self.networks, **filters)}
+
+    def show_network(self, net_id, fields=None):
+        self.calls['show_network'] += 1
+        return {'network': self._filter(self.networks, id=net_id)[0]}
+
+    def list_subnets(self, **filters):
+        self.calls['list_subnets'] += 1
+        return {'subnets': self._filter(self.subnets, **filters)}
+
+    def list_floatingips(self, **filters):
+        self.calls['list_floatingips'] += 1
+        return {'floatingips': self._filter(self.floating_ips, **filters)}
+
+
+class TestHealInstancesNetworkInfoCache(test.NoDBTestCase):
+    """Tests healing the network info cache of several instances at once."""
+
+    def setUp(self):
+        super(TestHealInstancesNetworkInfoCache, self).setUp()
+        self.api = neutronapi.API()
+        self.context = context.RequestContext(uuids.user_id, uuids.project_id)
+        self.instances = []
+        ports = []
+        for i in range(3):
+            instance = fake_instance.fake_instance_obj(
+                self.context, uuid=getattr(uuids, 'instance%d' % i),
+                project_id=uuids.project_id)
+            instance.info_cache = objects.InstanceInfoCache(
+                network_info=model.NetworkInfo([
+                    model.VIF(id=getattr(uuids, 'port%d' % i),
+                              network=model.Network(id=uuids.network))]))
+            self.instances.append(instance)
+            ports.append({
+                'id': getattr(uuids, 'port%d' % i),
+                'device_id': instance.uuid,
+                'tenant_id': uuids.project_id,
+                'network_id': uuids.network,
+                'admin_state_up': True,
+                'status': 'ACTIVE',
+                'mac_address': 'de:ad:be:ef:00:0%d' % i,
+                'fixed_ips': [{'ip_address': '10.0.0.%d' % (i + 2),
+                               'subnet_id': uuids.subnet}],
+                'binding:vif_type': model.VIF_TYPE_OVS,
+                'binding:vif_details': {},
+            })
+        ports.append({
+            'id': uuids.dhcp_port,
+            'device_id': uuids.dhcp,
+            'device_owner': 'network:dhcp',
+            'network_id': uuids.network,
+            'fixed_ips': [{'ip_address': '10.0.0.1',
+                           'subnet_id': uuids.subnet}],
+        })
+        networks = [{'id': uuids.network, 'name': 'net',
+                     'tenant_id': uuids.project_id, 'mtu': 1450,
+                     'provider:network_type': 'vxlan'}]
+        subnets = [{'id': uuids.subnet, 'network_id': uuids.network,
+                    'cidr': '10.0.0.0/24', 'gateway_ip': '10.0.0.254',
+                    'dns_nameservers': ['8.8.8.8']}]
+        floating_ips = [{'port_id': uuids.port1,
+                         'fixed_ip_address': '10.0.0.3',
+                         'floating_ip_address': '172.24.4.3'}]
+        self.client = _FakeNeutronClient(ports, networks, subnets,
+                                         floating_ips)
+        client_mock = mock.patch('nova.network.neutronv2.api.get_client',
+                                 return_value=self.client)
+        client_mock.start()
+        self.addCleanup(client_mock.stop)
+
+    def test_get_instances_nw_info(self):
+        nw_infos = self.api._get_instances_nw_info(self.context,
+                                                   self.instances)
+
+        # A single call per resource type, plus the one for the DHCP ports
+        self.assertEqual({'list_ports': 2, 'list_networks': 1,
+                          'list_subnets': 1, 'list_floatingips': 1},
+                         self.client.calls)
+        # The network info is the same as the one built for each instance
+        for instance in self.instances:
+            expected = self.api._build_network_info_model(self.context,
+                                                          instance)
+            self.assertEqual(jsonutils.loads(expected.json()),
+                             jsonutils.loads(nw_infos[instance.uuid].json()))
+        floating_ips = nw_infos[uuids.instance1].floating_ips()
+        self.assertEqual(['172.24.4.3'],
+                         [fip['address'] for fip in floating_ips])
+
+    def test_get_instances_nw_info_port_gone(self):
+        self.client.ports[0]['device_id'] = uuids.other_instance
+
+        nw_infos = self.api._get_instances_nw_info(self.context,
+                                                   self.instances)
+
+        self.assertEqual(0, len(nw_infos[uuids.instance0]))
+        self.assertEqual(1, len(nw_infos[uuids.instance1]))
+
+    @mock.patch('nova.compute.utils.refresh_info_cache_for_instance')
+    @mock.patch('nova.network.base_api.update_instance_cache_with_nw_info')
+    def test_heal_instances_nw_info_cache(self, mock_update, mock_refresh):
+        nw_infos = self.api._get_instances_nw_info(self.context,
+                                                   self.instances)
+        # The cache of the first instance is up to date, the ones of the
+        # other instances are stale and the third one is updated by another
+        # operation while healing.
+        self.instances[0].info_cache.network_info = nw_infos[uuids.instance0]
+
+        def _refresh(context, instance):
+            if instance.uuid == uuids.instance2:
+                instance.info_cache.network_info = nw_infos[instance.uuid]
+
+        mock_refresh.side_effect = _refresh
+
+        healed = self.api.heal_instances_nw_info_cache(self.context,
+                                                       self.instances)
+
+        self.assertEqual([self.instances[1]], healed)
+        mock_update.assert_called_once_with(
+            self.api, self.context, self.instances[1], nw_info=mock.ANY,
+            update_cells=False)
+        self.assertEqual(2, mock_refresh.call_count)
@@ -1397,6 +1397,33 @@ class _TestInstanceObject(object):
             inst.system_metadata
             mock_load.assert_called_once_with('system_metadata')
 
+    def test_lazy_load_counted_per_call_site(self):
+        instance.reset_lazy_load_stats()
+        self.addCleanup(instance.reset_lazy_load_stats)
+        insts = [objects.Instance(context=self.context, uuid=uuid)
+                 for uuid in (uuids.instance1, uuids.instance2)]
+
+        def fake_load(inst, name):
+            inst.system_metadata = {}
+
+        with test.nested(
+            mock.patch.object(objects.Instance, '_load_generic',
+                              autospec=True, side_effect=fake_load),
+            mock.patch.object(instance, 'LAZY_LOAD_STORM_THRESHOLD', 2),
+            mock.patch.object(instance, 'LOG'),
+        ) as (mock_load, _, mock_log):
+            for inst in insts:
+                inst.system_metadata
+
+        stats = instance.get_lazy_load_stats()
+        self.assertEqual(1, len(stats))
+        (call_site, attr), count = list(stats.items())[0]
+        self.assertEqual('system_metadata', attr)
+        self.assertEqual(2, count)
+        self.assertIn('%s:' % __name__, call_site)
+        self.assertIn('(test_lazy_load_counted_per_call_site)', call_site)
+        self.assertEqual(1, mock_log.warning.call_count)
+
     def test_load_fault_calls_handler(self):
         inst = objects.Instance(context=self.context, uuid=uuids.instance)
         with mock.patch.object(inst, '_load_fault') as mock_load:
@@ -1707,7 +1734,7 @@ class _TestInstanceListObject(object):
 
         mock_get_all.assert_called_once_with(self.context, {'foo': 'bar'},
             'uuid', 'asc', limit=None, marker=None,
-            columns_to_join=['metadata'])
+            columns_to_join=['metadata'], columns=None)
 
     @mock.patch.object(db, 'instance_get_all_by_filters_sort')
     def test_get_all_by_filters_sorted(self, mock_get_all):
@@ -1726,7 +1753,7 @@ class _TestInstanceListObject(object):
                                             limit=None, marker=None,
                                             columns_to_join=['metadata'],
                                             sort_keys=['uuid'],
-                                            sort_dirs=['asc'])
+                                            sort_dirs=['asc'], columns=None)
 
     @mock.patch.object(db, 'instance_get_all_by_filters_sort')
     @mock.patch.object(db, 'instance_get_all_by_filters')
@@ -1740,7 +1767,7 @@ class _TestInstanceListObject(object):
             limit=100, marker='uuid', use_slave=True)
         mock_get_by_filters.assert_called_once_with(
             self.context, {'foo': 'bar'}, 'key', 'dir', limit=100,
-            marker='uuid', columns_to_join=None)
+            marker='uuid', columns_to_join=None, columns=None)
         self.assertEqual(0, mock_get_by_filters_sort.call_count)
 
     @mock.patch.object(db, 'instance_get_all_by_filters_sort')
@@ -1757,9 +1784,39 @@ class _TestInstanceListObject(object):
         mock_get_by_filters_sort.assert_called_once_with(
             self.context, {'foo': 'bar'}, limit=100,
             marker='uuid', columns_to_join=None,
-            sort_keys=['key1', 'key2'], sort_dirs=['dir1', 'dir2'])
+            sort_keys=['key1', 'key2'], sort_dirs=['dir1', 'dir2'],
+            columns=None)
         self.assertEqual(0, mock_get_by_filters.call_count)
 
+    @mock.patch.object(db, 'instance_get_all_by_filters_sort')
+    def test_get_all_by_filters_columns(self, mock_get_all):
+        fakes = [self.fake_instance(1), self.fake_instance(2)]
+        mock_get_all.return_value = fakes
+
+        inst_list = objects.InstanceList.get_by_filters(
+            self.context, {'foo': 'bar'}, expected_attrs=['metadata'],
+            sort_keys=['uuid'], sort_dirs=['asc'],
+            columns=['display_name', 'vm_state'])
+
+        mock_get_all.assert_called_once_with(
+            self.context, {'foo': 'bar'}, limit=None, marker=None,
+            columns_to_join=['metadata'], sort_keys=['uuid'],
+            sort_dirs=['asc'],
+            columns=['display_name', 'id', 'uuid', 'vm_state'])
+        for i in range(0, len(fakes)):
+            inst = inst_list.objects[i]
+            self.assertEqual(fakes[i]['uuid'], inst.uuid)
+            self.assertEqual(fakes[i]['display_name'], inst.display_name)
+            self.assertEqual(fakes[i]['vm_state'], inst.vm_state)
+            self.assertIn('metadata', inst)
+            self.assertNotIn('host', inst)
+            self.assertNotIn('deleted', inst)
+
+    def test_get_all_by_filters_columns_not_columns(self):
+        self.assertRaises(exception.ObjectActionError,
+                          objects.InstanceList.get_by_filters,
+                          self.context, {}, columns=['uuid', 'flavor'])
+
     @mock.patch.object(db, 'instance_get_all_by_filters')
     def test_get_all_by_filters_works_for_cleaned(self, mock_get_all):
         fakes = [self.fake_instance(1),
@@ -1781,7 +1838,7 @@ class _TestInstanceListObject(object):
             {'deleted': True, 'cleaned': False},
             'uuid', 'asc',
             limit=None, marker=None,
-            columns_to_join=['metadata'])
+            columns_to_join=['metadata'], columns=None)
 
     @mock.patch.object(db, 'instance_get_all_by_host')
     def test_get_by_host(self, mock_get_all):
@@ -1948,6 +2005,54 @@ class _TestInstanceListObject(object):
                                                [x.uuid for x in insts],
                                                latest=True)
 
+    @mock.patch.object(objects.InstanceList, 'get_by_filters')
+    def test_fill_attrs(self, mock_get):
+        inst1 = objects.Instance(uuid=uuids.fill_1, flavor=objects.Flavor())
+        inst2 = objects.Instance(uuid=uuids.fill_2)
+        inst3 = objects.Instance(uuid=uuids.fill_3)
+        for inst in (inst1, inst2, inst3):
+            inst.obj_reset_changes()
+        db_insts = [objects.Instance(uuid=uuid,
+                                     flavor=objects.Flavor(name='foo'),
+                                     old_flavor=None, new_flavor=None,
+                                     numa_topology=None)
+                    for uuid in (uuids.fill_1, uuids.fill_2)]
+        mock_get.return_value = objects.InstanceList(objects=db_insts)
+
+        inst_list = objects.InstanceList()
+        inst_list._context = self.context
+        inst_list.objects = [inst1, inst2, inst3]
+        not_found = inst_list.fill_attrs(['old_flavor', 'numa_topology'])
+
+        self.assertEqual([uuids.fill_3], not_found)
+        mock_get.assert_called_once_with(
+            self.context, {'uuid': [uuids.fill_1, uuids.fill_2,
+                                    uuids.fill_3]},
+            expected_attrs=['flavor', 'numa_topology'])
+        self.assertEqual('foo', inst2.flavor.name)
+        self.assertIsNone(inst2.old_flavor)
+        self.assertIsNone(inst2.numa_topology)
+        self.assertEqual(set(), inst2.obj_what_changed())
+        # The attributes already loaded are kept.
+        self.assertNotIn('name', inst1.flavor)
+        self.assertIsNone(inst1.old_flavor)
+        self.assertNotIn('numa_topology', inst3)
+
+    @mock.patch.object(objects.InstanceList, 'get_by_filters')
+    def test_fill_attrs_nothing_missing(self, mock_get):
+        inst = objects.Instance(uuid=uuids.fill, numa_topology=None)
+        inst_list = objects.InstanceList(self.context, objects=[inst])
+
+        self.assertEqual([], inst_list.fill_attrs(['numa_topology']))
+        mock_get.assert_not_called()
+
+    def test_fill_attrs_not_fillable(self):
+        inst_list = objects.InstanceList(self.context, objects=[])
+        self.assertRaises(exception.ObjectActionError,
+                          inst_list.fill_attrs, ['ec2_ids'])
+        self.assertRaises(exception.ObjectActionError,
+                          inst_list.fill_attrs, ['hostname'])
+
     @mock.patch('nova.objects.instance.Instance.obj_make_compatible')
     def test_get_by_security_group(self, mock_compat):
         fake_secgroup = dict(test_security_group.fake_secgroup)
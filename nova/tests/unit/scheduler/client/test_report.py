@@ -14,10 +14,12 @@ import time
 
 import fixtures
 from keystoneauth1 import exceptions as ks_exc
+from keystoneauth1 import session as ks_session
 import mock
 from oslo_serialization import jsonutils
 from six.moves.urllib import parse
 
+from nova.compute import provider_tree
 import nova.conf
 from nova import context
 from nova import exception
@@ -26,6 +28,7 @@ from nova import rc_fields as fields
 from nova.scheduler.client import report
 from nova.scheduler import utils as scheduler_utils
 from nova import test
+from nova.tests import fixtures as nova_fixtures
 from nova.tests.unit import fake_requests
 from nova.tests import uuidsentinel as uuids
 
@@ -174,6 +177,23 @@ class TestConstructor(test.NoDBTestCase):
         self.assertEqual({'accept': 'application/json'},
                          client._client.additional_headers)
 
+    @mock.patch('keystoneauth1.loading.load_session_from_conf_options')
+    @mock.patch('keystoneauth1.loading.load_auth_from_conf_options')
+    def test_constructor_connection_pool(self, load_auth_mock,
+                                         load_sess_mock):
+        self.flags(resource_provider_update_concurrency=25, group='compute')
+        report.SchedulerReportClient()
+
+        mount_mock = load_sess_mock.return_value.session.mount
+        self.assertEqual(2, mount_mock.call_count)
+        for call, scheme in zip(mount_mock.call_args_list,
+                                ('https://', 'http://')):
+            self.assertEqual(scheme, call[0][0])
+            pool_adapter = call[0][1]
+            self.assertIsInstance(pool_adapter,
+                                  ks_session.TCPKeepAliveAdapter)
+            self.assertEqual(25, pool_adapter._pool_maxsize)
+
 
 class SchedulerReportClientTestCase(test.NoDBTestCase):
 
@@ -257,6 +277,36 @@ class SchedulerReportClientTestCase(test.NoDBTestCase):
                           (name_or_uuid, attr, expected))
 
 
+class TestReadConsistency(SchedulerReportClientTestCase):
+
+    def test_get_no_write(self):
+        self.client.get('/resource_providers')
+        self.ks_adap_mock.get.assert_called_once_with(
+            '/resource_providers', microversion=None, headers={})
+
+    def test_get_after_write(self):
+        self.client.put('/resource_providers/%s' % uuids.rp, {})
+        self.client.get('/resource_providers')
+        self.ks_adap_mock.get.assert_called_once_with(
+            '/resource_providers', microversion=None,
+            headers={report.MUST_BE_CURRENT_HEADER: 'true'})
+
+    def test_get_after_write_allow_stale(self):
+        self.client.post('/resource_providers', {})
+        self.client.get('/allocation_candidates', allow_stale=True)
+        self.ks_adap_mock.get.assert_called_once_with(
+            '/allocation_candidates', microversion=None, headers={})
+
+    def test_get_after_write_window_passed(self):
+        self.client.delete('/resource_providers/%s' % uuids.rp)
+        with mock.patch('time.time') as mock_time:
+            mock_time.return_value = (self.client._last_write_time +
+                                      report.MUST_BE_CURRENT_WINDOW)
+            self.client.get('/resource_providers')
+        self.ks_adap_mock.get.assert_called_once_with(
+            '/resource_providers', microversion=None, headers={})
+
+
 class TestPutAllocations(SchedulerReportClientTestCase):
     @mock.patch('nova.scheduler.client.report.SchedulerReportClient.put')
     def test_put_allocations(self, mock_put):
@@ -1442,6 +1492,98 @@ class TestProviderOperations(SchedulerReportClientTestCase):
         self.assertEqual([uuids.cn],
                          self.client._provider_tree.get_provider_uuids())
 
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_get_sharing_providers', return_value=[])
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_get_providers_in_tree')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_refresh_and_get_inventory')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_refresh_associations')
+    def test_ensure_resource_provider_revalidate(self, mock_ref_assoc,
+                                                 mock_ref_inv, mock_gpit,
+                                                 mock_shr):
+        """Make sure that when the tree is cached, only the providers whose
+        generation moved are refreshed and the providers gone from placement
+        are removed from the cache.
+        """
+        def rp(uuid, generation, parent=None):
+            return {'uuid': uuid, 'name': uuid, 'generation': generation,
+                    'parent_provider_uuid': parent}
+
+        mock_gpit.return_value = [rp(uuids.root, 1),
+                                  rp(uuids.child1, 1, uuids.root),
+                                  rp(uuids.child2, 1, uuids.root)]
+        self.client._ensure_resource_provider(self.context, uuids.root)
+        self.assertEqual(3, mock_ref_inv.call_count)
+        for u in (uuids.root, uuids.child1, uuids.child2):
+            self.client._association_refresh_time[u] = time.time()
+        mock_ref_inv.reset_mock()
+        mock_ref_assoc.reset_mock()
+
+        # Nothing moved, nothing is refreshed
+        self.client._ensure_resource_provider(self.context, uuids.root)
+        mock_ref_inv.assert_not_called()
+        mock_ref_assoc.assert_not_called()
+        mock_shr.assert_not_called()
+
+        # child1 moved, child2 is gone, grandchild is new
+        mock_gpit.return_value = [rp(uuids.root, 1),
+                                  rp(uuids.child1, 2, uuids.root),
+                                  rp(uuids.grandchild, 1, uuids.child1)]
+        self.client._ensure_resource_provider(self.context, uuids.root)
+        mock_ref_inv.assert_has_calls(
+            [mock.call(self.context, uuids.grandchild),
+             mock.call(self.context, uuids.child1)], any_order=True)
+        self.assertEqual(2, mock_ref_inv.call_count)
+        mock_ref_assoc.assert_has_calls(
+            [mock.call(self.context, uuids.grandchild, force=True),
+             mock.call(self.context, uuids.child1, force=True)],
+            any_order=True)
+        self.assertEqual(2, mock_ref_assoc.call_count)
+        self.assertEqual(
+            set([uuids.root, uuids.child1, uuids.grandchild]),
+            set(self.client._provider_tree.get_provider_uuids()))
+        self.assertNotIn(uuids.child2, self.client._association_refresh_time)
+
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_get_sharing_providers')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_get_providers_in_tree')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_refresh_and_get_inventory')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_refresh_associations')
+    def test_ensure_resource_provider_revalidate_sharing(
+            self, mock_ref_assoc, mock_ref_inv, mock_gpit, mock_shr):
+        """Make sure that when the associations of an unchanged provider are
+        stale, only its sharing providers are listed again and only those
+        whose generation moved are refreshed.
+        """
+        self.client._provider_tree.new_root('cn', uuids.cn, generation=1)
+        self.client._provider_tree.update_aggregates(uuids.cn, [uuids.agg])
+        self.client._provider_tree.new_root('ss1', uuids.ss1, generation=5)
+        self.client._provider_tree.new_root('ss2', uuids.ss2, generation=5)
+        mock_gpit.return_value = [{'uuid': uuids.cn, 'name': 'cn',
+                                   'generation': 1}]
+        mock_shr.return_value = [
+            {'uuid': uuids.ss1, 'name': 'ss1', 'generation': 5},
+            {'uuid': uuids.ss2, 'name': 'ss2', 'generation': 6},
+            {'uuid': uuids.ss3, 'name': 'ss3', 'generation': 1}]
+
+        self.client._ensure_resource_provider(self.context, uuids.cn)
+
+        mock_ref_inv.assert_not_called()
+        mock_shr.assert_called_once_with(self.context, set([uuids.agg]))
+        mock_ref_assoc.assert_has_calls([
+            mock.call(self.context, uuids.ss2, force=True,
+                      refresh_sharing=False),
+            mock.call(self.context, uuids.ss3, force=True,
+                      refresh_sharing=False)])
+        self.assertEqual(2, mock_ref_assoc.call_count)
+        self.assertTrue(self.client._provider_tree.exists(uuids.ss3))
+        self.assertFalse(self.client._associations_stale(uuids.cn))
+
     def test_get_allocation_candidates(self):
         resp_mock = mock.Mock(status_code=200)
         json_data = {
@@ -1934,6 +2076,140 @@ class TestProviderOperations(SchedulerReportClientTestCase):
 
             self.ks_adap_mock.delete.reset_mock()
 
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                'set_traits_for_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                'set_aggregates_for_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_set_inventory_for_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_ensure_resource_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_delete_provider')
+    def test_update_from_provider_tree_ordering(self, mock_delete,
+            mock_ensure, mock_set_inv, mock_set_aggs, mock_set_traits):
+        """Providers are deleted bottom-up, created top-down one tree at a
+        time and updated bottom-up, whatever the concurrency.
+        """
+        self.useFixture(nova_fixtures.SpawnIsSynchronousFixture())
+        self.flags(resource_provider_update_concurrency=2, group='compute')
+        calls = []
+        mock_delete.side_effect = lambda uuid: calls.append(('delete', uuid))
+        mock_ensure.side_effect = (
+            lambda ctx, uuid, **kw: calls.append(('ensure', uuid)))
+        mock_set_inv.side_effect = (
+            lambda ctx, uuid, inv: calls.append(('set', uuid)))
+        # The cache holds an old tree to be deleted and the first new tree
+        old_tree = self.client._provider_tree
+        old_tree.new_root('old', uuids.old)
+        old_tree.new_child('old_child', uuids.old, uuid=uuids.old_child)
+        old_tree.new_root('root1', uuids.root1)
+        new_tree = provider_tree.ProviderTree()
+        new_tree.new_root('root1', uuids.root1)
+        new_tree.new_child('child1', uuids.root1, uuid=uuids.child1)
+        new_tree.new_root('root2', uuids.root2)
+        new_tree.new_child('child2', uuids.root2, uuid=uuids.child2)
+        new_tree.new_child('grandchild2', uuids.child2,
+                           uuid=uuids.grandchild2)
+
+        self.client.update_from_provider_tree(self.context, new_tree)
+
+        self.assertEqual([
+            ('delete', uuids.old_child),
+            ('delete', uuids.old),
+            ('ensure', uuids.child1),
+            ('ensure', uuids.root2),
+            ('ensure', uuids.child2),
+            ('ensure', uuids.grandchild2),
+            ('set', uuids.grandchild2),
+            ('set', uuids.child1),
+            ('set', uuids.child2),
+            ('set', uuids.root1),
+            ('set', uuids.root2),
+        ], calls)
+
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                'set_traits_for_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                'set_aggregates_for_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_set_inventory_for_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_ensure_resource_provider')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_delete_provider')
+    def test_update_from_provider_tree_subtree(self, mock_delete,
+            mock_ensure, mock_set_inv, mock_set_aggs, mock_set_traits):
+        """Only the subtree of the specified provider is flushed, the other
+        providers of the cache and of the new tree are left alone.
+        """
+        self.useFixture(nova_fixtures.SpawnIsSynchronousFixture())
+        calls = []
+        mock_delete.side_effect = lambda uuid: calls.append(('delete', uuid))
+        mock_ensure.side_effect = (
+            lambda ctx, uuid, **kw: calls.append(('ensure', uuid)))
+        mock_set_inv.side_effect = (
+            lambda ctx, uuid, inv: calls.append(('set', uuid)))
+        # The cache holds the tree of another node, missing from the new tree
+        old_tree = self.client._provider_tree
+        old_tree.new_root('root1', uuids.root1)
+        old_tree.new_child('old_child1', uuids.root1, uuid=uuids.old_child1)
+        old_tree.new_root('root2', uuids.root2)
+        new_tree = provider_tree.ProviderTree()
+        new_tree.new_root('root1', uuids.root1)
+        new_tree.new_child('child1', uuids.root1, uuid=uuids.child1)
+        new_tree.new_root('root3', uuids.root3)
+
+        self.client.update_from_provider_tree(self.context, new_tree,
+                                              rp_uuid=uuids.root1)
+
+        self.assertEqual([
+            ('delete', uuids.old_child1),
+            ('ensure', uuids.child1),
+            ('set', uuids.child1),
+            ('set', uuids.root1),
+        ], calls)
+        self.assertTrue(old_tree.exists(uuids.root2))
+
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_refresh_and_get_inventory')
+    @mock.patch('nova.scheduler.client.report.SchedulerReportClient.'
+                '_ensure_resource_provider')
+    def test_get_provider_tree_and_ensure_root_scoped(self, mock_ensure,
+                                                      mock_refresh):
+        """The scoped tree only holds the tree of the provider and the
+        providers sharing its aggregates, and only the inventories of the
+        latter are refreshed.
+        """
+        shares = ['MISC_SHARES_VIA_AGGREGATE']
+        cache = self.client._provider_tree
+        cache.new_root('cn1', uuids.cn1)
+        cache.new_child('pf1', uuids.cn1, uuid=uuids.pf1)
+        cache.update_aggregates(uuids.pf1, [uuids.agg1])
+        cache.update_inventory(uuids.pf1, {'CUSTOM_BW': {'total': 10}})
+        cache.new_root('cn2', uuids.cn2)
+        cache.update_aggregates(uuids.cn2, [uuids.agg1])
+        cache.new_root('ss1', uuids.ss1)
+        cache.update_aggregates(uuids.ss1, [uuids.agg1])
+        cache.update_traits(uuids.ss1, shares)
+        cache.new_root('ss2', uuids.ss2)
+        cache.update_aggregates(uuids.ss2, [uuids.agg2])
+        cache.update_traits(uuids.ss2, shares)
+
+        ptree = self.client.get_provider_tree_and_ensure_root(
+            self.context, uuids.pf1, scoped=True)
+
+        mock_ensure.assert_called_once_with(
+            self.context, uuids.pf1, name=None, parent_provider_uuid=None)
+        mock_refresh.assert_called_once_with(self.context, uuids.ss1)
+        self.assertEqual([uuids.cn1, uuids.pf1, uuids.ss1],
+                         ptree.get_provider_uuids())
+        self.assertEqual(cache.data(uuids.pf1), ptree.data(uuids.pf1))
+        self.assertEqual(cache.data(uuids.ss1), ptree.data(uuids.ss1))
+        # The tree is a copy
+        ptree.update_traits(uuids.pf1, ['CUSTOM_FOO'])
+        self.assertEqual(set(), cache.data(uuids.pf1).traits)
+
     def test_set_aggregates_for_provider(self):
         aggs = [uuids.agg1, uuids.agg2]
         self.ks_adap_mock.put.return_value = fake_requests.FakeResponse(
@@ -2147,12 +2423,14 @@ class TestTraits(SchedulerReportClientTestCase):
 
         self.ks_adap_mock.reset_mock()
 
-        # Request standard traits; no traits need to be created
+        # Request standard traits; no traits need to be created. Since we
+        # just created traits, the read must be current.
         get_mock.json.return_value = {'traits': standard_traits}
         self.client._ensure_traits(self.context, standard_traits)
         self.ks_adap_mock.get.assert_called_once_with(
             '/traits?name=in:' + ','.join(standard_traits),
-            headers={'X-Openstack-Request-Id': self.context.global_id},
+            headers={'X-Openstack-Request-Id': self.context.global_id,
+                     report.MUST_BE_CURRENT_HEADER: 'true'},
             **self.trait_api_kwargs)
         self.ks_adap_mock.put.assert_not_called()
 
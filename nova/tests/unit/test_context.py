@@ -317,7 +317,8 @@ class ContextTestCase(test.NoDBTestCase):
         with context.target_cell(ctxt, mapping) as cctxt:
             self.assertEqual(mock.sentinel.db_conn_obj, cctxt.db_connection)
             self.assertEqual(mock.sentinel.mq_conn_obj, cctxt.mq_connection)
-        mock_create_cm.assert_called_once_with('fake://db')
+        mock_create_cm.assert_called_once_with('fake://db',
+                                               slave_connection=None)
         mock_create_tport.assert_called_once_with('fake://mq')
         # Second call should use cached objects.
         mock_create_cm.reset_mock()
@@ -328,6 +329,21 @@ class ContextTestCase(test.NoDBTestCase):
         mock_create_cm.assert_not_called()
         mock_create_tport.assert_not_called()
 
+    @mock.patch('nova.rpc.create_transport')
+    @mock.patch('nova.db.api.create_context_manager')
+    def test_target_cell_replica_connection(self, mock_create_cm,
+                                            mock_create_tport):
+        self.flags(cell_replica_connections={uuids.cell: 'fake://replica'},
+                   group='api')
+        ctxt = context.get_context()
+        mapping = objects.CellMapping(database_connection='fake://db',
+                                      transport_url='fake://mq',
+                                      uuid=uuids.cell)
+        with context.target_cell(ctxt, mapping):
+            pass
+        mock_create_cm.assert_called_once_with(
+            'fake://db', slave_connection='fake://replica')
+
     @mock.patch('nova.context.target_cell')
     @mock.patch('nova.objects.InstanceList.get_by_filters')
     def test_scatter_gather_cells(self, mock_get_inst, mock_target_cell):
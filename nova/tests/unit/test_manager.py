@@ -0,0 +1,139 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Unit Tests for the periodic tasks of nova.manager"""
+
+import itertools
+
+import mock
+from oslo_service import periodic_task
+
+from nova import manager
+from nova import test
+
+
+class FakeManager(manager.Manager):
+    """Fake manager with a few periodic tasks."""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeManager, self).__init__(*args, **kwargs)
+        self.calls = []
+        self.failing = set()
+
+    def _call(self, name):
+        if name in self.failing:
+            raise test.TestingException()
+        self.calls.append(name)
+
+    @periodic_task.periodic_task(spacing=10, run_immediately=True)
+    def _fast_task(self, context):
+        self._call('_fast_task')
+
+    @periodic_task.periodic_task(spacing=100, run_immediately=True)
+    def _slow_task(self, context):
+        self._call('_slow_task')
+
+    @periodic_task.periodic_task(spacing=100)
+    def _later_task(self, context):
+        self._call('_later_task')
+
+
+class PeriodicTasksTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(PeriodicTasksTestCase, self).setUp()
+        self.flags(periodic_task_jitter=0)
+
+    def _get_manager(self):
+        mgr = FakeManager()
+        # The later task was last run when its class was defined, make sure
+        # it isn't due yet however long ago that was.
+        mgr._periodic_last_run['_later_task'] = periodic_task.now()
+        return mgr
+
+    @mock.patch('random.uniform', return_value=30)
+    def test_jitter(self, mock_uniform):
+        self.flags(periodic_task_jitter=0.5)
+        mgr = FakeManager()
+
+        mock_uniform.assert_called_once_with(0, 50)
+        self.assertEqual(
+            FakeManager._later_task._periodic_last_run - 30,
+            mgr._periodic_last_run['_later_task'])
+        # The tasks running immediately aren't offset
+        self.assertIsNone(mgr._periodic_last_run['_fast_task'])
+
+    @mock.patch('random.uniform')
+    def test_jitter_disabled(self, mock_uniform):
+        self.flags(periodic_task_jitter=0)
+        mgr = FakeManager()
+
+        mock_uniform.assert_not_called()
+        self.assertEqual(FakeManager._later_task._periodic_last_run,
+                         mgr._periodic_last_run['_later_task'])
+
+    @mock.patch.object(manager.LOG, 'warning')
+    @mock.patch('oslo_utils.timeutils.now',
+                side_effect=itertools.count(0, 50))
+    def test_stats(self, mock_now, mock_warning):
+        mgr = self._get_manager()
+        mgr.run_periodic_tasks(mock.sentinel.context)
+
+        self.assertEqual(['_fast_task', '_slow_task'], mgr.calls)
+        stats = mgr.get_periodic_task_stats()
+        self.assertEqual(1, stats['_fast_task']['runs'])
+        self.assertEqual(50, stats['_fast_task']['last_runtime'])
+        # The fast task took longer than its interval
+        self.assertEqual(1, stats['_fast_task']['overruns'])
+        self.assertEqual(0, stats['_slow_task']['overruns'])
+        self.assertEqual(0, stats['_later_task']['runs'])
+        mock_warning.assert_called_once_with(mock.ANY, {
+            'task': '_fast_task', 'time': 50, 'spacing': 10})
+
+    def test_stats_failure(self):
+        mgr = self._get_manager()
+        mgr.failing.add('_fast_task')
+
+        mgr.run_periodic_tasks(mock.sentinel.context)
+
+        stats = mgr.get_periodic_task_stats()
+        self.assertEqual(1, stats['_fast_task']['runs'])
+        self.assertEqual(1, stats['_fast_task']['failures'])
+        # The failure doesn't prevent the other tasks from running
+        self.assertEqual(['_slow_task'], mgr.calls)
+
+    @mock.patch('nova.utils.spawn')
+    def test_dedicated_worker(self, mock_spawn):
+        self.flags(periodic_task_dedicated_workers=['_slow_task'])
+        mgr = self._get_manager()
+
+        mgr.run_periodic_tasks(mock.sentinel.context)
+
+        # The slow task was started in its own worker
+        self.assertEqual(['_fast_task'], mgr.calls)
+        mock_spawn.assert_called_once_with(mock.ANY, mgr,
+                                           mock.sentinel.context)
+
+        # The next run is skipped while the previous one is in progress
+        mgr._periodic_last_run['_slow_task'] = None
+        mgr.run_periodic_tasks(mock.sentinel.context)
+        self.assertEqual(1, mock_spawn.call_count)
+        self.assertEqual(
+            1, mgr.get_periodic_task_stats()['_slow_task']['skipped'])
+
+        # Once the worker completed, the task runs again
+        worker, args = mock_spawn.call_args[0][0], mock_spawn.call_args[0][1:]
+        worker(*args)
+        self.assertEqual(['_fast_task', '_slow_task'], mgr.calls)
+        mgr._periodic_last_run['_slow_task'] = None
+        mgr.run_periodic_tasks(mock.sentinel.context)
+        self.assertEqual(2, mock_spawn.call_count)
@@ -26,6 +26,7 @@ from oslo_utils import uuidutils
 from six.moves import StringIO
 
 from nova.cmd import manage
+from nova.compute import instance_list
 from nova import conf
 from nova import context
 from nova.db import api as db
@@ -392,13 +393,41 @@ class DBCommandsTestCase(test.NoDBTestCase):
         large_number = '1' * 100
         self.assertEqual(2, self.commands.archive_deleted_rows(large_number))
 
+    def test_archive_deleted_rows_invalid_batch_time(self):
+        self.assertEqual(2, self.commands.archive_deleted_rows(
+            20, batch_time=0))
+
+    @mock.patch.object(db, 'archive_deleted_rows')
+    @mock.patch.object(objects.CellMappingList, 'get_all')
+    def test_archive_deleted_rows_reports_rates(self, mock_get_all,
+                                                mock_db_archive):
+        def fake_archive(max_rows, max_workers, batch_time, report_fn):
+            report_fn('instances', 10, 0.5)
+            report_fn('consoles', 5, 0.25)
+            report_fn('instances', 10, 0.5)
+            return dict(instances=20, consoles=5), []
+        mock_db_archive.side_effect = fake_archive
+
+        result = self.commands.archive_deleted_rows(20, verbose=True,
+                                                    max_workers=2,
+                                                    batch_time=0.5)
+        self.assertEqual(1, result)
+        mock_db_archive.assert_called_once_with(
+            20, max_workers=2, batch_time=0.5, report_fn=mock.ANY)
+        output = self.output.getvalue()
+        self.assertIn('Archived 5 rows from consoles in 0.25 seconds '
+                      '(20 rows/s)\n'
+                      'Archived 20 rows from instances in 1.00 seconds '
+                      '(20 rows/s)\n', output)
+
     @mock.patch.object(db, 'archive_deleted_rows',
                        return_value=(dict(instances=10, consoles=5), list()))
     @mock.patch.object(objects.CellMappingList, 'get_all')
     def _test_archive_deleted_rows(self, mock_get_all, mock_db_archive,
                                    verbose=False):
         result = self.commands.archive_deleted_rows(20, verbose=verbose)
-        mock_db_archive.assert_called_once_with(20)
+        mock_db_archive.assert_called_once_with(
+            20, max_workers=4, batch_time=1.0, report_fn=mock.ANY)
         output = self.output.getvalue()
         if verbose:
             expected = '''\
@@ -449,9 +478,9 @@ Archiving.....complete
             expected = ''
 
         self.assertEqual(expected, self.output.getvalue())
-        mock_db_archive.assert_has_calls([mock.call(20),
-                                          mock.call(20),
-                                          mock.call(20)])
+        mock_db_archive.assert_has_calls(
+            [mock.call(20, max_workers=4, batch_time=1.0,
+                       report_fn=mock.ANY)] * 3)
 
     def test_archive_deleted_rows_until_complete_quiet(self):
         self.test_archive_deleted_rows_until_complete(verbose=False)
@@ -487,11 +516,12 @@ Rows were archived, running purge...
             expected = ''
 
         self.assertEqual(expected, self.output.getvalue())
-        mock_db_archive.assert_has_calls([mock.call(20),
-                                          mock.call(20),
-                                          mock.call(20)])
+        mock_db_archive.assert_has_calls(
+            [mock.call(20, max_workers=4, batch_time=1.0,
+                       report_fn=mock.ANY)] * 3)
         mock_db_purge.assert_called_once_with(mock.ANY, None,
-                                              status_fn=mock.ANY)
+                                              status_fn=mock.ANY,
+                                              max_workers=4, batch_time=1.0)
 
     def test_archive_deleted_rows_until_stopped_quiet(self):
         self.test_archive_deleted_rows_until_stopped(verbose=False)
@@ -502,7 +532,8 @@ Rows were archived, running purge...
                                                      mock_db_archive):
         result = self.commands.archive_deleted_rows(20, verbose=True,
                                                     purge=True)
-        mock_db_archive.assert_called_once_with(20)
+        mock_db_archive.assert_called_once_with(
+            20, max_workers=4, batch_time=1.0, report_fn=mock.ANY)
         output = self.output.getvalue()
         # If nothing was archived, there should be no purge messages
         self.assertIn('Nothing was archived.', output)
@@ -540,7 +571,8 @@ Rows were archived, running purge...
         result = self.commands.archive_deleted_rows(20, verbose=verbose)
 
         self.assertEqual(1, result)
-        mock_db_archive.assert_called_once_with(20)
+        mock_db_archive.assert_called_once_with(
+            20, max_workers=4, batch_time=1.0, report_fn=mock.ANY)
         self.assertEqual(1, mock_reqspec_destroy.call_count)
         mock_members_destroy.assert_called_once()
 
@@ -581,7 +613,8 @@ is set and run this command again.
         mock_purge.return_value = 1
         ret = self.commands.purge(purge_all=True)
         self.assertEqual(0, ret)
-        mock_purge.assert_called_once_with(mock.ANY, None, status_fn=mock.ANY)
+        mock_purge.assert_called_once_with(mock.ANY, None, status_fn=mock.ANY,
+                                           max_workers=4, batch_time=1.0)
 
     @mock.patch('nova.db.sqlalchemy.api.purge_shadow_tables')
     def test_purge_date(self, mock_purge):
@@ -590,7 +623,23 @@ is set and run this command again.
         self.assertEqual(0, ret)
         mock_purge.assert_called_once_with(mock.ANY,
                                            datetime.datetime(2015, 10, 21),
-                                           status_fn=mock.ANY)
+                                           status_fn=mock.ANY,
+                                           max_workers=4, batch_time=1.0)
+
+    @mock.patch('nova.db.sqlalchemy.api.purge_shadow_tables')
+    def test_purge_concurrently(self, mock_purge):
+        mock_purge.return_value = 1
+        ret = self.commands.purge(purge_all=True, max_workers=8,
+                                  batch_time=0.5)
+        self.assertEqual(0, ret)
+        mock_purge.assert_called_once_with(mock.ANY, None, status_fn=mock.ANY,
+                                           max_workers=8, batch_time=0.5)
+
+    @mock.patch('nova.db.sqlalchemy.api.purge_shadow_tables')
+    def test_purge_invalid_max_workers(self, mock_purge):
+        ret = self.commands.purge(purge_all=True, max_workers=0)
+        self.assertEqual(2, ret)
+        self.assertFalse(mock_purge.called)
 
     @mock.patch('nova.db.sqlalchemy.api.purge_shadow_tables')
     def test_purge_date_fail(self, mock_purge):
@@ -648,6 +697,53 @@ Cell %s: 456
         self.assertEqual(4, ret)
         self.assertIn('Unable to get cell list', self.output.getvalue())
 
+    @mock.patch('nova.compute.instance_list.InstanceChangeFeed.'
+                'get_instance_objects')
+    def test_instance_changes_since(self, mock_get):
+        updated_at = datetime.datetime(2015, 10, 21, 1, 2, 3)
+        mock_get.return_value = objects.InstanceList(objects=[
+            objects.Instance(uuid=uuidsentinel.inst, project_id='proj',
+                             host='host1', vm_state='active',
+                             task_state=None, deleted=False,
+                             updated_at=updated_at)])
+        ret = self.commands.instance_changes(since='oct 21 2015', limit=10)
+        self.assertEqual(0, ret)
+        mock_get.assert_called_once_with(
+            mock.ANY, limit=10,
+            columns=['project_id', 'host', 'vm_state', 'task_state',
+                     'deleted', 'updated_at'])
+        output = self.output.getvalue()
+        self.assertIn(uuidsentinel.inst, output)
+        self.assertIn('2015-10-21 01:02:03', output)
+        # The cursor continues the feed after the listed instances
+        cursor = output.splitlines()[-1].split('Cursor: ')[1]
+        feed = instance_list.InstanceChangeFeed.from_cursor(cursor)
+        self.assertEqual(datetime.datetime(2015, 10, 21), feed.changes_since)
+
+    @mock.patch('nova.compute.instance_list.InstanceChangeFeed.'
+                'get_instance_objects', return_value=[])
+    def test_instance_changes_cursor(self, mock_get):
+        marks = {uuidsentinel.cell1: [datetime.datetime(2015, 10, 21), 3]}
+        cursor = instance_list.InstanceChangeFeed(
+            datetime.datetime(2015, 10, 20), marks=marks).cursor
+        ret = self.commands.instance_changes(cursor=cursor)
+        self.assertEqual(0, ret)
+        mock_get.assert_called_once_with(mock.ANY, limit=1000,
+                                         columns=mock.ANY)
+        self.assertIn('Cursor: %s' % cursor, self.output.getvalue())
+
+    @mock.patch('nova.compute.instance_list.InstanceChangeFeed.'
+                'get_instance_objects')
+    def test_instance_changes_invalid_args(self, mock_get):
+        self.assertEqual(1, self.commands.instance_changes())
+        self.assertEqual(1, self.commands.instance_changes(
+            since='oct 21 2015', cursor='foo'))
+        self.assertEqual(2, self.commands.instance_changes(cursor='foo'))
+        self.assertEqual(2, self.commands.instance_changes(since='notadate'))
+        self.assertEqual(2, self.commands.instance_changes(
+            since='oct 21 2015', limit=0))
+        self.assertFalse(mock_get.called)
+
     @mock.patch.object(migration, 'db_null_instance_uuid_scan',
                        return_value={'foo': 0})
     def test_null_instance_uuid_scan_no_records_found(self, mock_scan):
@@ -1205,6 +1205,38 @@ class IronicDriverTestCase(test.NoDBTestCase):
         mock_gbiu.assert_called_once_with(instance.uuid,
                                           fields=ironic_driver._NODE_FIELDS)
 
+    @mock.patch.object(ironic_driver.IronicDriver, '_refresh_cache')
+    def test_get_power_states(self, mock_refresh):
+        on = _get_cached_node(uuid=uuids.node_on, instance_uuid=uuids.on,
+                              power_state=ironic_states.POWER_ON)
+        off = _get_cached_node(uuid=uuids.node_off, instance_uuid=uuids.off,
+                               power_state=ironic_states.POWER_OFF)
+        free = _get_cached_node(uuid=uuids.node_free, instance_uuid=None,
+                                power_state=ironic_states.POWER_OFF)
+        self.driver.node_cache = {node.uuid: node for node in (on, off, free)}
+
+        result = self.driver.get_power_states()
+
+        self.assertEqual({uuids.on: nova_states.RUNNING,
+                          uuids.off: nova_states.SHUTDOWN}, result)
+        mock_refresh.assert_not_called()
+
+    @mock.patch.object(ironic_driver.IronicDriver, '_refresh_cache')
+    def test_get_power_states_no_cache(self, mock_refresh):
+        node = _get_cached_node(instance_uuid=uuids.on,
+                                power_state=ironic_states.POWER_ON)
+
+        def _refresh():
+            self.driver.node_cache = {node.uuid: node}
+
+        mock_refresh.side_effect = _refresh
+        self.driver.node_cache = {}
+
+        result = self.driver.get_power_states()
+
+        self.assertEqual({uuids.on: nova_states.RUNNING}, result)
+        mock_refresh.assert_called_once_with()
+
     @mock.patch.object(ironic_driver.IronicDriver, '_get_node_list')
     @mock.patch.object(objects.InstanceList, 'get_uuids_by_host')
     @mock.patch.object(objects.ServiceList, 'get_all_computes_by_hv_type')
@@ -7281,6 +7281,51 @@ class LibvirtConnTestCase(test.NoDBTestCase,
         self.assertEqual(uuids[3], vm4.UUIDString())
         mock_list.assert_called_with(only_guests=True, only_running=False)
 
+    @mock.patch.object(host.Host, "list_instance_domain_states")
+    def test_get_power_states(self, mock_list):
+        vm1 = FakeVirtDomain(id=3, name="instance00000001")
+        vm2 = FakeVirtDomain(name="instance00000002")
+        mock_list.return_value = [
+            (vm1, fakelibvirt.VIR_DOMAIN_RUNNING),
+            (vm2, fakelibvirt.VIR_DOMAIN_SHUTOFF)]
+
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        power_states = drvr.get_power_states()
+
+        self.assertEqual({vm1.UUIDString(): power_state.RUNNING,
+                          vm2.UUIDString(): power_state.SHUTDOWN},
+                         power_states)
+        mock_list.assert_called_once_with()
+
+    def test_prefetch_image(self):
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        instance = objects.Instance(uuid=uuids.instance, trusted_certs=None)
+        image_meta = objects.ImageMeta.from_dict({'id': uuids.image})
+        backend = mock.Mock(SUPPORTS_CLONE=False)
+
+        with mock.patch.object(drvr.image_backend, 'by_name',
+                               return_value=backend) as mock_by_name:
+            drvr.prefetch_image(self.context, instance, image_meta)
+
+        mock_by_name.assert_called_once_with(instance, 'disk',
+                                             CONF.libvirt.images_type)
+        backend.prefetch.assert_called_once_with(
+            libvirt_driver.libvirt_utils.fetch_image,
+            imagecache.get_cache_fname(uuids.image),
+            context=self.context, image_id=uuids.image, trusted_certs=None)
+
+    def test_prefetch_image_supports_clone(self):
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        instance = objects.Instance(uuid=uuids.instance, trusted_certs=None)
+        image_meta = objects.ImageMeta.from_dict({'id': uuids.image})
+        backend = mock.Mock(SUPPORTS_CLONE=True)
+
+        with mock.patch.object(drvr.image_backend, 'by_name',
+                               return_value=backend):
+            drvr.prefetch_image(self.context, instance, image_meta)
+
+        backend.prefetch.assert_not_called()
+
     @mock.patch('nova.virt.libvirt.host.Host.get_online_cpus',
                 return_value=None)
     @mock.patch('nova.virt.libvirt.host.Host.get_cpu_count',
@@ -560,6 +560,29 @@ class HostTestCase(test.NoDBTestCase):
         self.assertEqual(doms[1].name(), vm1.name())
         self.assertEqual(doms[2].name(), vm2.name())
 
+    @mock.patch.object(fakelibvirt.Connection, "getAllDomainStats")
+    def test_list_instance_domain_states(self, mock_get_stats):
+        vm0 = FakeVirtDomain(id=0, name="Domain-0")  # Xen dom-0
+        vm1 = FakeVirtDomain(id=3, name="instance00000001")
+        vm2 = FakeVirtDomain(name="instance00000002")
+        mock_get_stats.return_value = [
+            (vm0, {'state.state': fakelibvirt.VIR_DOMAIN_RUNNING}),
+            (vm1, {'state.state': fakelibvirt.VIR_DOMAIN_RUNNING}),
+            (vm2, {'state.state': fakelibvirt.VIR_DOMAIN_SHUTOFF}),
+        ]
+
+        states = self.host.list_instance_domain_states()
+
+        mock_get_stats.assert_called_once_with(
+            fakelibvirt.VIR_DOMAIN_STATS_STATE)
+        self.assertEqual([(vm1, fakelibvirt.VIR_DOMAIN_RUNNING),
+                          (vm2, fakelibvirt.VIR_DOMAIN_SHUTOFF)], states)
+
+        states = self.host.list_instance_domain_states(only_guests=False)
+
+        self.assertEqual(3, len(states))
+        self.assertEqual(vm0, states[0][0])
+
     @mock.patch.object(host.Host, "list_instance_domains")
     def test_list_guests(self, mock_list_domains):
         dom0 = mock.Mock(spec=fakelibvirt.virDomain)
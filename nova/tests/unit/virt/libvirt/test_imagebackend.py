@@ -293,6 +293,36 @@ class FlatTestCase(_ImageTestCase, test.NoDBTestCase):
 
         mock_exists.assert_has_calls(exist_calls)
 
+    @mock.patch.object(os.path, 'exists')
+    def test_prefetch(self, mock_exists):
+        self.stub_out('nova.virt.libvirt.imagebackend.Flat.correct_format',
+                      lambda _: None)
+        mock_exists.side_effect = [True, False]
+        exist_calls = [mock.call(self.TEMPLATE_DIR),
+                       mock.call(self.TEMPLATE_PATH)]
+        fn = mock.Mock()
+        image = self.image_class(self.INSTANCE, self.NAME)
+        mock_exists.reset_mock()
+
+        image.prefetch(fn, self.TEMPLATE, image_id='fake-image')
+
+        mock_exists.assert_has_calls(exist_calls)
+        fn.assert_called_once_with(target=self.TEMPLATE_PATH,
+                                   image_id='fake-image')
+
+    @mock.patch.object(os.path, 'exists')
+    def test_prefetch_template_exists(self, mock_exists):
+        self.stub_out('nova.virt.libvirt.imagebackend.Flat.correct_format',
+                      lambda _: None)
+        mock_exists.side_effect = [True, True]
+        fn = mock.Mock()
+        image = self.image_class(self.INSTANCE, self.NAME)
+        mock_exists.reset_mock()
+
+        image.prefetch(fn, self.TEMPLATE, image_id='fake-image')
+
+        fn.assert_not_called()
+
     @mock.patch('os.path.exists')
     def test_cache_generating_resize(self, mock_path_exists):
         # Test for bug 1608934
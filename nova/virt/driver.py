@@ -172,6 +172,23 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_power_states(self):
+        """Get the current power state of all instances on this host at once.
+
+        The compute manager uses this to synchronize the power states of the
+        instances with the database without calling get_info() for each of
+        them. Drivers which can't retrieve the power states any cheaper than
+        get_info() should leave this method unimplemented.
+
+        :returns: A dict, keyed by instance UUID, of nova.compute.power_state
+                  values. Instances which the driver doesn't know of can be
+                  left out.
+        :raises: NotImplementedError if the driver doesn't support it, in
+                 which case the power state of each instance is retrieved with
+                 get_info().
+        """
+        raise NotImplementedError()
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
@@ -290,6 +307,23 @@ class ComputeDriver(object):
         """
         pass
 
+    def prefetch_image(self, context, instance, image_meta):
+        """Download the image of a new instance before spawning it.
+
+        Called while the networks and block devices of the instance are
+        prepared, so that spawn finds the image in the image cache of the
+        driver instead of downloading it. Drivers without an image cache
+        do nothing.
+
+        :param context: security context
+        :param instance: nova.objects.instance.Instance
+                         This function should use the data there to guide
+                         the creation of the new instance.
+        :param nova.objects.ImageMeta image_meta:
+            The metadata of the image of the instance.
+        """
+        pass
+
     def failed_spawn_cleanup(self, instance):
         """Cleanup from the instance spawn.
 
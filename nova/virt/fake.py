@@ -330,6 +330,9 @@ class FakeDriver(driver.ComputeDriver):
         i = self.instances[instance.uuid]
         return hardware.InstanceInfo(state=i.state)
 
+    def get_power_states(self):
+        return {uuid: i.state for uuid, i in self.instances.items()}
+
     def get_diagnostics(self, instance):
         return {'cpu0_time': 17300000000,
                 'memory': 524288,
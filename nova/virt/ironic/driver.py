@@ -931,6 +931,21 @@ class IronicDriver(virt_driver.ComputeDriver):
 
         return hardware.InstanceInfo(state=map_power_state(node.power_state))
 
+    def get_power_states(self):
+        """Get the power state of all instances from the node cache.
+
+        :returns: A dict, keyed by instance UUID, of power states. The
+                  instances whose node isn't in the cache are left out.
+        """
+        # we should already have a cache for our nodes, refreshed on every
+        # RT loop. but if we don't have a cache, generate it.
+        if not self.node_cache:
+            self._refresh_cache()
+
+        return {node.instance_uuid: map_power_state(node.power_state)
+                for node in self.node_cache.values()
+                if node.instance_uuid}
+
     def deallocate_networks_on_reschedule(self, instance):
         """Does the driver want networks deallocated on reschedule?
 
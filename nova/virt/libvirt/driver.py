@@ -835,6 +835,14 @@ class LibvirtDriver(driver.ComputeDriver):
 
         return uuids
 
+    def get_power_states(self):
+        power_states = {}
+        for dom, state in self._host.list_instance_domain_states():
+            guest = libvirt_guest.Guest(dom)
+            power_states[guest.uuid] = libvirt_guest.LIBVIRT_POWER_STATE[state]
+
+        return power_states
+
     def plug_vifs(self, instance, network_info):
         """Plug VIFs into networks."""
         for vif in network_info:
@@ -3646,6 +3654,19 @@ class LibvirtDriver(driver.ComputeDriver):
 
         return (created_instance_dir, created_disks)
 
+    def prefetch_image(self, context, instance, image_meta):
+        backend = self.image_backend.by_name(instance, 'disk',
+                                             CONF.libvirt.images_type)
+        if backend.SUPPORTS_CLONE:
+            # NOTE: The root disk is cloned from the image service in spawn,
+            # and only falls back to the image cache if cloning fails.
+            return
+        backend.prefetch(libvirt_utils.fetch_image,
+                         imagecache.get_cache_fname(image_meta.id),
+                         context=context,
+                         image_id=image_meta.id,
+                         trusted_certs=instance.trusted_certs)
+
     def _create_and_inject_local_root(self, context, instance,
                                       booted_from_volume, suffix, disk_images,
                                       injection_info, fallback_from_host):
@@ -610,6 +610,27 @@ class Host(object):
 
         return doms
 
+    def list_instance_domain_states(self, only_guests=True):
+        """Get the state of all libvirt.Domain objects for nova instances
+
+        :param only_guests: True to filter out any host domain (eg Dom-0)
+
+        Query libvirt for the state of all active and inactive domains with a
+        single call, rather than one call per domain.
+
+        :returns: list of tuples of (libvirt.Domain, VIR_DOMAIN_* state)
+        """
+        all_stats = self.get_connection().getAllDomainStats(
+            libvirt.VIR_DOMAIN_STATS_STATE)
+
+        states = []
+        for dom, stats in all_stats:
+            if only_guests and dom.ID() == 0:
+                continue
+            states.append((dom, stats['state.state']))
+
+        return states
+
     def get_online_cpus(self):
         """Get the set of CPUs that are online on the host
 
@@ -249,11 +249,7 @@ class Image(object):
         :filename: Name of the file in the image directory
         :size: Size of created image in bytes (optional)
         """
-        base_dir = os.path.join(CONF.instances_path,
-                                CONF.image_cache_subdirectory_name)
-        if not os.path.exists(base_dir):
-            fileutils.ensure_tree(base_dir)
-        base = os.path.join(base_dir, filename)
+        base = self._get_base_path(filename)
 
         @utils.synchronized(filename, external=True, lock_path=self.lock_path)
         def fetch_func_sync(target, *args, **kwargs):
@@ -285,6 +281,36 @@ class Image(object):
                     os.access(self.path, os.W_OK)):
                 utils.execute('fallocate', '-n', '-l', size, self.path)
 
+    def prefetch(self, fetch_func, filename, *args, **kwargs):
+        """Fetches template into the image cache, without creating image.
+
+        Synchronizes on template fetching with cache(), which then finds the
+        template in the image cache.
+
+        :fetch_func: Function that creates the base image
+                     Should accept `target` argument.
+        :filename: Name of the file in the image directory
+        """
+        base = self._get_base_path(filename)
+
+        @utils.synchronized(filename, external=True, lock_path=self.lock_path)
+        def fetch_func_sync():
+            if not os.path.exists(base):
+                fetch_func(target=base, *args, **kwargs)
+
+        fetch_func_sync()
+
+    @staticmethod
+    def _get_base_path(filename):
+        """Returns the path of a template in the image cache, ensuring that
+        the base directory exists.
+        """
+        base_dir = os.path.join(CONF.instances_path,
+                                CONF.image_cache_subdirectory_name)
+        if not os.path.exists(base_dir):
+            fileutils.ensure_tree(base_dir)
+        return os.path.join(base_dir, filename)
+
     def _can_fallocate(self):
         """Check once per class, whether fallocate(1) is available,
            and that the instances directory supports fallocate(2).
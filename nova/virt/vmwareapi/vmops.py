@@ -1762,29 +1762,34 @@ class VMwareVMOps(object):
             datastores_info.append((ds, dc_info))
         self._imagecache.update(context, instances, datastores_info)
 
-    def _get_valid_vms_from_retrieve_result(self, retrieve_result):
-        """Returns list of valid vms from RetrieveResult object."""
-        lst_vm_names = []
-
+    def _iter_valid_vms_from_retrieve_result(self, retrieve_result):
+        """Yields tuples of (instance UUID, dict of properties by name) of
+        the valid vms from a RetrieveResult object.
+        """
         while retrieve_result:
             for vm in retrieve_result.objects:
                 vm_uuid = None
-                conn_state = None
+                props = {}
                 for prop in vm.propSet:
-                    if prop.name == "runtime.connectionState":
-                        conn_state = prop.val
-                    elif prop.name == 'config.extraConfig["nvp.vm-uuid"]':
+                    if prop.name == 'config.extraConfig["nvp.vm-uuid"]':
                         vm_uuid = prop.val.value
+                    else:
+                        props[prop.name] = prop.val
                 # Ignore VM's that do not have nvp.vm-uuid defined
                 if not vm_uuid:
                     continue
                 # Ignoring the orphaned or inaccessible VMs
-                if conn_state not in ["orphaned", "inaccessible"]:
-                    lst_vm_names.append(vm_uuid)
+                if props.get("runtime.connectionState") not in [
+                        "orphaned", "inaccessible"]:
+                    yield vm_uuid, props
             retrieve_result = self._session._call_method(vutil,
                                                          'continue_retrieval',
                                                          retrieve_result)
-        return lst_vm_names
+
+    def _get_valid_vms_from_retrieve_result(self, retrieve_result):
+        """Returns list of valid vms from RetrieveResult object."""
+        return [vm_uuid for vm_uuid, props in
+                self._iter_valid_vms_from_retrieve_result(retrieve_result)]
 
     def instance_exists(self, instance):
         try:
@@ -2003,22 +2008,42 @@ class VMwareVMOps(object):
         """Get the datacenter name and the reference."""
         return ds_util.get_dc_info(self._session, ds_ref)
 
-    def list_instances(self):
-        """Lists the VM instances that are registered with vCenter cluster."""
+    def _get_cluster_vms(self, properties):
+        """Returns the RetrieveResult object with the supplied properties of
+        the VMs of the vCenter cluster.
+        """
         properties = ['runtime.connectionState',
-                      'config.extraConfig["nvp.vm-uuid"]']
-        LOG.debug("Getting list of instances from cluster %s",
-                  self._cluster)
+                      'config.extraConfig["nvp.vm-uuid"]'] + properties
         vms = []
         if self._root_resource_pool:
             vms = self._session._call_method(
                 vim_util, 'get_inner_objects', self._root_resource_pool, 'vm',
                 'VirtualMachine', properties)
+        return vms
+
+    def list_instances(self):
+        """Lists the VM instances that are registered with vCenter cluster."""
+        LOG.debug("Getting list of instances from cluster %s",
+                  self._cluster)
+        vms = self._get_cluster_vms([])
         lst_vm_names = self._get_valid_vms_from_retrieve_result(vms)
 
         LOG.debug("Got total of %s instances", str(len(lst_vm_names)))
         return lst_vm_names
 
+    def get_power_states(self):
+        """Returns a dict, keyed by instance UUID, of the power states of the
+        VM instances registered with vCenter cluster, retrieved with a single
+        property collector query.
+        """
+        LOG.debug("Getting power states of instances from cluster %s",
+                  self._cluster)
+        vms = self._get_cluster_vms(['runtime.powerState'])
+        return {vm_uuid: constants.POWER_STATES[props['runtime.powerState']]
+                for vm_uuid, props in
+                self._iter_valid_vms_from_retrieve_result(vms)
+                if 'runtime.powerState' in props}
+
     def get_vnc_console(self, instance):
         """Return connection info for a vnc console using vCenter logic."""
 